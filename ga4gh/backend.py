@@ -11,8 +11,15 @@ import os
 
 import ga4gh.datamodel as datamodel
 import ga4gh.datamodel.datasets as datasets
+import ga4gh.datamodel.pileup as pileup
+import ga4gh.datamodel.reads as reads
 import ga4gh.datamodel.references as references
+import ga4gh.datamodel.variantdensity as variantdensity
+import ga4gh.datamodel.variantexport as variantexport
+import ga4gh.datamodel.variantfilters as variantfilters
+import ga4gh.datamodel.variantslice as variantslice
 import ga4gh.exceptions as exceptions
+import ga4gh.genotypematrix as genotypematrix
 import ga4gh.protocol as protocol
 
 
@@ -52,6 +59,23 @@ def _parsePageToken(pageToken, numValues):
     return values
 
 
+def _mergeRegions(regions):
+    """
+    Returns the sorted list of the disjoint (referenceKey, start, end)
+    regions covering the specified list of regions, in which
+    overlapping and adjacent regions on the same reference are merged.
+    """
+    merged = []
+    for referenceKey, start, end in sorted(regions):
+        if (len(merged) > 0 and merged[-1][0] == referenceKey and
+                start <= merged[-1][2]):
+            merged[-1] = (
+                referenceKey, merged[-1][1], max(merged[-1][2], end))
+        else:
+            merged.append((referenceKey, start, end))
+    return merged
+
+
 class IntervalIterator(object):
     """
     Implements generator logic for types which accept a start/end
@@ -152,15 +176,24 @@ class IntervalIterator(object):
 
 class ReadsIntervalIterator(IntervalIterator):
     """
-    An interval iterator for reads
+    An interval iterator for reads. If a ReadFilter is specified, the
+    reads it excludes are skipped before the page tokens are counted,
+    so that the tokens remain valid for the same filtered search. If
+    includeReferenceSequence is True, the reference bases are included
+    in the reads' cigars.
     """
-    def __init__(self, request, parentContainer, reference):
+    def __init__(
+            self, request, parentContainer, reference, readFilter=None,
+            includeReferenceSequence=False):
         self._reference = reference
+        self._readFilter = readFilter
+        self._includeReferenceSequence = includeReferenceSequence
         super(ReadsIntervalIterator, self).__init__(request, parentContainer)
 
     def _search(self, start, end):
         return self._parentContainer.getReadAlignments(
-            self._reference, start, end)
+            self._reference, start, end, self._readFilter,
+            self._includeReferenceSequence)
 
     @classmethod
     def _getStart(cls, readAlignment):
@@ -175,13 +208,23 @@ class ReadsIntervalIterator(IntervalIterator):
 
 class VariantsIntervalIterator(IntervalIterator):
     """
-    An interval iterator for variants
+    An interval iterator for variants, including only those accepted by
+    the specified VariantFilter and carried by each of the specified
+    carrier call sets.
     """
+    def __init__(
+            self, request, parentContainer, variantFilter=None,
+            carrierCallSetIds=None):
+        self._variantFilter = variantFilter
+        self._carrierCallSetIds = carrierCallSetIds
+        super(VariantsIntervalIterator, self).__init__(
+            request, parentContainer)
 
     def _search(self, start, end):
         return self._parentContainer.getVariants(
             self._request.referenceName, start, end,
-            self._request.callSetIds)
+            self._request.callSetIds, self._variantFilter,
+            self._carrierCallSetIds)
 
     @classmethod
     def _getStart(cls, variant):
@@ -192,6 +235,142 @@ class VariantsIntervalIterator(IntervalIterator):
         return variant.end
 
 
+class GenotypeRowsIntervalIterator(VariantsIntervalIterator):
+    """
+    An interval iterator for the genotypematrix.GenotypeRows of the
+    variants defined by a SearchVariantsRequest, including the genotype
+    likelihoods if includeLikelihoods is True.
+    """
+    def __init__(self, request, parentContainer, includeLikelihoods=False):
+        self._includeLikelihoods = includeLikelihoods
+        super(GenotypeRowsIntervalIterator, self).__init__(
+            request, parentContainer)
+
+    def _search(self, start, end):
+        return self._parentContainer.getGenotypeRows(
+            self._request.referenceName, start, end,
+            self._request.callSetIds, self._includeLikelihoods)
+
+
+class JsonReadsIntervalIterator(ReadsIntervalIterator):
+    """
+    An interval iterator for reads that returns the JsonRecord of each
+    read rather than its ReadAlignment, including only the fields in
+    the specified FieldMask.
+    """
+    def __init__(
+            self, request, parentContainer, reference, fieldMask=None,
+            readFilter=None, includeReferenceSequence=False):
+        self._fieldMask = fieldMask
+        super(JsonReadsIntervalIterator, self).__init__(
+            request, parentContainer, reference, readFilter,
+            includeReferenceSequence)
+
+    def _search(self, start, end):
+        return self._parentContainer.getReadAlignmentsJson(
+            self._reference, start, end, self._fieldMask, self._readFilter,
+            self._includeReferenceSequence)
+
+    @classmethod
+    def _getStart(cls, jsonRecord):
+        return jsonRecord.start
+
+
+class JsonVariantsIntervalIterator(VariantsIntervalIterator):
+    """
+    An interval iterator for variants that returns the JsonRecord of
+    each variant rather than its GA Variant, including only the fields
+    in the specified FieldMask.
+    """
+    def __init__(
+            self, request, parentContainer, fieldMask=None,
+            variantFilter=None, carrierCallSetIds=None):
+        self._fieldMask = fieldMask
+        super(JsonVariantsIntervalIterator, self).__init__(
+            request, parentContainer, variantFilter, carrierCallSetIds)
+
+    def _search(self, start, end):
+        return self._parentContainer.getVariantsJson(
+            self._request.referenceName, start, end,
+            self._request.callSetIds, self._fieldMask, self._variantFilter,
+            self._carrierCallSetIds)
+
+    @classmethod
+    def _getStart(cls, jsonRecord):
+        return jsonRecord.start
+
+
+class MultiRegionIterator(object):
+    """
+    Iterates over the (object, pageToken) pairs of the objects in each of
+    a sorted list of disjoint (referenceKey, start, end) regions in turn,
+    using the IntervalIterator returned by getIntervalIterator(region,
+    pageToken) for each. An object overlapping the previous region on
+    the same reference has already been returned, so is skipped. The
+    page token is the index of the region of the next object, followed
+    by the page token of its IntervalIterator if it is not the first
+    object of the region.
+    """
+    def __init__(self, request, regions, getIntervalIterator):
+        self._regions = regions
+        self._getIntervalIterator = getIntervalIterator
+        regionIndex = 0
+        pageToken = None
+        if request.pageToken is not None:
+            tokens = request.pageToken.split(":", 1)
+            try:
+                regionIndex = int(tokens[0])
+            except ValueError:
+                raise exceptions.BadPageTokenException(
+                    "Malformed region index in page token")
+            if not 0 <= regionIndex < len(regions):
+                raise exceptions.BadPageTokenException(
+                    "Invalid region index in page token")
+            if len(tokens) == 2:
+                pageToken = tokens[1]
+        self._objects = self._generateObjects(regionIndex, pageToken)
+        self._nextObject = next(self._objects, None)
+
+    def _generateObjects(self, regionIndex, pageToken):
+        """
+        Returns a generator over the (object, pageToken) pairs of the
+        objects from the specified region and page token onwards, where
+        pageToken is the page token at which the object itself is found.
+        """
+        for index in range(regionIndex, len(self._regions)):
+            referenceKey, start, end = self._regions[index]
+            previousEnd = None
+            if index > 0 and self._regions[index - 1][0] == referenceKey:
+                previousEnd = self._regions[index - 1][2]
+            intervalIterator = self._getIntervalIterator(
+                self._regions[index], pageToken)
+            for obj, nextPageToken in intervalIterator:
+                if (previousEnd is None or
+                        intervalIterator._getStart(obj) >= previousEnd):
+                    if pageToken is None:
+                        yield obj, "{}".format(index)
+                    else:
+                        yield obj, "{}:{}".format(index, pageToken)
+                pageToken = nextPageToken
+            pageToken = None
+
+    def next(self):
+        """
+        Returns the next (object, nextPageToken) pair.
+        """
+        if self._nextObject is None:
+            raise StopIteration()
+        obj = self._nextObject[0]
+        self._nextObject = next(self._objects, None)
+        nextPageToken = None
+        if self._nextObject is not None:
+            nextPageToken = self._nextObject[1]
+        return obj, nextPageToken
+
+    def __iter__(self):
+        return self
+
+
 class AbstractBackend(object):
     """
     An abstract GA4GH backend.
@@ -208,6 +387,7 @@ class AbstractBackend(object):
         self._referenceSetIdMap = {}
         self._referenceSetNameMap = {}
         self._referenceSetIds = []
+        self._exportJobManager = None
 
     def addDataset(self, dataset):
         """
@@ -252,6 +432,13 @@ class AbstractBackend(object):
         """
         self._maxResponseLength = maxResponseLength
 
+    def setExportJobManager(self, exportJobManager):
+        """
+        Sets the exportjobs.ExportJobManager that runs export jobs, or
+        None if they are not supported.
+        """
+        self._exportJobManager = exportJobManager
+
     def getDatasets(self):
         """
         Returns a list of datasets in this backend
@@ -322,6 +509,53 @@ class AbstractBackend(object):
             raise exceptions.ReferenceSetNameNotFoundException(name)
         return self._referenceSetNameMap[name]
 
+    def getReference(self, id_):
+        """
+        Returns the Reference with the specified ID, or raises an
+        exception if it does not exist.
+        """
+        compoundId = datamodel.ReferenceCompoundId.parse(id_)
+        referenceSet = self.getReferenceSet(compoundId.referenceSetId)
+        return referenceSet.getReference(id_)
+
+    def getVariantSet(self, id_):
+        """
+        Returns the VariantSet with the specified ID, or raises an
+        exception if it does not exist.
+        """
+        compoundId = datamodel.VariantSetCompoundId.parse(id_)
+        dataset = self.getDataset(compoundId.datasetId)
+        return dataset.getVariantSet(id_)
+
+    def getCallSet(self, id_):
+        """
+        Returns the CallSet with the specified ID, or raises an
+        exception if it does not exist.
+        """
+        compoundId = datamodel.CallSetCompoundId.parse(id_)
+        dataset = self.getDataset(compoundId.datasetId)
+        variantSet = dataset.getVariantSet(compoundId.variantSetId)
+        return variantSet.getCallSet(id_)
+
+    def getReadGroupSet(self, id_):
+        """
+        Returns the ReadGroupSet with the specified ID, or raises an
+        exception if it does not exist.
+        """
+        compoundId = datamodel.ReadGroupSetCompoundId.parse(id_)
+        dataset = self.getDataset(compoundId.datasetId)
+        return dataset.getReadGroupSet(id_)
+
+    def getReadGroup(self, id_):
+        """
+        Returns the ReadGroup with the specified ID, or raises an
+        exception if it does not exist.
+        """
+        compoundId = datamodel.ReadGroupCompoundId.parse(id_)
+        dataset = self.getDataset(compoundId.datasetId)
+        readGroupSet = dataset.getReadGroupSet(compoundId.readGroupSetId)
+        return readGroupSet.getReadGroup(id_)
+
     def startProfile(self):
         """
         Profiling hook. Called at the start of the runSearchRequest method
@@ -345,13 +579,17 @@ class AbstractBackend(object):
                 raise exceptions.RequestValidationFailureException(
                     jsonDict, requestClass)
 
-    def validateResponse(self, jsonString, responseClass):
+    def validateResponse(
+            self, responseString, responseClass,
+            mimetype=protocol.JSON_MIMETYPE):
         """
-        Ensures the jsonDict corresponds to a valid instance of responseClass
-        Throws an error if the data is invalid
+        Ensures the responseString, encoded in the wire format identified
+        by the specified mimetype, corresponds to a valid instance of
+        responseClass. Throws an error if the data is invalid
         """
         if self._responseValidation:
-            jsonDict = json.loads(jsonString)
+            jsonDict = responseClass.deserialize(
+                responseString, mimetype).toJsonDict()
             if not responseClass.validate(jsonDict):
                 raise exceptions.ResponseValidationFailureException(
                     jsonDict, responseClass)
@@ -480,10 +718,170 @@ class AbstractBackend(object):
             request, dataset.getNumVariantSets(),
             dataset.getVariantSetByIndex)
 
-    def readsGenerator(self, request):
+    def readsGenerator(
+            self, request, includeReferenceSequence=False, regions=None,
+            **filterArgs):
         """
         Returns a generator over the (read, nextPageToken) pairs defined
-        by the specified request
+        by the specified request and read filter arguments, including
+        the reference bases in the reads' cigars if
+        includeReferenceSequence is True. If a list of regions is given,
+        the reads in them are also returned.
+        """
+        readGroup, reference = self._getReadsSearchTarget(request)
+        readFilter = self._getReadFilter(**filterArgs)
+        includeReferenceSequence = self._checkIncludeReferenceSequence(
+            includeReferenceSequence)
+
+        def getIntervalIterator(regionRequest, regionReference):
+            return ReadsIntervalIterator(
+                regionRequest, readGroup, regionReference, readFilter,
+                includeReferenceSequence)
+        return self._getReadsSearchIterator(
+            request, readGroup, reference, regions, getIntervalIterator)
+
+    def readsJsonGenerator(
+            self, request, fieldMask=None, includeReferenceSequence=False,
+            regions=None, **filterArgs):
+        """
+        Returns a generator over the (jsonRecord, nextPageToken) pairs
+        for the reads defined by the specified request and read filter
+        arguments, including only the fields in the specified FieldMask.
+        If a list of regions is given, the reads in them are also
+        returned.
+        """
+        readGroup, reference = self._getReadsSearchTarget(request)
+        readFilter = self._getReadFilter(**filterArgs)
+        includeReferenceSequence = self._checkIncludeReferenceSequence(
+            includeReferenceSequence)
+
+        def getIntervalIterator(regionRequest, regionReference):
+            return JsonReadsIntervalIterator(
+                regionRequest, readGroup, regionReference, fieldMask,
+                readFilter, includeReferenceSequence)
+        return self._getReadsSearchIterator(
+            request, readGroup, reference, regions, getIntervalIterator)
+
+    def _getReadsSearchIterator(
+            self, request, readGroup, reference, regions,
+            getIntervalIterator):
+        """
+        Returns the interval iterator returned by
+        getIntervalIterator(request, reference) for the specified
+        SearchReadsRequest, or, if a list of regions is given, the
+        MultiRegionIterator over the merged regions of the request and
+        of the list.
+        """
+        if regions is None:
+            return getIntervalIterator(request, reference)
+        references = {request.referenceId: reference}
+        referenceSet = readGroup.getParentContainer().getReferenceSet()
+        start = request.start or 0
+        end = request.end
+        if end is None:
+            end = reference.getLength()
+        regions = _mergeRegions(
+            [(request.referenceId, start, end)] + self._parseRegions(
+                regions, "referenceId", request.referenceId))
+        for referenceId, _, _ in regions:
+            if referenceId not in references:
+                references[referenceId] = referenceSet.getReference(
+                    referenceId)
+
+        def getRegionIterator(region, pageToken):
+            regionRequest = protocol.SearchReadsRequest.fromJsonDict(
+                request.toJsonDict())
+            regionRequest.referenceId, regionRequest.start, \
+                regionRequest.end = region
+            regionRequest.pageToken = pageToken
+            return getIntervalIterator(regionRequest, references[region[0]])
+        return MultiRegionIterator(request, regions, getRegionIterator)
+
+    maxSearchRegions = 10000
+    """
+    The greatest number of regions that may be given in a multi-region
+    search.
+    """
+
+    def _parseRegions(self, regions, referenceKeyName, defaultReferenceKey):
+        """
+        Returns the list of (referenceKey, start, end) tuples for the
+        specified "regions" argument of a search request, which is a
+        list of objects with integer start and end values, and an
+        optional referenceKeyName value defaulting to the specified one.
+        Raises a BadRequestArgumentException if it is not valid.
+        """
+        if not isinstance(regions, list) or len(regions) > \
+                self.maxSearchRegions:
+            raise exceptions.BadRequestArgumentException("regions", regions)
+        parsed = []
+        for region in regions:
+            if not isinstance(region, dict):
+                raise exceptions.BadRequestArgumentException(
+                    "regions", region)
+            referenceKey = region.get(referenceKeyName, defaultReferenceKey)
+            start = region.get("start")
+            end = region.get("end")
+            if (not isinstance(referenceKey, basestring) or not all(
+                    isinstance(value, (int, long)) and
+                    not isinstance(value, bool) for value in [start, end]) or
+                    not 0 <= start <= end):
+                raise exceptions.BadRequestArgumentException(
+                    "regions", region)
+            parsed.append((referenceKey, start, end))
+        return parsed
+
+    readFilterArgumentNames = [
+        "minMappingQuality", "requiredFlags", "excludedFlags"]
+    """
+    The names of the read filter arguments that may be given in a
+    SearchReadsRequest, which are not part of the protocol.
+    """
+    readsSearchExtensionNames = readFilterArgumentNames + [
+        "includeReferenceSequence", "regions"]
+    """
+    The names of all of the arguments that may be given in a
+    SearchReadsRequest which are not part of the protocol. The "regions"
+    argument is a list of further regions to search, each an object with
+    start and end values and a referenceId defaulting to that of the
+    request, which are merged with the request's own region and searched
+    in order as a single result stream.
+    """
+
+    def _checkIncludeReferenceSequence(self, includeReferenceSequence):
+        """
+        Returns the specified includeReferenceSequence argument, raising
+        a BadRequestArgumentException if it is not a boolean.
+        """
+        if not isinstance(includeReferenceSequence, bool):
+            raise exceptions.BadRequestArgumentException(
+                "includeReferenceSequence", includeReferenceSequence)
+        return includeReferenceSequence
+
+    def _getReadFilter(self, **filterArgs):
+        """
+        Returns the ReadFilter defined by the specified read filter
+        arguments, or None if there are none. Raises a
+        BadReadFilterException if any of the arguments are invalid.
+        """
+        if len(filterArgs) == 0:
+            return None
+        for name, value in filterArgs.items():
+            maxValue = reads.ReadFilter.maxFlag
+            if name == "minMappingQuality":
+                maxValue = 255
+            if (not isinstance(value, (int, long)) or
+                    isinstance(value, bool) or not 0 <= value <= maxValue):
+                raise exceptions.BadReadFilterException(name, value)
+        readFilter = reads.ReadFilter(**filterArgs)
+        if readFilter.isEmpty():
+            readFilter = None
+        return readFilter
+
+    def _getReadsSearchTarget(self, request):
+        """
+        Returns the (readGroup, reference) pair for the specified
+        SearchReadsRequest.
         """
         if request.referenceId is None:
             raise exceptions.UnmappedReadsNotSupported()
@@ -498,19 +896,144 @@ class AbstractBackend(object):
         # Find the reference.
         referenceSet = readGroupSet.getReferenceSet()
         reference = referenceSet.getReference(request.referenceId)
-        intervalIterator = ReadsIntervalIterator(request, readGroup, reference)
-        return intervalIterator
+        return readGroup, reference
 
-    def variantsGenerator(self, request):
+    def variantsGenerator(self, request, regions=None, **filterArgs):
         """
         Returns a generator over the (variant, nextPageToken) pairs defined
-        by the specified request.
+        by the specified request and variant filter arguments. If a list
+        of regions is given, the variants in them are also returned.
         """
         compoundId = datamodel.VariantSetCompoundId.parse(request.variantSetId)
         dataset = self.getDataset(compoundId.datasetId)
         variantSet = dataset.getVariantSet(compoundId.variantSetId)
-        intervalIterator = VariantsIntervalIterator(request, variantSet)
-        return intervalIterator
+        variantFilter = self._getVariantFilter(**filterArgs)
+        carrierCallSetIds = self._getCarrierCallSetIds(**filterArgs)
+
+        def getIntervalIterator(regionRequest):
+            return VariantsIntervalIterator(
+                regionRequest, variantSet, variantFilter, carrierCallSetIds)
+        return self._getVariantsSearchIterator(
+            request, regions, getIntervalIterator)
+
+    def variantsJsonGenerator(
+            self, request, fieldMask=None, regions=None, **filterArgs):
+        """
+        Returns a generator over the (jsonRecord, nextPageToken) pairs
+        for the variants defined by the specified request and variant
+        filter arguments, including only the fields in the specified
+        FieldMask. If a list of regions is given, the variants in them
+        are also returned.
+        """
+        compoundId = datamodel.VariantSetCompoundId.parse(request.variantSetId)
+        dataset = self.getDataset(compoundId.datasetId)
+        variantSet = dataset.getVariantSet(compoundId.variantSetId)
+        variantFilter = self._getVariantFilter(**filterArgs)
+        carrierCallSetIds = self._getCarrierCallSetIds(**filterArgs)
+
+        def getIntervalIterator(regionRequest):
+            return JsonVariantsIntervalIterator(
+                regionRequest, variantSet, fieldMask, variantFilter,
+                carrierCallSetIds)
+        return self._getVariantsSearchIterator(
+            request, regions, getIntervalIterator)
+
+    def _getVariantsSearchIterator(
+            self, request, regions, getIntervalIterator):
+        """
+        Returns the interval iterator returned by
+        getIntervalIterator(request) for the specified
+        SearchVariantsRequest, or, if a list of regions is given, the
+        MultiRegionIterator over the merged regions of the request and
+        of the list.
+        """
+        if regions is None:
+            return getIntervalIterator(request)
+        regions = _mergeRegions(
+            [(request.referenceName, request.start, request.end)] +
+            self._parseRegions(
+                regions, "referenceName", request.referenceName))
+
+        def getRegionIterator(region, pageToken):
+            regionRequest = protocol.SearchVariantsRequest.fromJsonDict(
+                request.toJsonDict())
+            regionRequest.referenceName, regionRequest.start, \
+                regionRequest.end = region
+            regionRequest.pageToken = pageToken
+            return getIntervalIterator(regionRequest)
+        return MultiRegionIterator(request, regions, getRegionIterator)
+
+    variantFilterArgumentNames = ["filter", "carrierCallSetIds"]
+    """
+    The names of the variant filter arguments that may be given in a
+    SearchVariantsRequest, which are not part of the protocol. The
+    "filter" argument is a filter expression (see variantfilters), and
+    the "carrierCallSetIds" argument is a list of call set IDs, each of
+    which must carry a non reference allele of the variants returned.
+    """
+    variantsSearchExtensionNames = variantFilterArgumentNames + ["regions"]
+    """
+    The names of all of the arguments that may be given in a
+    SearchVariantsRequest which are not part of the protocol. The
+    "regions" argument is a list of further regions to search, as in a
+    SearchReadsRequest, with referenceName values rather than
+    referenceId values.
+    """
+
+    def genotypeRowsGenerator(self, request, includeLikelihoods=False):
+        """
+        Returns a generator over the (genotypeRow, nextPageToken) pairs
+        for the variants defined by the specified request.
+        """
+        if not isinstance(includeLikelihoods, bool):
+            raise exceptions.BadRequestArgumentException(
+                "includeLikelihoods", includeLikelihoods)
+        compoundId = datamodel.VariantSetCompoundId.parse(request.variantSetId)
+        dataset = self.getDataset(compoundId.datasetId)
+        variantSet = dataset.getVariantSet(compoundId.variantSetId)
+        return GenotypeRowsIntervalIterator(
+            request, variantSet, includeLikelihoods)
+
+    genotypeMatrixExtensionNames = ["includeLikelihoods"]
+    """
+    The names of the arguments that may be given in the
+    SearchVariantsRequest of a genotype matrix search, which are not
+    part of the protocol.
+    """
+
+    def _getVariantFilter(self, **filterArgs):
+        """
+        Returns the VariantFilter defined by the specified variant
+        filter arguments, or None if there are none. Raises a
+        BadVariantFilterException if the filter expression is invalid.
+        """
+        expression = filterArgs.get("filter")
+        if expression is None:
+            return None
+        if not isinstance(expression, basestring):
+            raise exceptions.BadVariantFilterException(
+                expression, "the filter must be a string")
+        try:
+            return variantfilters.VariantFilter(expression)
+        except ValueError as error:
+            raise exceptions.BadVariantFilterException(
+                expression, str(error))
+
+    def _getCarrierCallSetIds(self, **filterArgs):
+        """
+        Returns the list of carrier call set IDs in the specified variant
+        filter arguments, or None if there are none. Raises a
+        BadRequestArgumentException if they are not a list of strings.
+        """
+        carrierCallSetIds = filterArgs.get("carrierCallSetIds")
+        if carrierCallSetIds is None:
+            return None
+        if not isinstance(carrierCallSetIds, list) or not all(
+                isinstance(callSetId, basestring)
+                for callSetId in carrierCallSetIds):
+            raise exceptions.BadRequestArgumentException(
+                "carrierCallSetIds", carrierCallSetIds)
+        return carrierCallSetIds
 
     def callSetsGenerator(self, request):
         """
@@ -539,49 +1062,127 @@ class AbstractBackend(object):
     #
     ###########################################################
 
-    def runGetRequest(self, obj):
+    def runGetRequest(self, obj, mimetype=protocol.JSON_MIMETYPE):
         """
         Runs a get request by converting the specified datamodel
-        object into its protocol representation.
+        object into its protocol representation, serialized in the
+        wire format identified by the specified mimetype.
         """
         protocolElement = obj.toProtocolElement()
-        jsonString = protocolElement.toJsonString()
-        return jsonString
+        return protocolElement.serialize(mimetype)
 
     def runSearchRequest(
-            self, requestStr, requestClass, responseClass, objectGenerator):
+            self, requestStr, requestClass, responseClass, objectGenerator,
+            mimetype=protocol.JSON_MIMETYPE, jsonObjectGenerator=None,
+            extensionNames=None):
         """
         Runs the specified request. The request is a string containing
         a JSON representation of an instance of the specified requestClass.
         We return a string representation of an instance of the specified
-        responseClass in JSON format. Objects are filled into the page list
+        responseClass in the wire format identified by the specified
+        mimetype (JSON by default). Objects are filled into the page list
         using the specified object generator, which must return
         (object, nextPageToken) pairs, and be able to resume iteration from
         any point using the nextPageToken attribute of the request object.
-        """
+        If a jsonObjectGenerator is specified, it is used instead when we
+        are writing JSON and response validation is off. It returns the
+        same pairs, except that each object is a JsonRecord written
+        directly from the underlying data.
+
+        Searches with a jsonObjectGenerator also accept a "fields" value
+        in the request, which is not part of the protocol. This is a
+        comma separated list of the fields of the returned objects to
+        include in the response (see protocol.FieldMask). Responses
+        that include only some fields are not validated.
+
+        Any of the specified extensionNames that are given in the request
+        are also removed before it is validated, and passed as keyword
+        arguments to the object generators.
+        """
+        if extensionNames is None:
+            extensionNames = []
         self.startProfile()
+        request, fields, extensions = self._parseSearchRequest(
+            requestStr, requestClass, extensionNames)
+        responseBuilder = protocol.getSearchResponseBuilder(
+            mimetype, responseClass, request.pageSize,
+            self._maxResponseLength)
+        fieldMask = None
+        if fields is not None:
+            fieldMask = self._getFieldMask(
+                fields, responseClass, mimetype,
+                jsonObjectGenerator is not None)
+        if (jsonObjectGenerator is not None and
+                mimetype == protocol.JSON_MIMETYPE and
+                (fieldMask is not None or not self._responseValidation)):
+            searchIterator = jsonObjectGenerator(
+                request, fieldMask, **extensions)
+        else:
+            searchIterator = objectGenerator(request, **extensions)
+        nextPageToken = None
+        for obj, nextPageToken in searchIterator:
+            responseBuilder.addValue(obj)
+            if responseBuilder.isFull():
+                break
+        responseBuilder.setNextPageToken(nextPageToken)
+        responseString = responseBuilder.getSerializedResponse()
+        if fieldMask is None:
+            self.validateResponse(responseString, responseClass, mimetype)
+        self.endProfile()
+        return responseString
+
+    def _parseSearchRequest(self, requestStr, requestClass, extensionNames):
+        """
+        Parses the specified JSON string into an instance of the specified
+        requestClass, with the default page size if none is given.
+        Returns the (request, fields, extensions) tuple, where fields is
+        the "fields" value of the request or None, and extensions is the
+        dictionary of the values of the specified extensionNames given
+        in the request.
+        """
         try:
             requestDict = json.loads(requestStr)
         except ValueError:
             raise exceptions.InvalidJsonException(requestStr)
+        fields = None
+        extensions = {}
+        if isinstance(requestDict, dict):
+            # We remove the fields and other extensions before validating
+            # the request, as they are not part of the protocol.
+            fields = requestDict.pop("fields", None)
+            for name in extensionNames:
+                if name in requestDict:
+                    extensions[name] = requestDict.pop(name)
         self.validateRequest(requestDict, requestClass)
         request = requestClass.fromJsonDict(requestDict)
         if request.pageSize is None:
             request.pageSize = self._defaultPageSize
         if request.pageSize <= 0:
             raise exceptions.BadPageSizeException(request.pageSize)
-        responseBuilder = protocol.SearchResponseBuilder(
-            responseClass, request.pageSize, self._maxResponseLength)
-        nextPageToken = None
-        for obj, nextPageToken in objectGenerator(request):
-            responseBuilder.addValue(obj)
-            if responseBuilder.isFull():
-                break
-        responseBuilder.setNextPageToken(nextPageToken)
-        responseString = responseBuilder.getJsonString()
-        self.validateResponse(responseString, responseClass)
-        self.endProfile()
-        return responseString
+        return request, fields, extensions
+
+    def _getFieldMask(self, fields, responseClass, mimetype, supported):
+        """
+        Returns the FieldMask for the values in the specified
+        responseClass described by the specified fields string. Raises
+        a BadFieldMaskException if fields cannot be used for this
+        search.
+        """
+        if not supported:
+            raise exceptions.BadFieldMaskException(
+                fields, "fields are not supported for this search")
+        if mimetype != protocol.JSON_MIMETYPE:
+            raise exceptions.BadFieldMaskException(
+                fields, "fields are only supported for JSON responses")
+        if not isinstance(fields, basestring):
+            raise exceptions.BadFieldMaskException(
+                fields, "fields must be a string")
+        valueClass = responseClass.getEmbeddedType(
+            responseClass.getValueListName())
+        try:
+            return protocol.FieldMask.parse(valueClass, fields)
+        except ValueError as error:
+            raise exceptions.BadFieldMaskException(fields, str(error))
 
     def runListReferenceBases(self, id_, requestArgs):
         """
@@ -611,19 +1212,255 @@ class AbstractBackend(object):
         response.nextPageToken = nextPageToken
         return response.toJsonString()
 
+    defaultCoverageBins = 1000
+    """
+    The number of bins requested in coverage requests that do not give
+    maxBins.
+    """
+    maxCoverageBins = 100000
+    """
+    The greatest number of bins that may be requested in a coverage
+    request.
+    """
+
+    def runListReadGroupCoverage(self, id_, requestArgs):
+        """
+        Runs a coverage request for the read group with the specified ID
+        and the specified request arguments, and returns the JSON object
+        giving the mean depth of coverage of each of about maxBins
+        consecutive bins covering the region. The depth of a bin holding
+        the end of the reference is the mean over the bases before it.
+        """
+        readGroup = self.getReadGroup(id_)
+        if "referenceId" not in requestArgs:
+            raise exceptions.BadRequestArgumentException("referenceId", None)
+        referenceSet = readGroup.getParentContainer().getReferenceSet()
+        if referenceSet is None:
+            raise exceptions.ReferenceNotFoundException(
+                requestArgs["referenceId"])
+        reference = referenceSet.getReference(requestArgs["referenceId"])
+        length = reference.getLength()
+        start = _parseIntegerArgument(requestArgs, "start", 0)
+        end = _parseIntegerArgument(requestArgs, "end", length)
+        maxBins = _parseIntegerArgument(
+            requestArgs, "maxBins", self.defaultCoverageBins)
+        if start < 0 or start >= end:
+            raise exceptions.BadRequestArgumentException("start", start)
+        if maxBins < 1 or maxBins > self.maxCoverageBins:
+            raise exceptions.BadRequestArgumentException("maxBins", maxBins)
+        binSize, firstBin, sums = readGroup.getCoverage(
+            reference, start, end, maxBins)
+        depths = []
+        for index, total in enumerate(sums):
+            binStart = (firstBin + index) * binSize
+            width = binSize
+            if binStart < length < binStart + binSize:
+                width = length - binStart
+            depths.append(round(int(total) / width, 3))
+        return json.dumps({
+            "referenceId": reference.getId(),
+            "start": firstBin * binSize,
+            "end": (firstBin + len(depths)) * binSize,
+            "binSize": binSize,
+            "depths": depths,
+        })
+
+    def runExportReadGroupSetBam(self, id_, requestArgs):
+        """
+        Runs a BAM slice request for the read group set with the
+        specified ID and the specified request arguments, and returns a
+        generator over the pieces of a BAM file holding the header of
+        the read group set's BAM file and its reads overlapping the
+        region, or all of its reads if referenceName is not given.
+        """
+        readGroupSet = self.getReadGroupSet(id_)
+        bamSlicer = readGroupSet.getBamSlicer()
+        if bamSlicer is None:
+            raise exceptions.NotImplementedException(
+                "BAM slices are not available for this read group set")
+        referenceName = requestArgs.get("referenceName")
+        start = _parseIntegerArgument(requestArgs, "start", 0)
+        end = _parseIntegerArgument(requestArgs, "end", None)
+        if referenceName is None and ("start" in requestArgs or
+                                      "end" in requestArgs):
+            raise exceptions.BadRequestArgumentException(
+                "referenceName", None)
+        if start < 0 or (end is not None and start >= end):
+            raise exceptions.BadRequestArgumentException("start", start)
+        chunks = bamSlicer.getChunks(referenceName, start, end)
+        return bamSlicer.iterSlice(chunks)
+
+    defaultDensityBins = 1000
+    """
+    The number of bins requested in variant density requests that do not
+    give maxBins.
+    """
+    maxDensityBins = 10000
+    """
+    The greatest number of bins that may be requested in a variant
+    density request.
+    """
+
+    def runListVariantSetDensity(self, id_, requestArgs):
+        """
+        Runs a density request for the variant set with the specified ID
+        and the specified request arguments, and returns the JSON object
+        giving the number of variants starting in each of about maxBins
+        consecutive bins covering the region, split by variant class and
+        allele frequency class.
+        """
+        variantSet = self.getVariantSet(id_)
+        for argumentName in ["referenceName", "end"]:
+            if argumentName not in requestArgs:
+                raise exceptions.BadRequestArgumentException(
+                    argumentName, None)
+        referenceName = requestArgs["referenceName"]
+        start = _parseIntegerArgument(requestArgs, "start", 0)
+        end = _parseIntegerArgument(requestArgs, "end", 0)
+        maxBins = _parseIntegerArgument(
+            requestArgs, "maxBins", self.defaultDensityBins)
+        if start < 0 or start >= end:
+            raise exceptions.BadRequestArgumentException("start", start)
+        if maxBins < 1 or maxBins > self.maxDensityBins:
+            raise exceptions.BadRequestArgumentException("maxBins", maxBins)
+        binSize, firstBin, counts = variantSet.getVariantDensity(
+            referenceName, start, end, maxBins)
+        return json.dumps({
+            "variantSetId": variantSet.getId(),
+            "referenceName": referenceName,
+            "start": firstBin * binSize,
+            "end": (firstBin + len(counts)) * binSize,
+            "binSize": binSize,
+            "variantClasses": variantfilters.VARIANT_CLASSES,
+            "alleleFrequencyClasses": variantdensity.ALLELE_FREQUENCY_CLASSES,
+            "counts": counts.tolist(),
+        })
+
+    exportRegionSize = variantexport.DEFAULT_REGION_SIZE
+    """
+    The number of bases of a contig exported by each of the tasks run by
+    the worker processes of variant exports.
+    """
+
+    def runExportVariantSet(self, id_, requestArgs, exporter=None):
+        """
+        Runs an export request for the variant set with the specified ID
+        and the specified request arguments, and returns a generator over
+        the newline delimited JSON of its variants overlapping the
+        region, on the contig given by referenceName or on all of its
+        contigs in turn. The tasks of the export are run by the specified
+        exporter, or by variantexport.variantExporter if it is None.
+        """
+        variantSet = self.getVariantSet(id_)
+        if "referenceName" in requestArgs:
+            referenceNames = [requestArgs["referenceName"]]
+        else:
+            referenceNames = variantSet.getReferenceNames()
+        start = _parseIntegerArgument(requestArgs, "start", 0)
+        end = _parseIntegerArgument(requestArgs, "end", None)
+        if start < 0 or (end is not None and start >= end):
+            raise exceptions.BadRequestArgumentException("start", start)
+        tasks = variantexport.getExportTasks(
+            variantSet, referenceNames, start, end, self.exportRegionSize)
+        if tasks is None:
+            raise exceptions.BadRequestArgumentException("end", None)
+        if exporter is None:
+            exporter = variantexport.variantExporter
+        return exporter.export(variantSet, tasks)
+
+    def runExportVariantSetSlice(self, id_, requestArgs):
+        """
+        Runs a VCF slice request for the variant set with the specified
+        ID and the specified request arguments, and returns the
+        (mimetype, pieces) pair of the bgzipped VCF or BCF file holding
+        its variants overlapping the region of the contig given by
+        referenceName, with the calls of the comma separated callSetIds
+        or of all of its call sets.
+        """
+        variantSet = self.getVariantSet(id_)
+        referenceName = requestArgs.get("referenceName")
+        if referenceName is None:
+            raise exceptions.BadRequestArgumentException(
+                "referenceName", None)
+        start = _parseIntegerArgument(requestArgs, "start", 0)
+        end = _parseIntegerArgument(requestArgs, "end", None)
+        if start < 0 or (end is not None and start >= end):
+            raise exceptions.BadRequestArgumentException("start", start)
+        sampleNames = None
+        if "callSetIds" in requestArgs:
+            sampleNames = [
+                variantSet.getCallSet(callSetId).getSampleName()
+                for callSetId in requestArgs["callSetIds"].split(",")]
+        slicers = variantSet.getVariantFileSlicers(referenceName, start, end)
+        if slicers is None:
+            raise exceptions.NotImplementedException(
+                "VCF slices are not available for this variant set")
+        return variantslice.getSlice(
+            slicers, referenceName, start, end, sampleNames)
+
+    def _getExportJobManager(self):
+        if self._exportJobManager is None:
+            raise exceptions.NotImplementedException(
+                "Export jobs are not enabled on this server")
+        return self._exportJobManager
+
+    def runCreateExportJob(self, requestStr, userId=None):
+        """
+        Runs a request to create an export job, given as a JSON object
+        with the type of the export, the id of the object to export, the
+        optional args of the export request, which are the string or
+        integer arguments of its GET endpoint, and the optional priority
+        of the job. Returns the JSON describing the queued job.
+        """
+        try:
+            requestDict = json.loads(requestStr)
+        except ValueError:
+            raise exceptions.InvalidJsonException(requestStr)
+        if not isinstance(requestDict, dict):
+            raise exceptions.InvalidJsonException(requestStr)
+        objectId = requestDict.get("id")
+        if not isinstance(objectId, basestring):
+            raise exceptions.BadRequestArgumentException("id", objectId)
+        args = requestDict.get("args", {})
+        if not isinstance(args, dict) or not all(
+                isinstance(value, (basestring, int)) and
+                not isinstance(value, bool) for value in args.values()):
+            raise exceptions.BadRequestArgumentException("args", args)
+        args = dict((key, "{}".format(value)) for key, value in args.items())
+        job = self._getExportJobManager().submit(
+            requestDict.get("type"), objectId, args,
+            requestDict.get("priority", 0), userId)
+        return json.dumps(job.toJsonDict())
+
+    def runGetExportJob(self, id_, userId=None):
+        """
+        Returns the JSON describing the progress of the export job with
+        the specified ID, which must have been submitted by the specified
+        user unless userId is None.
+        """
+        return json.dumps(
+            self._getExportJobManager().getJob(id_, userId).toJsonDict())
+
+    def getExportJobOutput(self, id_, userId=None):
+        """
+        Returns the (path, mimetype) pair of the output of the export job
+        with the specified ID, which must have finished successfully, and
+        have been submitted by the specified user unless userId is None.
+        """
+        exportJobManager = self._getExportJobManager()
+        return (
+            exportJobManager.getOutputPath(id_, userId),
+            exportJobManager.getJob(id_, userId).mimetype)
+
     # Get requests.
 
-    def runGetCallset(self, id_):
+    def runGetCallset(self, id_, mimetype=protocol.JSON_MIMETYPE):
         """
         Returns a callset with the given id
         """
-        compoundId = datamodel.CallSetCompoundId.parse(id_)
-        dataset = self.getDataset(compoundId.datasetId)
-        variantSet = dataset.getVariantSet(compoundId.variantSetId)
-        callSet = variantSet.getCallSet(id_)
-        return self.runGetRequest(callSet)
+        return self.runGetRequest(self.getCallSet(id_), mimetype)
 
-    def runGetVariant(self, id_):
+    def runGetVariant(self, id_, mimetype=protocol.JSON_MIMETYPE):
         """
         Returns a variant with the given id
         """
@@ -634,133 +1471,374 @@ class AbstractBackend(object):
         # TODO variant is a special case here, as it's returning a
         # protocol element rather than a datamodel object. We should
         # fix this for consistency.
-        jsonString = gaVariant.toJsonString()
-        return jsonString
+        return gaVariant.serialize(mimetype)
 
-    def runGetReadGroupSet(self, id_):
+    def runGetVariantCarriers(self, id_):
         """
-        Returns a readGroupSet with the given id_
+        Returns the JSON object listing the IDs of the call sets that
+        carry a non reference allele of the variant with the given id.
         """
-        compoundId = datamodel.ReadGroupSetCompoundId.parse(id_)
+        compoundId = datamodel.VariantCompoundId.parse(id_)
         dataset = self.getDataset(compoundId.datasetId)
-        readGroupSet = dataset.getReadGroupSet(id_)
-        return self.runGetRequest(readGroupSet)
+        variantSet = dataset.getVariantSet(compoundId.variantSetId)
+        callSetIds = variantSet.getCarrierCallSetIds(compoundId)
+        return json.dumps({"callSetIds": callSetIds})
+
+    def runGetReadGroupSet(self, id_, mimetype=protocol.JSON_MIMETYPE):
+        """
+        Returns a readGroupSet with the given id_
+        """
+        return self.runGetRequest(self.getReadGroupSet(id_), mimetype)
 
-    def runGetReadGroup(self, id_):
+    def runGetReadGroup(self, id_, mimetype=protocol.JSON_MIMETYPE):
         """
         Returns a read group with the given id_
         """
-        compoundId = datamodel.ReadGroupCompoundId.parse(id_)
-        dataset = self.getDataset(compoundId.datasetId)
-        readGroupSet = dataset.getReadGroupSet(compoundId.readGroupSetId)
-        readGroup = readGroupSet.getReadGroup(id_)
-        return self.runGetRequest(readGroup)
+        return self.runGetRequest(self.getReadGroup(id_), mimetype)
 
-    def runGetReference(self, id_):
+    def runGetReference(self, id_, mimetype=protocol.JSON_MIMETYPE):
         """
         Runs a getReference request for the specified ID.
         """
-        compoundId = datamodel.ReferenceCompoundId.parse(id_)
-        referenceSet = self.getReferenceSet(compoundId.referenceSetId)
-        reference = referenceSet.getReference(id_)
-        return self.runGetRequest(reference)
+        return self.runGetRequest(self.getReference(id_), mimetype)
 
-    def runGetReferenceSet(self, id_):
+    def runGetReferenceSet(self, id_, mimetype=protocol.JSON_MIMETYPE):
         """
         Runs a getReferenceSet request for the specified ID.
         """
-        referenceSet = self.getReferenceSet(id_)
-        return self.runGetRequest(referenceSet)
+        return self.runGetRequest(self.getReferenceSet(id_), mimetype)
 
-    def runGetVariantSet(self, id_):
+    def runGetVariantSet(self, id_, mimetype=protocol.JSON_MIMETYPE):
         """
         Runs a getVariantSet request for the specified ID.
         """
-        compoundId = datamodel.VariantSetCompoundId.parse(id_)
-        dataset = self.getDataset(compoundId.datasetId)
-        variantSet = dataset.getVariantSet(id_)
-        return self.runGetRequest(variantSet)
+        return self.runGetRequest(self.getVariantSet(id_), mimetype)
 
-    def runGetDataset(self, id_):
+    def runGetDataset(self, id_, mimetype=protocol.JSON_MIMETYPE):
         """
         Runs a getDataset request for the specified ID.
         """
-        dataset = self.getDataset(id_)
-        return self.runGetRequest(dataset)
+        return self.runGetRequest(self.getDataset(id_), mimetype)
+
+    # Batch get requests.
+
+    maxBatchGetIds = 1000
+    """
+    The greatest number of IDs that may be given in a batch get request.
+    """
+
+    def _parseBatchGetRequest(self, requestStr):
+        """
+        Parses the specified JSON string of a batch get request, and
+        returns its list of IDs.
+        """
+        try:
+            requestDict = json.loads(requestStr)
+        except ValueError:
+            raise exceptions.InvalidJsonException(requestStr)
+        ids = None
+        if isinstance(requestDict, dict):
+            ids = requestDict.get("ids")
+        if (not isinstance(ids, list) or
+                not all(isinstance(id_, basestring) for id_ in ids) or
+                len(ids) > self.maxBatchGetIds):
+            raise exceptions.BadRequestArgumentException("ids", ids)
+        return ids
+
+    def _getBatchGetResponse(self, ids, results):
+        """
+        Returns the JSON string of the response to a batch get request
+        for the specified IDs, given the list of the protocol object or
+        the exception for each of them.
+        """
+        entries = []
+        for id_, result in zip(ids, results):
+            if isinstance(result, exceptions.RuntimeException):
+                entries.append({
+                    "id": id_,
+                    "error": result.toProtocolElement().toJsonDict()})
+            else:
+                entries.append({"id": id_, "value": result.toJsonDict()})
+        return json.dumps({"results": entries})
+
+    def _runBatchGetRequest(self, requestStr, getMethod):
+        """
+        Runs the specified batch get request, calling getMethod for each
+        of its IDs to find the datamodel object.
+        """
+        ids = self._parseBatchGetRequest(requestStr)
+        results = []
+        for id_ in ids:
+            try:
+                results.append(getMethod(id_).toProtocolElement())
+            except (exceptions.NotFoundException,
+                    exceptions.BadIdentifierException) as exception:
+                results.append(exception)
+        return self._getBatchGetResponse(ids, results)
+
+    def runBatchGetVariants(self, requestStr, mimetype=protocol.JSON_MIMETYPE):
+        """
+        Runs the specified batch get request for variants, returning the
+        JSON object giving the variant or the error for each of the
+        requested IDs, in order. The IDs are grouped by variant set, and
+        the variants of each variant set are read together.
+        """
+        ids = self._parseBatchGetRequest(requestStr)
+        results = [None] * len(ids)
+        # Maps each variant set ID to the list of (index, compoundId)
+        # pairs of the variants requested from it.
+        requested = {}
+        for index, id_ in enumerate(ids):
+            try:
+                compoundId = datamodel.VariantCompoundId.parse(id_)
+            except (exceptions.NotFoundException,
+                    exceptions.BadIdentifierException) as exception:
+                results[index] = exception
+                continue
+            requested.setdefault(compoundId.variantSetId, []).append(
+                (index, compoundId))
+        for pairs in requested.values():
+            compoundId = pairs[0][1]
+            try:
+                dataset = self.getDataset(compoundId.datasetId)
+                variantSet = dataset.getVariantSet(compoundId.variantSetId)
+            except exceptions.NotFoundException as exception:
+                for index, _ in pairs:
+                    results[index] = exception
+                continue
+            gaVariants = variantSet.getVariantsById(
+                [pair[1] for pair in pairs])
+            for (index, _), gaVariant in zip(pairs, gaVariants):
+                results[index] = gaVariant
+                if gaVariant is None:
+                    results[index] = exceptions.ObjectWithIdNotFoundException(
+                        ids[index])
+        return self._getBatchGetResponse(ids, results)
+
+    def runBatchGetCallSets(self, requestStr, mimetype=protocol.JSON_MIMETYPE):
+        """
+        Runs the specified batch get request for call sets.
+        """
+        return self._runBatchGetRequest(requestStr, self.getCallSet)
+
+    def runBatchGetReadGroups(
+            self, requestStr, mimetype=protocol.JSON_MIMETYPE):
+        """
+        Runs the specified batch get request for read groups.
+        """
+        return self._runBatchGetRequest(requestStr, self.getReadGroup)
+
+    def runBatchGetReferences(
+            self, requestStr, mimetype=protocol.JSON_MIMETYPE):
+        """
+        Runs the specified batch get request for references.
+        """
+        return self._runBatchGetRequest(requestStr, self.getReference)
 
     # Search requests.
 
-    def runSearchReadGroupSets(self, request):
+    def runSearchReadGroupSets(
+            self, request, mimetype=protocol.JSON_MIMETYPE):
         """
         Runs the specified SearchReadGroupSetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchReadGroupSetsRequest,
             protocol.SearchReadGroupSetsResponse,
-            self.readGroupSetsGenerator)
+            self.readGroupSetsGenerator, mimetype)
 
-    def runSearchReads(self, request):
+    def runSearchReads(
+            self, request, mimetype=protocol.JSON_MIMETYPE):
         """
         Runs the specified SearchReadsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchReadsRequest,
             protocol.SearchReadsResponse,
-            self.readsGenerator)
+            self.readsGenerator, mimetype,
+            jsonObjectGenerator=self.readsJsonGenerator,
+            extensionNames=self.readsSearchExtensionNames)
 
-    def runSearchReferenceSets(self, request):
+    def runSearchReferenceSets(
+            self, request, mimetype=protocol.JSON_MIMETYPE):
         """
         Runs the specified SearchReferenceSetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchReferenceSetsRequest,
             protocol.SearchReferenceSetsResponse,
-            self.referenceSetsGenerator)
+            self.referenceSetsGenerator, mimetype)
 
-    def runSearchReferences(self, request):
+    def runSearchReferences(
+            self, request, mimetype=protocol.JSON_MIMETYPE):
         """
         Runs the specified SearchReferenceRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchReferencesRequest,
             protocol.SearchReferencesResponse,
-            self.referencesGenerator)
+            self.referencesGenerator, mimetype)
 
-    def runSearchVariantSets(self, request):
+    def runSearchVariantSets(
+            self, request, mimetype=protocol.JSON_MIMETYPE):
         """
         Runs the specified SearchVariantSetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchVariantSetsRequest,
             protocol.SearchVariantSetsResponse,
-            self.variantSetsGenerator)
+            self.variantSetsGenerator, mimetype)
 
-    def runSearchVariants(self, request):
+    def runSearchVariants(
+            self, request, mimetype=protocol.JSON_MIMETYPE):
         """
         Runs the specified SearchVariantRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchVariantsRequest,
             protocol.SearchVariantsResponse,
-            self.variantsGenerator)
+            self.variantsGenerator, mimetype,
+            jsonObjectGenerator=self.variantsJsonGenerator,
+            extensionNames=self.variantsSearchExtensionNames)
+
+    def runSearchGenotypeMatrix(
+            self, requestStr, mimetype=protocol.JSON_MIMETYPE):
+        """
+        Runs the specified SearchVariantsRequest, returning the genotypes
+        of the requested call sets at the variants it defines as a
+        genotypematrix.GenotypeMatrix in the wire format identified by
+        the specified mimetype. The columns of the matrix are the call
+        sets in the order they are given in the request, or all the call
+        sets of the variant set if there are none. The request may also
+        include an "includeLikelihoods" boolean value, which is not part
+        of the protocol. Pages hold up to pageSize variants, and end once
+        the arrays reach the maximum response length.
+        """
+        self.startProfile()
+        request, fields, extensions = self._parseSearchRequest(
+            requestStr, protocol.SearchVariantsRequest,
+            self.genotypeMatrixExtensionNames)
+        if fields is not None:
+            raise exceptions.BadFieldMaskException(
+                fields, "fields are not supported for this search")
+        searchIterator = self.genotypeRowsGenerator(request, **extensions)
+        callSetIds = request.callSetIds
+        if callSetIds is None:
+            callSetIds = [
+                callSet.getId() for callSet in
+                self.getVariantSet(request.variantSetId).getCallSets()]
+        matrixBuilder = genotypematrix.GenotypeMatrixBuilder(
+            callSetIds, request.pageSize, self._maxResponseLength,
+            extensions.get("includeLikelihoods", False))
+        nextPageToken = None
+        for genotypeRow, nextPageToken in searchIterator:
+            matrixBuilder.addValue(genotypeRow)
+            if matrixBuilder.isFull():
+                break
+        matrixBuilder.setNextPageToken(nextPageToken)
+        responseString = matrixBuilder.getSerializedResponse(mimetype)
+        self.endProfile()
+        return responseString
 
-    def runSearchCallSets(self, request):
+    pileupExtensionNames = readFilterArgumentNames + ["minBaseQuality"]
+    """
+    The names of the arguments that may be given in a SearchReadsRequest
+    for a pileup, which are not part of the protocol.
+    """
+    maxPileupLength = 10000
+    """
+    The greatest number of positions that may be requested in a pileup.
+    """
+
+    def runSearchPileup(self, requestStr, mimetype=protocol.JSON_MIMETYPE):
+        """
+        Runs the specified SearchReadsRequest, returning the JSON object
+        giving the number of each of pileup.ALLELES at each position of
+        the requested region in the reads of all of the requested read
+        groups. The request may also include the read filter arguments,
+        and a "minBaseQuality" below which bases are not counted, which
+        are not part of the protocol. The counts are cached, so repeated
+        requests for a pileup do not read the reads again.
+        """
+        request, fields, extensions = self._parseSearchRequest(
+            requestStr, protocol.SearchReadsRequest,
+            self.pileupExtensionNames)
+        if fields is not None:
+            raise exceptions.BadFieldMaskException(
+                fields, "fields are not supported for this search")
+        if request.referenceId is None:
+            raise exceptions.UnmappedReadsNotSupported()
+        if len(request.readGroupIds) == 0:
+            raise exceptions.BadRequestArgumentException(
+                "readGroupIds", request.readGroupIds)
+        minBaseQuality = extensions.pop("minBaseQuality", 0)
+        if (not isinstance(minBaseQuality, (int, long)) or
+                isinstance(minBaseQuality, bool) or
+                not 0 <= minBaseQuality <= 255):
+            raise exceptions.BadRequestArgumentException(
+                "minBaseQuality", minBaseQuality)
+        readFilter = self._getReadFilter(**extensions)
+        targets = []
+        for readGroupId in request.readGroupIds:
+            readGroup = self.getReadGroup(readGroupId)
+            referenceSet = readGroup.getParentContainer().getReferenceSet()
+            if referenceSet is None:
+                raise exceptions.ReferenceNotFoundException(
+                    request.referenceId)
+            targets.append(
+                (readGroup, referenceSet.getReference(request.referenceId)))
+        start = request.start or 0
+        end = request.end
+        if end is None:
+            end = targets[0][1].getLength()
+        if start < 0 or start >= end:
+            raise exceptions.BadRequestArgumentException("start", start)
+        if end - start > self.maxPileupLength:
+            raise exceptions.BadRequestArgumentException("end", end)
+
+        def computeCounts():
+            counts = pileup.getEmptyCounts(end - start)
+            for readGroup, reference in targets:
+                readGroup.addPileupCounts(
+                    counts, reference, start, readFilter, minBaseQuality)
+            return counts
+        # The counts are the sum over the read groups, so the order in
+        # which they are requested does not matter, but they must be
+        # recomputed when the data files of any of them change.
+        readGroupStates = tuple(sorted(
+            (readGroup.getId(), readGroup.getDataModificationTime())
+            for readGroup, _ in targets))
+        key = (
+            readGroupStates, request.referenceId, start, end,
+            minBaseQuality, tuple(sorted(extensions.items())))
+        counts = pileup.pileupCache.getCounts(key, computeCounts)
+        return json.dumps({
+            "referenceId": request.referenceId,
+            "start": start,
+            "end": end,
+            "alleles": pileup.ALLELES,
+            "counts": counts.tolist(),
+        })
+
+    def runSearchCallSets(
+            self, request, mimetype=protocol.JSON_MIMETYPE):
         """
         Runs the specified SearchCallSetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchCallSetsRequest,
             protocol.SearchCallSetsResponse,
-            self.callSetsGenerator)
+            self.callSetsGenerator, mimetype)
 
-    def runSearchDatasets(self, request):
+    def runSearchDatasets(
+            self, request, mimetype=protocol.JSON_MIMETYPE):
         """
         Runs the specified SearchDatasetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchDatasetsRequest,
             protocol.SearchDatasetsResponse,
-            self.datasetsGenerator)
+            self.datasetsGenerator, mimetype)
 
 
 class EmptyBackend(AbstractBackend):
@@ -114,7 +114,8 @@ class AbstractQueryRunner(object):
             self._client = client.LocalClient(theBackend)
         else:
             self._client = client.HttpClient(
-                args.baseUrl, verbosityToLogLevel(args.verbose), self._key)
+                args.baseUrl, verbosityToLogLevel(args.verbose), self._key,
+                args.avroBinary)
 
 
 class FormattedOutputRunner(AbstractQueryRunner):
@@ -652,6 +653,11 @@ def addClientGlobalOptions(parser):
     parser.add_argument(
         "--key", "-k", default='invalid',
         help="Auth Key. Found on server index page.")
+    parser.add_argument(
+        "--avroBinary", default=False, action="store_true",
+        help=(
+            "Request responses in the Avro binary encoding rather "
+            "than JSON"))
     addDisableUrllibWarningsArgument(parser)
 
 
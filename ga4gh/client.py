@@ -5,10 +5,13 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
+import json
 import requests
 import posixpath
 import logging
 
+import ga4gh.genotypematrix as genotypematrix
 import ga4gh.protocol as protocol
 import ga4gh.exceptions as exceptions
 
@@ -26,13 +29,19 @@ class AbstractClient(object):
         self._logger = logging.getLogger(__name__)
         self._logger.setLevel(logLevel)
 
-    def _deserializeResponse(self, jsonResponseString, protocolResponseClass):
-        self._protocolBytesReceived += len(jsonResponseString)
-        self._logger.debug("response:{}".format(jsonResponseString))
-        if jsonResponseString == '':
+    def _deserializeResponse(
+            self, responseString, protocolResponseClass,
+            mimetype=protocol.JSON_MIMETYPE):
+        self._protocolBytesReceived += len(responseString)
+        if mimetype == protocol.JSON_MIMETYPE:
+            self._logger.debug("response:{}".format(responseString))
+        else:
+            self._logger.debug("response:<{} bytes of {}>".format(
+                len(responseString), mimetype))
+        if len(responseString) == 0:
             raise exceptions.EmptyResponseException()
-        responseObject = protocolResponseClass.fromJsonString(
-            jsonResponseString)
+        responseObject = protocolResponseClass.deserialize(
+            responseString, mimetype)
         return responseObject
 
     def _runSearchPageRequest(
@@ -90,6 +99,112 @@ class AbstractClient(object):
             request.pageToken = response.nextPageToken
         return "".join(basesList)
 
+    def _runGenotypeMatrixPageRequest(self, requestString):
+        """
+        Runs a complete transaction with the server to get a single
+        page of the genotype matrix for the specified JSON request.
+        """
+        raise NotImplemented()
+
+    def _deserializeGenotypeMatrix(self, responseString, mimetype):
+        self._protocolBytesReceived += len(responseString)
+        self._logger.debug("response:<{} bytes of {}>".format(
+            len(responseString), mimetype))
+        if len(responseString) == 0:
+            raise exceptions.EmptyResponseException()
+        return genotypematrix.GenotypeMatrix.deserialize(
+            responseString, mimetype)
+
+    def getGenotypeMatrix(
+            self, variantSetId, referenceName, start, end,
+            callSetIds=None, includeLikelihoods=False):
+        """
+        Returns the genotypes of the specified call sets at the variants
+        in the specified region as a single GenotypeMatrix, which holds
+        the genotypes, phasing and likelihoods in NumPy arrays with a
+        row for each variant and a column for each call set. The pages
+        returned by the server are concatenated.
+
+        :param str variantSetId: The ID of the
+            :class:`ga4gh.protocol.VariantSet` of interest.
+        :param str referenceName: The name of the
+            :class:`ga4gh.protocol.Reference` we wish to return variants from.
+        :param int start: The beginning of the window (0-based, inclusive)
+            for which overlapping variants should be returned.
+        :param int end: The end of the window (0-based, exclusive) for
+            which overlapping variants should be returned.
+        :param list callSetIds: The IDs of the call sets for the columns
+            of the matrix, in order. If None, all of the call sets in the
+            variant set are returned.
+        :param bool includeLikelihoods: If True, the matrix includes the
+            genotype likelihoods of the calls.
+        :return: The matrix for the variants defined by the query
+            parameters.
+        :rtype: :class:`ga4gh.genotypematrix.GenotypeMatrix`
+        """
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = variantSetId
+        request.referenceName = referenceName
+        request.start = start
+        request.end = end
+        request.callSetIds = callSetIds
+        request.pageSize = self._pageSize
+        matrices = []
+        notDone = True
+        while notDone:
+            requestDict = request.toJsonDict()
+            requestDict["includeLikelihoods"] = includeLikelihoods
+            matrix = self._runGenotypeMatrixPageRequest(
+                json.dumps(requestDict))
+            matrices.append(matrix)
+            notDone = matrix.nextPageToken is not None
+            request.pageToken = matrix.nextPageToken
+        return genotypematrix.GenotypeMatrix.concatenate(matrices)
+
+    def _runPileupRequest(self, requestString):
+        """
+        Runs a complete transaction with the server to get the JSON
+        describing the pileup for the specified JSON request.
+        """
+        raise NotImplemented()
+
+    def getPileup(
+            self, readGroupIds, referenceId, start=None, end=None,
+            minBaseQuality=0, minMappingQuality=0, requiredFlags=0,
+            excludedFlags=0):
+        """
+        Returns the number of reads with each allele at each position of
+        the specified region in the specified ReadGroups, counting only
+        the bases with at least the specified quality in the reads with
+        at least the specified mapping quality, all of the SAM flags in
+        requiredFlags set and none of those in excludedFlags set.
+
+        :param list readGroupIds: The IDs of the ReadGroups of interest.
+        :param str referenceId: The ID of the Reference of interest.
+        :param int start: The start of the region (0-based, inclusive),
+            or None for the start of the reference.
+        :param int end: The end of the region (0-based, exclusive), or
+            None for the end of the reference.
+        :return: A dictionary with the start and end of the region, the
+            list of the alleles counted, and the list of the counts of
+            the alleles at each position.
+        :rtype: dict
+        """
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = readGroupIds
+        request.referenceId = referenceId
+        request.start = start
+        request.end = end
+        requestDict = request.toJsonDict()
+        requestDict.update({
+            "minBaseQuality": minBaseQuality,
+            "minMappingQuality": minMappingQuality,
+            "requiredFlags": requiredFlags,
+            "excludedFlags": excludedFlags})
+        responseString = self._runPileupRequest(json.dumps(requestDict))
+        self._protocolBytesReceived += len(responseString)
+        return json.loads(responseString)
+
     def _runGetRequest(self, objectName, protocolResponseClass, id_):
         """
         Requests an object from the server and returns the object of
@@ -197,6 +312,376 @@ class AbstractClient(object):
         """
         return self._runGetRequest("variants", protocol.Variant, variantId)
 
+    def _runBatchGetRequest(self, objectName, requestString):
+        """
+        Runs a complete transaction with the server to get the JSON
+        describing the objects of the specified type with the IDs in the
+        specified JSON request.
+        """
+        raise NotImplemented()
+
+    def _batchGet(self, objectName, protocolResponseClass, ids):
+        """
+        Requests the objects of the specified type with the specified
+        IDs from the server, and returns the list of the objects of type
+        protocolResponseClass, in order, with None for each ID that was
+        not found.
+        """
+        responseString = self._runBatchGetRequest(
+            objectName, json.dumps({"ids": ids}))
+        self._protocolBytesReceived += len(responseString)
+        results = []
+        for result in json.loads(responseString)["results"]:
+            value = result.get("value")
+            if value is not None:
+                value = protocolResponseClass.fromJsonDict(value)
+            results.append(value)
+        return results
+
+    def batchGetVariants(self, variantIds):
+        """
+        Returns the Variants with the specified IDs from the server in a
+        single request.
+
+        :param list variantIds: The IDs of the Variants of interest.
+        :return: The list of the Variants, in order, with None for each
+            ID that was not found.
+        :rtype: list
+        """
+        return self._batchGet("variants", protocol.Variant, variantIds)
+
+    def batchGetCallSets(self, callSetIds):
+        """
+        Returns the CallSets with the specified IDs from the server in a
+        single request.
+
+        :param list callSetIds: The IDs of the CallSets of interest.
+        :return: The list of the CallSets, in order, with None for each
+            ID that was not found.
+        :rtype: list
+        """
+        return self._batchGet("callsets", protocol.CallSet, callSetIds)
+
+    def batchGetReadGroups(self, readGroupIds):
+        """
+        Returns the ReadGroups with the specified IDs from the server in
+        a single request.
+
+        :param list readGroupIds: The IDs of the ReadGroups of interest.
+        :return: The list of the ReadGroups, in order, with None for each
+            ID that was not found.
+        :rtype: list
+        """
+        return self._batchGet(
+            "readgroups", protocol.ReadGroup, readGroupIds)
+
+    def batchGetReferences(self, referenceIds):
+        """
+        Returns the References with the specified IDs from the server in
+        a single request.
+
+        :param list referenceIds: The IDs of the References of interest.
+        :return: The list of the References, in order, with None for each
+            ID that was not found.
+        :rtype: list
+        """
+        return self._batchGet(
+            "references", protocol.Reference, referenceIds)
+
+    def _runReadGroupCoverageRequest(self, readGroupId, requestArgs):
+        """
+        Runs a complete transaction with the server to get the JSON
+        describing the coverage of the specified read group.
+        """
+        raise NotImplemented()
+
+    def getReadGroupCoverage(
+            self, readGroupId, referenceId, start=None, end=None,
+            maxBins=None):
+        """
+        Returns the mean depth of coverage of the ReadGroup with the
+        specified ID over consecutive bins covering the specified region
+        of the specified reference. The server chooses the bin size, and
+        answers from precomputed coverage tiles if it has them.
+
+        :param str readGroupId: The ID of the ReadGroup of interest.
+        :param str referenceId: The ID of the Reference of interest.
+        :param int start: The start of the region (0-based, inclusive),
+            or None for the start of the reference.
+        :param int end: The end of the region (0-based, exclusive), or
+            None for the end of the reference.
+        :param int maxBins: The approximate number of bins required, or
+            None for the server's default.
+        :return: A dictionary with the binSize, the start and end of the
+            bins, and the list of the depths of the bins.
+        :rtype: dict
+        """
+        requestArgs = {"referenceId": referenceId}
+        for key, value in [
+                ("start", start), ("end", end), ("maxBins", maxBins)]:
+            if value is not None:
+                requestArgs[key] = value
+        responseString = self._runReadGroupCoverageRequest(
+            readGroupId, requestArgs)
+        self._protocolBytesReceived += len(responseString)
+        return json.loads(responseString)
+
+    def _runVariantSetDensityRequest(self, variantSetId, requestArgs):
+        """
+        Runs a complete transaction with the server to get the JSON
+        describing the density of the variants in the specified variant
+        set.
+        """
+        raise NotImplemented()
+
+    def getVariantSetDensity(
+            self, variantSetId, referenceName, start, end, maxBins=None):
+        """
+        Returns the number of variants in the VariantSet with the
+        specified ID starting in each of the consecutive bins covering
+        the specified region, split by variant class and allele
+        frequency class. The server chooses the bin size, and answers
+        from a precomputed density index if the variant set has one.
+
+        :param str variantSetId: The ID of the VariantSet of interest.
+        :param str referenceName: The name of the reference of interest.
+        :param int start: The start of the region (0-based, inclusive).
+        :param int end: The end of the region (0-based, exclusive).
+        :param int maxBins: The approximate number of bins required, or
+            None for the server's default.
+        :return: A dictionary with the binSize, the start and end of the
+            bins, the lists of the variant classes and allele frequency
+            classes, and the counts of each bin indexed by variant class
+            and allele frequency class.
+        :rtype: dict
+        """
+        requestArgs = {
+            "referenceName": referenceName, "start": start, "end": end}
+        if maxBins is not None:
+            requestArgs["maxBins"] = maxBins
+        responseString = self._runVariantSetDensityRequest(
+            variantSetId, requestArgs)
+        self._protocolBytesReceived += len(responseString)
+        return json.loads(responseString)
+
+    def _runExportVariantSetRequest(self, variantSetId, requestArgs):
+        """
+        Runs a transaction with the server to export the variants of the
+        specified variant set, and returns an iterator over the lines of
+        the newline delimited JSON response as they are received.
+        """
+        raise NotImplemented()
+
+    def exportVariantSet(
+            self, variantSetId, referenceName=None, start=None, end=None):
+        """
+        Returns an iterator over the Variants, with all of their calls,
+        exported from the VariantSet with the specified ID that overlap
+        the specified region, in order of contig and position. The
+        variants are streamed as the server exports them.
+
+        :param str variantSetId: The ID of the VariantSet of interest.
+        :param str referenceName: The name of the reference of interest,
+            or None for all of the references of the variant set.
+        :param int start: The start of the region (0-based, inclusive),
+            or None for the start of each reference.
+        :param int end: The end of the region (0-based, exclusive), or
+            None for the end of the variants on each reference.
+        :return: An iterator over the GA4GH Variant objects exported.
+        :rtype: iter
+        """
+        requestArgs = {}
+        for key, value in [
+                ("referenceName", referenceName), ("start", start),
+                ("end", end)]:
+            if value is not None:
+                requestArgs[key] = value
+        for line in self._runExportVariantSetRequest(
+                variantSetId, requestArgs):
+            self._protocolBytesReceived += len(line) + 1
+            if line:
+                yield protocol.Variant.fromJsonString(line)
+
+    def _runExportReadGroupSetBamRequest(self, readGroupSetId, requestArgs):
+        """
+        Runs a transaction with the server to get a BAM slice of the
+        specified read group set, and returns an iterator over the pieces
+        of the BAM file as they are received.
+        """
+        raise NotImplemented()
+
+    def getReadGroupSetBam(
+            self, readGroupSetId, referenceName=None, start=None, end=None):
+        """
+        Returns an iterator over the pieces of a BAM file holding the
+        header and the reads of the ReadGroupSet with the specified ID
+        overlapping the specified region, which may also hold some of
+        the reads near it. The pieces are copied from the server's BAM
+        file, and are streamed as they are received.
+
+        :param str readGroupSetId: The ID of the ReadGroupSet of interest.
+        :param str referenceName: The name of the reference of interest
+            in the BAM header, or None for all of the reads.
+        :param int start: The start of the region (0-based, inclusive),
+            or None for the start of the reference.
+        :param int end: The end of the region (0-based, exclusive), or
+            None for the end of the reference.
+        :return: An iterator over the byte strings making up the BAM file.
+        :rtype: iter
+        """
+        requestArgs = {}
+        for key, value in [
+                ("referenceName", referenceName), ("start", start),
+                ("end", end)]:
+            if value is not None:
+                requestArgs[key] = value
+        for piece in self._runExportReadGroupSetBamRequest(
+                readGroupSetId, requestArgs):
+            self._protocolBytesReceived += len(piece)
+            yield piece
+
+    def _runExportVariantSetSliceRequest(self, variantSetId, requestArgs):
+        """
+        Runs a transaction with the server to get a VCF slice of the
+        specified variant set, and returns an iterator over the pieces of
+        the file as they are received.
+        """
+        raise NotImplemented()
+
+    def getVariantSetVcf(
+            self, variantSetId, referenceName, start=None, end=None,
+            callSetIds=None):
+        """
+        Returns an iterator over the pieces of a bgzipped VCF file, or a
+        BCF file if the VariantSet is read from one, holding the header
+        and the variants of the VariantSet with the specified ID
+        overlapping the specified region, which may also hold some of
+        the variants near it. Unless callSetIds is given, the pieces are
+        mostly copied from the server's data files, and are streamed as
+        they are received.
+
+        :param str variantSetId: The ID of the VariantSet of interest.
+        :param str referenceName: The name of the reference of interest.
+        :param int start: The start of the region (0-based, inclusive),
+            or None for the start of the reference.
+        :param int end: The end of the region (0-based, exclusive), or
+            None for the end of the reference.
+        :param list callSetIds: The IDs of the CallSets whose calls are
+            included, or None for all of them.
+        :return: An iterator over the byte strings making up the file.
+        :rtype: iter
+        """
+        requestArgs = {"referenceName": referenceName}
+        for key, value in [("start", start), ("end", end)]:
+            if value is not None:
+                requestArgs[key] = value
+        if callSetIds is not None:
+            requestArgs["callSetIds"] = ",".join(callSetIds)
+        for piece in self._runExportVariantSetSliceRequest(
+                variantSetId, requestArgs):
+            self._protocolBytesReceived += len(piece)
+            yield piece
+
+    def _runCreateExportJobRequest(self, requestString):
+        """
+        Runs a complete transaction with the server to create the export
+        job in the specified JSON request, and returns the JSON
+        describing it.
+        """
+        raise NotImplemented()
+
+    def _runGetExportJobRequest(self, jobId):
+        """
+        Runs a complete transaction with the server to get the JSON
+        describing the progress of the specified export job.
+        """
+        raise NotImplemented()
+
+    def _runGetExportJobDataRequest(self, jobId, start):
+        """
+        Runs a transaction with the server to download the output of the
+        specified export job from the specified byte offset, and returns
+        an iterator over its pieces as they are received.
+        """
+        raise NotImplemented()
+
+    def createExportJob(self, exportType, id_, args=None, priority=0):
+        """
+        Creates an export job on the server, which writes the output of
+        the export to a file in the background, and returns the JSON
+        dictionary describing the job.
+
+        :param str exportType: The type of the export: "variants" for the
+            NDJSON export of a VariantSet, "bam" for the BAM file of a
+            ReadGroupSet or "vcf" for a VCF slice of a VariantSet.
+        :param str id_: The ID of the object to export.
+        :param dict args: The arguments of the export, as accepted by
+            exportVariantSet, getReadGroupSetBam or getVariantSetVcf
+            (with callSetIds separated by commas).
+        :param int priority: The priority of the job, from 0 to 9; jobs
+            of higher priority are run first.
+        :return: The job, with its "id" and "state".
+        :rtype: dict
+        """
+        requestString = json.dumps({
+            "type": exportType, "id": id_, "args": args or {},
+            "priority": priority})
+        responseString = self._runCreateExportJobRequest(requestString)
+        self._protocolBytesReceived += len(responseString)
+        return json.loads(responseString)
+
+    def getExportJob(self, jobId):
+        """
+        Returns the JSON dictionary describing the progress of the export
+        job with the specified ID: its "state", which is QUEUED, RUNNING,
+        SUCCEEDED or FAILED, the "bytesWritten" so far and the
+        "mimetype" of its output.
+
+        :param str jobId: The ID of the export job of interest.
+        :return: The job.
+        :rtype: dict
+        """
+        responseString = self._runGetExportJobRequest(jobId)
+        self._protocolBytesReceived += len(responseString)
+        return json.loads(responseString)
+
+    def getExportJobData(self, jobId, start=0):
+        """
+        Returns an iterator over the pieces of the output of the export
+        job with the specified ID, which must have succeeded, from the
+        specified byte offset, so that an interrupted download can be
+        resumed.
+
+        :param str jobId: The ID of the export job of interest.
+        :param int start: The offset of the first byte to download.
+        :return: An iterator over the byte strings of the output.
+        :rtype: iter
+        """
+        for piece in self._runGetExportJobDataRequest(jobId, start):
+            self._protocolBytesReceived += len(piece)
+            yield piece
+
+    def _runGetVariantCarriersRequest(self, variantId):
+        """
+        Runs a complete transaction with the server to get the JSON
+        listing the carriers of the specified variant.
+        """
+        raise NotImplemented()
+
+    def getVariantCarriers(self, variantId):
+        """
+        Returns the IDs of the call sets carrying a non reference allele
+        of the Variant with the specified ID.
+
+        :param str variantId: The ID of the Variant of interest.
+        :return: The IDs of the carrier call sets, in the order of the
+            call sets in the variant set.
+        :rtype: list
+        """
+        responseString = self._runGetVariantCarriersRequest(variantId)
+        self._protocolBytesReceived += len(responseString)
+        return json.loads(responseString)["callSetIds"]
+
     def getVariantSet(self, variantSetId):
         """
         Returns the VariantSet with the specified ID from the server.
@@ -404,13 +889,27 @@ class HttpClient(AbstractClient):
         the :mod:`logging` module. This is :data:`logging.WARNING` by default.
     :param str authenticationKey: The authentication key provided by the
         server after logging in.
+    :param bool avroBinary: If True, ask the server to send responses
+        using the Avro binary encoding rather than JSON. This is
+        considerably more compact for large search responses.
+    :param int cacheSize: The maximum number of responses to object GET
+        requests to keep. When we request an object again, we ask the
+        server to respond with 304 Not Modified if our copy is still
+        current, and decode our copy rather than transferring it again.
+        Set this to 0 to disable the cache.
     """
 
     def __init__(
-            self, urlPrefix, logLevel=logging.WARNING, authenticationKey=None):
+            self, urlPrefix, logLevel=logging.WARNING, authenticationKey=None,
+            avroBinary=False, cacheSize=64):
         super(HttpClient, self).__init__(logLevel)
         self._urlPrefix = urlPrefix
         self._authenticationKey = authenticationKey
+        self._acceptMimetype = protocol.JSON_MIMETYPE
+        if avroBinary:
+            self._acceptMimetype = protocol.AVRO_BINARY_MIMETYPE
+        self._cacheSize = cacheSize
+        self._responseCache = collections.OrderedDict()
         self._session = requests.Session()
         self._setupHttpSession()
         requestsLog = logging.getLogger("requests.packages.urllib3")
@@ -421,7 +920,13 @@ class HttpClient(AbstractClient):
         """
         Sets up the common HTTP session parameters used by requests.
         """
-        headers = {"Content-type": "application/json"}
+        # The requests package transparently decodes responses that
+        # are compressed using either of the encodings we accept.
+        headers = {
+            "Content-type": protocol.JSON_MIMETYPE,
+            "Accept": self._acceptMimetype,
+            "Accept-Encoding": "gzip, deflate",
+        }
         self._session.headers.update(headers)
         # TODO is this unsafe????
         self._session.verify = False
@@ -438,6 +943,22 @@ class HttpClient(AbstractClient):
                 "Url {0} had status_code {1}".format(
                     response.url, response.status_code))
 
+    def _deserializeHttpResponse(self, response, protocolResponseClass):
+        """
+        Deserializes the specified HTTP response from the requests package
+        into an instance of the specified protocol class, using the wire
+        format given in the response's Content-Type header.
+        """
+        contentType = response.headers.get(
+            "Content-Type", protocol.JSON_MIMETYPE)
+        mimetype = contentType.split(";")[0].strip()
+        if mimetype == protocol.JSON_MIMETYPE:
+            responseString = response.text
+        else:
+            responseString = response.content
+        return self._deserializeResponse(
+            responseString, protocolResponseClass, mimetype)
+
     def _getHttpParameters(self):
         """
         Returns the basic HTTP parameters we need all requests.
@@ -452,14 +973,153 @@ class HttpClient(AbstractClient):
         response = self._session.post(
             url, params=self._getHttpParameters(), data=data)
         self._checkResponseStatus(response)
-        return self._deserializeResponse(response.text, protocolResponseClass)
+        return self._deserializeHttpResponse(response, protocolResponseClass)
+
+    def _runGenotypeMatrixPageRequest(self, requestString):
+        url = posixpath.join(self._urlPrefix, "genotypematrix/search")
+        self._logger.debug("request:{}".format(requestString))
+        # The matrix is always requested in the binary format, which
+        # is decoded without copying its arrays.
+        response = self._session.post(
+            url, params=self._getHttpParameters(), data=requestString,
+            headers={"Accept": genotypematrix.BINARY_MIMETYPE})
+        self._checkResponseStatus(response)
+        contentType = response.headers.get(
+            "Content-Type", protocol.JSON_MIMETYPE)
+        mimetype = contentType.split(";")[0].strip()
+        return self._deserializeGenotypeMatrix(response.content, mimetype)
+
+    def _runPileupRequest(self, requestString):
+        url = posixpath.join(self._urlPrefix, "pileup/search")
+        self._logger.debug("request:{}".format(requestString))
+        response = self._session.post(
+            url, params=self._getHttpParameters(), data=requestString)
+        self._checkResponseStatus(response)
+        return response.text
+
+    def _runCreateExportJobRequest(self, requestString):
+        url = posixpath.join(self._urlPrefix, "exports")
+        self._logger.debug("request:{}".format(requestString))
+        response = self._session.post(
+            url, params=self._getHttpParameters(), data=requestString)
+        self._checkResponseStatus(response)
+        return response.text
+
+    def _runGetExportJobRequest(self, jobId):
+        url = posixpath.join(self._urlPrefix, "exports", jobId)
+        response = self._session.get(url, params=self._getHttpParameters())
+        self._checkResponseStatus(response)
+        return response.text
+
+    def _runGetExportJobDataRequest(self, jobId, start):
+        url = posixpath.join(self._urlPrefix, "exports", jobId, "data")
+        headers = {}
+        if start > 0:
+            headers["Range"] = "bytes={}-".format(start)
+        response = self._session.get(
+            url, params=self._getHttpParameters(), headers=headers,
+            stream=True)
+        self._checkResponseStatus(response)
+        return response.iter_content(chunk_size=65536)
+
+    def _runBatchGetRequest(self, objectName, requestString):
+        url = posixpath.join(self._urlPrefix, objectName, "batchget")
+        self._logger.debug("request:{}".format(requestString))
+        response = self._session.post(
+            url, params=self._getHttpParameters(), data=requestString)
+        self._checkResponseStatus(response)
+        return response.text
+
+    def _getCachedResponse(self, url):
+        """
+        Returns the cached response for the specified URL, or None if
+        there is none. The response becomes the most recently used.
+        """
+        response = self._responseCache.pop(url, None)
+        if response is not None:
+            self._responseCache[url] = response
+        return response
+
+    def _cacheResponse(self, url, response):
+        """
+        Stores the specified response for the specified URL if the server
+        has given it an entity tag, evicting the least recently used
+        response if the cache is full.
+        """
+        if self._cacheSize > 0 and "ETag" in response.headers:
+            self._responseCache.pop(url, None)
+            self._responseCache[url] = response
+            if len(self._responseCache) > self._cacheSize:
+                self._responseCache.popitem(last=False)
 
     def _runGetRequest(self, objectName, protocolResponseClass, id_):
         urlSuffix = "{objectName}/{id}".format(objectName=objectName, id=id_)
         url = posixpath.join(self._urlPrefix, urlSuffix)
+        cachedResponse = self._getCachedResponse(url)
+        headers = {}
+        if cachedResponse is not None:
+            headers["If-None-Match"] = cachedResponse.headers["ETag"]
+        response = self._session.get(
+            url, params=self._getHttpParameters(), headers=headers)
+        if (cachedResponse is not None and
+                response.status_code == requests.codes.not_modified):
+            response = cachedResponse
+        else:
+            self._checkResponseStatus(response)
+            self._cacheResponse(url, response)
+        return self._deserializeHttpResponse(response, protocolResponseClass)
+
+    def _runReadGroupCoverageRequest(self, readGroupId, requestArgs):
+        urlSuffix = "readgroups/{id}/coverage".format(id=readGroupId)
+        url = posixpath.join(self._urlPrefix, urlSuffix)
+        params = self._getHttpParameters()
+        params.update(requestArgs)
+        response = self._session.get(url, params=params)
+        self._checkResponseStatus(response)
+        return response.text
+
+    def _runVariantSetDensityRequest(self, variantSetId, requestArgs):
+        urlSuffix = "variantsets/{id}/density".format(id=variantSetId)
+        url = posixpath.join(self._urlPrefix, urlSuffix)
+        params = self._getHttpParameters()
+        params.update(requestArgs)
+        response = self._session.get(url, params=params)
+        self._checkResponseStatus(response)
+        return response.text
+
+    def _runExportVariantSetRequest(self, variantSetId, requestArgs):
+        urlSuffix = "variantsets/{id}/export".format(id=variantSetId)
+        url = posixpath.join(self._urlPrefix, urlSuffix)
+        params = self._getHttpParameters()
+        params.update(requestArgs)
+        response = self._session.get(url, params=params, stream=True)
+        self._checkResponseStatus(response)
+        return response.iter_lines(decode_unicode=True)
+
+    def _runExportReadGroupSetBamRequest(self, readGroupSetId, requestArgs):
+        urlSuffix = "readgroupsets/{id}/bam".format(id=readGroupSetId)
+        url = posixpath.join(self._urlPrefix, urlSuffix)
+        params = self._getHttpParameters()
+        params.update(requestArgs)
+        response = self._session.get(url, params=params, stream=True)
+        self._checkResponseStatus(response)
+        return response.iter_content(chunk_size=65536)
+
+    def _runExportVariantSetSliceRequest(self, variantSetId, requestArgs):
+        urlSuffix = "variantsets/{id}/vcf".format(id=variantSetId)
+        url = posixpath.join(self._urlPrefix, urlSuffix)
+        params = self._getHttpParameters()
+        params.update(requestArgs)
+        response = self._session.get(url, params=params, stream=True)
+        self._checkResponseStatus(response)
+        return response.iter_content(chunk_size=65536)
+
+    def _runGetVariantCarriersRequest(self, variantId):
+        urlSuffix = "variants/{id}/carriers".format(id=variantId)
+        url = posixpath.join(self._urlPrefix, urlSuffix)
         response = self._session.get(url, params=self._getHttpParameters())
         self._checkResponseStatus(response)
-        return self._deserializeResponse(response.text, protocolResponseClass)
+        return response.text
 
     def _runListReferenceBasesPageRequest(self, id_, request):
         urlSuffix = "references/{id}/bases".format(id=id_)
@@ -468,8 +1128,8 @@ class HttpClient(AbstractClient):
         params.update(request.toJsonDict())
         response = self._session.get(url, params=params)
         self._checkResponseStatus(response)
-        return self._deserializeResponse(
-            response.text, protocol.ListReferenceBasesResponse)
+        return self._deserializeHttpResponse(
+            response, protocol.ListReferenceBasesResponse)
 
 
 class LocalClient(AbstractClient):
@@ -495,6 +1155,12 @@ class LocalClient(AbstractClient):
             "readgroupsets": self._backend.runSearchReadGroupSets,
             "reads": self._backend.runSearchReads,
         }
+        self._batchGetMethodMap = {
+            "variants": self._backend.runBatchGetVariants,
+            "callsets": self._backend.runBatchGetCallSets,
+            "readgroups": self._backend.runBatchGetReadGroups,
+            "references": self._backend.runBatchGetReferences,
+        }
 
     def _runGetRequest(self, objectName, protocolResponseClass, id_):
         getMethod = self._getMethodMap[objectName]
@@ -507,6 +1173,60 @@ class LocalClient(AbstractClient):
         responseJson = searchMethod(protocolRequest.toJsonString())
         return self._deserializeResponse(responseJson, protocolResponseClass)
 
+    def _runGenotypeMatrixPageRequest(self, requestString):
+        mimetype = genotypematrix.BINARY_MIMETYPE
+        responseString = self._backend.runSearchGenotypeMatrix(
+            requestString, mimetype)
+        return self._deserializeGenotypeMatrix(responseString, mimetype)
+
+    def _runPileupRequest(self, requestString):
+        return self._backend.runSearchPileup(requestString)
+
+    def _runBatchGetRequest(self, objectName, requestString):
+        return self._batchGetMethodMap[objectName](requestString)
+
+    def _runReadGroupCoverageRequest(self, readGroupId, requestArgs):
+        return self._backend.runListReadGroupCoverage(
+            readGroupId, requestArgs)
+
+    def _runVariantSetDensityRequest(self, variantSetId, requestArgs):
+        return self._backend.runListVariantSetDensity(
+            variantSetId, requestArgs)
+
+    def _runExportVariantSetRequest(self, variantSetId, requestArgs):
+        for chunk in self._backend.runExportVariantSet(
+                variantSetId, requestArgs):
+            for line in chunk.splitlines():
+                yield line
+
+    def _runExportReadGroupSetBamRequest(self, readGroupSetId, requestArgs):
+        return self._backend.runExportReadGroupSetBam(
+            readGroupSetId, requestArgs)
+
+    def _runExportVariantSetSliceRequest(self, variantSetId, requestArgs):
+        _, pieces = self._backend.runExportVariantSetSlice(
+            variantSetId, requestArgs)
+        return pieces
+
+    def _runCreateExportJobRequest(self, requestString):
+        return self._backend.runCreateExportJob(requestString)
+
+    def _runGetExportJobRequest(self, jobId):
+        return self._backend.runGetExportJob(jobId)
+
+    def _runGetExportJobDataRequest(self, jobId, start):
+        path, _ = self._backend.getExportJobOutput(jobId)
+        with open(path, "rb") as dataFile:
+            dataFile.seek(start)
+            while True:
+                data = dataFile.read(65536)
+                if len(data) == 0:
+                    break
+                yield data
+
+    def _runGetVariantCarriersRequest(self, variantId):
+        return self._backend.runGetVariantCarriers(variantId)
+
     def _runListReferenceBasesPageRequest(self, id_, request):
         requestArgs = request.toJsonDict()
         # We need to remove end from this dict if it's not specified because
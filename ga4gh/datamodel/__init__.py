@@ -10,6 +10,7 @@ import base64
 import collections
 import glob
 import os
+import threading
 
 import ga4gh.exceptions as exceptions
 
@@ -20,12 +21,15 @@ class PysamFileHandleCache(object):
     advantage to have push/pop operations in O(1) We always add
     elements on the left of the deque and pop elements from the right.
     When a file is accessed via getFileHandle, its priority gets
-    updated, it is put at the "top" of the deque.
+    updated, it is put at the "top" of the deque. The cache is shared by
+    the threads that fetch from the shards of a variant set, so it is
+    guarded by a lock.
     """
 
     def __init__(self):
         self._cache = collections.deque()
         self._memoTable = dict()
+        self._lock = threading.Lock()
         # Initialize the value even if it will be set up by the config
         self._maxCacheSize = 50
 
@@ -75,22 +79,23 @@ class PysamFileHandleCache(object):
         its handle. Otherwise, open the file using openMethod, store
         it in the cache and return the corresponding handle.
         """
-        if dataFile in self._memoTable:
-            handle = self._memoTable[dataFile]
-            self._update(dataFile, handle)
-            return handle
-        else:
-            try:
-                handle = openMethod(dataFile)
-            except ValueError:
-                raise exceptions.FileOpenFailedException(dataFile)
-
-            self._memoTable[dataFile] = handle
-            self._add(dataFile, handle)
-            if len(self._memoTable) > self._maxCacheSize:
-                dataFile = self._removeLru()
-                del self._memoTable[dataFile]
-            return handle
+        with self._lock:
+            if dataFile in self._memoTable:
+                handle = self._memoTable[dataFile]
+                self._update(dataFile, handle)
+                return handle
+            else:
+                try:
+                    handle = openMethod(dataFile)
+                except ValueError:
+                    raise exceptions.FileOpenFailedException(dataFile)
+
+                self._memoTable[dataFile] = handle
+                self._add(dataFile, handle)
+                if len(self._memoTable) > self._maxCacheSize:
+                    dataFile = self._removeLru()
+                    del self._memoTable[dataFile]
+                return handle
 
 
 # LRU cache of open file handles
@@ -282,6 +287,28 @@ class ReadAlignmentCompoundId(ReadGroupCompoundId):
     fields = ReadGroupCompoundId.fields + ['readAlignment']
 
 
+class JsonRecord(object):
+    """
+    The JSON representation of a protocol element, such as a read or a
+    variant, that covers an interval of a reference. This is written
+    directly from the record in the underlying data file, and allows
+    the record to be added to a search response without creating the
+    protocol element. We keep the start position so that searches over
+    these records can be paged.
+    """
+    __slots__ = ['start', '_jsonString']
+
+    def __init__(self, start, jsonString):
+        self.start = start
+        self._jsonString = jsonString
+
+    def toJsonString(self):
+        """
+        Returns the JSON encoded string representation of this record.
+        """
+        return self._jsonString
+
+
 class DatamodelObject(object):
     """
     Superclass of all datamodel types. A datamodel object is a concrete
@@ -335,6 +362,25 @@ class DatamodelObject(object):
         """
         return self._parentContainer
 
+    def getDataFilePaths(self):
+        """
+        Returns the list of paths of the files and directories from which
+        the representation of this DatamodelObject is derived. This is
+        empty for objects that are not backed by files.
+        """
+        return []
+
+    def getDataModificationTime(self):
+        """
+        Returns the most recent modification time (in seconds since the
+        epoch) of the data files for this DatamodelObject, or None if
+        it is not backed by files.
+        """
+        paths = self.getDataFilePaths()
+        if len(paths) == 0:
+            return None
+        return max(os.path.getmtime(path) for path in paths)
+
 
 class PysamDatamodelMixin(object):
     """
@@ -0,0 +1,183 @@
+"""
+Slices of BAM files streamed as BAM, without decoding their reads.
+
+A BAM file is a series of BGZF blocks (see bgzf), and its .bai index
+lists, for each bin of each reference sequence, the chunks of the file
+holding the reads of the bin. A slice of a region is made up of a copy
+of the header, the chunks of the bins overlapping the region, and the
+empty block marking the end of the file. The blocks wholly inside a
+chunk are copied from the file without being decompressed; only the
+blocks at the ends of a chunk, which hold reads outside it, are
+decompressed, trimmed and compressed again, as is the header.
+
+As with htsget, the slice holds every read in the region, but may also
+hold some of the reads near it, which clients filter out if they need
+to.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import struct
+
+import ga4gh.datamodel.bgzf as bgzf
+import ga4gh.datamodel.htslibindex as htslibindex
+import ga4gh.exceptions as exceptions
+
+
+BAM_MIMETYPE = "application/vnd.ga4gh.bam"
+
+_bamMagic = b"BAM\x01"
+# The largest position in the binning scheme of BAM indexes.
+_maxPosition = 1 << 29
+
+
+def getIndexFilePath(bamFilePath):
+    """
+    Returns the path of the .bai index of the specified BAM file, or
+    None if it does not exist.
+    """
+    for indexFilePath in [
+            bamFilePath + ".bai", os.path.splitext(bamFilePath)[0] + ".bai"]:
+        if os.path.exists(indexFilePath):
+            return indexFilePath
+    return None
+
+
+class BamSlicer(object):
+    """
+    Streams slices of an indexed BAM file.
+    """
+    def __init__(self, bamFilePath):
+        self._bamFilePath = bamFilePath
+        indexFilePath = getIndexFilePath(bamFilePath)
+        if indexFilePath is None:
+            raise exceptions.NotIndexedException(bamFilePath)
+        self._fileStates = self._getFileStates(
+            [bamFilePath, indexFilePath])
+        self._index = htslibindex.HtslibIndex.parse(indexFilePath)
+        with io.open(bamFilePath, "rb") as bamFile:
+            self._fileSize = os.fstat(bamFile.fileno()).st_size
+            headerData, self._referenceNames, self._headerEnd = \
+                self._readHeader(bamFile)
+            bamFile.seek(max(0, self._fileSize - len(bgzf.EOF)))
+            if bamFile.read() == bgzf.EOF:
+                self._fileSize -= len(bgzf.EOF)
+        self._headerBlocks = bgzf.compressBlocks(headerData)
+
+    @classmethod
+    def _getFileStates(cls, paths):
+        states = []
+        for path in paths:
+            fileStat = os.stat(path)
+            states.append((fileStat.st_size, fileStat.st_mtime))
+        return states
+
+    def _readHeader(self, bamFile):
+        """
+        Returns the uncompressed header of the specified BAM file, the
+        names of its reference sequences, and the virtual offset of its
+        first read.
+        """
+        data = b""
+        blockOffset = 0
+        try:
+            while True:
+                blockSize, blockData = bgzf.readBlock(bamFile, blockOffset)
+                if blockSize == 0:
+                    raise exceptions.FileOpenFailedException(
+                        self._bamFilePath)
+                data += blockData
+                header = self._parseHeader(data)
+                if header is not None:
+                    break
+                blockOffset += blockSize
+        except struct.error:
+            raise exceptions.FileOpenFailedException(self._bamFilePath)
+        headerLength, referenceNames = header
+        blockStart = len(data) - len(blockData)
+        # The first read is found at the start of the next block if the
+        # header ends at the end of a block.
+        if headerLength == len(data):
+            headerEnd = (blockOffset + blockSize) << 16
+        else:
+            headerEnd = (blockOffset << 16) | (headerLength - blockStart)
+        return data[:headerLength], referenceNames, headerEnd
+
+    def _parseHeader(self, data):
+        """
+        Returns the (length, referenceNames) pair of the BAM header at
+        the start of the specified data, or None if the data does not
+        hold all of it.
+        """
+        if len(data) < 8:
+            return None
+        if data[:4] != _bamMagic:
+            raise exceptions.FileOpenFailedException(self._bamFilePath)
+        textLength, = struct.unpack_from(b"<i", data, 4)
+        offset = 8 + textLength
+        if len(data) < offset + 4:
+            return None
+        numReferences, = struct.unpack_from(b"<i", data, offset)
+        offset += 4
+        referenceNames = []
+        for _ in range(numReferences):
+            if len(data) < offset + 4:
+                return None
+            nameLength, = struct.unpack_from(b"<i", data, offset)
+            if len(data) < offset + 8 + nameLength:
+                return None
+            name = data[offset + 4:offset + 4 + nameLength].rstrip(b"\0")
+            referenceNames.append(name.decode("utf8"))
+            offset += 8 + nameLength
+        return offset, referenceNames
+
+    def isCurrent(self):
+        """
+        Returns True if the BAM file and its index have not changed since
+        this slicer read them.
+        """
+        indexFilePath = getIndexFilePath(self._bamFilePath)
+        try:
+            return indexFilePath is not None and self._getFileStates(
+                [self._bamFilePath, indexFilePath]) == self._fileStates
+        except OSError:
+            return False
+
+    def getReferenceNames(self):
+        """
+        Returns the names of the reference sequences in the BAM header.
+        """
+        return self._referenceNames
+
+    def getChunks(self, referenceName=None, start=0, end=None):
+        """
+        Returns the list of the (startOffset, endOffset) virtual offset
+        pairs of the chunks of the slice of the specified region, or of
+        all of the reads in the file if referenceName is None. Raises a
+        ReferenceNameNotFoundException if the reference is not in the
+        BAM header.
+        """
+        if referenceName is None:
+            return [(self._headerEnd, self._fileSize << 16)]
+        if referenceName not in self._referenceNames:
+            raise exceptions.ReferenceNameNotFoundException(referenceName)
+        if end is None:
+            end = _maxPosition
+        return self._index.getChunks(
+            self._referenceNames.index(referenceName), start, end)
+
+    def iterSlice(self, chunks):
+        """
+        Returns a generator over the pieces of the BAM file holding the
+        specified chunks.
+        """
+        yield self._headerBlocks
+        with io.open(self._bamFilePath, "rb") as bamFile:
+            for chunkStart, chunkEnd in chunks:
+                for piece in bgzf.iterChunk(bamFile, chunkStart, chunkEnd):
+                    if len(piece) > 0:
+                        yield piece
+        yield bgzf.EOF
@@ -0,0 +1,225 @@
+"""
+Reading and writing the BGZF blocks of htslib data files.
+
+A BGZF file, such as a BAM file or a bgzipped VCF or BCF file, is a
+series of gzip members, each holding up to 64 KiB of the uncompressed
+stream, and ends with an empty block. A position in the stream is given
+by a virtual offset: the offset of a block in the file shifted left by
+16 bits, plus the offset within its uncompressed data. The chunks of a
+file listed in its index are pairs of virtual offsets, and the blocks
+wholly inside a chunk can be copied from the file without being
+decompressed; only the blocks at the ends of a chunk need to be
+decompressed, trimmed and compressed again.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import binascii
+import collections
+import multiprocessing.pool
+import struct
+import threading
+import zlib
+
+import ga4gh.exceptions as exceptions
+
+
+EOF = binascii.unhexlify(
+    b"1f8b08040000000000ff0600424302001b0003000000000000000000")
+"""
+The empty BGZF block that marks the end of a file.
+"""
+
+_blockHeaderSize = 18
+_blockHeader = struct.Struct(b"<4BI2BH2BHH")
+# The most uncompressed data written in a block, as in htslib, which
+# leaves room for the data to expand when it is compressed.
+_maxBlockDataSize = 0xff00
+_copyBufferSize = 1 << 16
+
+
+def compressBlocks(data, compressionLevel=6):
+    """
+    Returns the BGZF blocks holding the specified uncompressed data, or
+    an empty string if there is no data.
+    """
+    blocks = []
+    for offset in range(0, len(data), _maxBlockDataSize):
+        blockData = data[offset:offset + _maxBlockDataSize]
+        compressor = zlib.compressobj(
+            compressionLevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(blockData) + compressor.flush()
+        blocks.append(_blockHeader.pack(
+            0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord(b"B"), ord(b"C"), 2,
+            _blockHeaderSize + len(compressed) + 8 - 1))
+        blocks.append(compressed)
+        blocks.append(struct.pack(
+            b"<Ii", binascii.crc32(blockData) & 0xffffffff, len(blockData)))
+    return b"".join(blocks)
+
+
+def readBlock(dataFile, offset):
+    """
+    Reads the BGZF block at the specified offset of the specified file,
+    and returns its (size, uncompressedData) pair, or (0, b"") at the
+    end of the file.
+    """
+    dataFile.seek(offset)
+    header = dataFile.read(_blockHeaderSize)
+    if len(header) == 0:
+        return 0, b""
+    if (len(header) != _blockHeaderSize or
+            header[:4] != b"\x1f\x8b\x08\x04" or
+            header[12:16] != b"BC\x02\x00"):
+        raise exceptions.FileOpenFailedException(dataFile.name)
+    blockSize = struct.unpack_from(b"<H", header, 16)[0] + 1
+    compressed = dataFile.read(blockSize - _blockHeaderSize - 8)
+    try:
+        data = zlib.decompress(compressed, -zlib.MAX_WBITS)
+    except zlib.error:
+        raise exceptions.FileOpenFailedException(dataFile.name)
+    return blockSize, data
+
+
+def readData(dataFile, startOffset, endOffset):
+    """
+    Returns the uncompressed data of the specified file from the
+    specified start virtual offset up to the specified end virtual
+    offset, or to the end of the file if it is None.
+    """
+    pieces = []
+    blockOffset, dataOffset = startOffset >> 16, startOffset & 0xffff
+    while endOffset is None or blockOffset <= endOffset >> 16:
+        blockSize, data = readBlock(dataFile, blockOffset)
+        if blockSize == 0:
+            break
+        if endOffset is not None and blockOffset == endOffset >> 16:
+            data = data[:endOffset & 0xffff]
+        pieces.append(data[dataOffset:])
+        dataOffset = 0
+        blockOffset += blockSize
+    return b"".join(pieces)
+
+
+def iterChunk(dataFile, chunkStart, chunkEnd):
+    """
+    Returns a generator over the pieces of BGZF blocks holding the data
+    of the specified file between the specified virtual offsets. The
+    blocks wholly inside the chunk are copied from the file unchanged,
+    and the data at its ends is compressed into new blocks.
+    """
+    startBlock, startOffset = chunkStart >> 16, chunkStart & 0xffff
+    endBlock, endOffset = chunkEnd >> 16, chunkEnd & 0xffff
+    if startBlock == endBlock:
+        _, data = readBlock(dataFile, startBlock)
+        yield compressBlocks(data[startOffset:endOffset])
+        return
+    if startOffset > 0:
+        blockSize, data = readBlock(dataFile, startBlock)
+        yield compressBlocks(data[startOffset:])
+        startBlock += blockSize
+    dataFile.seek(startBlock)
+    remaining = endBlock - startBlock
+    while remaining > 0:
+        piece = dataFile.read(min(remaining, _copyBufferSize))
+        if len(piece) == 0:
+            break
+        remaining -= len(piece)
+        yield piece
+    if endOffset > 0:
+        _, data = readBlock(dataFile, endBlock)
+        yield compressBlocks(data[:endOffset])
+
+
+class BlockCompressor(object):
+    """
+    Compresses streams of data into BGZF blocks concurrently, using a
+    pool of threads shared by all of them. zlib releases the GIL while
+    it compresses, so the blocks of a stream are compressed in parallel.
+    If the number of threads is zero, the blocks are compressed one
+    after the other.
+    """
+    blocksPerTask = 16
+    """
+    The number of blocks compressed by each task run on a thread.
+    """
+
+    tasksPerThread = 2
+    """
+    The number of tasks of a stream that are submitted for each thread
+    before the result of the first of them is waited for.
+    """
+
+    def __init__(self):
+        self._numThreads = 4
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def setNumThreads(self, numThreads):
+        """
+        Sets the number of threads used to compress blocks.
+        """
+        if numThreads < 0:
+            raise ValueError(
+                "The number of threads must be a non-negative value")
+        self.close()
+        self._numThreads = numThreads
+
+    def close(self):
+        """
+        Shuts down the threads.
+        """
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def _iterTasks(self, pieces):
+        """
+        Returns a generator over the specified pieces of uncompressed
+        data regrouped into runs of whole blocks.
+        """
+        taskSize = self.blocksPerTask * _maxBlockDataSize
+        buffered = []
+        bufferedSize = 0
+        for piece in pieces:
+            buffered.append(piece)
+            bufferedSize += len(piece)
+            if bufferedSize >= taskSize:
+                data = b"".join(buffered)
+                split = len(data) - len(data) % _maxBlockDataSize
+                yield data[:split]
+                buffered = [data[split:]]
+                bufferedSize = len(buffered[0])
+        if bufferedSize > 0:
+            yield b"".join(buffered)
+
+    def compress(self, pieces):
+        """
+        Returns a generator over the BGZF blocks holding the specified
+        pieces of uncompressed data, in order.
+        """
+        if self._numThreads == 0:
+            for data in self._iterTasks(pieces):
+                yield compressBlocks(data)
+            return
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.pool.ThreadPool(
+                    self._numThreads)
+            pool = self._pool
+            maxPending = self._numThreads * self.tasksPerThread
+        pending = collections.deque()
+        for data in self._iterTasks(pieces):
+            pending.append(pool.apply_async(compressBlocks, (data,)))
+            if len(pending) >= maxPending:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+
+
+# The threads that compress BGZF blocks
+blockCompressor = BlockCompressor()
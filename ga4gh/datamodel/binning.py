@@ -0,0 +1,20 @@
+"""
+Helpers for the counts precomputed over bins of several sizes, such as
+the read coverage tiles (see coverage) and the variant density index
+(see variantdensity).
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+
+def getPrecomputedBinSize(binSizes, binSize):
+    """
+    Returns the greatest of the specified precomputed bin sizes that is
+    no greater than the specified bin size, or the least of them if they
+    are all greater.
+    """
+    smaller = [size for size in binSizes if size <= binSize]
+    if len(smaller) == 0:
+        return min(binSizes)
+    return max(smaller)
@@ -0,0 +1,271 @@
+"""
+An index of the samples that carry each variant in a HtslibVariantSet.
+
+For each contig, the index holds the start, end and hash of every record,
+in the order they are read from the data files, and a bitmap with a bit
+for each sample that is set if the sample's genotype includes a non
+reference allele. The bitmaps are packed eight samples to a byte, so the
+carriers of a selection of samples are found for a block of sites with a
+few vectorised operations on memory mapped arrays, without reading the
+records.
+
+The index is built offline into the variant set directory, as a JSON
+manifest and a .npy file for each column of each contig. The manifest
+records the size and modification time of each data file, and an index
+that does not match the data files is not used.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import logging
+import os
+import re
+
+import numpy
+
+import ga4gh.exceptions as exceptions
+
+
+MANIFEST_FILE_NAME = "carriers.json"
+INDEX_FORMAT_VERSION = 1
+_allelePattern = re.compile(r"[/|]")
+
+
+def _getColumnFileName(contigIndex, columnName):
+    return "carriers.contig{}.{}.npy".format(contigIndex, columnName)
+
+
+def getDataFileStates(dataFilePaths):
+    """
+    Returns the dictionary mapping the base name of each of the
+    specified data files to its [size, modificationTime] pair.
+    """
+    states = {}
+    for path in dataFilePaths:
+        fileStat = os.stat(path)
+        states[os.path.basename(path)] = [
+            fileStat.st_size, fileStat.st_mtime]
+    return states
+
+
+def isCarrier(genotypeData):
+    """
+    Returns True if the specified VCF genotype string includes a non
+    reference allele.
+    """
+    for allele in _allelePattern.split(genotypeData):
+        if allele != "." and allele != "" and int(allele) > 0:
+            return True
+    return False
+
+
+def build(variantSet, indexDir):
+    """
+    Builds the carrier index of the specified HtslibVariantSet in the
+    specified directory, which is normally the variant set's own
+    directory. The manifest is written last, so the index is only
+    recognised once it is complete.
+    """
+    samples = [
+        callSet.getSampleName() for callSet in variantSet.getCallSets()]
+    sampleIndexes = dict(
+        (sample, index) for index, sample in enumerate(samples))
+    contigs = []
+    for referenceName in variantSet.getReferenceNames():
+        starts = []
+        ends = []
+        md5s = []
+        carriers = []
+        for record in variantSet.getPysamRecords(
+                referenceName, variantSet.vcfMin, variantSet.vcfMax):
+            starts.append(record.start)
+            ends.append(record.stop)
+            alternateBases = []
+            if record.alts is not None:
+                alternateBases = list(record.alts)
+            md5s.append(variantSet.hashBases(record.ref, alternateBases))
+            row = numpy.zeros(len(samples), dtype=numpy.bool_)
+            # As in HtslibVariantSet.convertVariant, the genotypes are
+            # read from the text of the record.
+            sampleData = record.__str__().split()[9:]
+            for sampleIterator, name in enumerate(record.samples.keys()):
+                genotypeData = sampleData[sampleIterator].split(":")[0]
+                row[sampleIndexes[name]] = isCarrier(genotypeData)
+            carriers.append(numpy.packbits(row))
+        contigIndex = len(contigs)
+        lengths = [end - start for start, end in zip(starts, ends)]
+        contigs.append({
+            "name": referenceName,
+            "numVariants": len(starts),
+            "maxLength": max([0] + lengths),
+        })
+        bitmaps = numpy.array(carriers, dtype=numpy.uint8).reshape(
+            (len(starts), (len(samples) + 7) // 8))
+        columns = [
+            ("starts", numpy.array(starts, dtype=numpy.int64)),
+            ("ends", numpy.array(ends, dtype=numpy.int64)),
+            ("md5s", numpy.array(md5s, dtype=numpy.bytes_)),
+            ("bitmaps", bitmaps),
+        ]
+        for columnName, column in columns:
+            numpy.save(os.path.join(
+                indexDir, _getColumnFileName(contigIndex, columnName)),
+                column)
+    manifest = {
+        "version": INDEX_FORMAT_VERSION,
+        "samples": samples,
+        "dataFiles": getDataFileStates(variantSet.getDataFileNames()),
+        "contigs": contigs,
+    }
+    manifestPath = os.path.join(indexDir, MANIFEST_FILE_NAME)
+    tempFilePath = "{}.{}.tmp".format(manifestPath, os.getpid())
+    with open(tempFilePath, "w") as manifestFile:
+        json.dump(manifest, manifestFile)
+    os.rename(tempFilePath, manifestPath)
+
+
+class _ContigCarriers(object):
+    """
+    The memory mapped columns of the carrier index for one contig.
+    """
+    def __init__(self, indexDir, contigIndex, contigManifest):
+        self.name = contigManifest["name"]
+        self.numVariants = contigManifest["numVariants"]
+        self.maxLength = contigManifest["maxLength"]
+        self.filePaths = []
+
+        def load(columnName):
+            filePath = os.path.join(
+                indexDir, _getColumnFileName(contigIndex, columnName))
+            self.filePaths.append(filePath)
+            try:
+                return numpy.load(filePath, mmap_mode="r")
+            except (IOError, ValueError):
+                raise exceptions.FileOpenFailedException(filePath)
+        self.starts = load("starts")
+        self.ends = load("ends")
+        self.md5s = load("md5s")
+        self.bitmaps = load("bitmaps")
+
+
+class CarrierIndex(object):
+    """
+    The carrier index of a HtslibVariantSet. Rows are numbered in the
+    order the records of each contig are read from the data files.
+    """
+    blockSize = 4096
+
+    def __init__(self, indexDir, dataFilePaths):
+        manifestPath = os.path.join(indexDir, MANIFEST_FILE_NAME)
+        try:
+            with open(manifestPath) as manifestFile:
+                manifest = json.load(manifestFile)
+        except (IOError, ValueError):
+            raise exceptions.FileOpenFailedException(manifestPath)
+        if (not isinstance(manifest, dict) or
+                manifest.get("version") != INDEX_FORMAT_VERSION):
+            raise exceptions.FileOpenFailedException(manifestPath)
+        if manifest.get("dataFiles") != getDataFileStates(dataFilePaths):
+            raise exceptions.StaleCarrierIndexException(manifestPath)
+        self._manifestPath = manifestPath
+        try:
+            self._sampleIndexes = dict(
+                (sample, index) for index, sample in
+                enumerate(manifest["samples"]))
+            self._samples = manifest["samples"]
+            self._contigs = {}
+            for contigIndex, contigManifest in enumerate(
+                    manifest["contigs"]):
+                contig = _ContigCarriers(
+                    indexDir, contigIndex, contigManifest)
+                self._contigs[contig.name] = contig
+        except (KeyError, TypeError):
+            raise exceptions.FileOpenFailedException(manifestPath)
+
+    def getFilePaths(self):
+        """
+        Returns the paths of the files making up this index.
+        """
+        paths = [self._manifestPath]
+        for name in sorted(self._contigs.keys()):
+            paths.extend(self._contigs[name].filePaths)
+        return paths
+
+    def getCarrierRows(self, referenceName, start, end, sampleNames):
+        """
+        Returns the array of the rows of the specified contig for the
+        records overlapping the specified region in which each of the
+        specified samples carries a non reference allele.
+        """
+        contig = self._contigs.get(referenceName)
+        if contig is None:
+            return numpy.zeros(0, dtype=numpy.int64)
+        sampleIndexes = numpy.array(
+            [self._sampleIndexes[name] for name in sampleNames],
+            dtype=numpy.int64)
+        byteIndexes = sampleIndexes >> 3
+        # numpy.packbits puts the first sample in the high bit.
+        bitMasks = (0x80 >> (sampleIndexes & 7)).astype(numpy.uint8)
+        first = int(numpy.searchsorted(
+            contig.starts, start - contig.maxLength, side="left"))
+        last = int(numpy.searchsorted(contig.starts, end, side="left"))
+        blocks = []
+        for blockStart in range(first, last, self.blockSize):
+            blockEnd = min(blockStart + self.blockSize, last)
+            bits = contig.bitmaps[blockStart:blockEnd][:, byteIndexes]
+            included = (bits & bitMasks != 0).all(axis=1)
+            included &= contig.ends[blockStart:blockEnd] > start
+            blocks.append(numpy.nonzero(included)[0] + blockStart)
+        if len(blocks) == 0:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return numpy.concatenate(blocks)
+
+    def getRowStart(self, referenceName, row):
+        """
+        Returns the (start, ordinal) pair identifying the record in the
+        specified row of the specified contig, where ordinal is the
+        number of records before it with the same start position.
+        """
+        starts = self._contigs[referenceName].starts
+        start = int(starts[row])
+        return start, int(row) - int(
+            numpy.searchsorted(starts, start, side="left"))
+
+    def getCarrierSampleNames(self, referenceName, start, md5):
+        """
+        Returns the list of the names of the samples carrying the variant
+        with the specified start position and hash on the specified
+        contig, or None if there is no such variant.
+        """
+        contig = self._contigs.get(referenceName)
+        if contig is None:
+            return None
+        first = int(numpy.searchsorted(contig.starts, start, side="left"))
+        last = int(numpy.searchsorted(contig.starts, start, side="right"))
+        for row in range(first, last):
+            if contig.md5s[row] == md5:
+                carriers = numpy.unpackbits(contig.bitmaps[row])
+                return [
+                    self._samples[index] for index in
+                    numpy.nonzero(carriers[:len(self._samples)])[0]]
+        return None
+
+
+def load(indexDir, dataFilePaths):
+    """
+    Returns the CarrierIndex in the specified directory for the specified
+    data files, or None if there is no index there. An index that was
+    built from other versions of the data files, or that cannot be read
+    (e.g. a corrupt or truncated manifest or column), is ignored with a
+    warning, as the variant set can be searched without it.
+    """
+    if not os.path.exists(os.path.join(indexDir, MANIFEST_FILE_NAME)):
+        return None
+    try:
+        return CarrierIndex(indexDir, dataFilePaths)
+    except (exceptions.StaleCarrierIndexException,
+            exceptions.FileOpenFailedException) as exception:
+        logging.getLogger(__name__).warning(exception.message)
+        return None
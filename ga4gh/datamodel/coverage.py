@@ -0,0 +1,324 @@
+"""
+Precomputed read coverage tiles for the read groups in a BAM file.
+
+A genome browser showing a large region only needs the depth of coverage
+in a few hundred bins, but computing it from the reads means reading
+every read in the region. The tiles hold, for each read group and
+reference, the total depth of the bases in each bin at several bin
+sizes, so the depth over any region is found by summing a few values
+from the coarsest bin size that resolves it. Sums rather than means are
+stored so that bins can be merged exactly. The bin sizes are multiples
+of the smallest of them, so the sums of the coarser bins are those of
+the finest bins they hold; there is no per base level, as a region small
+enough to need one is quickly computed from its reads.
+
+The tiles are built in a single pass over the BAM file, which collects
+the aligned blocks of a bounded number of reads at a time and adds them
+to the depth sums of the finest bins of their read group and reference.
+
+The tiles are stored in a sidecar file next to the BAM file, which
+consists of a JSON header line describing the arrays, followed by the
+arrays as little endian unsigned 32 bit integers, which are memory
+mapped when the file is loaded. Each array only spans the bins between
+the first and last reads of its read group on the reference. As with
+the read group index, the tiles are only used while the BAM file is
+unchanged.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import array
+import json
+import os
+
+import numpy
+import pysam
+
+
+COVERAGE_FILE_SUFFIX = ".coverage"
+COVERAGE_FORMAT_VERSION = 1
+DEFAULT_BIN_SIZES = [100, 10000]
+# The array typecode used to collect the aligned blocks of the reads.
+ARRAY_TYPECODE = b"l"
+_sumDtype = numpy.dtype(b"<u4")
+
+
+def getCoverageFilePath(samFilePath):
+    """
+    Returns the path of the sidecar coverage tiles for the specified BAM
+    file.
+    """
+    return samFilePath + COVERAGE_FILE_SUFFIX
+
+
+def addBlockSums(sums, firstBin, binSize, blocks):
+    """
+    Adds the number of bases in each of the specified (start, end)
+    aligned blocks to the specified array of the depth sums of the
+    consecutive bins of the specified size from the specified first bin.
+    Bases outside the bins are ignored.
+    """
+    regionStart = firstBin * binSize
+    regionEnd = regionStart + len(sums) * binSize
+    for start, end in blocks:
+        start = max(start, regionStart)
+        end = min(end, regionEnd)
+        if start >= end:
+            continue
+        first = (start - regionStart) // binSize
+        last = (end - 1 - regionStart) // binSize
+        if first == last:
+            sums[first] += end - start
+        else:
+            sums[first] += (first + 1) * binSize - (start - regionStart)
+            sums[first + 1:last] += binSize
+            sums[last] += (end - regionStart) - last * binSize
+
+
+def _getBinSums(starts, ends, binSize, numBins):
+    """
+    Returns the array of the number of bases of the aligned blocks with
+    the specified start and end arrays in each of the specified number
+    of bins of the specified size from the start of the reference, which
+    must hold all of the blocks.
+    """
+    firstBins = starts // binSize
+    lastBins = (ends - 1) // binSize
+    # The bases of each block in its first bin, which are all of them if
+    # it lies within a single bin.
+    sums = numpy.bincount(
+        firstBins, weights=numpy.minimum(ends, (firstBins + 1) * binSize) -
+        starts, minlength=numBins)
+    spanning = firstBins < lastBins
+    firstBins = firstBins[spanning]
+    lastBins = lastBins[spanning]
+    sums += numpy.bincount(
+        lastBins, weights=ends[spanning] - lastBins * binSize,
+        minlength=numBins)
+    # The bins between the first and last bins of a block are full.
+    changes = (
+        numpy.bincount(firstBins + 1, minlength=numBins + 1) -
+        numpy.bincount(lastBins, minlength=numBins + 1))
+    sums += numpy.cumsum(changes[:numBins]) * binSize
+    return sums.astype(numpy.int64)
+
+
+def _trimBinSums(sums):
+    """
+    Returns the pair (firstBin, sums) of the bins of the specified array
+    of depth sums between the first and last bins with any depth, or
+    None if there are none.
+    """
+    coveredBins = numpy.flatnonzero(sums)
+    if len(coveredBins) == 0:
+        return None
+    firstBin = int(coveredBins[0])
+    lastBin = int(coveredBins[-1]) + 1
+    return firstBin, sums[firstBin:lastBin].astype(_sumDtype)
+
+
+class CoverageTiles(object):
+    """
+    The depth sums of the bins of each of a number of sizes, for each
+    (readGroupId, referenceName) pair in a BAM file. Reads that are not
+    in a read group are counted under the empty string.
+    """
+    chunkSize = 65536
+    """
+    The number of aligned blocks collected from the BAM file before they
+    are added to the depth sums when the tiles are built.
+    """
+
+    def __init__(self, samFilePath, modificationTime, size, binSizes):
+        self._samFilePath = samFilePath
+        self._modificationTime = modificationTime
+        self._size = size
+        self._binSizes = sorted(binSizes)
+        # Maps (readGroupId, referenceName, binSize) to (firstBin, sums).
+        self._tiles = {}
+
+    @classmethod
+    def build(cls, samFilePath, binSizes=DEFAULT_BIN_SIZES):
+        """
+        Scans the specified BAM file and returns the CoverageTiles of the
+        specified bin sizes for it, which must be multiples of the
+        smallest of them. The coverage counts the aligned bases of every
+        mapped read, so deletions and skipped regions are not covered.
+        """
+        binSizes = sorted(binSizes)
+        if binSizes[0] < 1 or any(
+                binSize % binSizes[0] != 0 for binSize in binSizes):
+            raise ValueError(
+                "The bin sizes must be multiples of the smallest of them")
+        fileStat = os.stat(samFilePath)
+        tiles = cls(samFilePath, fileStat.st_mtime, fileStat.st_size, binSizes)
+        # Maps (readGroupId, referenceName) to the array of the depth sums
+        # of the finest bins from the start of the reference.
+        finestSums = {}
+        # Maps (readGroupId, referenceName) to the arrays of the starts
+        # and ends of the aligned blocks not yet added to the sums.
+        blocks = {}
+        numBlocks = 0
+        samFile = pysam.AlignmentFile(samFilePath)
+        try:
+            referenceNames = [
+                samFile.getrname(referenceId)
+                for referenceId in range(samFile.nreferences)]
+            referenceLengths = dict(zip(referenceNames, samFile.lengths))
+            for read in samFile.fetch(until_eof=True):
+                if read.is_unmapped or read.reference_id == -1:
+                    continue
+                readGroupId = ""
+                if read.has_tag(b"RG"):
+                    readGroupId = read.get_tag(b"RG")
+                key = (readGroupId, referenceNames[read.reference_id])
+                if key not in blocks:
+                    blocks[key] = (
+                        array.array(ARRAY_TYPECODE),
+                        array.array(ARRAY_TYPECODE))
+                starts, ends = blocks[key]
+                for start, end in read.get_blocks():
+                    starts.append(start)
+                    ends.append(end)
+                    numBlocks += 1
+                if numBlocks >= cls.chunkSize:
+                    tiles._addBlocks(finestSums, blocks, referenceLengths)
+                    blocks = {}
+                    numBlocks = 0
+            tiles._addBlocks(finestSums, blocks, referenceLengths)
+        finally:
+            samFile.close()
+        for (readGroupId, referenceName), sums in finestSums.items():
+            for binSize in binSizes:
+                factor = binSize // binSizes[0]
+                binSums = numpy.add.reduceat(
+                    sums, numpy.arange(0, len(sums), factor))
+                trimmed = _trimBinSums(binSums)
+                if trimmed is not None:
+                    tiles._tiles[(readGroupId, referenceName, binSize)] = \
+                        trimmed
+        return tiles
+
+    def _addBlocks(self, finestSums, blocks, referenceLengths):
+        """
+        Adds the number of bases of the aligned blocks in the specified
+        map of the (starts, ends) arrays of each (readGroupId,
+        referenceName) pair to the depth sums of its finest bins, which
+        are extended if the blocks lie beyond the end of the reference.
+        """
+        binSize = self._binSizes[0]
+        for key, (starts, ends) in blocks.items():
+            if len(starts) == 0:
+                continue
+            starts = numpy.frombuffer(starts, dtype=ARRAY_TYPECODE)
+            ends = numpy.frombuffer(ends, dtype=ARRAY_TYPECODE)
+            sums = finestSums.get(key)
+            if sums is None:
+                sums = numpy.zeros(
+                    -(-referenceLengths[key[1]] // binSize),
+                    dtype=numpy.int64)
+            numBins = max(len(sums), -(-int(ends.max()) // binSize))
+            if numBins > len(sums):
+                sums = numpy.concatenate(
+                    [sums, numpy.zeros(numBins - len(sums), numpy.int64)])
+            sums += _getBinSums(starts, ends, binSize, numBins)
+            finestSums[key] = sums
+
+    def isCurrent(self):
+        """
+        Returns True if the BAM file has not changed since these tiles
+        were built.
+        """
+        try:
+            fileStat = os.stat(self._samFilePath)
+        except OSError:
+            return False
+        return (
+            fileStat.st_mtime == self._modificationTime and
+            fileStat.st_size == self._size)
+
+    def getBinSizes(self):
+        """
+        Returns the sorted list of the bin sizes of these tiles.
+        """
+        return self._binSizes
+
+    def getBinSums(self, readGroupId, referenceName, binSize, firstBin,
+                   lastBin):
+        """
+        Returns the array of the depth sums of the bins of the specified
+        size from firstBin to lastBin (exclusive) on the specified
+        reference, for the read group with the specified ID, or for all
+        of the reads if it is None.
+        """
+        sums = numpy.zeros(lastBin - firstBin, dtype=numpy.int64)
+        for key, (tileFirstBin, tileSums) in self._tiles.items():
+            if (key[1:] != (referenceName, binSize) or
+                    (readGroupId is not None and key[0] != readGroupId)):
+                continue
+            first = max(firstBin, tileFirstBin)
+            last = min(lastBin, tileFirstBin + len(tileSums))
+            if first < last:
+                sums[first - firstBin:last - firstBin] += \
+                    tileSums[first - tileFirstBin:last - tileFirstBin]
+        return sums
+
+    def save(self):
+        """
+        Writes these tiles to their sidecar file.
+        """
+        keys = sorted(self._tiles.keys())
+        entries = []
+        offset = 0
+        for key in keys:
+            firstBin, sums = self._tiles[key]
+            entries.append(list(key) + [firstBin, len(sums), offset])
+            offset += sums.nbytes
+        header = {
+            "version": COVERAGE_FORMAT_VERSION,
+            "modificationTime": self._modificationTime,
+            "size": self._size,
+            "binSizes": self._binSizes,
+            "entries": entries,
+        }
+        coverageFilePath = getCoverageFilePath(self._samFilePath)
+        tempFilePath = "{}.{}.tmp".format(coverageFilePath, os.getpid())
+        with open(tempFilePath, "wb") as coverageFile:
+            coverageFile.write(json.dumps(header).encode("utf-8") + b"\n")
+            for key in keys:
+                coverageFile.write(self._tiles[key][1].tobytes())
+        os.rename(tempFilePath, coverageFilePath)
+
+    @classmethod
+    def load(cls, samFilePath):
+        """
+        Returns the CoverageTiles stored in the sidecar file for the
+        specified BAM file, or None if there is no such file or the BAM
+        file has changed since it was written.
+        """
+        coverageFilePath = getCoverageFilePath(samFilePath)
+        try:
+            with open(coverageFilePath, "rb") as coverageFile:
+                headerLine = coverageFile.readline()
+            header = json.loads(headerLine.decode("utf-8"))
+            if header.get("version") != COVERAGE_FORMAT_VERSION:
+                return None
+            tiles = cls(
+                samFilePath, header["modificationTime"], header["size"],
+                header["binSizes"])
+            if not tiles.isCurrent():
+                return None
+            for entry in header["entries"]:
+                readGroupId, referenceName, binSize = entry[:3]
+                firstBin, numBins, offset = entry[3:]
+                sums = numpy.zeros(0, dtype=_sumDtype)
+                if numBins > 0:
+                    sums = numpy.memmap(
+                        coverageFilePath, dtype=_sumDtype, mode="r",
+                        offset=len(headerLine) + offset, shape=(numBins,))
+                tiles._tiles[(readGroupId, referenceName, binSize)] = (
+                    firstBin, sums)
+        except (IOError, ValueError, KeyError):
+            return None
+        return tiles
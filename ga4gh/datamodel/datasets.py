@@ -12,6 +12,7 @@ import os
 import ga4gh.datamodel as datamodel
 import ga4gh.datamodel.reads as reads
 import ga4gh.datamodel.variants as variants
+import ga4gh.datamodel.variantstore as variantstore
 import ga4gh.exceptions as exceptions
 import ga4gh.protocol as protocol
 
@@ -167,8 +168,15 @@ class FileSystemDataset(AbstractDataset):
         for localId in os.listdir(variantSetDir):
             relativePath = os.path.join(variantSetDir, localId)
             if os.path.isdir(relativePath):
-                variantSet = variants.HtslibVariantSet(
-                    self, localId, relativePath, backend)
+                if variantstore.isStoreDir(relativePath):
+                    variantSet = variantstore.ColumnarVariantSet(
+                        self, localId, relativePath, backend)
+                elif variants.isSampleShardedDir(relativePath):
+                    variantSet = variants.SampleShardedVariantSet(
+                        self, localId, relativePath, backend)
+                else:
+                    variantSet = variants.HtslibVariantSet(
+                        self, localId, relativePath, backend)
                 self.addVariantSet(variantSet)
         # Reads
         readGroupSetDir = os.path.join(dataDir, "reads")
@@ -180,6 +188,13 @@ class FileSystemDataset(AbstractDataset):
                     self, localId, bamPath, backend)
                 self.addReadGroupSet(readGroupSet)
 
+    def getDataFilePaths(self):
+        paths = [self._dataDir]
+        metadataFileName = '{}.json'.format(self._dataDir)
+        if os.path.isfile(metadataFileName):
+            paths.append(metadataFileName)
+        return paths
+
     def _setMetadata(self):
         metadataFileName = '{}.json'.format(self._dataDir)
         if os.path.isfile(metadataFileName):
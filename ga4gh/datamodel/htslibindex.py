@@ -0,0 +1,327 @@
+"""
+Readers for the tabix (.tbi), CSI (.csi) and BAM (.bai) indexes of
+htslib data files.
+
+For each reference sequence in the index we record the chunks of each
+bin, as (startOffset, endOffset) pairs of BGZF virtual offsets (see
+bgzf), and the virtual offsets used to skip the records before a region:
+the linear index of tabix and BAM indexes, and the offset of each bin in
+CSI indexes. The smallest and largest start positions of the bins that
+hold records bound the region of the reference covered by the data file
+without having to read the records themselves, and the chunks of the
+bins overlapping a region locate its records in the file, as in htslib.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gzip
+import io
+import os
+import struct
+
+import ga4gh.exceptions as exceptions
+
+
+_tabixMagic = b"TBI\x01"
+_csiMagic = b"CSI\x01"
+_baiMagic = b"BAI\x01"
+# The tabix and BAM indexes are CSI indexes with fixed bins of 2^14 to
+# 2^29 bases, and a linear index of 2^14 base windows.
+_tabixMinShift = 14
+_tabixDepth = 5
+
+
+def getIndexFilePath(dataFilePath):
+    """
+    Returns the path of the tabix or CSI index of the specified data
+    file, or None if neither exists.
+    """
+    for extension in [".tbi", ".csi"]:
+        indexFilePath = dataFilePath + extension
+        if os.path.exists(indexFilePath):
+            return indexFilePath
+    return None
+
+
+class _Reader(object):
+    """
+    Reads little-endian values from the decompressed bytes of an index.
+    """
+    def __init__(self, data):
+        self._data = data
+        self._offset = 0
+
+    def read(self, fmt):
+        values = struct.unpack_from(b"<" + fmt, self._data, self._offset)
+        self._offset += struct.calcsize(b"<" + fmt)
+        return values
+
+    def readInt(self):
+        return self.read(b"i")[0]
+
+    def readBytes(self, length):
+        value = self._data[self._offset:self._offset + length]
+        if len(value) != length:
+            raise struct.error("unexpected end of index")
+        self._offset += length
+        return value
+
+    def skip(self, length):
+        self.readBytes(length)
+
+
+class BinExtent(object):
+    """
+    The region of a reference sequence covered by the bins of an index
+    that hold records.
+    """
+    def __init__(self, minBinStart, maxBinStart, maxBinEnd):
+        self.minBinStart = minBinStart
+        self.maxBinStart = maxBinStart
+        self.maxBinEnd = maxBinEnd
+
+
+class _ReferenceIndex(object):
+    """
+    The bins of one reference sequence of an index, mapping each bin
+    number to its list of chunks, with its linear index (for tabix and
+    BAM indexes) or the offset of each bin (for CSI indexes).
+    """
+    def __init__(self, bins, linearIndex, binOffsets):
+        self.bins = bins
+        self.linearIndex = linearIndex
+        self.binOffsets = binOffsets
+
+
+class HtslibIndex(object):
+    """
+    The binning index of a tabix, CSI or BAM indexed data file.
+    """
+    def __init__(self, minShift, depth, referenceNames, referenceIndexes):
+        self._minShift = minShift
+        self._depth = depth
+        self._referenceNames = referenceNames
+        self._referenceIndexes = referenceIndexes
+
+    @classmethod
+    def parse(cls, indexFilePath):
+        """
+        Reads the index in the specified file. Raises a
+        FileOpenFailedException if it is not a valid tabix, CSI or BAM
+        index.
+        """
+        try:
+            with io.open(indexFilePath, "rb") as indexFile:
+                magic = indexFile.read(4)
+            if magic == _baiMagic:
+                # BAM indexes are not compressed.
+                with io.open(indexFilePath, "rb") as indexFile:
+                    reader = _Reader(indexFile.read())
+            else:
+                with gzip.open(indexFilePath, "rb") as indexFile:
+                    reader = _Reader(indexFile.read())
+            magic = reader.readBytes(4)
+            if magic == _tabixMagic:
+                minShift, depth = _tabixMinShift, _tabixDepth
+                numReferences = reader.readInt()
+                referenceNames = cls._readTabixHeader(reader)
+                hasLinearIndex = True
+            elif magic == _csiMagic:
+                minShift, depth, auxLength = reader.read(b"iii")
+                auxReader = _Reader(reader.readBytes(auxLength))
+                referenceNames = None
+                if auxLength >= 28:
+                    # CSI indexes built by tabix carry the tabix header.
+                    referenceNames = cls._readTabixHeader(auxReader)
+                numReferences = reader.readInt()
+                hasLinearIndex = False
+            elif magic == _baiMagic:
+                # The reference names are in the header of the BAM file.
+                minShift, depth = _tabixMinShift, _tabixDepth
+                numReferences = reader.readInt()
+                referenceNames = None
+                hasLinearIndex = True
+            else:
+                raise exceptions.FileOpenFailedException(indexFilePath)
+            referenceIndexes = [
+                cls._readReferenceIndex(reader, hasLinearIndex)
+                for _ in range(numReferences)]
+        except (IOError, struct.error):
+            raise exceptions.FileOpenFailedException(indexFilePath)
+        return cls(minShift, depth, referenceNames, referenceIndexes)
+
+    @classmethod
+    def _readTabixHeader(cls, reader):
+        # format, col_seq, col_beg, col_end, meta and skip precede the
+        # concatenated NUL terminated reference names.
+        reader.skip(24)
+        namesLength = reader.readInt()
+        names = reader.readBytes(namesLength).split(b"\0")
+        return [name.decode("utf8") for name in names if name != b""]
+
+    @classmethod
+    def _readReferenceIndex(cls, reader, hasLinearIndex):
+        bins = {}
+        binOffsets = {}
+        numBins = reader.readInt()
+        for _ in range(numBins):
+            if hasLinearIndex:
+                binNumber, numChunks = reader.read(b"Ii")
+            else:
+                binNumber, binOffset, numChunks = reader.read(b"IQi")
+                binOffsets[binNumber] = binOffset
+            offsets = reader.read(b"{}Q".format(2 * numChunks))
+            bins[binNumber] = list(zip(offsets[::2], offsets[1::2]))
+        linearIndex = ()
+        if hasLinearIndex:
+            numIntervals = reader.readInt()
+            linearIndex = reader.read(b"{}Q".format(numIntervals))
+        return _ReferenceIndex(bins, linearIndex, binOffsets)
+
+    def _getPseudoBin(self):
+        # The metadata of each reference is held in a bin past the last.
+        return getFirstBin(self._depth + 1) + 1
+
+    def getReferenceNames(self):
+        """
+        Returns the names of the reference sequences in the order they
+        are numbered in this index, or None if the index does not name
+        them (as in the CSI indexes of BCF files and BAM indexes, where
+        the names are taken from the header of the data file).
+        """
+        return self._referenceNames
+
+    def getNumReferences(self):
+        """
+        Returns the number of reference sequences in this index.
+        """
+        return len(self._referenceIndexes)
+
+    def getBinExtent(self, referenceIndex):
+        """
+        Returns the BinExtent of the reference sequence with the
+        specified number, or None if there are no records for it.
+        """
+        extent = None
+        pseudoBin = self._getPseudoBin()
+        for binNumber, chunks in self._referenceIndexes[
+                referenceIndex].bins.items():
+            if binNumber == pseudoBin or len(chunks) == 0:
+                continue
+            binStart, binEnd = getBinRegion(
+                binNumber, self._minShift, self._depth)
+            if extent is None:
+                extent = BinExtent(binStart, binStart, binEnd)
+            else:
+                extent.minBinStart = min(extent.minBinStart, binStart)
+                extent.maxBinStart = max(extent.maxBinStart, binStart)
+                extent.maxBinEnd = max(extent.maxBinEnd, binEnd)
+        return extent
+
+    def getChunks(self, referenceIndex, start, end):
+        """
+        Returns the sorted list of the (startOffset, endOffset) virtual
+        offset pairs of the chunks holding the records of the specified
+        reference sequence overlapping the region from start to end,
+        merging the chunks that overlap or share a block. As in htslib,
+        the chunks are trimmed to the records that may overlap the
+        region: those from the first record overlapping the start of
+        the region, and before the first record of the bins to the right
+        of the region. If end is None the region extends to the end of
+        the reference sequence.
+        """
+        if referenceIndex >= len(self._referenceIndexes):
+            return []
+        referenceIndex = self._referenceIndexes[referenceIndex]
+        maxPosition = 1 << (self._minShift + 3 * self._depth)
+        if end is None or end > maxPosition:
+            end = maxPosition
+        if start >= end:
+            return []
+        minOffset = self._getMinOffset(referenceIndex, start)
+        maxOffset = self._getMaxOffset(referenceIndex, end)
+        chunks = []
+        for level in range(self._depth + 1):
+            shift = self._minShift + 3 * (self._depth - level)
+            firstBin = getFirstBin(level)
+            for binNumber in range(
+                    firstBin + (start >> shift),
+                    firstBin + ((end - 1) >> shift) + 1):
+                for chunkStart, chunkEnd in referenceIndex.bins.get(
+                        binNumber, []):
+                    chunkStart = max(chunkStart, minOffset)
+                    if maxOffset is not None:
+                        chunkEnd = min(chunkEnd, maxOffset)
+                    if chunkStart < chunkEnd:
+                        chunks.append((chunkStart, chunkEnd))
+        chunks.sort()
+        merged = []
+        for chunkStart, chunkEnd in chunks:
+            if len(merged) > 0 and (
+                    chunkStart <= merged[-1][1] or
+                    chunkStart >> 16 == merged[-1][1] >> 16):
+                merged[-1][1] = max(merged[-1][1], chunkEnd)
+            else:
+                merged.append([chunkStart, chunkEnd])
+        return [tuple(chunk) for chunk in merged]
+
+    def _getMinOffset(self, referenceIndex, start):
+        """
+        Returns the virtual offset before which no record overlaps the
+        specified start position: the linear index entry of its window,
+        or the offset of the smallest bin holding it that has records.
+        """
+        linearIndex = referenceIndex.linearIndex
+        if len(linearIndex) > 0:
+            return linearIndex[
+                min(start >> self._minShift, len(linearIndex) - 1)]
+        binNumber = getFirstBin(self._depth) + (start >> self._minShift)
+        while binNumber > 0:
+            if binNumber in referenceIndex.binOffsets:
+                return referenceIndex.binOffsets[binNumber]
+            binNumber = (binNumber - 1) >> 3
+        return referenceIndex.binOffsets.get(0, 0)
+
+    def _getMaxOffset(self, referenceIndex, end):
+        """
+        Returns the virtual offset of the first record of the nearest bin
+        with records to the right of the specified end, all of whose
+        records start after it, or None if there is no such bin.
+        """
+        binNumber = (
+            getFirstBin(self._depth) + ((end - 1) >> self._minShift) + 1)
+        if binNumber >= getFirstBin(self._depth + 1):
+            return None
+        while True:
+            # Moving right from the last child of a bin, move up to the
+            # next bin at the level of its parent.
+            while binNumber % 8 == 1:
+                binNumber = (binNumber - 1) >> 3
+            if binNumber == 0:
+                return None
+            chunks = referenceIndex.bins.get(binNumber)
+            if chunks:
+                return min(chunkStart for chunkStart, _ in chunks)
+            binNumber += 1
+
+
+def getFirstBin(level):
+    """
+    Returns the number of the first bin at the specified level of the
+    binning scheme.
+    """
+    return ((1 << (3 * level)) - 1) // 7
+
+
+def getBinRegion(binNumber, minShift, depth):
+    """
+    Returns the (start, end) region covered by the specified bin in a
+    binning scheme with the specified minimum shift and depth.
+    """
+    level = 0
+    while level < depth and binNumber >= getFirstBin(level + 1):
+        level += 1
+    binSize = 1 << (minShift + 3 * (depth - level))
+    start = (binNumber - getFirstBin(level)) * binSize
+    return start, start + binSize
@@ -0,0 +1,147 @@
+"""
+Per-base allele counts of the reads aligned to a region of a reference.
+
+The counts of a region are held in an array with a row for each position
+and a column for each of ALLELES, which is filled in from the CIGAR,
+sequence and base qualities of each read in turn, with a few vectorised
+operations per CIGAR operation. Bases with a quality below a threshold
+are not counted, and deletions are counted at each reference position
+they span; insertions, skipped regions and clipped bases are ignored.
+
+Pileups are usually requested repeatedly for the same few thousand
+sites, so the counts are kept in a least recently used cache keyed by
+the read groups, region and filters of the request.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import threading
+
+import numpy
+
+
+ALLELES = ["A", "C", "G", "T", "N", "DEL"]
+DELETION = ALLELES.index("DEL")
+DEFAULT_CACHE_SIZE = 100
+
+# The SAM CIGAR operation codes that align read bases to the reference,
+# that delete reference bases, and that consume the bases of the read
+# and of the reference (see reads.SamCigar).
+_alignedOperations = frozenset([0, 7, 8])
+_deletionOperation = 2
+_queryOperations = frozenset([0, 1, 4, 7, 8])
+_referenceOperations = frozenset([0, 2, 3, 7, 8])
+
+# Maps each byte of a read sequence to its column in the counts.
+_alleleIndexes = numpy.empty(256, dtype=numpy.intp)
+_alleleIndexes.fill(ALLELES.index("N"))
+for _index, _base in enumerate("ACGT"):
+    _alleleIndexes[ord(_base)] = _index
+    _alleleIndexes[ord(_base.lower())] = _index
+
+
+def getEmptyCounts(numPositions):
+    """
+    Returns an array of zero allele counts for the specified number of
+    positions.
+    """
+    return numpy.zeros((numPositions, len(ALLELES)), dtype=numpy.int32)
+
+
+def addAlignedCounts(counts, start, position, cigarTuples, sequence,
+                     qualities, minBaseQuality=0):
+    """
+    Adds the bases and deletions of a read aligned at the specified
+    position to the specified counts of the consecutive positions from
+    start. The read is given by its list of (operation, length) SAM
+    CIGAR pairs, its sequence as a byte string, and its list or array of
+    base qualities, which may be None or empty if they are not known, in
+    which case all of the bases are counted.
+    """
+    end = start + len(counts)
+    if sequence is not None:
+        sequence = numpy.frombuffer(sequence, dtype=numpy.uint8)
+    if qualities and minBaseQuality > 0:
+        qualities = numpy.asarray(qualities)
+    else:
+        qualities = None
+    queryPosition = 0
+    for operation, length in cigarTuples:
+        first = max(position, start)
+        last = min(position + length, end)
+        if first < last:
+            if operation in _alignedOperations and sequence is not None:
+                queryStart = queryPosition + first - position
+                queryEnd = queryStart + last - first
+                offsets = numpy.arange(first - start, last - start)
+                alleles = _alleleIndexes[sequence[queryStart:queryEnd]]
+                if qualities is not None:
+                    included = (
+                        qualities[queryStart:queryEnd] >= minBaseQuality)
+                    offsets = offsets[included]
+                    alleles = alleles[included]
+                numpy.add.at(counts, (offsets, alleles), 1)
+            elif operation == _deletionOperation:
+                counts[first - start:last - start, DELETION] += 1
+        if operation in _queryOperations:
+            queryPosition += length
+        if operation in _referenceOperations:
+            position += length
+
+
+class PileupCache(object):
+    """
+    A least recently used cache of the allele counts of pileups. The
+    counts are computed outside the lock, so that concurrent requests
+    for different pileups do not wait for each other; a pileup requested
+    concurrently may be computed more than once.
+    """
+    def __init__(self, maxCacheSize=DEFAULT_CACHE_SIZE):
+        self._maxCacheSize = maxCacheSize
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def setMaxCacheSize(self, maxCacheSize):
+        """
+        Sets the maximum number of pileups held in the cache, discarding
+        the least recently used ones if there are more. A size of 0
+        disables the cache.
+        """
+        with self._lock:
+            self._maxCacheSize = maxCacheSize
+            self._trim()
+
+    def _trim(self):
+        while len(self._cache) > self._maxCacheSize:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        """
+        Discards all of the pileups in the cache.
+        """
+        with self._lock:
+            self._cache.clear()
+
+    def getCounts(self, key, computeCounts):
+        """
+        Returns the read-only allele counts cached under the specified
+        key, calling computeCounts to compute them if they are not in
+        the cache.
+        """
+        with self._lock:
+            counts = self._cache.pop(key, None)
+            if counts is not None:
+                self._cache[key] = counts
+                return counts
+        counts = computeCounts()
+        counts.flags.writeable = False
+        with self._lock:
+            if self._maxCacheSize > 0:
+                self._cache[key] = counts
+                self._trim()
+        return counts
+
+
+pileupCache = PileupCache()
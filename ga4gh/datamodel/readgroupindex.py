@@ -0,0 +1,206 @@
+"""
+An optional index of the reads belonging to each read group in a BAM
+file.
+
+When a BAM file holds many read groups (e.g. multiplexed lanes), a search
+for the reads in one of them would otherwise have to decode every read in
+the requested region and discard those in other read groups. The index
+records the virtual file offset and the extent of each read, grouped by
+read group and reference, so that we can seek directly to the reads we
+need. It is stored in a sidecar file next to the BAM file, and is only
+used while the BAM file is unchanged. The arrays in the file are
+memory mapped when it is loaded, so that only the pages for the read
+groups and regions that are searched are read.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+
+import numpy
+import pysam
+
+
+INDEX_FILE_SUFFIX = ".rgi"
+INDEX_FORMAT_VERSION = 2
+# The dtype used for read positions and virtual file offsets, which
+# must be 8 bytes to hold a BGZF virtual file offset.
+_valueDtype = numpy.dtype(b"<i8")
+
+
+def getIndexFilePath(samFilePath):
+    """
+    Returns the path of the sidecar read group index for the specified
+    BAM file.
+    """
+    return samFilePath + INDEX_FILE_SUFFIX
+
+
+class ReadGroupIndex(object):
+    """
+    The offsets of the reads in each read group of a BAM file, for each
+    reference. For each (readGroupId, referenceId) pair we keep arrays of
+    the start position, end position and virtual file offset of each
+    read, sorted by start position.
+    """
+    def __init__(self, samFilePath, modificationTime, size):
+        self._samFilePath = samFilePath
+        self._modificationTime = modificationTime
+        self._size = size
+        self._entries = {}
+        self._maxReadLengths = {}
+
+    def _addEntry(
+            self, readGroupId, referenceId, starts, ends, offsets,
+            maxReadLength):
+        key = (readGroupId, referenceId)
+        self._entries[key] = (starts, ends, offsets)
+        self._maxReadLengths[key] = maxReadLength
+
+    @classmethod
+    def build(cls, samFilePath):
+        """
+        Scans the specified BAM file and returns the ReadGroupIndex for
+        it. Reads that are not in a read group are indexed under the
+        empty string.
+        """
+        fileStat = os.stat(samFilePath)
+        readGroupIndex = cls(samFilePath, fileStat.st_mtime, fileStat.st_size)
+        reads = {}
+        samFile = pysam.AlignmentFile(samFilePath)
+        try:
+            # Fetching with until_eof positions the file at the first
+            # read, so that we can note the offset of each read before
+            # reading it.
+            samFile.fetch(until_eof=True)
+            while True:
+                offset = samFile.tell()
+                try:
+                    read = next(samFile)
+                except StopIteration:
+                    break
+                if read.reference_id == -1:
+                    continue
+                readGroupId = ""
+                if read.has_tag(b"RG"):
+                    readGroupId = read.get_tag(b"RG")
+                start = read.reference_start
+                end = read.reference_end
+                if end is None:
+                    end = start + 1
+                key = (readGroupId, read.reference_id)
+                reads.setdefault(key, []).append((start, end, offset))
+        finally:
+            samFile.close()
+        for (readGroupId, referenceId), values in reads.items():
+            values.sort()
+            values = numpy.array(values, dtype=_valueDtype)
+            starts, ends, offsets = values[:, 0], values[:, 1], values[:, 2]
+            readGroupIndex._addEntry(
+                readGroupId, referenceId, starts, ends, offsets,
+                int((ends - starts).max()))
+        return readGroupIndex
+
+    def isCurrent(self):
+        """
+        Returns True if the BAM file has not changed since this index
+        was built.
+        """
+        try:
+            fileStat = os.stat(self._samFilePath)
+        except OSError:
+            return False
+        return (
+            fileStat.st_mtime == self._modificationTime and
+            fileStat.st_size == self._size)
+
+    def getOffsets(self, readGroupId, referenceId, start=None, end=None):
+        """
+        Returns the list of virtual file offsets, in file order, of the
+        reads in the specified read group that overlap the specified
+        region of the reference with the specified ID.
+        """
+        key = (readGroupId, referenceId)
+        if key not in self._entries:
+            return []
+        starts, ends, offsets = self._entries[key]
+        if start is None:
+            start = 0
+        if end is None:
+            end = starts[-1] + 1
+        # Reads are sorted by start, so only those starting within the
+        # longest read length before the region can overlap it.
+        first = numpy.searchsorted(
+            starts, start - self._maxReadLengths[key], side=b"left")
+        last = numpy.searchsorted(starts, end, side=b"left")
+        overlapping = ends[first:last] > start
+        return numpy.sort(offsets[first:last][overlapping]).tolist()
+
+    def save(self):
+        """
+        Writes this index to its sidecar file. The file consists of a
+        JSON header line describing the arrays, followed by the arrays as
+        little endian 64 bit integers.
+        """
+        keys = sorted(self._entries.keys())
+        header = {
+            "version": INDEX_FORMAT_VERSION,
+            "modificationTime": self._modificationTime,
+            "size": self._size,
+            "entries": [
+                [readGroupId, referenceId,
+                 len(self._entries[(readGroupId, referenceId)][0]),
+                 self._maxReadLengths[(readGroupId, referenceId)]]
+                for readGroupId, referenceId in keys],
+        }
+        indexFilePath = getIndexFilePath(self._samFilePath)
+        tempFilePath = "{}.{}.tmp".format(indexFilePath, os.getpid())
+        with open(tempFilePath, "wb") as indexFile:
+            indexFile.write(json.dumps(header).encode("utf-8") + b"\n")
+            for key in keys:
+                for values in self._entries[key]:
+                    values.astype(_valueDtype).tofile(indexFile)
+        os.rename(tempFilePath, indexFilePath)
+
+    @classmethod
+    def load(cls, samFilePath):
+        """
+        Returns the ReadGroupIndex stored in the sidecar file for the
+        specified BAM file, or None if there is no such file or the BAM
+        file has changed since it was written.
+        """
+        indexFilePath = getIndexFilePath(samFilePath)
+        try:
+            with open(indexFilePath, "rb") as indexFile:
+                headerLine = indexFile.readline()
+            header = json.loads(headerLine.decode("utf-8"))
+            if header.get("version") != INDEX_FORMAT_VERSION:
+                return None
+            readGroupIndex = cls(
+                samFilePath, header["modificationTime"], header["size"])
+            if not readGroupIndex.isCurrent():
+                return None
+            # All of the arrays are mapped at once, since there may be
+            # thousands of (readGroupId, referenceId) pairs.
+            numValues = 3 * sum(entry[2] for entry in header["entries"])
+            values = numpy.zeros(0, dtype=_valueDtype)
+            if numValues > 0:
+                values = numpy.memmap(
+                    indexFilePath, dtype=_valueDtype, mode="r",
+                    offset=len(headerLine), shape=(numValues,))
+            position = 0
+            for entry in header["entries"]:
+                readGroupId, referenceId, numReads, maxReadLength = entry
+                starts, ends, offsets = [
+                    values[position + j * numReads:
+                           position + (j + 1) * numReads]
+                    for j in range(3)]
+                position += 3 * numReads
+                readGroupIndex._addEntry(
+                    readGroupId, referenceId, starts, ends, offsets,
+                    maxReadLength)
+        except (IOError, ValueError, KeyError):
+            return None
+        return readGroupIndex
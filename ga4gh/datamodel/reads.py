@@ -7,15 +7,67 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import itertools
+import json
+import os
 
+import numpy
 import pysam
 
 import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.bamslice as bamslice
+import ga4gh.datamodel.binning as binning
+import ga4gh.datamodel.coverage as coverage
+import ga4gh.datamodel.pileup as pileup
+import ga4gh.datamodel.readgroupindex as readgroupindex
 import ga4gh.datamodel.references as references
+import ga4gh.datamodel.stats as stats
 import ga4gh.exceptions as exceptions
 import ga4gh.protocol as protocol
 
 
+def getReadGroupTag(read):
+    """
+    Returns the value of the RG tag of the specified pysam read, or None
+    if it does not have one. This decodes only the RG tag, rather than
+    all of the read's tags.
+    """
+    try:
+        return read.get_tag(b"RG")
+    except KeyError:
+        return None
+
+
+def getReadAlignmentsAtOffsets(samFile, offsets):
+    """
+    Returns an iterator over the pysam reads at the specified sorted
+    list of virtual file offsets in the specified pysam AlignmentFile.
+
+    Seeking discards the decompressed BGZF block, so rather than seeking
+    to each read we seek once to the first read we need in a block and
+    read on from there, skipping the reads we do not need, until we have
+    all of the reads we need in that block.
+    """
+    j = 0
+    while j < len(offsets):
+        # The file handle may be shared, so we must seek before each
+        # block in case another iterator has moved it, and read all of
+        # the reads we need from the block before yielding any.
+        samFile.seek(offsets[j])
+        blockReads = []
+        position = offsets[j]
+        while (j < len(offsets) and
+                offsets[j] >> _BGZF_BLOCK_SHIFT ==
+                position >> _BGZF_BLOCK_SHIFT):
+            read = next(samFile)
+            if position == offsets[j]:
+                blockReads.append(read)
+                j += 1
+            position = samFile.tell()
+        for read in blockReads:
+            yield read
+
+
 def parseMalformedBamHeader(headerDict):
     """
     Parses the (probably) intended values out of the specified
@@ -49,6 +101,10 @@ class SamCigar(object):
         protocol.CigarOperation.SEQUENCE_MATCH,
         protocol.CigarOperation.SEQUENCE_MISMATCH,
     ]
+    # The indexes of the operations that consume reference bases, and
+    # of those for which we give the reference bases in the CigarUnit.
+    referenceOperations = frozenset([0, 2, 3, 7, 8])
+    referenceSequenceOperations = frozenset([0, 2, 7, 8])
 
     @classmethod
     def ga2int(cls, value):
@@ -61,6 +117,18 @@ class SamCigar(object):
         return cls.cigarStrings[value]
 
 
+# The GA4GH cigar operations that consume reference bases, and those that
+# align bases of the read to them.
+_referenceCigarOperations = frozenset(
+    SamCigar.cigarStrings[index] for index in SamCigar.referenceOperations)
+_coveringCigarOperations = frozenset(
+    SamCigar.cigarStrings[index] for index in [0, 7, 8])
+# A BGZF virtual file offset holds the file offset of the compressed
+# block in its upper bits and the offset within the block in its lower
+# 16 bits.
+_BGZF_BLOCK_SHIFT = 16
+
+
 class SamFlags(object):
     """
     Utility class for working with SAM flags
@@ -85,6 +153,426 @@ class SamFlags(object):
         return flagAttr | flag
 
 
+def _decodeSamFlags(flag):
+    """
+    Returns the tuple of GA4GH ReadAlignment field values that are
+    derived from the specified SAM flag value. See
+    HtslibReadAlignmentConverter for the order of the values.
+    """
+    isFlagSet = SamFlags.isFlagSet
+    strand = protocol.Strand.POS_STRAND
+    if isFlagSet(flag, SamFlags.REVERSED):
+        strand = protocol.Strand.NEG_STRAND
+    nextMateStrand = protocol.Strand.POS_STRAND
+    if isFlagSet(flag, SamFlags.NEXT_MATE_REVERSED):
+        nextMateStrand = protocol.Strand.NEG_STRAND
+    # TODO Is this the correct mapping between numberReads and
+    # sam flag 0x1? What about the mapping between numberReads
+    # and 0x40 and 0x80?
+    numberReads = None
+    readNumber = None
+    if isFlagSet(flag, SamFlags.NUMBER_READS):
+        numberReads = 2
+        if isFlagSet(
+                flag, SamFlags.READ_NUMBER_ONE | SamFlags.READ_NUMBER_TWO):
+            readNumber = 2
+        elif isFlagSet(flag, SamFlags.READ_NUMBER_ONE):
+            readNumber = 0
+        elif isFlagSet(flag, SamFlags.READ_NUMBER_TWO):
+            readNumber = 1
+    return (
+        strand, nextMateStrand, numberReads, readNumber,
+        isFlagSet(flag, SamFlags.DUPLICATE_FRAGMENT),
+        isFlagSet(flag, SamFlags.FAILED_VENDOR_QUALITY_CHECKS),
+        isFlagSet(flag, SamFlags.PROPER_PLACEMENT),
+        isFlagSet(flag, SamFlags.SECONDARY_ALIGNMENT),
+        isFlagSet(flag, SamFlags.SUPPLEMENTARY_ALIGNMENT))
+
+
+def _encodeSamFlags(flagValues):
+    """
+    Returns the JSON encoded equivalent of the specified tuple of values
+    derived from a SAM flag. This is the pair of encoded strand values,
+    followed by the dictionary of encoded ReadAlignment field values.
+    """
+    (strand, nextMateStrand, numberReads, readNumber, duplicateFragment,
+        failedVendorQualityChecks, properPlacement, secondaryAlignment,
+        supplementaryAlignment) = flagValues
+    fields = {
+        "numberReads": numberReads,
+        "readNumber": readNumber,
+        "duplicateFragment": duplicateFragment,
+        "failedVendorQualityChecks": failedVendorQualityChecks,
+        "properPlacement": properPlacement,
+        "secondaryAlignment": secondaryAlignment,
+        "supplementaryAlignment": supplementaryAlignment,
+    }
+    return (
+        json.dumps(strand), json.dumps(nextMateStrand),
+        {key: json.dumps(value) for key, value in fields.items()})
+
+
+class ReadFilter(object):
+    """
+    A filter on the reads returned by a search, on their mapping
+    quality and SAM flags. HtslibReadGroups evaluate the filter on the
+    pysam reads, so that the reads it excludes are never converted.
+    """
+    maxFlag = 0xfff
+    """
+    The largest SAM flag value that can be used in a filter.
+    """
+
+    def __init__(self, minMappingQuality=0, requiredFlags=0, excludedFlags=0):
+        """
+        Creates a filter that includes the reads with a mapping quality
+        of at least minMappingQuality, all of the SAM flags in
+        requiredFlags set and none of the SAM flags in excludedFlags set.
+        """
+        self._minMappingQuality = minMappingQuality
+        self._requiredFlags = requiredFlags
+        self._excludedFlags = excludedFlags
+
+    def isEmpty(self):
+        """
+        Returns True if this filter includes every read.
+        """
+        return (
+            self._minMappingQuality <= 0 and self._requiredFlags == 0 and
+            self._excludedFlags == 0)
+
+    def filterReads(self, reads):
+        """
+        Returns an iterator over the pysam reads in the specified
+        iterable that are included by this filter.
+        """
+        if self.isEmpty():
+            return reads
+        return self._filterReads(reads)
+
+    def _filterReads(self, reads):
+        minMappingQuality = self._minMappingQuality
+        requiredFlags = self._requiredFlags
+        flagMask = self._requiredFlags | self._excludedFlags
+        for read in reads:
+            if (read.flag & flagMask == requiredFlags and
+                    read.mapping_quality >= minMappingQuality):
+                yield read
+
+    def includesReadAlignment(self, gaAlignment):
+        """
+        Returns True if the specified GA4GH ReadAlignment is included by
+        this filter. Only the flags that are represented in the
+        ReadAlignment can be tested.
+        """
+        flag = 0
+        fieldFlags = [
+            ("properPlacement", SamFlags.PROPER_PLACEMENT),
+            ("secondaryAlignment", SamFlags.SECONDARY_ALIGNMENT),
+            ("failedVendorQualityChecks",
+                SamFlags.FAILED_VENDOR_QUALITY_CHECKS),
+            ("duplicateFragment", SamFlags.DUPLICATE_FRAGMENT),
+            ("supplementaryAlignment", SamFlags.SUPPLEMENTARY_ALIGNMENT),
+        ]
+        for fieldName, fieldFlag in fieldFlags:
+            if getattr(gaAlignment, fieldName):
+                flag = SamFlags.setFlag(flag, fieldFlag)
+        if gaAlignment.numberReads is not None:
+            flag = SamFlags.setFlag(flag, SamFlags.NUMBER_READS)
+        mappingQuality = 0
+        if gaAlignment.alignment is not None:
+            mappingQuality = gaAlignment.alignment.mappingQuality or 0
+            if (gaAlignment.alignment.position.strand ==
+                    protocol.Strand.NEG_STRAND):
+                flag = SamFlags.setFlag(flag, SamFlags.REVERSED)
+        if (gaAlignment.nextMatePosition is not None and
+                gaAlignment.nextMatePosition.strand ==
+                protocol.Strand.NEG_STRAND):
+            flag = SamFlags.setFlag(flag, SamFlags.NEXT_MATE_REVERSED)
+        flagMask = self._requiredFlags | self._excludedFlags
+        return (
+            flag & flagMask == self._requiredFlags and
+            mappingQuality >= self._minMappingQuality)
+
+
+class HtslibReadAlignmentConverter(object):
+    """
+    Converts pysam reads from a sam file into GA4GH ReadAlignments for a
+    ReadGroup. A converter is created for each search, so that the work
+    that is the same for every read (finding the file handle, the table
+    of reference names and the ID prefix) is done only once.
+    """
+    flagTable = [_decodeSamFlags(flag) for flag in range(0x1000)]
+    """
+    The values derived from each possible 12 bit SAM flag value.
+    """
+    jsonFlagTable = [_encodeSamFlags(flagValues) for flagValues in flagTable]
+    """
+    The JSON encoded values derived from each possible SAM flag value.
+    """
+    _jsonCigarOperations = [
+        protocol.encodeJsonString(operation)
+        for operation in SamCigar.cigarStrings]
+    jsonCigarCacheSize = 1024
+    """
+    The maximum number of distinct cigars cached by toJsonString.
+    """
+
+    def __init__(
+            self, readGroup, samFile, fieldMask=None, referenceWindow=None):
+        """
+        Creates a converter for reads in the specified ReadGroup from
+        the specified pysam samFile. If a FieldMask for ReadAlignments is
+        specified, toJsonString writes only the fields it includes. If
+        a ReferenceWindow onto the reads' reference is specified, the
+        referenceSequence of the match and deletion CigarUnits is filled
+        in from it.
+        """
+        self._referenceWindow = referenceWindow
+        self._readGroupId = readGroup.getId()
+        self._referenceNames = samFile.references
+        self._jsonReferenceNames = [
+            protocol.encodeJsonString(referenceName)
+            for referenceName in self._referenceNames]
+        if fieldMask is None:
+            fieldMask = protocol.FieldMask(protocol.ReadAlignment)
+        self._includedFields = fieldMask.getIncludedFieldNames()
+        self._readAlignmentTemplate = protocol.JsonObjectTemplate(
+            protocol.ReadAlignment, {
+                "fragmentId": "TODO",
+                "readGroupId": self._readGroupId,
+            }, fieldMask)
+        alignmentMask = fieldMask.getSubmask("alignment")
+        self._includeCigar = alignmentMask.includes("cigar")
+        cigarMask = alignmentMask.getSubmask("cigar")
+        self._includeReferenceSequence = (
+            referenceWindow is not None and
+            cigarMask.includes("referenceSequence"))
+        self._linearAlignmentTemplate = protocol.JsonObjectTemplate(
+            protocol.LinearAlignment, fieldMask=alignmentMask)
+        self._positionTemplate = protocol.JsonObjectTemplate(
+            protocol.Position, fieldMask=alignmentMask.getSubmask("position"))
+        cigarUnitConstants = {}
+        if not self._includeReferenceSequence:
+            cigarUnitConstants["referenceSequence"] = None
+        self._cigarUnitTemplate = protocol.JsonObjectTemplate(
+            protocol.CigarUnit, cigarUnitConstants, cigarMask)
+        self._nextMatePositionTemplate = protocol.JsonObjectTemplate(
+            protocol.Position,
+            fieldMask=fieldMask.getSubmask("nextMatePosition"))
+        self._jsonCigarCache = {}
+        # This is the prefix of str(ReadAlignmentCompoundId) for reads
+        # in the read group, before obfuscation.
+        compoundId = readGroup.getCompoundId()
+        values = [getattr(compoundId, field) for field in compoundId.fields]
+        self._readAlignmentIdPrefix = datamodel.CompoundId.separator.join(
+            values + [""])
+
+    def convert(self, read):
+        """
+        Returns the GA4GH ReadAlignment for the specified pysam read.
+        """
+        # TODO fill out remaining fields
+        # TODO refine in tandem with code in converters module
+        (strand, nextMateStrand, numberReads, readNumber, duplicateFragment,
+            failedVendorQualityChecks, properPlacement, secondaryAlignment,
+            supplementaryAlignment) = self.flagTable[read.flag & 0xfff]
+        ret = protocol.ReadAlignment()
+        ret.fragmentId = 'TODO'
+        queryQualities = read.query_qualities
+        if queryQualities is None:
+            ret.alignedQuality = []
+        else:
+            ret.alignedQuality = list(queryQualities)
+        ret.alignedSequence = read.query_sequence
+        alignment = protocol.LinearAlignment()
+        alignment.mappingQuality = read.mapping_quality
+        position = protocol.Position()
+        position.referenceName = self._referenceNames[read.reference_id]
+        position.position = read.reference_start
+        position.strand = strand
+        alignment.position = position
+        cigarStrings = SamCigar.cigarStrings
+        referenceSequences = itertools.repeat(None)
+        if self._referenceWindow is not None:
+            referenceSequences = self._getReferenceSequences(read)
+        cigar = []
+        for (operation, length), referenceSequence in zip(
+                read.cigar, referenceSequences):
+            gaCigarUnit = protocol.CigarUnit()
+            gaCigarUnit.operation = cigarStrings[operation]
+            gaCigarUnit.operationLength = length
+            gaCigarUnit.referenceSequence = referenceSequence
+            cigar.append(gaCigarUnit)
+        alignment.cigar = cigar
+        ret.alignment = alignment
+        ret.duplicateFragment = duplicateFragment
+        ret.failedVendorQualityChecks = failedVendorQualityChecks
+        ret.fragmentLength = read.template_length
+        fragmentName = read.query_name
+        ret.fragmentName = fragmentName
+        ret.info = {key: [str(value)] for key, value in read.tags}
+        ret.nextMatePosition = None
+        nextReferenceId = read.next_reference_id
+        if nextReferenceId != -1:
+            nextMatePosition = protocol.Position()
+            nextMatePosition.referenceName = self._referenceNames[
+                nextReferenceId]
+            nextMatePosition.position = read.next_reference_start
+            nextMatePosition.strand = nextMateStrand
+            ret.nextMatePosition = nextMatePosition
+        ret.numberReads = numberReads
+        ret.readNumber = readNumber
+        ret.properPlacement = properPlacement
+        ret.readGroupId = self._readGroupId
+        ret.secondaryAlignment = secondaryAlignment
+        ret.supplementaryAlignment = supplementaryAlignment
+        ret.id = datamodel.CompoundId.obfuscate(
+            self._readAlignmentIdPrefix + str(fragmentName))
+        return ret
+
+    def toJsonString(self, read):
+        """
+        Returns the JSON representation of the GA4GH ReadAlignment for
+        the specified pysam read. This is identical to the result of
+        convert(read).toJsonString(), but is written directly from the
+        pysam read without creating the ReadAlignment. Only the fields
+        included by the converter's FieldMask are computed and written.
+        """
+        encodeString = protocol.encodeJsonString
+        strand, nextMateStrand, flagFields = self.jsonFlagTable[
+            read.flag & 0xfff]
+        values = dict(flagFields)
+        included = self._includedFields
+        if "alignedQuality" in included:
+            queryQualities = read.query_qualities
+            if queryQualities is None:
+                values["alignedQuality"] = b"[]"
+            else:
+                values["alignedQuality"] = json.dumps(
+                    queryQualities.tolist())
+        if "alignedSequence" in included:
+            values["alignedSequence"] = encodeString(read.query_sequence)
+        if "alignment" in included:
+            position = self._positionTemplate.fill({
+                "position": read.reference_start,
+                "referenceName": self._jsonReferenceNames[read.reference_id],
+                "strand": strand})
+            jsonCigar = None
+            if self._includeReferenceSequence:
+                jsonCigar = self._getJsonCigarWithReference(read)
+            elif self._includeCigar:
+                jsonCigar = self._getJsonCigar(read.cigartuples)
+            values["alignment"] = self._linearAlignmentTemplate.fill({
+                "cigar": jsonCigar,
+                "mappingQuality": read.mapping_quality,
+                "position": position})
+        values["fragmentLength"] = read.template_length
+        fragmentName = read.query_name
+        values["fragmentName"] = encodeString(fragmentName)
+        if "info" in included:
+            # We must build the info dictionary in the same way as
+            # convert, so that its keys are written in the same order.
+            values["info"] = json.dumps(
+                {key: [str(value)] for key, value in read.tags})
+        if "nextMatePosition" in included:
+            values["nextMatePosition"] = b"null"
+            nextReferenceId = read.next_reference_id
+            if nextReferenceId != -1:
+                values["nextMatePosition"] = (
+                    self._nextMatePositionTemplate.fill({
+                        "position": read.next_reference_start,
+                        "referenceName": self._jsonReferenceNames[
+                            nextReferenceId],
+                        "strand": nextMateStrand}))
+        if "id" in included:
+            values["id"] = encodeString(datamodel.CompoundId.obfuscate(
+                self._readAlignmentIdPrefix + str(fragmentName)))
+        return self._readAlignmentTemplate.fill(values)
+
+    def _getJsonCigar(self, cigarTuples):
+        """
+        Returns the JSON encoded list of GA4GH CigarUnits for the
+        specified list of pysam cigar tuples. There are usually few
+        distinct cigars among the reads in a search, so we cache them.
+        """
+        cigarTuples = tuple(cigarTuples)
+        jsonCigar = self._jsonCigarCache.get(cigarTuples)
+        if jsonCigar is None:
+            cigarUnitTemplate = self._cigarUnitTemplate
+            cigarOperations = self._jsonCigarOperations
+            jsonCigar = b"[" + b", ".join(
+                cigarUnitTemplate.fill({
+                    "operation": cigarOperations[operation],
+                    "operationLength": length})
+                for operation, length in cigarTuples) + b"]"
+            if len(self._jsonCigarCache) >= self.jsonCigarCacheSize:
+                self._jsonCigarCache.clear()
+            self._jsonCigarCache[cigarTuples] = jsonCigar
+        return jsonCigar
+
+    def _getJsonCigarWithReference(self, read):
+        """
+        Returns the JSON encoded list of GA4GH CigarUnits for the
+        specified pysam read, including their reference sequences. These
+        depend on the position of the read, so they are not cached.
+        """
+        cigarUnitTemplate = self._cigarUnitTemplate
+        cigarOperations = self._jsonCigarOperations
+        encodeString = protocol.encodeJsonString
+        return b"[" + b", ".join(
+            cigarUnitTemplate.fill({
+                "operation": cigarOperations[operation],
+                "operationLength": length,
+                "referenceSequence": encodeString(referenceSequence)})
+            for (operation, length), referenceSequence in zip(
+                read.cigar, self._getReferenceSequences(read))) + b"]"
+
+    def _getReferenceSequences(self, read):
+        """
+        Returns the list of the reference bases aligned to each of the
+        cigar operations of the specified pysam read. This is None for
+        the operations that do not have reference bases, and for those
+        that are not within the reference.
+        """
+        getBases = self._referenceWindow.getBases
+        referenceOperations = SamCigar.referenceOperations
+        referenceSequenceOperations = SamCigar.referenceSequenceOperations
+        position = read.reference_start
+        referenceSequences = []
+        for operation, length in read.cigar:
+            referenceSequence = None
+            if operation in referenceOperations:
+                if operation in referenceSequenceOperations:
+                    referenceSequence = getBases(position, position + length)
+                position += length
+            referenceSequences.append(referenceSequence)
+        return referenceSequences
+
+    def convertBatch(self, reads):
+        """
+        Returns the list of GA4GH ReadAlignments for the specified list
+        of pysam reads.
+        """
+        convert = self.convert
+        return [convert(read) for read in reads]
+
+    def convertReads(self, reads, batchSize=16):
+        """
+        Returns an iterator over the GA4GH ReadAlignments for the
+        specified iterable of pysam reads. Reads are converted in small
+        batches; the batches are kept small because searches are paged,
+        and reads converted beyond the end of a page are wasted.
+        """
+        reads = iter(reads)
+        while True:
+            batch = list(itertools.islice(reads, batchSize))
+            if len(batch) == 0:
+                break
+            for readAlignment in self.convertBatch(batch):
+                yield readAlignment
+
+
 class AbstractReadGroupSet(datamodel.DatamodelObject):
     """
     The base class of a read group set
@@ -126,6 +614,13 @@ class AbstractReadGroupSet(datamodel.DatamodelObject):
         """
         return self._referenceSet
 
+    def getBamSlicer(self):
+        """
+        Returns the BamSlicer that streams slices of the BAM file of this
+        ReadGroupSet, or None if it is not read from an indexed BAM file.
+        """
+        return None
+
     def toProtocolElement(self):
         """
         Returns the GA4GH protocol representation of this ReadGroupSet.
@@ -137,10 +632,11 @@ class AbstractReadGroupSet(datamodel.DatamodelObject):
             for readGroup in self.getReadGroups()]
         readGroupSet.name = self.getLocalId()
         readGroupSet.datasetId = self.getParentContainer().getId()
-        stats = protocol.ReadStats()
-        stats.alignedReadCount = self.getNumAlignedReads()
-        stats.unalignedReadCount = self.getNumUnalignedReads()
-        readGroupSet.stats = stats
+        readStats = protocol.ReadStats()
+        readStats.alignedReadCount = self.getNumAlignedReads()
+        readStats.unalignedReadCount = self.getNumUnalignedReads()
+        readStats.baseCount = self.getNumBases()
+        readGroupSet.stats = readStats
         return readGroupSet
 
     def getNumAlignedReads(self):
@@ -155,6 +651,13 @@ class AbstractReadGroupSet(datamodel.DatamodelObject):
         """
         raise NotImplementedError()
 
+    def getNumBases(self):
+        """
+        Return the number of bases in this read group set, or None if
+        this is not known.
+        """
+        return None
+
     def getPrograms(self):
         """
         Returns an array of Programs used to generate this read group set
@@ -197,6 +700,12 @@ class HtslibReadGroupSet(datamodel.PysamDatamodelMixin, AbstractReadGroupSet):
             self, parentContainer, localId, samFilePath, backend):
         super(HtslibReadGroupSet, self).__init__(parentContainer, localId)
         self._samFilePath = samFilePath
+        stats.statsEngine.requestStats(
+            samFilePath, stats.computeReadGroupSetStats)
+        self._readGroupIndex = readgroupindex.ReadGroupIndex.load(
+            samFilePath)
+        self._coverageTiles = coverage.CoverageTiles.load(samFilePath)
+        self._bamSlicer = None
         samFile = self.getFileHandle(self._samFilePath)
         self._setHeaderFields(samFile)
         if 'RG' not in samFile.header or len(samFile.header['RG']) == 0:
@@ -254,6 +763,70 @@ class HtslibReadGroupSet(datamodel.PysamDatamodelMixin, AbstractReadGroupSet):
         """
         return self._samFilePath
 
+    def getDataFilePaths(self):
+        return [self._samFilePath]
+
+    def getDataModificationTime(self):
+        modificationTime = super(
+            HtslibReadGroupSet, self).getDataModificationTime()
+        dataFileStats = stats.statsEngine.getStats(self._samFilePath)
+        if dataFileStats is not None:
+            modificationTime = max(
+                modificationTime, dataFileStats.getStatsTime())
+        return modificationTime
+
+    def getReadGroupStats(self, readGroupId=None):
+        """
+        Returns the precomputed counts of aligned reads, unaligned
+        reads and bases for the read group with the specified local ID,
+        or for all reads in the file if it is None. Returns None if the
+        counts are not available.
+        """
+        dataFileStats = stats.statsEngine.getStats(self._samFilePath)
+        if dataFileStats is None:
+            return None
+        readGroups = dataFileStats.getValues()
+        if readGroupId is None:
+            countsList = readGroups.values()
+        else:
+            countsList = [readGroups.get(readGroupId, {})]
+        keys = ["alignedReadCount", "unalignedReadCount", "baseCount"]
+        return {
+            key: sum(counts.get(key, 0) for counts in countsList)
+            for key in keys}
+
+    def getReadGroupIndex(self):
+        """
+        Returns the ReadGroupIndex for the sam file, or None if there is
+        no current index for it.
+        """
+        if (self._readGroupIndex is not None and
+                not self._readGroupIndex.isCurrent()):
+            self._readGroupIndex = None
+        return self._readGroupIndex
+
+    def getCoverageTiles(self):
+        """
+        Returns the CoverageTiles for the sam file, or None if there are
+        no current tiles for it.
+        """
+        if (self._coverageTiles is not None and
+                not self._coverageTiles.isCurrent()):
+            self._coverageTiles = None
+        return self._coverageTiles
+
+    def getBamSlicer(self):
+        """
+        Returns the BamSlicer for the BAM file, which is read when it is
+        first needed and again whenever the file or its index changes.
+        Raises a NotIndexedException if the file has no .bai index.
+        """
+        bamSlicer = self._bamSlicer
+        if bamSlicer is None or not bamSlicer.isCurrent():
+            bamSlicer = bamslice.BamSlicer(self._samFilePath)
+            self._bamSlicer = bamSlicer
+        return bamSlicer
+
     def isUsingDefaultReadGroup(self):
         """
         Returns whether the readGroupSet is using a default read group
@@ -268,6 +841,12 @@ class HtslibReadGroupSet(datamodel.PysamDatamodelMixin, AbstractReadGroupSet):
         samFile = self.getFileHandle(self._samFilePath)
         return samFile.unmapped
 
+    def getNumBases(self):
+        readGroupStats = self.getReadGroupStats()
+        if readGroupStats is None:
+            return None
+        return readGroupStats["baseCount"]
+
     def getPrograms(self):
         return self._programs
 
@@ -282,11 +861,17 @@ class AbstractReadGroup(datamodel.DatamodelObject):
 
     def __init__(self, parentContainer, localId):
         super(AbstractReadGroup, self).__init__(parentContainer, localId)
-        datetimeNow = datetime.datetime.now()
-        now = protocol.convertDatetime(datetimeNow)
-        self._iso8601 = datetimeNow.strftime("%Y-%m-%dT%H:%M:%SZ")
-        self._creationTime = now
-        self._updateTime = now
+        self._setRecordTimes(datetime.datetime.now())
+
+    def _setRecordTimes(self, recordDatetime):
+        """
+        Sets the creation and update times of this ReadGroup to the
+        specified datetime.
+        """
+        millis = protocol.convertDatetime(recordDatetime)
+        self._iso8601 = recordDatetime.strftime("%Y-%m-%dT%H:%M:%SZ")
+        self._creationTime = millis
+        self._updateTime = millis
 
     def toProtocolElement(self):
         """
@@ -310,11 +895,11 @@ class AbstractReadGroup(datamodel.DatamodelObject):
         readGroup.sampleId = self.getSampleId()
         if referenceSet is not None:
             readGroup.referenceSetId = referenceSet.getId()
-        stats = protocol.ReadStats()
-        stats.alignedReadCount = self.getNumAlignedReads()
-        stats.unalignedReadCount = self.getNumUnalignedReads()
-        stats.baseCount = None  # TODO requires iterating through all reads
-        readGroup.stats = stats
+        readStats = protocol.ReadStats()
+        readStats.alignedReadCount = self.getNumAlignedReads()
+        readStats.unalignedReadCount = self.getNumUnalignedReads()
+        readStats.baseCount = self.getNumBases()
+        readGroup.stats = readStats
         readGroup.programs = self.getPrograms()
         readGroup.description = self.getDescription()
         experiment = protocol.Experiment()
@@ -337,6 +922,115 @@ class AbstractReadGroup(datamodel.DatamodelObject):
         readGroup.experiment = experiment
         return readGroup
 
+    def getReadAlignmentsJson(
+            self, reference, start=None, end=None, fieldMask=None,
+            readFilter=None, includeReferenceSequence=False):
+        """
+        Returns an iterator over the JsonRecords of the specified reads,
+        including only the fields in the specified FieldMask if it is
+        not None. Subclasses may override this to write the JSON for
+        each read without creating its ReadAlignment.
+        """
+        if fieldMask is None:
+            fieldMask = protocol.FieldMask(protocol.ReadAlignment)
+        readAlignments = self.getReadAlignments(
+            reference, start, end, readFilter, includeReferenceSequence)
+        for readAlignment in readAlignments:
+            yield datamodel.JsonRecord(
+                readAlignment.alignment.position.position,
+                fieldMask.toJsonString(readAlignment))
+
+    def getCoverage(self, reference, start, end, maxBins):
+        """
+        Returns the triple (binSize, firstBin, sums) describing the depth
+        of coverage of the specified region of the specified reference
+        in about maxBins bins, where sums is the array of the total depth
+        of the bases in each of the consecutive bins of binSize bases
+        from firstBin that cover the region. If there are coverage
+        tiles with bins no larger than those of the region, the bin size
+        is a multiple of the tile bin size that best fits the region, and
+        the sums are read from the tiles; otherwise they are computed
+        from the reads.
+        """
+        binSize = max(1, -(-(end - start) // maxBins))
+        tiles = self._getCoverageTiles()
+        if tiles is not None and binSize < tiles.getBinSizes()[0]:
+            tiles = None
+        if tiles is not None:
+            tileBinSize = binning.getPrecomputedBinSize(
+                tiles.getBinSizes(), binSize)
+            factor = -(-binSize // tileBinSize)
+            binSize = tileBinSize * factor
+        firstBin = start // binSize
+        lastBin = -(-end // binSize)
+        if tiles is not None:
+            sums = tiles.getBinSums(
+                self._getCoverageReadGroupId(), reference.getLocalId(),
+                tileBinSize, firstBin * factor, lastBin * factor)
+            sums = sums.reshape((lastBin - firstBin, factor)).sum(axis=1)
+        else:
+            sums = numpy.zeros(lastBin - firstBin, dtype=numpy.int64)
+            coverage.addBlockSums(
+                sums, firstBin, binSize, self._getAlignedBlocks(
+                    reference, firstBin * binSize, lastBin * binSize))
+        return binSize, firstBin, sums
+
+    def _getCoverageTiles(self):
+        """
+        Returns the CoverageTiles holding the coverage of this read
+        group, or None if there are none.
+        """
+        return None
+
+    def _getCoverageReadGroupId(self):
+        """
+        Returns the read group ID of the reads of this read group in its
+        CoverageTiles, or None if all of the reads are in it.
+        """
+        return self.getLocalId()
+
+    def _getAlignedBlocks(self, reference, start, end):
+        """
+        Returns an iterator over the (start, end) pairs of the reference
+        ranges aligned to the bases of the reads in the specified region.
+        """
+        for readAlignment in self.getReadAlignments(reference, start, end):
+            alignment = readAlignment.alignment
+            if alignment is None:
+                continue
+            position = alignment.position.position
+            for cigarUnit in alignment.cigar:
+                length = cigarUnit.operationLength
+                if cigarUnit.operation in _coveringCigarOperations:
+                    yield position, position + length
+                if cigarUnit.operation in _referenceCigarOperations:
+                    position += length
+
+    def addPileupCounts(self, counts, reference, start, readFilter=None,
+                        minBaseQuality=0):
+        """
+        Adds the bases and deletions of the reads in this read group
+        that are accepted by the specified ReadFilter to the specified
+        allele counts of the consecutive positions of the specified
+        reference from start (see pileup).
+        """
+        readAlignments = self.getReadAlignments(
+            reference, start, start + len(counts), readFilter)
+        for readAlignment in readAlignments:
+            alignment = readAlignment.alignment
+            if alignment is None:
+                continue
+            cigarTuples = [
+                (SamCigar.ga2int(cigarUnit.operation),
+                 cigarUnit.operationLength)
+                for cigarUnit in alignment.cigar]
+            sequence = readAlignment.alignedSequence
+            if sequence is not None:
+                sequence = sequence.encode("ascii")
+            pileup.addAlignedCounts(
+                counts, start, alignment.position.position, cigarTuples,
+                sequence, readAlignment.alignedQuality, minBaseQuality)
+
     def getReadAlignmentId(self, gaAlignment):
         """
         Returns a string ID suitable for use in the specified GA
@@ -358,6 +1052,13 @@ class AbstractReadGroup(datamodel.DatamodelObject):
         """
         raise NotImplementedError()
 
+    def getNumBases(self):
+        """
+        Return the number of bases in the read group, or None if this
+        is not known.
+        """
+        return None
+
     def getPrograms(self):
         """
         Returns an array of Programs used to generate this read group
@@ -433,9 +1134,16 @@ class SimulatedReadGroup(AbstractReadGroup):
     def __init__(self, parentContainer, localId, randomSeed, numAlignments=2):
         super(SimulatedReadGroup, self).__init__(parentContainer, localId)
 
-    def getReadAlignments(self, referenceId=None, start=None, end=None):
+    def getReadAlignments(
+            self, referenceId=None, start=None, end=None, readFilter=None,
+            includeReferenceSequence=False):
+        # Simulated reads have no cigar, so there are no reference
+        # sequences to include.
         for i in range(self.getNumAlignedReads()):
-            yield self._createReadAlignment(i)
+            readAlignment = self._createReadAlignment(i)
+            if (readFilter is None or
+                    readFilter.includesReadAlignment(readAlignment)):
+                yield readAlignment
 
     def _createReadAlignment(self, i):
         # TODO fill out a bit more
@@ -509,6 +1217,11 @@ class HtslibReadGroup(datamodel.PysamDatamodelMixin, AbstractReadGroup):
     def __init__(self, parentContainer, localId, readGroupHeader=None):
         super(HtslibReadGroup, self).__init__(parentContainer, localId)
         self._parentSamFilePath = parentContainer.getSamFilePath()
+        # We take the record times from the BAM file rather than the
+        # time the server started, so that our representation of this
+        # ReadGroup (and therefore its ETag) is stable across restarts.
+        self._setRecordTimes(datetime.datetime.utcfromtimestamp(
+            os.path.getmtime(self._parentSamFilePath)))
         self._filterReads = not parentContainer.isUsingDefaultReadGroup()
         self._sampleId = None
         self._description = None
@@ -534,9 +1247,59 @@ class HtslibReadGroup(datamodel.PysamDatamodelMixin, AbstractReadGroup):
     def getSamFilePath(self):
         return self._parentSamFilePath
 
-    def getReadAlignments(self, reference, start=None, end=None):
+    def getDataFilePaths(self):
+        return [self._parentSamFilePath]
+
+    def getDataModificationTime(self):
+        return self._parentContainer.getDataModificationTime()
+
+    def getReadAlignments(
+            self, reference, start=None, end=None, readFilter=None,
+            includeReferenceSequence=False):
         """
-        Returns an iterator over the specified reads
+        Returns an iterator over the specified reads, including only
+        those accepted by the specified ReadFilter if it is not None.
+        If includeReferenceSequence is True, the reference bases of the
+        match and deletion operations are included in the reads' cigars.
+        """
+        samFile, readAlignments = self._getPysamReads(
+            reference, start, end, readFilter)
+        converter = HtslibReadAlignmentConverter(
+            self, samFile,
+            referenceWindow=self._getReferenceWindow(
+                reference, includeReferenceSequence))
+        return converter.convertReads(readAlignments)
+
+    def getReadAlignmentsJson(
+            self, reference, start=None, end=None, fieldMask=None,
+            readFilter=None, includeReferenceSequence=False):
+        samFile, readAlignments = self._getPysamReads(
+            reference, start, end, readFilter)
+        toJsonString = HtslibReadAlignmentConverter(
+            self, samFile, fieldMask,
+            self._getReferenceWindow(
+                reference, includeReferenceSequence)).toJsonString
+        for readAlignment in readAlignments:
+            yield datamodel.JsonRecord(
+                readAlignment.reference_start, toJsonString(readAlignment))
+
+    def _getReferenceWindow(self, reference, includeReferenceSequence):
+        """
+        Returns a new ReferenceWindow onto the specified reference if
+        includeReferenceSequence is True, and None otherwise. A window
+        is used for a single search, so that the reference bases for a
+        page of reads are usually fetched only once.
+        """
+        if not includeReferenceSequence:
+            return None
+        return references.ReferenceWindow(reference)
+
+    def _getPysamReads(self, reference, start, end, readFilter=None):
+        """
+        Returns the pair (samFile, reads), where reads is an iterator
+        over the pysam reads in this ReadGroup in the specified region
+        that are accepted by the specified ReadFilter, and samFile is the
+        file they are read from.
         """
         # TODO If reference is None, return against all references,
         # including unmapped reads.
@@ -544,93 +1307,92 @@ class HtslibReadGroup(datamodel.PysamDatamodelMixin, AbstractReadGroup):
         referenceName = reference.getLocalId().encode()
         # TODO deal with errors from htslib
         start, end = self.sanitizeAlignmentFileFetch(start, end)
-        readAlignments = samFile.fetch(referenceName, start, end)
+        readGroupIndex = None
         if self._filterReads:
-            for readAlignment in readAlignments:
-                tags = dict(readAlignment.tags)
-                if 'RG' in tags and tags['RG'] == self._localId:
-                    yield self.convertReadAlignment(readAlignment)
+            readGroupIndex = self._parentContainer.getReadGroupIndex()
+        if readGroupIndex is not None:
+            readAlignments = self._getIndexedReadAlignments(
+                samFile, readGroupIndex, referenceName, start, end)
         else:
-            for readAlignment in readAlignments:
-                yield self.convertReadAlignment(readAlignment)
+            readAlignments = samFile.fetch(referenceName, start, end)
+            if self._filterReads:
+                readAlignments = (
+                    readAlignment for readAlignment in readAlignments
+                    if getReadGroupTag(readAlignment) == self._localId)
+        if readFilter is not None:
+            readAlignments = readFilter.filterReads(readAlignments)
+        return samFile, readAlignments
+
+    def _getIndexedReadAlignments(
+            self, samFile, readGroupIndex, referenceName, start, end):
+        """
+        Returns an iterator over the reads in this ReadGroup in the
+        specified region, which seeks directly to the reads using the
+        specified ReadGroupIndex.
+        """
+        referenceId = samFile.gettid(referenceName)
+        offsets = readGroupIndex.getOffsets(
+            self._localId, referenceId, start, end)
+        return getReadAlignmentsAtOffsets(samFile, offsets)
+
+    def _getCoverageTiles(self):
+        return self._parentContainer.getCoverageTiles()
+
+    def _getCoverageReadGroupId(self):
+        if self._filterReads:
+            return self._localId
+        return None
+
+    def _getAlignedBlocks(self, reference, start, end):
+        _, readAlignments = self._getPysamReads(reference, start, end)
+        for readAlignment in readAlignments:
+            if not readAlignment.is_unmapped:
+                for block in readAlignment.get_blocks():
+                    yield block
+
+    def addPileupCounts(self, counts, reference, start, readFilter=None,
+                        minBaseQuality=0):
+        _, readAlignments = self._getPysamReads(
+            reference, start, start + len(counts), readFilter)
+        for readAlignment in readAlignments:
+            if not readAlignment.is_unmapped:
+                pileup.addAlignedCounts(
+                    counts, start, readAlignment.reference_start,
+                    readAlignment.cigartuples or [],
+                    readAlignment.query_sequence,
+                    readAlignment.query_qualities, minBaseQuality)
 
     def convertReadAlignment(self, read):
         """
         Convert a pysam ReadAlignment to a GA4GH ReadAlignment
         """
-        # TODO fill out remaining fields
-        # TODO refine in tandem with code in converters module
-        ret = protocol.ReadAlignment()
-        ret.fragmentId = 'TODO'
-        if read.query_qualities is None:
-            ret.alignedQuality = []
-        else:
-            ret.alignedQuality = list(read.query_qualities)
-        ret.alignedSequence = read.query_sequence
-        ret.alignment = protocol.LinearAlignment()
-        ret.alignment.mappingQuality = read.mapping_quality
-        ret.alignment.position = protocol.Position()
         samFile = self._parentContainer.getFileHandle(
             self._parentSamFilePath)
-        ret.alignment.position.referenceName = samFile.getrname(
-            read.reference_id)
-        ret.alignment.position.position = read.reference_start
-        ret.alignment.position.strand = protocol.Strand.POS_STRAND
-        if SamFlags.isFlagSet(read.flag, SamFlags.REVERSED):
-            ret.alignment.position.strand = protocol.Strand.NEG_STRAND
-        ret.alignment.cigar = []
-        for operation, length in read.cigar:
-            gaCigarUnit = protocol.CigarUnit()
-            gaCigarUnit.operation = SamCigar.int2ga(operation)
-            gaCigarUnit.operationLength = length
-            gaCigarUnit.referenceSequence = None  # TODO fix this!
-            ret.alignment.cigar.append(gaCigarUnit)
-        ret.duplicateFragment = SamFlags.isFlagSet(
-            read.flag, SamFlags.DUPLICATE_FRAGMENT)
-        ret.failedVendorQualityChecks = SamFlags.isFlagSet(
-            read.flag, SamFlags.FAILED_VENDOR_QUALITY_CHECKS)
-        ret.fragmentLength = read.template_length
-        ret.fragmentName = read.query_name
-        ret.info = {key: [str(value)] for key, value in read.tags}
-        ret.nextMatePosition = None
-        if read.next_reference_id != -1:
-            ret.nextMatePosition = protocol.Position()
-            ret.nextMatePosition.referenceName = samFile.getrname(
-                read.next_reference_id)
-            ret.nextMatePosition.position = read.next_reference_start
-            ret.nextMatePosition.strand = protocol.Strand.POS_STRAND
-            if SamFlags.isFlagSet(read.flag, SamFlags.NEXT_MATE_REVERSED):
-                ret.nextMatePosition.strand = protocol.Strand.NEG_STRAND
-        # TODO Is this the correct mapping between numberReads and
-        # sam flag 0x1? What about the mapping between numberReads
-        # and 0x40 and 0x80?
-        ret.numberReads = None
-        ret.readNumber = None
-        if SamFlags.isFlagSet(read.flag, SamFlags.NUMBER_READS):
-            ret.numberReads = 2
-            if SamFlags.isFlagSet(read.flag,
-                                  SamFlags.READ_NUMBER_ONE |
-                                  SamFlags.READ_NUMBER_TWO):
-                ret.readNumber = 2
-            elif SamFlags.isFlagSet(read.flag, SamFlags.READ_NUMBER_ONE):
-                ret.readNumber = 0
-            elif SamFlags.isFlagSet(read.flag, SamFlags.READ_NUMBER_TWO):
-                ret.readNumber = 1
-        ret.properPlacement = SamFlags.isFlagSet(
-            read.flag, SamFlags.PROPER_PLACEMENT)
-        ret.readGroupId = self.getId()
-        ret.secondaryAlignment = SamFlags.isFlagSet(
-            read.flag, SamFlags.SECONDARY_ALIGNMENT)
-        ret.supplementaryAlignment = SamFlags.isFlagSet(
-            read.flag, SamFlags.SUPPLEMENTARY_ALIGNMENT)
-        ret.id = self.getReadAlignmentId(ret)
-        return ret
+        return HtslibReadAlignmentConverter(self, samFile).convert(read)
+
+    def _getReadGroupStats(self):
+        readGroupId = None
+        if self._filterReads:
+            readGroupId = self._localId
+        return self._parentContainer.getReadGroupStats(readGroupId)
 
     def getNumAlignedReads(self):
-        return -1  # TODO populate with metadata
+        readGroupStats = self._getReadGroupStats()
+        if readGroupStats is None:
+            return -1
+        return readGroupStats["alignedReadCount"]
 
     def getNumUnalignedReads(self):
-        return -1  # TODO populate with metadata
+        readGroupStats = self._getReadGroupStats()
+        if readGroupStats is None:
+            return -1
+        return readGroupStats["unalignedReadCount"]
+
+    def getNumBases(self):
+        readGroupStats = self._getReadGroupStats()
+        if readGroupStats is None:
+            return None
+        return readGroupStats["baseCount"]
 
     def getPrograms(self):
         return self._parentContainer.getPrograms()
@@ -14,6 +14,7 @@ import random
 import pysam
 
 import ga4gh.datamodel as datamodel
+import ga4gh.metrics as metrics
 import ga4gh.protocol as protocol
 import ga4gh.exceptions as exceptions
 
@@ -288,6 +289,53 @@ class AbstractReference(datamodel.DatamodelObject):
         """
         raise NotImplemented()
 
+
+class ReferenceWindow(object):
+    """
+    A window onto the bases of a reference, for a series of lookups at
+    increasing positions such as those made for the reads in a page of
+    search results. Each fetch from the reference reads at least
+    windowSize bases, so that a page of reads usually costs a single
+    fetch rather than one for each read.
+    """
+    defaultWindowSize = 65536
+
+    def __init__(self, reference, windowSize=None):
+        self._reference = reference
+        self._windowSize = windowSize
+        if windowSize is None:
+            self._windowSize = self.defaultWindowSize
+        self._start = 0
+        self._end = 0
+        self._bases = ""
+        self._numFetches = 0
+
+    def getBases(self, start, end):
+        """
+        Returns the bases of the reference from start (inclusive) to end
+        (exclusive), or None if this range is not within the reference.
+        """
+        if start < 0 or end > self._reference.getLength() or start > end:
+            return None
+        if start < self._start or end > self._end:
+            self._fetch(start, max(end, start + self._windowSize))
+        return self._bases[start - self._start:end - self._start]
+
+    def _fetch(self, start, end):
+        end = min(end, self._reference.getLength())
+        with metrics.timer("reference"):
+            self._bases = self._reference.getBases(start, end)
+        self._start = start
+        self._end = end
+        self._numFetches += 1
+
+    def getNumFetches(self):
+        """
+        Returns the number of times the bases have been fetched from
+        the reference.
+        """
+        return self._numFetches
+
 ##################################################################
 #
 # Simulated references
@@ -367,6 +415,9 @@ class HtslibReferenceSet(datamodel.PysamDatamodelMixin, AbstractReferenceSet):
         self._setMetadata()
         self._scanDataFiles(dataDir, ["*.fa.gz"])
 
+    def getDataFilePaths(self):
+        return [self._dataDir, '{}.json'.format(self._dataDir)]
+
     def _setMetadata(self):
         metadataFileName = '{}.json'.format(self._dataDir)
         with open(metadataFileName) as metadataFile:
@@ -424,6 +475,9 @@ class HtslibReference(datamodel.PysamDatamodelMixin, AbstractReference):
         """
         return self._fastaFilePath
 
+    def getDataFilePaths(self):
+        return [self._fastaFilePath]
+
     def openFile(self, dataFile):
         return pysam.FastaFile(dataFile)
 
@@ -0,0 +1,305 @@
+"""
+Precomputed statistics for the data files backing the data model.
+
+Some of the values in the protocol objects, such as the number of reads
+in a read group, can only be computed by scanning a whole data file. The
+StatsEngine scans each file once in a pool of worker processes, and
+stores the results in a sidecar file next to the data file so that they
+are available immediately the next time the server starts. A sidecar is
+only used if the data file has not been modified since it was written.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import pysam
+
+
+STATS_FILE_SUFFIX = ".stats.json"
+STATS_FORMAT_VERSION = 1
+
+
+def getStatsFilePath(dataFilePath):
+    """
+    Returns the path of the sidecar file holding the statistics for the
+    specified data file.
+    """
+    return dataFilePath + STATS_FILE_SUFFIX
+
+
+def computeReadGroupSetStats(samFilePath):
+    """
+    Scans the specified SAM/BAM file and returns a dictionary mapping
+    each read group ID to a dictionary of the number of aligned reads,
+    unaligned reads and bases in that read group. Reads that are not
+    in a read group are counted under the empty string.
+    """
+    samFile = pysam.AlignmentFile(samFilePath)
+    readGroups = {}
+    try:
+        for read in samFile.fetch(until_eof=True):
+            readGroupId = ""
+            if read.has_tag(b"RG"):
+                readGroupId = read.get_tag(b"RG")
+            if readGroupId not in readGroups:
+                readGroups[readGroupId] = {
+                    "alignedReadCount": 0,
+                    "unalignedReadCount": 0,
+                    "baseCount": 0,
+                }
+            counts = readGroups[readGroupId]
+            if read.is_unmapped:
+                counts["unalignedReadCount"] += 1
+            else:
+                counts["alignedReadCount"] += 1
+            counts["baseCount"] += read.query_length
+    finally:
+        samFile.close()
+    return readGroups
+
+
+def computeVariantFileStats(variantFilePath):
+    """
+    Scans the specified VCF/BCF file and returns a dictionary mapping
+    each contig name to the number of variant records on that contig.
+    """
+    variantFile = pysam.VariantFile(variantFilePath)
+    contigs = {}
+    try:
+        for record in variantFile:
+            contigs[record.chrom] = contigs.get(record.chrom, 0) + 1
+    finally:
+        variantFile.close()
+    return contigs
+
+
+def _computeStats(function, dataFilePath):
+    """
+    Runs the specified stats function over the specified data file in a
+    worker process, and returns the resulting DataFileStats, or None if
+    an error occured.
+    """
+    try:
+        fileStat = os.stat(dataFilePath)
+        values = function(dataFilePath)
+        return DataFileStats(
+            dataFilePath, fileStat.st_mtime, fileStat.st_size, time.time(),
+            values)
+    except Exception:
+        logging.getLogger(__name__).exception(
+            "Error computing stats for %s", dataFilePath)
+        return None
+
+
+class DataFileStats(object):
+    """
+    The statistics computed for a single data file, along with the
+    modification time and size of the file when they were computed.
+    """
+    def __init__(
+            self, dataFilePath, modificationTime, size, statsTime, values):
+        self._dataFilePath = dataFilePath
+        self._modificationTime = modificationTime
+        self._size = size
+        self._statsTime = statsTime
+        self._values = values
+
+    def getDataFilePath(self):
+        """
+        Returns the path of the data file these statistics describe.
+        """
+        return self._dataFilePath
+
+    def getStatsTime(self):
+        """
+        Returns the time (in seconds since the epoch) at which these
+        statistics were computed.
+        """
+        return self._statsTime
+
+    def getValues(self):
+        """
+        Returns the JSON compatible value computed by the stats function.
+        """
+        return self._values
+
+    def isCurrent(self):
+        """
+        Returns True if the data file has not changed since these
+        statistics were computed.
+        """
+        try:
+            fileStat = os.stat(self._dataFilePath)
+        except OSError:
+            return False
+        return (
+            fileStat.st_mtime == self._modificationTime and
+            fileStat.st_size == self._size)
+
+    def toJsonDict(self):
+        return {
+            "version": STATS_FORMAT_VERSION,
+            "modificationTime": self._modificationTime,
+            "size": self._size,
+            "statsTime": self._statsTime,
+            "values": self._values,
+        }
+
+    @classmethod
+    def fromJsonDict(cls, dataFilePath, jsonDict):
+        return cls(
+            dataFilePath, jsonDict["modificationTime"], jsonDict["size"],
+            jsonDict["statsTime"], jsonDict["values"])
+
+    def save(self):
+        """
+        Writes these statistics to the sidecar file for the data file.
+        We write to a temporary file and rename it, so that a concurrent
+        reader never sees a partially written file.
+        """
+        statsFilePath = getStatsFilePath(self._dataFilePath)
+        tempFilePath = "{}.{}.tmp".format(statsFilePath, os.getpid())
+        with open(tempFilePath, "w") as statsFile:
+            json.dump(self.toJsonDict(), statsFile)
+        os.rename(tempFilePath, statsFilePath)
+
+    @classmethod
+    def load(cls, dataFilePath):
+        """
+        Returns the statistics stored in the sidecar file for the
+        specified data file, or None if there is no such file or the data
+        file has changed since it was written.
+        """
+        statsFilePath = getStatsFilePath(dataFilePath)
+        try:
+            with open(statsFilePath) as statsFile:
+                jsonDict = json.load(statsFile)
+        except (IOError, ValueError):
+            return None
+        if jsonDict.get("version") != STATS_FORMAT_VERSION:
+            return None
+        dataFileStats = cls.fromJsonDict(dataFilePath, jsonDict)
+        if not dataFileStats.isCurrent():
+            return None
+        return dataFileStats
+
+
+class StatsEngine(object):
+    """
+    Computes statistics for data files in the background using a pool
+    of worker processes, and keeps the results in memory and in sidecar
+    files. If the number of processes is zero (the default), no
+    statistics are computed, but any valid sidecar files are still used.
+    """
+    def __init__(self):
+        self._numProcesses = 0
+        self._pool = None
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._functions = {}
+        self._pending = {}
+
+    def setNumProcesses(self, numProcesses):
+        """
+        Sets the number of worker processes used to compute statistics.
+        """
+        if numProcesses < 0:
+            raise ValueError(
+                "The number of processes must be a non-negative value")
+        self.close()
+        self._numProcesses = numProcesses
+
+    def requestStats(self, dataFilePath, function):
+        """
+        Registers the specified data file, whose statistics are computed
+        by the specified module level function. The statistics are read
+        from the sidecar file if it is current, and otherwise computed in
+        the background.
+        """
+        with self._lock:
+            self._functions[dataFilePath] = function
+            if dataFilePath not in self._stats:
+                dataFileStats = DataFileStats.load(dataFilePath)
+                if dataFileStats is not None:
+                    self._stats[dataFilePath] = dataFileStats
+                else:
+                    self._schedule(dataFilePath)
+
+    def getStats(self, dataFilePath):
+        """
+        Returns the current DataFileStats for the specified data file,
+        or None if they are not available yet. If the data file has
+        changed since its statistics were computed, they are computed
+        again.
+        """
+        with self._lock:
+            dataFileStats = self._stats.get(dataFilePath)
+            if dataFileStats is not None and not dataFileStats.isCurrent():
+                del self._stats[dataFilePath]
+                dataFileStats = None
+                self._schedule(dataFilePath)
+            return dataFileStats
+
+    def wait(self):
+        """
+        Waits until all of the statistics currently being computed are
+        available.
+        """
+        while True:
+            with self._lock:
+                pending = self._pending.values()
+            if len(pending) == 0:
+                break
+            for asyncResult in pending:
+                asyncResult.wait()
+
+    def close(self):
+        """
+        Shuts down the worker processes, abandoning any statistics being
+        computed.
+        """
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+            self._pending = {}
+        # The pool's result handler thread runs our callbacks, which
+        # take the lock, so we must not hold it while terminating.
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    def _schedule(self, dataFilePath):
+        # Must be called with the lock held.
+        if self._numProcesses == 0 or dataFilePath in self._pending:
+            return
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self._numProcesses)
+        function = self._functions[dataFilePath]
+
+        def callback(dataFileStats):
+            self._storeStats(dataFilePath, dataFileStats)
+
+        self._pending[dataFilePath] = self._pool.apply_async(
+            _computeStats, (function, dataFilePath), callback=callback)
+
+    def _storeStats(self, dataFilePath, dataFileStats):
+        with self._lock:
+            self._pending.pop(dataFilePath, None)
+            if dataFileStats is None:
+                return
+            self._stats[dataFilePath] = dataFileStats
+        try:
+            dataFileStats.save()
+        except (IOError, OSError):
+            logging.getLogger(__name__).warning(
+                "Cannot write stats file for %s", dataFilePath)
+
+
+statsEngine = StatsEngine()
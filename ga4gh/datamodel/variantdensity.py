@@ -0,0 +1,284 @@
+"""
+A precomputed index of the density of the variants in a HtslibVariantSet.
+
+A genome browser showing a large region of a variant set only needs the
+number of variants in a few hundred bins, but counting them from the
+variants means converting every record in the region. The index holds,
+for each contig, the number of variants starting in each bin at several
+bin sizes, split by variant class (see variantfilters) and by allele
+frequency class, so the counts over any region are found by summing a
+few values from the coarsest bin size that resolves it.
+
+The index is stored in the variant set directory, as a JSON manifest and
+a .npy file of counts for each bin size of each contig, each spanning
+only the bins between the first and last variants of the contig. As with
+the carrier index, the manifest records the size and modification time
+of each data file, and an index that does not match the data files is
+ignored, so that it is rebuilt when it is next used. The server builds
+the indexes in worker processes (see variants.DensityIndexBuilder), and
+counts the variants of a region itself until the index is ready.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import bisect
+import json
+import os
+
+import numpy
+
+import ga4gh.datamodel.carrierindex as carrierindex
+import ga4gh.datamodel.variantfilters as variantfilters
+
+
+MANIFEST_FILE_NAME = "density.json"
+INDEX_FORMAT_VERSION = 1
+DEFAULT_BIN_SIZES = [1000, 100000, 10000000]
+
+UNKNOWN = "UNKNOWN"
+RARE = "RARE"
+LOW = "LOW"
+COMMON = "COMMON"
+ALLELE_FREQUENCY_CLASSES = [UNKNOWN, RARE, LOW, COMMON]
+"""
+The allele frequency classes of the variants, by the greatest of their
+INFO AF values: RARE below 1%, LOW below 5%, and COMMON otherwise. The
+variants without a usable AF value are UNKNOWN.
+"""
+_alleleFrequencyBounds = [0.01, 0.05]
+_countDtype = numpy.dtype(b"<i4")
+
+
+def _getCountsFileName(contigIndex, binSize):
+    return "density.contig{}.bins{}.npy".format(contigIndex, binSize)
+
+
+def getAlleleFrequencyClassIndex(alleleFrequencies):
+    """
+    Returns the index in ALLELE_FREQUENCY_CLASSES of the class of a
+    variant with the specified INFO AF values, which may be numbers or
+    strings, or None if the variant has no AF values.
+    """
+    values = []
+    for value in alleleFrequencies or []:
+        try:
+            values.append(float(value))
+        except (TypeError, ValueError):
+            pass
+    if len(values) == 0:
+        return ALLELE_FREQUENCY_CLASSES.index(UNKNOWN)
+    return 1 + bisect.bisect_right(_alleleFrequencyBounds, max(values))
+
+
+def getCategory(referenceBases, alternateBases, alleleFrequencies):
+    """
+    Returns the (variantClassIndex, alleleFrequencyClassIndex) pair of
+    the indexes in VARIANT_CLASSES and ALLELE_FREQUENCY_CLASSES of the
+    classes of a variant with the specified bases and INFO AF values.
+    """
+    variantClass = variantfilters.getVariantClass(
+        referenceBases, alternateBases)
+    return (
+        variantfilters.VARIANT_CLASSES.index(variantClass),
+        getAlleleFrequencyClassIndex(alleleFrequencies))
+
+
+def getEmptyCounts(numBins):
+    """
+    Returns an array of zero counts for the specified number of bins,
+    indexed by bin, variant class and allele frequency class.
+    """
+    return numpy.zeros(
+        (numBins, len(variantfilters.VARIANT_CLASSES),
+         len(ALLELE_FREQUENCY_CLASSES)), dtype=numpy.int64)
+
+
+def addSiteCounts(counts, firstBin, binSize, starts, categories):
+    """
+    Adds the variants with the specified start positions and (variant
+    class, allele frequency class) index pairs to the specified counts
+    of the consecutive bins of the specified size from the specified
+    first bin. Variants starting outside the bins are ignored.
+    """
+    if len(starts) == 0:
+        return
+    bins = numpy.asarray(starts, dtype=numpy.int64) // binSize - firstBin
+    categories = numpy.asarray(categories, dtype=numpy.int64)
+    included = (bins >= 0) & (bins < len(counts))
+    numpy.add.at(
+        counts, (bins[included], categories[included, 0],
+                 categories[included, 1]), 1)
+
+
+class VariantDensityIndex(object):
+    """
+    The variant counts of the bins of each of a number of sizes, for
+    each contig of a HtslibVariantSet.
+    """
+    def __init__(self, dataFileStates, binSizes):
+        self._dataFileStates = dataFileStates
+        self._binSizes = sorted(binSizes)
+        # Maps (referenceName, binSize) to (firstBin, counts).
+        self._counts = {}
+
+    @classmethod
+    def build(cls, variantSet, binSizes=DEFAULT_BIN_SIZES):
+        """
+        Reads the records of the specified HtslibVariantSet and returns
+        the VariantDensityIndex of the specified bin sizes for it.
+        """
+        contigRecords = (
+            (referenceName, variantSet.getPysamRecords(
+                referenceName, variantSet.vcfMin, variantSet.vcfMax))
+            for referenceName in variantSet.getReferenceNames())
+        return cls.buildFromRecords(
+            variantSet.getDataFileNames(), contigRecords, binSizes)
+
+    @classmethod
+    def buildFromRecords(
+            cls, dataFilePaths, contigRecords, binSizes=DEFAULT_BIN_SIZES):
+        """
+        Returns the VariantDensityIndex of the specified bin sizes for the
+        data files with the specified paths, whose pysam records on each
+        contig are given by the specified iterable of (referenceName,
+        records) pairs. The records are classified directly, without
+        converting them into GA Variants.
+        """
+        index = cls(carrierindex.getDataFileStates(dataFilePaths), binSizes)
+        for referenceName, records in contigRecords:
+            starts = []
+            categories = []
+            for record in records:
+                alternateBases = []
+                if record.alts is not None:
+                    alternateBases = list(record.alts)
+                alleleFrequencies = record.info.get("AF")
+                if not isinstance(alleleFrequencies, (tuple, type(None))):
+                    alleleFrequencies = (alleleFrequencies,)
+                starts.append(record.start)
+                categories.append(getCategory(
+                    record.ref, alternateBases, alleleFrequencies))
+            if len(starts) == 0:
+                continue
+            for binSize in index._binSizes:
+                firstBin = min(starts) // binSize
+                lastBin = max(starts) // binSize + 1
+                counts = getEmptyCounts(lastBin - firstBin)
+                addSiteCounts(counts, firstBin, binSize, starts, categories)
+                index._counts[(referenceName, binSize)] = (
+                    firstBin, counts.astype(_countDtype))
+        return index
+
+    def isCurrent(self, dataFilePaths):
+        """
+        Returns True if the specified data files have not changed since
+        this index was built.
+        """
+        try:
+            return (
+                carrierindex.getDataFileStates(dataFilePaths) ==
+                self._dataFileStates)
+        except OSError:
+            return False
+
+    def getBinSizes(self):
+        """
+        Returns the sorted list of the bin sizes of this index.
+        """
+        return self._binSizes
+
+    def getBinCounts(self, referenceName, binSize, firstBin, lastBin):
+        """
+        Returns the array of the variant counts of the bins of the
+        specified size from firstBin to lastBin (exclusive) on the
+        specified contig, indexed by bin, variant class and allele
+        frequency class.
+        """
+        counts = getEmptyCounts(lastBin - firstBin)
+        entry = self._counts.get((referenceName, binSize))
+        if entry is not None:
+            indexFirstBin, indexCounts = entry
+            first = max(firstBin, indexFirstBin)
+            last = min(lastBin, indexFirstBin + len(indexCounts))
+            if first < last:
+                counts[first - firstBin:last - firstBin] += \
+                    indexCounts[first - indexFirstBin:last - indexFirstBin]
+        return counts
+
+    def getFilePaths(self, indexDir):
+        """
+        Returns the paths of the files making up this index in the
+        specified directory.
+        """
+        paths = [os.path.join(indexDir, MANIFEST_FILE_NAME)]
+        referenceNames = sorted(set(
+            referenceName for referenceName, _ in self._counts.keys()))
+        for contigIndex in range(len(referenceNames)):
+            for binSize in self._binSizes:
+                paths.append(os.path.join(
+                    indexDir, _getCountsFileName(contigIndex, binSize)))
+        return paths
+
+    def save(self, indexDir):
+        """
+        Writes this index into the specified directory. The manifest is
+        written last, so the index is only recognised once it is
+        complete.
+        """
+        referenceNames = sorted(set(
+            referenceName for referenceName, _ in self._counts.keys()))
+        contigs = []
+        for contigIndex, referenceName in enumerate(referenceNames):
+            firstBins = {}
+            for binSize in self._binSizes:
+                firstBin, counts = self._counts[(referenceName, binSize)]
+                firstBins[str(binSize)] = firstBin
+                numpy.save(os.path.join(
+                    indexDir, _getCountsFileName(contigIndex, binSize)),
+                    counts)
+            contigs.append({"name": referenceName, "firstBins": firstBins})
+        manifest = {
+            "version": INDEX_FORMAT_VERSION,
+            "dataFiles": self._dataFileStates,
+            "binSizes": self._binSizes,
+            "variantClasses": variantfilters.VARIANT_CLASSES,
+            "alleleFrequencyClasses": ALLELE_FREQUENCY_CLASSES,
+            "contigs": contigs,
+        }
+        manifestPath = os.path.join(indexDir, MANIFEST_FILE_NAME)
+        tempFilePath = "{}.{}.tmp".format(manifestPath, os.getpid())
+        with open(tempFilePath, "w") as manifestFile:
+            json.dump(manifest, manifestFile)
+        os.rename(tempFilePath, manifestPath)
+
+    @classmethod
+    def load(cls, indexDir, dataFilePaths):
+        """
+        Returns the VariantDensityIndex stored in the specified directory
+        for the specified data files, or None if there is no index there
+        or the data files have changed since it was written.
+        """
+        manifestPath = os.path.join(indexDir, MANIFEST_FILE_NAME)
+        try:
+            with open(manifestPath) as manifestFile:
+                manifest = json.load(manifestFile)
+            if (manifest.get("version") != INDEX_FORMAT_VERSION or
+                    manifest["variantClasses"] !=
+                    variantfilters.VARIANT_CLASSES or
+                    manifest["alleleFrequencyClasses"] !=
+                    ALLELE_FREQUENCY_CLASSES):
+                return None
+            index = cls(manifest["dataFiles"], manifest["binSizes"])
+            if not index.isCurrent(dataFilePaths):
+                return None
+            for contigIndex, contig in enumerate(manifest["contigs"]):
+                for binSize in index._binSizes:
+                    counts = numpy.load(os.path.join(
+                        indexDir, _getCountsFileName(contigIndex, binSize)),
+                        mmap_mode="r")
+                    index._counts[(contig["name"], binSize)] = (
+                        contig["firstBins"][str(binSize)], counts)
+        except (IOError, ValueError, KeyError):
+            return None
+        return index
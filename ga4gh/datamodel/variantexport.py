@@ -0,0 +1,221 @@
+"""
+Parallel export of the variants of a variant set over large regions.
+
+Writing the JSON of each variant is CPU bound, so an export of a whole
+genome, or of a very wide region, from a single request would use only
+one core. The export is instead split into tasks covering at most a
+fixed number of bases of one contig, which the VariantExporter runs in a
+pool of worker processes. The JSON written by each task is yielded in
+order as soon as it and the tasks before it are finished, so the export
+can be streamed while the later tasks are still running, and only a few
+tasks per worker are in flight at once.
+
+Each worker opens the variant sets it is given from their directories,
+and keeps them open for later tasks. Variant sets that are not read from
+a directory, such as simulated ones, are exported in the server process.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import multiprocessing
+import threading
+
+import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.datasets as datasets
+import ga4gh.datamodel.stats as stats
+import ga4gh.datamodel.variants as variants
+
+
+EXPORT_MIMETYPE = "application/x-ndjson"
+DEFAULT_REGION_SIZE = 10000000
+
+
+class ExportTask(object):
+    """
+    The export of the variants starting in a region of a contig, which
+    also includes those overlapping the start of the region if it is the
+    first task of the export on the contig.
+    """
+    __slots__ = ['referenceName', 'start', 'end', 'includeOverlapping']
+
+    def __init__(self, referenceName, start, end, includeOverlapping):
+        self.referenceName = referenceName
+        self.start = start
+        self.end = end
+        self.includeOverlapping = includeOverlapping
+
+    def __getstate__(self):
+        return (
+            self.referenceName, self.start, self.end,
+            self.includeOverlapping)
+
+    def __setstate__(self, state):
+        (self.referenceName, self.start, self.end,
+         self.includeOverlapping) = state
+
+    def __eq__(self, other):
+        return self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def run(self, variantSet):
+        """
+        Returns the newline delimited JSON of the variants of this task
+        in the specified variant set.
+        """
+        lines = []
+        for jsonRecord in variantSet.getVariantsJson(
+                self.referenceName, self.start, self.end):
+            if self.includeOverlapping or jsonRecord.start >= self.start:
+                lines.append(jsonRecord.toJsonString())
+                lines.append("\n")
+        return "".join(lines)
+
+
+def getExportTasks(variantSet, referenceNames, start, end, regionSize):
+    """
+    Returns the list of the ExportTasks of at most regionSize bases for
+    the variants of the specified variant set on each of the specified
+    contigs in turn, overlapping the region from start to end. If end is
+    None, the region extends to the end of the variants on each contig.
+    The tasks only cover the part of each contig holding variants, if
+    the variant set knows it. Returns None if end is None and the
+    variant set does not know the extent of one of the contigs.
+    """
+    tasks = []
+    for referenceName in referenceNames:
+        taskStart = start
+        taskEnd = end
+        referenceRange = variantSet.getReferenceRange(referenceName)
+        if referenceRange is not None:
+            taskStart = max(start, referenceRange[0])
+            if taskEnd is None or taskEnd > referenceRange[1]:
+                taskEnd = referenceRange[1]
+        elif taskEnd is None:
+            return None
+        includeOverlapping = True
+        while taskStart < taskEnd:
+            regionEnd = min(taskStart + regionSize, taskEnd)
+            tasks.append(ExportTask(
+                referenceName, taskStart, regionEnd, includeOverlapping))
+            includeOverlapping = False
+            taskStart = regionEnd
+    return tasks
+
+
+# The variant sets opened by a worker process, keyed by the arguments of
+# their constructors.
+_workerVariantSets = {}
+
+
+def _initialiseWorker():
+    """
+    Replaces the file handle cache, statistics engine and shard fetcher
+    inherited from the server process, so that the worker reads the data
+    files through its own handles, does not start processes of its own,
+    and does not use the threads of the server process, which it does
+    not have.
+    """
+    datamodel.fileHandleCache = datamodel.PysamFileHandleCache()
+    stats.statsEngine = stats.StatsEngine()
+    variants.shardFetcher = variants.ShardFetcher()
+    _workerVariantSets.clear()
+
+
+def _runTask(variantSetArguments, task):
+    """
+    Runs the specified task in a worker process, on the variant set
+    constructed from the specified (class, datasetLocalId, localId,
+    dataDir) arguments.
+    """
+    variantSet = _workerVariantSets.get(variantSetArguments)
+    if variantSet is None:
+        variantSetClass, datasetLocalId, localId, dataDir = \
+            variantSetArguments
+        variantSet = variantSetClass(
+            datasets.AbstractDataset(datasetLocalId), localId, dataDir,
+            None)
+        _workerVariantSets[variantSetArguments] = variantSet
+    return task.run(variantSet)
+
+
+class VariantExporter(object):
+    """
+    Runs the tasks of variant exports in a pool of worker processes
+    shared by all of them. If the number of processes is zero, the tasks
+    are run one after the other in the server process.
+
+    The tasks of a variant set read from data files are run in the server
+    process when there is only one of them, through the pysam handles it
+    shares with the request threads, unless alwaysInWorkers is True, for
+    exports that run alongside requests in threads of their own.
+    """
+    tasksPerProcess = 2
+    """
+    The number of tasks of an export that are submitted for each worker
+    process before the result of the first of them is waited for.
+    """
+
+    def __init__(self, alwaysInWorkers=False):
+        self._numProcesses = 0
+        self._alwaysInWorkers = alwaysInWorkers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def setNumProcesses(self, numProcesses):
+        """
+        Sets the number of worker processes used to run export tasks.
+        """
+        if numProcesses < 0:
+            raise ValueError(
+                "The number of processes must be a non-negative value")
+        self.close()
+        self._numProcesses = numProcesses
+
+    def close(self):
+        """
+        Shuts down the worker processes.
+        """
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    def export(self, variantSet, tasks):
+        """
+        Returns a generator over the newline delimited JSON written by
+        each of the specified tasks on the specified variant set, in
+        order.
+        """
+        dataDir = variantSet.getDataDir()
+        if (self._numProcesses == 0 or dataDir is None or
+                (len(tasks) <= 1 and not self._alwaysInWorkers)):
+            for task in tasks:
+                yield task.run(variantSet)
+            return
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(
+                    self._numProcesses, _initialiseWorker)
+            pool = self._pool
+            maxPending = self._numProcesses * self.tasksPerProcess
+        variantSetArguments = (
+            variantSet.__class__, variantSet.getParentContainer().getLocalId(),
+            variantSet.getLocalId(), dataDir)
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(pool.apply_async(
+                _runTask, (variantSetArguments, task)))
+            if len(pending) >= maxPending:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+
+
+# The worker processes that run export tasks
+variantExporter = VariantExporter()
@@ -0,0 +1,410 @@
+"""
+Filter expressions for variant searches.
+
+A filter expression selects variants by their INFO values, their
+variant class and their FILTER status, for example
+
+    FILTER == PASS AND TYPE == SNV AND INFO.AF < 0.01
+
+The expression is made up of the following tests, combined with AND, OR,
+NOT and parentheses:
+
+    INFO.<key> <op> <value>   True if any of the values of the INFO key
+                              compares as specified with the value. The
+                              comparison is numeric if the value is a
+                              number, and on strings otherwise. Records
+                              without the key never match.
+    INFO.<key>                True if the record has the INFO key (or
+                              the INFO flag is set).
+    TYPE == <class>           True if the variant class of the record is
+                              one of SNV, MNV, INDEL, MIXED or OTHER.
+    FILTER == <name>          True if the record has the named FILTER,
+                              or has no FILTER if the name is ".".
+
+where <op> is one of ==, !=, <, <=, > and >=, and TYPE and FILTER also
+allow !=. Values are numbers, quoted strings or bare words. The
+expression is compiled once into a tree of closures, which are evaluated
+on the pysam record before it is converted, so that rejected records
+cost only the few attribute reads that the expression needs.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import operator
+import re
+import time
+
+import ga4gh.metrics as metrics
+
+
+SNV = "SNV"
+MNV = "MNV"
+INDEL = "INDEL"
+MIXED = "MIXED"
+OTHER = "OTHER"
+VARIANT_CLASSES = [SNV, MNV, INDEL, MIXED, OTHER]
+
+_operators = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+_tokenPattern = re.compile(r"""
+    \s*(?:
+        (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?) |
+        (?P<string>"[^"]*"|'[^']*') |
+        (?P<operator>==|!=|<=|>=|<|>) |
+        (?P<paren>[()]) |
+        (?P<word>[A-Za-z_][A-Za-z0-9_.]*)
+    )""", re.VERBOSE)
+
+
+def getVariantClass(referenceBases, alternateBases):
+    """
+    Returns the variant class of a variant with the specified reference
+    and alternate bases. This is the class shared by all of the
+    alternate alleles, or MIXED if they differ. Symbolic alleles, and
+    variants with no alternate alleles, are of class OTHER.
+    """
+    variantClass = None
+    for alternate in alternateBases or []:
+        if (alternate in ("", ".", "*") or alternate[0] == "<" or
+                "[" in alternate or "]" in alternate):
+            alleleClass = OTHER
+        elif len(alternate) != len(referenceBases):
+            alleleClass = INDEL
+        elif len(alternate) == 1:
+            alleleClass = SNV
+        else:
+            alleleClass = MNV
+        if variantClass is None:
+            variantClass = alleleClass
+        elif variantClass != alleleClass:
+            return MIXED
+    if variantClass is None:
+        variantClass = OTHER
+    return variantClass
+
+
+class _PysamRecordAccessor(object):
+    """
+    Reads the values tested by filter expressions from pysam
+    VariantRecords.
+    """
+    @staticmethod
+    def getInfoValues(record, key):
+        value = record.info.get(key)
+        if value is None:
+            return None
+        if isinstance(value, tuple):
+            return value
+        return (value,)
+
+    @staticmethod
+    def hasInfo(record, key):
+        return record.info.get(key) not in (None, False)
+
+    @staticmethod
+    def getVariantClass(record):
+        return getVariantClass(record.ref, record.alts)
+
+    @staticmethod
+    def getFilters(record):
+        return record.filter.keys()
+
+
+class _GaVariantAccessor(object):
+    """
+    Reads the values tested by filter expressions from GA Variants. GA
+    Variants do not record the FILTER status, so they are treated as
+    having no FILTER.
+    """
+    @staticmethod
+    def getInfoValues(variant, key):
+        return variant.info.get(key)
+
+    @staticmethod
+    def hasInfo(variant, key):
+        return key in variant.info
+
+    @staticmethod
+    def getVariantClass(variant):
+        return getVariantClass(
+            variant.referenceBases, variant.alternateBases)
+
+    @staticmethod
+    def getFilters(variant):
+        return []
+
+
+class _FilteredGaVariantAccessor(object):
+    """
+    Reads the values tested by filter expressions from (variant,
+    filters) pairs of a GA Variant and the list of its FILTER names.
+    """
+    @staticmethod
+    def getInfoValues(pair, key):
+        return _GaVariantAccessor.getInfoValues(pair[0], key)
+
+    @staticmethod
+    def hasInfo(pair, key):
+        return _GaVariantAccessor.hasInfo(pair[0], key)
+
+    @staticmethod
+    def getVariantClass(pair):
+        return _GaVariantAccessor.getVariantClass(pair[0])
+
+    @staticmethod
+    def getFilters(pair):
+        return pair[1]
+
+
+def _tokenize(expression):
+    """
+    Returns the list of (kind, text) tokens in the specified expression.
+    """
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _tokenPattern.match(expression, position)
+        if match is None or match.end() == position:
+            raise ValueError("unexpected character at '{}'".format(
+                expression[position:].strip()))
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+class _Parser(object):
+    """
+    A recursive descent parser that compiles filter expressions into
+    predicates, which are functions of an accessor and a record.
+    """
+    def __init__(self, expression):
+        self._tokens = _tokenize(expression)
+        self._index = 0
+
+    def _peek(self):
+        if self._index < len(self._tokens):
+            return self._tokens[self._index]
+        return None, None
+
+    def _next(self):
+        token = self._peek()
+        if token[0] is None:
+            raise ValueError("unexpected end of expression")
+        self._index += 1
+        return token
+
+    def _acceptKeyword(self, keyword):
+        kind, text = self._peek()
+        if kind == "word" and text.upper() == keyword:
+            self._index += 1
+            return True
+        return False
+
+    def parse(self):
+        predicate = self._parseOr()
+        kind, text = self._peek()
+        if kind is not None:
+            raise ValueError("unexpected '{}'".format(text))
+        return predicate
+
+    def _parseOr(self):
+        predicates = [self._parseAnd()]
+        while self._acceptKeyword("OR"):
+            predicates.append(self._parseAnd())
+        if len(predicates) == 1:
+            return predicates[0]
+        return lambda accessor, record: any(
+            predicate(accessor, record) for predicate in predicates)
+
+    def _parseAnd(self):
+        predicates = [self._parseNot()]
+        while self._acceptKeyword("AND"):
+            predicates.append(self._parseNot())
+        if len(predicates) == 1:
+            return predicates[0]
+        return lambda accessor, record: all(
+            predicate(accessor, record) for predicate in predicates)
+
+    def _parseNot(self):
+        if self._acceptKeyword("NOT"):
+            predicate = self._parseNot()
+            return lambda accessor, record: not predicate(accessor, record)
+        return self._parseTest()
+
+    def _parseTest(self):
+        kind, text = self._next()
+        if kind == "paren" and text == "(":
+            predicate = self._parseOr()
+            if self._next() != ("paren", ")"):
+                raise ValueError("missing ')'")
+            return predicate
+        if kind != "word" or text.upper() in ("AND", "OR", "NOT"):
+            raise ValueError("expected a test at '{}'".format(text))
+        name = text.upper()
+        if name.startswith("INFO."):
+            return self._parseInfoTest(text[len("INFO."):])
+        elif name == "TYPE":
+            return self._parseTypeTest()
+        elif name == "FILTER":
+            return self._parseFilterTest()
+        raise ValueError("unknown field '{}'".format(text))
+
+    def _parseOperator(self, allowed):
+        kind, text = self._next()
+        if kind != "operator" or text not in allowed:
+            raise ValueError("expected one of {} at '{}'".format(
+                ", ".join(allowed), text))
+        return _operators[text]
+
+    def _parseValue(self):
+        kind, text = self._next()
+        if kind == "number":
+            return float(text)
+        elif kind == "string":
+            return text[1:-1]
+        elif kind == "word":
+            return text
+        raise ValueError("expected a value at '{}'".format(text))
+
+    def _parseInfoTest(self, key):
+        if key == "":
+            raise ValueError("missing INFO key")
+        if self._peek()[0] != "operator":
+            return lambda accessor, record: accessor.hasInfo(record, key)
+        compare = self._parseOperator(["==", "!=", "<", "<=", ">", ">="])
+        value = self._parseValue()
+        if isinstance(value, float):
+            def matches(accessor, record):
+                values = accessor.getInfoValues(record, key)
+                if values is not None:
+                    for infoValue in values:
+                        try:
+                            if compare(float(infoValue), value):
+                                return True
+                        except (TypeError, ValueError):
+                            pass
+                return False
+        else:
+            def matches(accessor, record):
+                values = accessor.getInfoValues(record, key)
+                if values is not None:
+                    for infoValue in values:
+                        if compare(str(infoValue), value):
+                            return True
+                return False
+        return matches
+
+    def _parseTypeTest(self):
+        compare = self._parseOperator(["==", "!="])
+        value = self._parseValue()
+        variantClass = str(value).upper()
+        if variantClass not in VARIANT_CLASSES:
+            raise ValueError("unknown variant class '{}'".format(value))
+        return lambda accessor, record: compare(
+            accessor.getVariantClass(record), variantClass)
+
+    def _parseFilterTest(self):
+        compare = self._parseOperator(["==", "!="])
+        value = self._parseValue()
+        if isinstance(value, float):
+            raise ValueError("FILTER names must be strings")
+        if value == ".":
+            return lambda accessor, record: compare(
+                len(accessor.getFilters(record)), 0)
+        return lambda accessor, record: compare(
+            value in accessor.getFilters(record), True)
+
+
+class VariantFilter(object):
+    """
+    A compiled variant filter expression.
+    """
+    timedBatchSize = 256
+    """
+    The number of records whose filtering times are summed before they
+    are added to the request's metrics.
+    """
+
+    def __init__(self, expression):
+        """
+        Compiles the specified filter expression. Raises a ValueError
+        if it is not valid.
+        """
+        self._expression = expression
+        self._predicate = _Parser(expression).parse()
+
+    def getExpression(self):
+        """
+        Returns the expression this filter was compiled from.
+        """
+        return self._expression
+
+    def includesRecord(self, record):
+        """
+        Returns True if the specified pysam VariantRecord is included
+        by this filter.
+        """
+        return self._predicate(_PysamRecordAccessor, record)
+
+    def includesVariant(self, gaVariant, filters=None):
+        """
+        Returns True if the specified GA Variant is included by this
+        filter. As GA Variants do not record their FILTER status, the
+        list of FILTER names may be specified separately; otherwise the
+        variant is treated as having no FILTER.
+        """
+        if filters is None:
+            return self._predicate(_GaVariantAccessor, gaVariant)
+        return self._predicate(
+            _FilteredGaVariantAccessor, (gaVariant, filters))
+
+    def filterRecords(self, records):
+        """
+        Returns an iterator over the pysam VariantRecords in the
+        specified iterable that are included by this filter. The time
+        spent evaluating the filter is recorded in the "filter" phase of
+        the current request's metrics.
+        """
+        requestMetrics = metrics.getRequestMetrics()
+        if requestMetrics is None:
+            return (
+                record for record in records
+                if self._predicate(_PysamRecordAccessor, record))
+        return self._filterRecordsTimed(records, requestMetrics)
+
+    def _filterRecordsTimed(self, records, requestMetrics):
+        """
+        Filters the specified records one at a time, so that no record is
+        read before the caller asks for it (e.g. past the end of a page).
+        The time spent evaluating the filter is summed locally and added
+        to the metrics once for each batch of timedBatchSize records, and
+        when the iteration ends.
+        """
+        predicate = self._predicate
+        clock = time.time
+        seconds = 0
+        count = 0
+        try:
+            for record in records:
+                before = clock()
+                included = predicate(_PysamRecordAccessor, record)
+                seconds += clock() - before
+                count += 1
+                if count == self.timedBatchSize:
+                    requestMetrics.addTime("filter", seconds)
+                    seconds = 0
+                    count = 0
+                if included:
+                    yield record
+        finally:
+            requestMetrics.addTime("filter", seconds)
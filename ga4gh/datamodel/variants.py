@@ -6,15 +6,31 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import bisect
+import collections
 import datetime
+import itertools
+import logging
+import multiprocessing.pool
+import os
 import random
 import hashlib
+import json
+import threading
 
+import numpy
 import pysam
 
+import ga4gh.genotypematrix as genotypematrix
 import ga4gh.protocol as protocol
 import ga4gh.exceptions as exceptions
 import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.binning as binning
+import ga4gh.datamodel.carrierindex as carrierindex
+import ga4gh.datamodel.htslibindex as htslibindex
+import ga4gh.datamodel.stats as stats
+import ga4gh.datamodel.variantdensity as variantdensity
+import ga4gh.datamodel.variantslice as variantslice
 
 
 def convertVCFPhaseset(vcfPhaseset):
@@ -47,6 +63,14 @@ def convertVCFGenotype(vcfGenotype, vcfPhaseset):
     return genotype, phaseset
 
 
+def isCarrierGenotype(genotype):
+    """
+    Returns True if the specified GA4GH genotype includes a non reference
+    allele.
+    """
+    return any(allele > 0 for allele in genotype)
+
+
 class CallSet(datamodel.DatamodelObject):
     """
     Class representing a CallSet. A CallSet basically represents the
@@ -69,6 +93,9 @@ class CallSet(datamodel.DatamodelObject):
         gaCallSet.variantSetIds = [variantSet.getId()]
         return gaCallSet
 
+    def getDataFilePaths(self):
+        return self.getParentContainer().getDataFilePaths()
+
     def getSampleName(self):
         """
         Returns the sample name for this CallSet.
@@ -149,6 +176,28 @@ class AbstractVariantSet(datamodel.DatamodelObject):
             raise exceptions.CallSetNotFoundException(id_)
         return self._callSetIdMap[id_]
 
+    def _checkCallSetIds(self, callSetIds):
+        """
+        Returns the specified list of callSetIds, or all of the
+        callSetIds in this VariantSet if it is None. Raises a
+        CallSetNotInVariantSetException if any of them is not in this
+        VariantSet.
+        """
+        if callSetIds is None:
+            return self._callSetIds
+        for callSetId in callSetIds:
+            if callSetId not in self._callSetIds:
+                raise exceptions.CallSetNotInVariantSetException(
+                    callSetId, self.getId())
+        return callSetIds
+
+    def getMetadataId(self, metadata):
+        """
+        Returns the id of a metadata
+        """
+        return str(datamodel.VariantSetMetadataCompoundId(
+                    self.getCompoundId(), 'metadata:' + metadata.key))
+
     def toProtocolElement(self):
         """
         Converts this VariantSet into its GA4GH protocol equivalent.
@@ -161,9 +210,10 @@ class AbstractVariantSet(datamodel.DatamodelObject):
         protocolElement.name = self.getLocalId()
         return protocolElement
 
-    def getNumVariants(self):
+    def getNumVariants(self, referenceName=None):
         """
-        Returns the number of variants contained in this VariantSet.
+        Returns the number of variants contained in this VariantSet, or
+        on the specified reference if referenceName is not None.
         """
         raise NotImplementedError()
 
@@ -178,15 +228,176 @@ class AbstractVariantSet(datamodel.DatamodelObject):
         ret.variantSetId = self.getId()
         return ret
 
+    def getVariantsJson(self, referenceName, startPosition, endPosition,
+                        callSetIds=None, fieldMask=None, variantFilter=None,
+                        carrierCallSetIds=None):
+        """
+        Returns an iterator over the JsonRecords of the specified
+        variants, including only the fields in the specified FieldMask
+        if it is not None. Subclasses may override this to write the
+        JSON for each variant without creating its GA Variant object.
+        """
+        if fieldMask is None:
+            fieldMask = protocol.FieldMask(protocol.Variant)
+        variants = self.getVariants(
+            referenceName, startPosition, endPosition, callSetIds,
+            variantFilter, carrierCallSetIds)
+        for variant in variants:
+            yield datamodel.JsonRecord(
+                variant.start, fieldMask.toJsonString(variant))
+
+    def getGenotypeRows(self, referenceName, startPosition, endPosition,
+                        callSetIds=None, includeLikelihoods=False):
+        """
+        Returns an iterator over the genotypematrix.GenotypeRows for the
+        specified call sets at the variants in the specified region, in
+        the order of the call set IDs. Subclasses may override this to
+        build the rows without creating the GA Variants and their calls.
+        """
+        callSetIds = self._checkCallSetIds(callSetIds)
+        gaVariants = self.getVariants(
+            referenceName, startPosition, endPosition, callSetIds)
+        for gaVariant in gaVariants:
+            yield genotypematrix.GenotypeRow.fromGaVariant(
+                gaVariant, callSetIds, includeLikelihoods)
+
+    def getVariantsById(self, compoundIds):
+        """
+        Returns the list of the GA Variants with the specified compound
+        IDs, in the same order, with None for each ID that does not
+        identify a variant in this variant set. Subclasses may override
+        this to read many variants together.
+        """
+        gaVariants = []
+        for compoundId in compoundIds:
+            try:
+                gaVariants.append(self.getVariant(compoundId))
+            except exceptions.ObjectNotFoundException:
+                gaVariants.append(None)
+        return gaVariants
+
+    def getCarrierCallSetIds(self, compoundId):
+        """
+        Returns the list of the IDs of the call sets whose genotypes
+        include a non reference allele of the variant with the specified
+        compound ID. Subclasses with an index of the carriers may
+        override this to answer without building the variant.
+        """
+        gaVariant = self.getVariant(compoundId)
+        return [
+            call.callSetId for call in gaVariant.calls
+            if isCarrierGenotype(call.genotype)]
+
+    def getReferenceNames(self):
+        """
+        Returns the sorted list of the names of the contigs that have
+        variants in this variant set, which is empty if they are not
+        known.
+        """
+        return []
+
+    def getReferenceRange(self, referenceName):
+        """
+        Returns the (start, end) pair of the region of the specified
+        contig covered by the variants in this variant set, or None if
+        it is not known.
+        """
+        return None
+
+    def getDataDir(self):
+        """
+        Returns the directory this variant set is read from, or None if
+        it is not read from a directory.
+        """
+        return None
+
+    def getVariantFileSlicers(self, referenceName, start, end):
+        """
+        Returns the list of the VariantFileSlicers of the data files
+        holding the variants of the specified region, in order of
+        position (see variantslice), or None if this variant set is not
+        read from indexed VCF or BCF files.
+        """
+        return None
+
+    def getVariantDensity(self, referenceName, start, end, maxBins):
+        """
+        Returns the triple (binSize, firstBin, counts) describing the
+        density of the variants in the specified region in about maxBins
+        bins, where counts is the array of the numbers of variants
+        starting in each of the consecutive bins of binSize bases from
+        firstBin that cover the region, indexed by bin, variant class and
+        allele frequency class (see variantdensity). If there is a
+        density index, the bin size is a multiple of the index bin size
+        that best fits the region, and the counts are read from the
+        index; otherwise they are counted from the variants.
+        """
+        binSize = max(1, -(-(end - start) // maxBins))
+        densityIndex = self._getDensityIndex()
+        if densityIndex is not None:
+            indexBinSize = binning.getPrecomputedBinSize(
+                densityIndex.getBinSizes(), binSize)
+            factor = -(-binSize // indexBinSize)
+            binSize = indexBinSize * factor
+        firstBin = start // binSize
+        lastBin = -(-end // binSize)
+        if densityIndex is not None:
+            counts = densityIndex.getBinCounts(
+                referenceName, indexBinSize, firstBin * factor,
+                lastBin * factor)
+            counts = counts.reshape(
+                (lastBin - firstBin, factor) + counts.shape[1:]).sum(axis=1)
+        else:
+            starts = []
+            categories = []
+            for gaVariant in self.getVariants(
+                    referenceName, firstBin * binSize, lastBin * binSize,
+                    []):
+                starts.append(gaVariant.start)
+                categories.append(variantdensity.getCategory(
+                    gaVariant.referenceBases, gaVariant.alternateBases,
+                    gaVariant.info.get("AF")))
+            counts = variantdensity.getEmptyCounts(lastBin - firstBin)
+            variantdensity.addSiteCounts(
+                counts, firstBin, binSize, starts, categories)
+        return binSize, firstBin, counts
+
+    def _getDensityIndex(self):
+        """
+        Returns the VariantDensityIndex of this variant set, or None if
+        it has none.
+        """
+        return None
+
+    def _includesCarriers(self, gaVariant, carrierCallSetIds):
+        """
+        Returns True if each of the specified call sets carries a non
+        reference allele in the calls of the specified GA Variant.
+        """
+        carriers = set(
+            call.callSetId for call in gaVariant.calls
+            if isCarrierGenotype(call.genotype))
+        return all(
+            callSetId in carriers for callSetId in carrierCallSetIds)
+
     def getVariantId(self, gaVariant):
         """
         Returns an ID string suitable for the specified GA Variant
         object in this variant set.
         """
-        md5 = self.hashVariant(gaVariant)
+        return self.getVariantIdFor(
+            gaVariant.referenceName, gaVariant.start,
+            gaVariant.referenceBases, gaVariant.alternateBases)
+
+    def getVariantIdFor(
+            self, referenceName, start, referenceBases, alternateBases):
+        """
+        Returns the ID string for the variant with the specified fields
+        in this variant set.
+        """
+        md5 = self.hashBases(referenceBases, alternateBases)
         compoundId = datamodel.VariantCompoundId(
-            self.getCompoundId(), gaVariant.referenceName,
-            gaVariant.start, md5)
+            self.getCompoundId(), referenceName, start, md5)
         return str(compoundId)
 
     def getCallSetId(self, sampleName):
@@ -204,9 +415,13 @@ class AbstractVariantSet(datamodel.DatamodelObject):
         Produces an MD5 hash of the ga variant object to uniquely
         identify it
         """
+        return cls.hashBases(
+            gaVariant.referenceBases, gaVariant.alternateBases)
+
+    @classmethod
+    def hashBases(cls, referenceBases, alternateBases):
         return hashlib.md5(
-            gaVariant.referenceBases +
-            str(tuple(gaVariant.alternateBases))).hexdigest()
+            referenceBases + str(tuple(alternateBases))).hexdigest()
 
 
 class SimulatedVariantSet(AbstractVariantSet):
@@ -227,7 +442,7 @@ class SimulatedVariantSet(AbstractVariantSet):
         self._creationTime = now
         self._updatedTime = now
 
-    def getNumVariants(self):
+    def getNumVariants(self, referenceName=None):
         return 0
 
     def getMetadata(self):
@@ -244,15 +459,23 @@ class SimulatedVariantSet(AbstractVariantSet):
         return variant
 
     def getVariants(self, referenceName, startPosition, endPosition,
-                    callSetIds=None):
+                    callSetIds=None, variantFilter=None,
+                    carrierCallSetIds=None):
+        if carrierCallSetIds:
+            carrierCallSetIds = self._checkCallSetIds(carrierCallSetIds)
         randomNumberGenerator = random.Random()
         randomNumberGenerator.seed(self._randomSeed)
         i = startPosition
         while i < endPosition:
             if randomNumberGenerator.random() < self._variantDensity:
                 randomNumberGenerator.seed(self._randomSeed + i)
-                yield self.generateVariant(
+                variant = self.generateVariant(
                     referenceName, i, randomNumberGenerator)
+                if ((variantFilter is None or
+                        variantFilter.includesVariant(variant)) and
+                        (not carrierCallSetIds or self._includesCarriers(
+                            variant, carrierCallSetIds))):
+                    yield variant
             i += 1
 
     def generateVariant(self, referenceName, position, randomNumberGenerator):
@@ -306,18 +529,204 @@ def isEmptyIter(it):
     return next(it, _nothing) is _nothing
 
 
+class HtslibVariantJsonWriter(object):
+    """
+    Writes the JSON representation of the GA4GH Variants for pysam
+    variant records from a HtslibVariantSet, without creating the
+    Variants. This is identical to the JSON of the Variants returned by
+    the variant set's convertVariant method. A writer is created for
+    each search, so that the fields that are the same for every variant
+    and call are encoded only once. If a FieldMask for Variants is
+    specified, only the fields it includes are computed and written.
+    """
+    def __init__(self, variantSet, callSetIds, fieldMask=None):
+        self._variantSet = variantSet
+        self._callSetIds = set(callSetIds)
+        if fieldMask is None:
+            fieldMask = protocol.FieldMask(protocol.Variant)
+        self._includedFields = fieldMask.getIncludedFieldNames()
+        self._variantTemplate = protocol.JsonObjectTemplate(
+            protocol.Variant, {
+                "created": variantSet.getCreationTime(),
+                "updated": variantSet.getUpdatedTime(),
+                "variantSetId": variantSet.getId(),
+            }, fieldMask)
+        self._callMask = fieldMask.getSubmask("calls")
+        callFields = self._callMask.getIncludedFieldNames()
+        self._includeGenotype = bool(
+            callFields & set(["genotype", "phaseset"]))
+        self._includeCallValues = bool(
+            callFields & set(["genotypeLikelihood", "info"]))
+        self._callTemplates = {}
+
+    def _getCallTemplate(self, sampleName):
+        """
+        Returns the pair (callSetId, template) for the calls of the
+        specified sample, where template is the JsonObjectTemplate for
+        these calls with the call set fields filled in.
+        """
+        if sampleName not in self._callTemplates:
+            variantSet = self._variantSet
+            callSet = variantSet.getCallSet(
+                variantSet.getCallSetId(sampleName))
+            template = protocol.JsonObjectTemplate(
+                protocol.Call, {
+                    "callSetId": callSet.getId(),
+                    "callSetName": callSet.getSampleName(),
+                }, self._callMask)
+            self._callTemplates[sampleName] = callSet.getId(), template
+        return self._callTemplates[sampleName]
+
+    def _getJsonCalls(self, record):
+        """
+        Returns the JSON encoded list of the calls in the specified
+        record for our callSetIds.
+        """
+        calls = []
+        sampleData = None
+        if self._includeGenotype:
+            sampleData = record.__str__().split()[9:]
+        sampleIterator = 0
+        for name, pysamCall in record.samples.iteritems():
+            callSetId, callTemplate = self._getCallTemplate(name)
+            if callSetId in self._callSetIds:
+                values = {}
+                if self._includeGenotype:
+                    genotypeData = sampleData[sampleIterator].split(":")[0]
+                    genotype, phaseset = convertVCFGenotype(
+                        genotypeData, None)
+                    values["genotype"] = json.dumps(genotype)
+                    values["phaseset"] = protocol.encodeJsonString(phaseset)
+                if self._includeCallValues:
+                    # The info dictionary is built in the same way as in
+                    # convertVariant, so that its keys are written in
+                    # the same order.
+                    genotypeLikelihood = []
+                    info = {}
+                    for key, value in pysamCall.iteritems():
+                        if key == 'GL' and value is not None:
+                            genotypeLikelihood = list(value)
+                        elif key != 'GT':
+                            info[key] = _encodeValue(value)
+                    values["genotypeLikelihood"] = json.dumps(
+                        genotypeLikelihood)
+                    values["info"] = json.dumps(info)
+                calls.append(callTemplate.fill(values))
+            sampleIterator += 1
+        return "[{}]".format(", ".join(calls))
+
+    def toJsonString(self, record):
+        """
+        Returns the JSON representation of the GA4GH Variant for the
+        specified pysam variant record.
+        """
+        encodeString = protocol.encodeJsonString
+        included = self._includedFields
+        values = {}
+        values["referenceName"] = encodeString(record.contig)
+        if "names" in included:
+            names = []
+            if record.id is not None:
+                names = record.id.split(';')
+            values["names"] = json.dumps(names)
+        start = record.start
+        values["start"] = start
+        values["end"] = record.stop
+        referenceBases = record.ref
+        values["referenceBases"] = encodeString(referenceBases)
+        alternateBases = []
+        if record.alts is not None:
+            alternateBases = list(record.alts)
+        values["alternateBases"] = json.dumps(alternateBases)
+        if "info" in included:
+            # As for calls, the dictionary must be built in the same way
+            # as in convertVariant.
+            info = {}
+            for key, value in record.info.iteritems():
+                if value is not None:
+                    info[key] = _encodeValue(value)
+            values["info"] = json.dumps(info)
+        if "calls" in included:
+            values["calls"] = self._getJsonCalls(record)
+        if "id" in included:
+            values["id"] = encodeString(self._variantSet.getVariantIdFor(
+                record.contig, start, referenceBases, alternateBases))
+        return self._variantTemplate.fill(values)
+
+
+class VariantFileShard(object):
+    """
+    The records for one contig in one of the data files of a variant set.
+    The shard covers the region from the start of its first record to the
+    end of the record that ends last.
+    """
+    def __init__(self, filename, firstStart, lastStart, end):
+        self.filename = filename
+        self.firstStart = firstStart
+        self.lastStart = lastStart
+        self.end = end
+
+    def overlaps(self, start, end):
+        """
+        Returns True if records in this shard may overlap the specified
+        region.
+        """
+        return self.firstStart < end and start < self.end
+
+    def overlapsShard(self, other):
+        """
+        Returns True if the start positions of the records in this shard
+        are interleaved with those of the specified shard, so that the
+        records of the two cannot be returned in order one after the
+        other. Shards may share the position at which one ends and the
+        other begins, where the records repeated in both are only
+        returned once (see _chainShardRecords).
+        """
+        return (self.firstStart < other.lastStart and
+                other.firstStart < self.lastStart)
+
+
 class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
     """
     Class representing a single variant set backed by a directory of indexed
-    VCF or BCF files.
+    VCF or BCF files. Each contig may be split over many files, as long as
+    the records in each of them follow on from those in the previous one.
+    The directory may also hold a carrier index (see carrierindex), which
+    is used to select the records carried by a set of call sets, and a
+    density index (see variantdensity), which is built in the background
+    by the densityIndexBuilder when the density of the variants is first
+    requested.
+    """
+    carrierRunGap = 64
+    """
+    Carrier records whose rows in the carrier index are at most this far
+    apart are read with a single fetch.
     """
+    variantBatchGap = 1000
+    """
+    Variants requested together whose start positions are at most this
+    far apart are read with a single fetch.
+    """
+
     def __init__(self, parentContainer, localId, dataDir, backend):
         super(HtslibVariantSet, self).__init__(parentContainer, localId)
         self._dataDir = dataDir
         self._setAccessTimes(dataDir)
-        self._chromFileMap = {}
+        # Maps each contig to the list of its VariantFileShards, in order
+        # of position.
+        self._chromShardMap = {}
         self._metadata = None
         self._scanDataFiles(dataDir, ['*.bcf', '*.vcf.gz'])
+        for filename in self.getDataFileNames():
+            stats.statsEngine.requestStats(
+                filename, stats.computeVariantFileStats)
+        self._carrierIndex = carrierindex.load(
+            dataDir, self.getDataFileNames())
+        self._densityIndex = variantdensity.VariantDensityIndex.load(
+            dataDir, self.getDataFileNames())
+        # Maps each data file to its VariantFileSlicer, which is created
+        # when it is first needed.
+        self._variantFileSlicers = {}
 
     def _updateMetadata(self, variantFile):
         """
@@ -333,12 +742,42 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
                 raise exceptions.InconsistentMetaDataException(
                     variantFile.filename)
 
-    def getNumVariants(self):
+    def getNumVariants(self, referenceName=None):
         """
-        Returns the total number of variants in this VariantSet.
+        Returns the total number of variants in this VariantSet, or on
+        the specified reference if referenceName is not None. Returns
+        None if the precomputed variant counts are not available.
         """
-        # TODO How do we get the number of records in a VariantFile?
-        return 0
+        if referenceName is None:
+            referenceNames = self._chromShardMap.keys()
+        elif referenceName in self._chromShardMap:
+            referenceNames = [referenceName]
+        else:
+            return 0
+        numVariants = 0
+        for chrom in referenceNames:
+            for shard in self._chromShardMap[chrom]:
+                dataFileStats = stats.statsEngine.getStats(shard.filename)
+                if dataFileStats is None:
+                    return None
+                numVariants += dataFileStats.getValues().get(chrom, 0)
+        return numVariants
+
+    def getDataFilePaths(self):
+        paths = [self._dataDir] + self.getDataFileNames()
+        if self._carrierIndex is not None:
+            paths.extend(self._carrierIndex.getFilePaths())
+        if self._densityIndex is not None:
+            paths.extend(self._densityIndex.getFilePaths(self._dataDir))
+        return paths
+
+    def getDataFileNames(self):
+        """
+        Returns the sorted list of the data files in this variant set.
+        """
+        return sorted(set(
+            shard.filename for shards in self._chromShardMap.values()
+            for shard in shards))
 
     def _updateCallSetIds(self, variantFile):
         """
@@ -364,20 +803,102 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         varFile = self.openFile(filename)
         if varFile.index is None:
             raise exceptions.NotIndexedException(filename)
+        binExtents = self._getBinExtents(filename, varFile)
         for chrom in varFile.index:
             # Unlike Tabix indices, CSI indices include all contigs defined
             # in the BCF header.  Thus we must test each one to see if
             # records exist or else they are likely to trigger spurious
             # overlapping errors.
+            binExtent = None
+            if binExtents is not None:
+                binExtent = binExtents.get(chrom)
+                if binExtent is None:
+                    continue
             chrom, _, _ = self.sanitizeVariantFileFetch(chrom)
-            if not isEmptyIter(varFile.fetch(chrom)):
-                if chrom in self._chromFileMap:
-                    raise exceptions.OverlappingVcfException(filename, chrom)
+            shard = self._getShard(varFile, filename, chrom, binExtent)
+            if shard is not None:
+                self._addShard(chrom, shard)
                 self._updateMetadata(varFile)
                 self._updateCallSetIds(varFile)
-                self._chromFileMap[chrom] = filename
         varFile.close()
 
+    def _getBinExtents(self, filename, varFile):
+        """
+        Returns a dictionary mapping the contigs in the index of the
+        specified file to their htslibindex.BinExtents, or None if the
+        index cannot be found.
+        """
+        indexFilePath = htslibindex.getIndexFilePath(filename)
+        if indexFilePath is None:
+            return None
+        index = htslibindex.HtslibIndex.parse(indexFilePath)
+        referenceNames = index.getReferenceNames()
+        if referenceNames is None:
+            referenceNames = list(varFile.header.contigs)
+        if len(referenceNames) != index.getNumReferences():
+            return None
+        return dict(
+            (referenceName, index.getBinExtent(referenceIndex))
+            for referenceIndex, referenceName in enumerate(referenceNames))
+
+    def _getShard(self, varFile, filename, chrom, binExtent):
+        """
+        Returns the VariantFileShard for the records of the specified
+        contig in the specified file, or None if there are none. Only
+        the first record and the records in the last bin of the index
+        are read to find the region that the shard covers.
+        """
+        firstRecord = next(varFile.fetch(chrom), None)
+        if firstRecord is None:
+            return None
+        tailStart = 0
+        if binExtent is not None:
+            # Every record that ends after the start of the last bin is
+            # returned by a fetch from there, so this finds the last start
+            # and the greatest end of the records.
+            tailStart = binExtent.maxBinStart
+        lastStart = firstRecord.start
+        end = firstRecord.stop
+        for record in varFile.fetch(chrom, tailStart):
+            lastStart = max(lastStart, record.start)
+            end = max(end, record.stop)
+        return VariantFileShard(filename, firstRecord.start, lastStart, end)
+
+    def _addShard(self, chrom, shard):
+        """
+        Adds the specified shard to the routing table for the specified
+        contig. Raises an OverlappingVcfException if it overlaps any
+        of the contig's existing shards.
+        """
+        shards = self._chromShardMap.setdefault(chrom, [])
+        for other in shards:
+            if shard.overlapsShard(other):
+                raise exceptions.OverlappingVcfException(
+                    shard.filename, chrom)
+        index = bisect.bisect(
+            [(other.firstStart, other.lastStart) for other in shards],
+            (shard.firstStart, shard.lastStart))
+        shards.insert(index, shard)
+
+    def _getOverlappingShards(self, referenceName, start, end):
+        """
+        Returns the list of shards of the specified contig that overlap
+        the specified region, in order of position.
+        """
+        return [
+            shard for shard in self._chromShardMap.get(referenceName, [])
+            if shard.overlaps(start, end)]
+
+    def _fetchShards(self, shards, referenceName, start, end):
+        """
+        Returns an iterator over the records in the specified region
+        from each of the specified shards in turn. Each shard's file is
+        only opened once the records of the previous one are exhausted.
+        """
+        return _fetchShardRecords(
+            (self.getFileHandle(shard.filename) for shard in shards),
+            referenceName, start, end)
+
     def _convertGaCall(self, recordId, name, pysamCall, genotypeData):
         compoundId = self.getCallSetId(name)
         callSet = self.getCallSet(compoundId)
@@ -448,15 +969,13 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         return variant
 
     def getVariant(self, compoundId):
-        if compoundId.referenceName in self._chromFileMap:
-            varFileName = self._chromFileMap[compoundId.referenceName]
-        else:
+        if compoundId.referenceName not in self._chromShardMap:
             raise exceptions.ObjectNotFoundException(compoundId)
         start = int(compoundId.start)
         referenceName, startPosition, endPosition = \
             self.sanitizeVariantFileFetch(
                 compoundId.referenceName, start, start + 1)
-        cursor = self.getFileHandle(varFileName).fetch(
+        cursor = self.getPysamRecords(
             referenceName, startPosition, endPosition)
         for record in cursor:
             variant = self.convertVariant(record, self._callSetIds)
@@ -467,38 +986,354 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
                 raise exceptions.ObjectNotFoundException()
         raise exceptions.ObjectNotFoundException(compoundId)
 
+    def getVariantsById(self, compoundIds):
+        """
+        Returns the list of the GA Variants with the specified compound
+        IDs, in the same order, with None for each ID that does not
+        identify a variant in this variant set. The requested variants
+        of each contig are sorted by position and split into runs, and
+        the records of each run are read with a single fetch, in which
+        only the requested records are converted.
+        """
+        gaVariants = [None] * len(compoundIds)
+        # Maps each contig to the list of the (start, md5, index) triples
+        # of the variants requested on it.
+        requested = collections.defaultdict(list)
+        for index, compoundId in enumerate(compoundIds):
+            if compoundId.referenceName not in self._chromShardMap:
+                continue
+            try:
+                start = int(compoundId.start)
+            except ValueError:
+                continue
+            requested[compoundId.referenceName].append(
+                (start, compoundId.md5, index))
+        for referenceName, triples in requested.items():
+            triples.sort()
+            runStart = 0
+            for index in range(1, len(triples) + 1):
+                if (index == len(triples) or
+                        triples[index][0] - triples[index - 1][0] >
+                        self.variantBatchGap):
+                    self._fetchVariantRun(
+                        referenceName, triples[runStart:index], gaVariants)
+                    runStart = index
+        return gaVariants
+
+    def _fetchVariantRun(self, referenceName, triples, gaVariants):
+        """
+        Reads the records of the specified contig from the first to the
+        last of the specified sorted (start, md5, index) triples with a
+        single fetch, and stores the GA Variant of each of the records
+        they identify in gaVariants at its index.
+        """
+        indexes = collections.defaultdict(list)
+        for start, md5, index in triples:
+            indexes[(start, md5)].append(index)
+        start = triples[0][0]
+        end = triples[-1][0] + 1
+        for record in self.getPysamRecords(referenceName, start, end):
+            if record.start < start:
+                continue
+            alternateBases = []
+            if record.alts is not None:
+                alternateBases = list(record.alts)
+            key = (record.start, self.hashBases(record.ref, alternateBases))
+            if key in indexes:
+                gaVariant = self.convertVariant(record, self._callSetIds)
+                for index in indexes.pop(key):
+                    gaVariants[index] = gaVariant
+            if len(indexes) == 0:
+                break
+
     def getVariants(self, referenceName, startPosition, endPosition,
-                    callSetIds=None):
+                    callSetIds=None, variantFilter=None,
+                    carrierCallSetIds=None):
         """
         Returns an iterator over the specified variants. The parameters
         correspond to the attributes of a GASearchVariantsRequest object.
+        If a VariantFilter is specified, only the records it includes
+        are converted. If carrierCallSetIds are specified, only the
+        records in which each of these call sets carries a non reference
+        allele are converted.
         """
-        if callSetIds is None:
-            callSetIds = self._callSetIds
+        callSetIds = self._checkCallSetIds(callSetIds)
+        records = self.getPysamRecords(
+            referenceName, startPosition, endPosition, variantFilter,
+            carrierCallSetIds)
+        for record in records:
+            yield self.convertVariant(record, callSetIds)
+
+    def getVariantsWithFilters(
+            self, referenceName, startPosition, endPosition,
+            callSetIds=None, carrierCallSetIds=None):
+        """
+        Returns an iterator over the (gaVariant, filters) pairs for the
+        specified variants, where filters is the list of the FILTER
+        names of the record, which GA Variants do not record. This
+        allows a VariantFilter to be applied once the variants of
+        several files have been merged.
+        """
+        callSetIds = self._checkCallSetIds(callSetIds)
+        records = self.getPysamRecords(
+            referenceName, startPosition, endPosition, None,
+            carrierCallSetIds)
+        for record in records:
+            yield (
+                self.convertVariant(record, callSetIds),
+                list(record.filter.keys()))
+
+    def getVariantsJson(self, referenceName, startPosition, endPosition,
+                        callSetIds=None, fieldMask=None, variantFilter=None,
+                        carrierCallSetIds=None):
+        callSetIds = self._checkCallSetIds(callSetIds)
+        records = self.getPysamRecords(
+            referenceName, startPosition, endPosition, variantFilter,
+            carrierCallSetIds)
+        toJsonString = HtslibVariantJsonWriter(
+            self, callSetIds, fieldMask).toJsonString
+        for record in records:
+            yield datamodel.JsonRecord(record.start, toJsonString(record))
+
+    def getGenotypeRows(self, referenceName, startPosition, endPosition,
+                        callSetIds=None, includeLikelihoods=False):
+        """
+        Returns an iterator over the genotypematrix.GenotypeRows for the
+        specified call sets, which are parsed from the text of the
+        sample columns of each record without building its calls.
+        """
+        callSetIds = self._checkCallSetIds(callSetIds)
+        if referenceName not in self._chromShardMap:
+            return
+        referenceName, startPosition, endPosition = \
+            self.sanitizeVariantFileFetch(
+                referenceName, startPosition, endPosition)
+        shards = self._getOverlappingShards(
+            referenceName, startPosition, endPosition)
+
+        def getShardRecords():
+            for shard in shards:
+                varFile = self.getFileHandle(shard.filename)
+                # The samples may be in a different order in each file.
+                samples = list(varFile.header.samples)
+                columns = [
+                    samples.index(
+                        self.getCallSet(callSetId).getSampleName())
+                    for callSetId in callSetIds]
+                yield columns, varFile.fetch(
+                    referenceName, startPosition, endPosition)
+        for columns, record in _chainShardRecords(getShardRecords()):
+            yield self._convertGenotypeRow(
+                record, columns, includeLikelihoods)
+
+    def _convertGenotypeRow(self, record, columns, includeLikelihoods):
+        """
+        Returns the GenotypeRow for the samples in the specified columns
+        of the specified pysam record. The genotypes are parsed in the
+        same way as in convertVariant.
+        """
+        fields = record.__str__().split()
+        sampleData = fields[9:]
+        likelihoodIndex = None
+        if includeLikelihoods and len(fields) > 8:
+            formatKeys = fields[8].split(":")
+            if "GL" in formatKeys:
+                likelihoodIndex = formatKeys.index("GL")
+        genotypes = []
+        phased = []
+        likelihoods = []
+        for column in columns:
+            values = sampleData[column].split(":")
+            genotype, phaseset = convertVCFGenotype(values[0], None)
+            genotypes.append(genotype)
+            phased.append(phaseset is not None)
+            likelihood = []
+            if likelihoodIndex is not None and likelihoodIndex < len(values):
+                likelihood = [
+                    numpy.nan if value == "." else float(value)
+                    for value in values[likelihoodIndex].split(",")]
+            likelihoods.append(likelihood)
+        if includeLikelihoods:
+            likelihoods = genotypematrix.toPaddedArray(
+                likelihoods, numpy.nan, numpy.float32)
         else:
-            for callSetId in callSetIds:
-                if callSetId not in self._callSetIds:
-                    raise exceptions.CallSetNotInVariantSetException(
-                        callSetId, self.getId())
-        if referenceName in self._chromFileMap:
-            varFileName = self._chromFileMap[referenceName]
+            likelihoods = None
+        alternateBases = []
+        if record.alts is not None:
+            alternateBases = list(record.alts)
+        return genotypematrix.GenotypeRow(
+            self.getVariantIdFor(
+                record.contig, record.start, record.ref, alternateBases),
+            record.start, record.stop, record.ref, alternateBases,
+            genotypematrix.toPaddedArray(
+                genotypes, genotypematrix.PADDING_ALLELE, numpy.int16),
+            numpy.array(phased, dtype=numpy.bool_), likelihoods)
+
+    def getPysamRecords(self, referenceName, startPosition, endPosition,
+                        variantFilter=None, carrierCallSetIds=None):
+        """
+        Returns an iterator over the pysam records for the variants in
+        the specified region that are included by the specified
+        VariantFilter, and are carried by each of the specified call
+        sets. The records come from the shards of the contig that
+        overlap the region, one after the other. If there is a carrier
+        index, only the records it selects are read.
+        """
+        carrierSampleNames = []
+        if carrierCallSetIds:
+            carrierSampleNames = [
+                self.getCallSet(callSetId).getSampleName() for callSetId in
+                self._checkCallSetIds(carrierCallSetIds)]
+        if referenceName in self._chromShardMap:
             referenceName, startPosition, endPosition = \
                 self.sanitizeVariantFileFetch(
                     referenceName, startPosition, endPosition)
-            cursor = self.getFileHandle(varFileName).fetch(
-                referenceName, startPosition, endPosition)
-            for record in cursor:
-                yield self.convertVariant(record, callSetIds)
+            if len(carrierSampleNames) == 0:
+                shards = self._getOverlappingShards(
+                    referenceName, startPosition, endPosition)
+                records = self._fetchShards(
+                    shards, referenceName, startPosition, endPosition)
+            elif self._carrierIndex is not None:
+                records = self._fetchCarrierRecords(
+                    referenceName, startPosition, endPosition,
+                    carrierSampleNames)
+            else:
+                shards = self._getOverlappingShards(
+                    referenceName, startPosition, endPosition)
+                records = self._filterCarrierRecords(
+                    self._fetchShards(
+                        shards, referenceName, startPosition, endPosition),
+                    carrierSampleNames)
+            if variantFilter is not None:
+                records = variantFilter.filterRecords(records)
+            return records
+        return iter([])
 
-    def getMetadata(self):
-        return self._metadata
+    def _filterCarrierRecords(self, records, sampleNames):
+        """
+        Returns an iterator over the specified records in which each of
+        the specified samples carries a non reference allele.
+        """
+        for record in records:
+            samples = record.samples
+            if all(isCarrierGenotype(
+                    allele for allele in samples[name].allele_indices
+                    if allele is not None) for name in sampleNames):
+                yield record
 
-    def getMetadataId(self, metadata):
+    def _fetchCarrierRecords(self, referenceName, start, end, sampleNames):
         """
-        Returns the id of a metadata
+        Returns an iterator over the records in the specified region
+        that the carrier index selects for the specified samples. The
+        selected rows are split into runs, and the records of each run
+        are read with a single fetch, in which each record is identified
+        by its start position and the number of records before it with
+        the same start.
         """
-        return str(datamodel.VariantSetMetadataCompoundId(
-                    self.getCompoundId(), 'metadata:' + metadata.key))
+        rows = self._carrierIndex.getCarrierRows(
+            referenceName, start, end, sampleNames)
+        runStart = 0
+        for index in range(1, len(rows) + 1):
+            if (index == len(rows) or
+                    rows[index] - rows[index - 1] > self.carrierRunGap):
+                selected = set(
+                    self._carrierIndex.getRowStart(referenceName, row)
+                    for row in rows[runStart:index])
+                for record in self._fetchRun(referenceName, selected):
+                    yield record
+                runStart = index
+
+    def _fetchRun(self, referenceName, selected):
+        """
+        Returns an iterator over the records of the specified contig
+        identified by the specified set of (start, ordinal) pairs.
+        """
+        starts = [start for start, _ in selected]
+        start = min(starts)
+        end = max(starts) + 1
+        shards = self._getOverlappingShards(referenceName, start, end)
+        ordinal = 0
+        previousStart = None
+        for record in self._fetchShards(shards, referenceName, start, end):
+            if record.start < start:
+                continue
+            if record.start == previousStart:
+                ordinal += 1
+            else:
+                ordinal = 0
+                previousStart = record.start
+            if (record.start, ordinal) in selected:
+                yield record
+
+    def getCarrierCallSetIds(self, compoundId):
+        if self._carrierIndex is None:
+            return super(HtslibVariantSet, self).getCarrierCallSetIds(
+                compoundId)
+        sampleNames = self._carrierIndex.getCarrierSampleNames(
+            compoundId.referenceName, int(compoundId.start), compoundId.md5)
+        if sampleNames is None:
+            raise exceptions.ObjectNotFoundException(compoundId)
+        return [self.getCallSetId(sampleName) for sampleName in sampleNames]
+
+    def _getDensityIndex(self):
+        """
+        Returns the density index of this variant set, or None if it is
+        not available yet. If there is no index, or the data files have
+        changed since it was built, it is built in the background by the
+        densityIndexBuilder, and the variants are counted until then.
+        """
+        densityIndex = self._densityIndex
+        if (densityIndex is None or
+                not densityIndex.isCurrent(self.getDataFileNames())):
+            contigFileNames = dict(
+                (referenceName, [shard.filename for shard in shards])
+                for referenceName, shards in self._chromShardMap.items())
+            densityIndex = densityIndexBuilder.getIndex(
+                self._dataDir, self.getDataFileNames(), contigFileNames)
+            self._densityIndex = densityIndex
+        return densityIndex
+
+    def getReferenceNames(self):
+        """
+        Returns the sorted list of the names of the contigs that have
+        variants in this variant set.
+        """
+        return sorted(self._chromShardMap.keys())
+
+    def getReferenceRange(self, referenceName):
+        shards = self._chromShardMap.get(referenceName)
+        if not shards:
+            return 0, 0
+        return shards[0].firstStart, max(shard.end for shard in shards)
+
+    def getDataDir(self):
+        return self._dataDir
+
+    def getVariantFileSlicers(self, referenceName, start, end):
+        """
+        Returns the VariantFileSlicers of the shards of the specified
+        contig overlapping the specified region, or of the first data
+        file if there are none, so that a slice always has a header. A
+        slicer is read again whenever its file or index changes.
+        """
+        if end is None:
+            end = self.vcfMax
+        filenames = [
+            shard.filename for shard in self._getOverlappingShards(
+                referenceName, start, end)]
+        if len(filenames) == 0:
+            filenames = self.getDataFileNames()[:1]
+        slicers = []
+        for filename in filenames:
+            slicer = self._variantFileSlicers.get(filename)
+            if slicer is None or not slicer.isCurrent():
+                slicer = variantslice.VariantFileSlicer(filename)
+                self._variantFileSlicers[filename] = slicer
+            slicers.append(slicer)
+        return slicers
+
+    def getMetadata(self):
+        return self._metadata
 
     def _getMetadataFromVcf(self, varFile):
         # All the metadata is available via each varFile.header, including:
@@ -547,3 +1382,531 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
                         number="{}".format(value.number),
                         description=description))
         return ret
+
+
+class ShardFetcher(object):
+    """
+    Fetches from the sample shards of variant sets concurrently, using a
+    pool of threads shared by all of them. The threads spend most of
+    their time in htslib reading and decompressing records. If the
+    number of threads is zero, the shards are read one after the other.
+    """
+    def __init__(self):
+        self._numThreads = 4
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def setNumThreads(self, numThreads):
+        """
+        Sets the number of threads used to fetch from sample shards.
+        """
+        if numThreads < 0:
+            raise ValueError(
+                "The number of threads must be a non-negative value")
+        self.close()
+        self._numThreads = numThreads
+
+    def map(self, function, items):
+        """
+        Returns the list of the results of calling the specified function
+        on each of the specified items, calling it concurrently if there
+        is more than one.
+        """
+        items = list(items)
+        if self._numThreads == 0 or len(items) <= 1:
+            return [function(item) for item in items]
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.pool.ThreadPool(
+                    self._numThreads)
+            pool = self._pool
+        return pool.map(function, items)
+
+    def close(self):
+        """
+        Shuts down the threads.
+        """
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+# The threads that fetch from sample shards
+shardFetcher = ShardFetcher()
+
+
+def _chainShardRecords(shardRecords):
+    """
+    Returns an iterator over the (key, record) pairs for the records in
+    the specified iterable of (key, records) pairs for the consecutive
+    shards of a contig, in turn. Adjacent shards may both hold records
+    at the position where one ends and the next begins; the records
+    there that exactly repeat those of the previous shard are dropped,
+    so that each record is returned once.
+    """
+    lastStart = None
+    lastRecords = []
+    for key, records in shardRecords:
+        boundaryStart = lastStart
+        boundaryRecords = lastRecords
+        boundaryTexts = None
+        for record in records:
+            if record.start == boundaryStart:
+                if boundaryTexts is None:
+                    boundaryTexts = set(
+                        str(other) for other in boundaryRecords)
+                if str(record) in boundaryTexts:
+                    continue
+            if record.start != lastStart:
+                lastStart = record.start
+                lastRecords = []
+            lastRecords.append(record)
+            yield key, record
+
+
+def _fetchShardRecords(variantFiles, referenceName, start, end):
+    """
+    Returns an iterator over the records in the specified region from
+    the pysam VariantFiles of each of the shards of a contig in turn,
+    which may be given by a generator, so that each file is only opened
+    once the records of the previous one are exhausted.
+    """
+    shardRecords = (
+        (None, variantFile.fetch(referenceName, start, end))
+        for variantFile in variantFiles)
+    for _, record in _chainShardRecords(shardRecords):
+        yield record
+
+
+def _buildDensityIndex(dataFilePaths, contigFileNames):
+    """
+    Builds the VariantDensityIndex of the variant set with the specified
+    data files in a worker process, reading the records of each contig
+    from the data files of its shards listed in the specified dictionary
+    through handles of its own. Returns None if an error occurs.
+    """
+    variantFiles = {}
+
+    def openFiles(fileNames):
+        for fileName in fileNames:
+            if fileName not in variantFiles:
+                variantFiles[fileName] = pysam.VariantFile(fileName)
+            yield variantFiles[fileName]
+
+    try:
+        contigRecords = (
+            (referenceName, _fetchShardRecords(
+                openFiles(fileNames), referenceName,
+                HtslibVariantSet.vcfMin, HtslibVariantSet.vcfMax))
+            for referenceName, fileNames in sorted(contigFileNames.items()))
+        return variantdensity.VariantDensityIndex.buildFromRecords(
+            dataFilePaths, contigRecords)
+    except Exception:
+        logging.getLogger(__name__).exception(
+            "Error building the density index of %s", dataFilePaths)
+        return None
+    finally:
+        for variantFile in variantFiles.values():
+            variantFile.close()
+
+
+class DensityIndexBuilder(object):
+    """
+    Builds the density indexes of variant sets in the background using a
+    pool of worker processes, and keeps them in memory and in the
+    directories of the variant sets, like the stats.StatsEngine. If the
+    number of processes is zero, no indexes are built, but any indexes
+    already in the directories are still used.
+    """
+    def __init__(self):
+        self._numProcesses = 1
+        self._pool = None
+        self._lock = threading.Lock()
+        # Maps the directory of each variant set to its built index.
+        self._indexes = {}
+        self._pending = {}
+
+    def setNumProcesses(self, numProcesses):
+        """
+        Sets the number of worker processes used to build indexes.
+        """
+        if numProcesses < 0:
+            raise ValueError(
+                "The number of processes must be a non-negative value")
+        self.close()
+        self._numProcesses = numProcesses
+
+    def getIndex(self, dataDir, dataFilePaths, contigFileNames):
+        """
+        Returns the VariantDensityIndex built for the variant set in the
+        specified directory, with the specified data files, or None if
+        it is not available yet, in which case it is built in the
+        background from the data files of the shards of each contig in
+        the specified dictionary.
+        """
+        with self._lock:
+            densityIndex = self._indexes.get(dataDir)
+            if (densityIndex is not None and
+                    not densityIndex.isCurrent(dataFilePaths)):
+                del self._indexes[dataDir]
+                densityIndex = None
+            if densityIndex is None:
+                self._schedule(dataDir, dataFilePaths, contigFileNames)
+            return densityIndex
+
+    def wait(self):
+        """
+        Waits until all of the indexes currently being built are
+        available.
+        """
+        while True:
+            with self._lock:
+                pending = self._pending.values()
+            if len(pending) == 0:
+                break
+            for asyncResult in pending:
+                asyncResult.wait()
+
+    def close(self):
+        """
+        Shuts down the worker processes, abandoning any indexes being
+        built.
+        """
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+            self._pending = {}
+        # The pool's result handler thread runs our callbacks, which
+        # take the lock, so we must not hold it while terminating.
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    def _schedule(self, dataDir, dataFilePaths, contigFileNames):
+        # Must be called with the lock held.
+        if self._numProcesses == 0 or dataDir in self._pending:
+            return
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self._numProcesses)
+
+        def callback(densityIndex):
+            self._storeIndex(dataDir, densityIndex)
+
+        self._pending[dataDir] = self._pool.apply_async(
+            _buildDensityIndex, (dataFilePaths, contigFileNames),
+            callback=callback)
+
+    def _storeIndex(self, dataDir, densityIndex):
+        with self._lock:
+            self._pending.pop(dataDir, None)
+            if densityIndex is None:
+                return
+            self._indexes[dataDir] = densityIndex
+        try:
+            densityIndex.save(dataDir)
+        except (IOError, OSError):
+            logging.getLogger(__name__).warning(
+                "Cannot write the density index of %s", dataDir)
+
+
+# The worker processes that build density indexes
+densityIndexBuilder = DensityIndexBuilder()
+
+
+class _ShardReader(object):
+    """
+    Reads the (gaVariant, filters) pairs from one sample shard in
+    batches, which start small so that the first page of a search is
+    returned quickly, and double in size up to a maximum.
+    """
+    minBatchSize = 16
+    maxBatchSize = 1024
+
+    def __init__(self, pairs):
+        self._pairs = pairs
+        self._buffer = collections.deque()
+        self._batchSize = self.minBatchSize
+        self._exhausted = False
+
+    def needsFetch(self):
+        """
+        Returns True if all of the buffered variants have been consumed
+        and there may be more to read.
+        """
+        return len(self._buffer) == 0 and not self._exhausted
+
+    def fetch(self):
+        """
+        Reads the next batch of variants into the buffer.
+        """
+        batch = list(itertools.islice(self._pairs, self._batchSize))
+        if len(batch) < self._batchSize:
+            self._exhausted = True
+        self._buffer.extend(batch)
+        self._batchSize = min(2 * self._batchSize, self.maxBatchSize)
+
+    def peekStart(self):
+        """
+        Returns the start of the next variant, or None if all variants in
+        the buffer have been consumed.
+        """
+        if len(self._buffer) == 0:
+            return None
+        return self._buffer[0][0].start
+
+    def popSite(self, start):
+        """
+        Removes and returns the list of pairs at the front of the buffer
+        whose variants start at the specified position. Reads further
+        batches if the site continues past the end of the buffer.
+        """
+        pairs = []
+        while True:
+            if self.needsFetch():
+                self.fetch()
+            if self.peekStart() != start:
+                return pairs
+            pairs.append(self._buffer.popleft())
+
+
+# The manifest that marks a variant set directory as holding sample
+# shards, listing their subdirectories.
+SHARDS_FILE_NAME = "shards.json"
+
+
+def isSampleShardedDir(dataDir):
+    """
+    Returns True if the specified variant set directory holds sample
+    shards, which are the subdirectories of indexed VCF or BCF files
+    listed in its shards.json manifest.
+    """
+    return os.path.exists(os.path.join(dataDir, SHARDS_FILE_NAME))
+
+
+class SampleShardedVariantSet(
+        datamodel.PysamDatamodelMixin, AbstractVariantSet):
+    """
+    Class representing a variant set whose samples are split over
+    several sample shards. Each shard is a subdirectory holding the
+    variants for the same sites in a disjoint subset of the samples,
+    and is read as a HtslibVariantSet. The shards are listed, in order,
+    in the shards.json manifest, e.g. {"shards": ["shard0", "shard1"]}.
+    Searches read only the shards that hold the requested call sets,
+    fetching from them concurrently and merging the calls, INFO and
+    FILTER of each site.
+    """
+    def __init__(self, parentContainer, localId, dataDir, backend):
+        super(SampleShardedVariantSet, self).__init__(
+            parentContainer, localId)
+        self._dataDir = dataDir
+        self._setAccessTimes(dataDir)
+        # The shards share our parent container and local ID, so that
+        # the IDs of their call sets and variants are the same as ours.
+        self._shards = []
+        self._callSetShardMap = {}
+        shardsFilePath = os.path.join(dataDir, SHARDS_FILE_NAME)
+        try:
+            with open(shardsFilePath) as shardsFile:
+                shardNames = json.load(shardsFile)["shards"]
+        except (IOError, ValueError, KeyError, TypeError):
+            raise exceptions.FileOpenFailedException(shardsFilePath)
+        for shardName in shardNames:
+            shardDir = os.path.join(dataDir, shardName)
+            if not os.path.isdir(shardDir):
+                raise exceptions.FileOpenFailedException(shardDir)
+            self._addShard(HtslibVariantSet(
+                parentContainer, localId, shardDir, backend))
+        if len(self._shards) == 0:
+            raise exceptions.EmptyDirException(dataDir, ["*/"])
+
+    def _addShard(self, shard):
+        if (len(self._shards) > 0 and
+                shard.getMetadata() != self._shards[0].getMetadata()):
+            raise exceptions.InconsistentMetaDataException(
+                shard.getDataFilePaths()[0])
+        for callSet in shard.getCallSets():
+            if callSet.getId() in self._callSetShardMap:
+                raise exceptions.OverlappingSampleShardsException(
+                    shard.getDataFilePaths()[0], callSet.getSampleName())
+            self.addCallSet(callSet.getSampleName())
+            self._callSetShardMap[callSet.getId()] = shard
+        self._shards.append(shard)
+
+    def getShards(self):
+        """
+        Returns the list of HtslibVariantSets for the sample shards of
+        this variant set.
+        """
+        return self._shards
+
+    def getMetadata(self):
+        return self._shards[0].getMetadata()
+
+    def getNumVariants(self, referenceName=None):
+        """
+        Returns the number of variants in the sample shard with the
+        most variants, as the shards are expected to hold the same
+        sites. Returns None if the counts are not available.
+        """
+        counts = [
+            shard.getNumVariants(referenceName) for shard in self._shards]
+        if None in counts:
+            return None
+        return max(counts)
+
+    def getDataFilePaths(self):
+        paths = [self._dataDir]
+        for shard in self._shards:
+            paths.extend(shard.getDataFilePaths())
+        return paths
+
+    def getReferenceNames(self):
+        return self._shards[0].getReferenceNames()
+
+    def getReferenceRange(self, referenceName):
+        return self._shards[0].getReferenceRange(referenceName)
+
+    def getDataDir(self):
+        return self._dataDir
+
+    def _getShardCallSetIds(self, callSetIds, allShards=False):
+        """
+        Returns the list of (shard, callSetIds) pairs for the shards that
+        hold the specified call sets, in shard order, or for all of the
+        shards if allShards is True. If no call sets are requested, only
+        the first shard is read for the sites.
+        """
+        shardCallSetIds = collections.OrderedDict(
+            (shard, []) for shard in self._shards)
+        for callSetId in callSetIds:
+            shardCallSetIds[self._callSetShardMap[callSetId]].append(
+                callSetId)
+        pairs = [
+            (shard, shardIds) for shard, shardIds in shardCallSetIds.items()
+            if allShards or len(shardIds) > 0]
+        if len(pairs) == 0:
+            pairs = [(self._shards[0], [])]
+        return pairs
+
+    def _mergeSite(self, pairs, merged):
+        """
+        Adds the specified (gaVariant, filters) pairs from one shard to
+        the specified dictionary of merged pairs at a site. The calls of
+        a variant are added to those of the variant with the same ID
+        from earlier shards, along with the INFO keys and FILTER names
+        that they do not have. A merged variant only has the PASS filter
+        if none of its shards has another filter.
+        """
+        for gaVariant, filters in pairs:
+            if gaVariant.id not in merged:
+                gaVariant.created = self._creationTime
+                gaVariant.updated = self._updatedTime
+                merged[gaVariant.id] = (gaVariant, list(filters))
+                continue
+            mergedVariant, mergedFilters = merged[gaVariant.id]
+            mergedVariant.calls.extend(gaVariant.calls)
+            for key, value in gaVariant.info.items():
+                if key not in mergedVariant.info:
+                    mergedVariant.info[key] = value
+            for name in filters:
+                if name not in mergedFilters:
+                    mergedFilters.append(name)
+            if len(mergedFilters) > 1 and "PASS" in mergedFilters:
+                mergedFilters.remove("PASS")
+
+    def getVariant(self, compoundId):
+        merged = collections.OrderedDict()
+        for shard in self._shards:
+            try:
+                gaVariant = shard.getVariant(compoundId)
+            except exceptions.ObjectNotFoundException:
+                continue
+            self._mergeSite([(gaVariant, [])], merged)
+        if len(merged) == 0:
+            raise exceptions.ObjectNotFoundException(compoundId)
+        return merged.values()[0][0]
+
+    def getVariantsById(self, compoundIds):
+        """
+        Returns the list of the GA Variants with the specified compound
+        IDs, in the same order, with None for each ID that does not
+        identify a variant in this variant set. Each shard reads the
+        variants with its own batched fetches, and the calls of the
+        shards are merged for each variant.
+        """
+        shardVariants = [
+            shard.getVariantsById(compoundIds) for shard in self._shards]
+        # The shards return the same object for repeated IDs, so each
+        # variant is only merged once.
+        mergedVariants = {}
+        gaVariants = []
+        for index, compoundId in enumerate(compoundIds):
+            key = str(compoundId)
+            if key not in mergedVariants:
+                merged = collections.OrderedDict()
+                for shardResults in shardVariants:
+                    if shardResults[index] is not None:
+                        self._mergeSite(
+                            [(shardResults[index], [])], merged)
+                mergedVariants[key] = None
+                if len(merged) > 0:
+                    mergedVariants[key] = merged.values()[0][0]
+            gaVariants.append(mergedVariants[key])
+        return gaVariants
+
+    def getVariants(self, referenceName, startPosition, endPosition,
+                    callSetIds=None, variantFilter=None,
+                    carrierCallSetIds=None):
+        """
+        Returns an iterator over the specified variants, with the calls
+        for the specified call sets. The VariantFilter is applied to the
+        merged variant, with the INFO and FILTER of all of the shards,
+        so every shard is read when there is a filter. Each shard
+        selects the records carried by the carrierCallSetIds it holds,
+        and a site is only included if all of them carry it, so their
+        calls are read even if they are not requested.
+        """
+        callSetIds = self._checkCallSetIds(callSetIds)
+        carrierCallSetIds = self._checkCallSetIds(carrierCallSetIds or [])
+        readCallSetIds = callSetIds + [
+            callSetId for callSetId in carrierCallSetIds
+            if callSetId not in callSetIds]
+        readers = []
+        shardCallSetIds = self._getShardCallSetIds(
+            readCallSetIds, variantFilter is not None)
+        for shard, shardIds in shardCallSetIds:
+            shardCarrierIds = [
+                callSetId for callSetId in carrierCallSetIds
+                if callSetId in shardIds]
+            readers.append(_ShardReader(shard.getVariantsWithFilters(
+                referenceName, startPosition, endPosition, shardIds,
+                shardCarrierIds)))
+        while True:
+            shardFetcher.map(
+                _ShardReader.fetch,
+                [reader for reader in readers if reader.needsFetch()])
+            starts = [
+                reader.peekStart() for reader in readers
+                if reader.peekStart() is not None]
+            if len(starts) == 0:
+                break
+            start = min(starts)
+            merged = collections.OrderedDict()
+            for reader in readers:
+                self._mergeSite(reader.popSite(start), merged)
+            for gaVariant, filters in merged.values():
+                if (variantFilter is not None and
+                        not variantFilter.includesVariant(
+                            gaVariant, filters)):
+                    continue
+                if len(carrierCallSetIds) > 0:
+                    if not self._includesCarriers(
+                            gaVariant, carrierCallSetIds):
+                        continue
+                    gaVariant.calls = [
+                        call for call in gaVariant.calls
+                        if call.callSetId in callSetIds]
+                yield gaVariant
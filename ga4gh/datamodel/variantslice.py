@@ -0,0 +1,287 @@
+"""
+Slices of variant sets streamed as bgzipped VCF or BCF.
+
+Like BAM slices (see bamslice), a slice of the region of a contig is
+made up of the header of a data file, the chunks of the data files
+overlapping the region listed in their tabix or CSI indexes, and the
+empty block marking the end of the file. The blocks wholly inside a
+chunk are copied from the data files without being decompressed, so a
+slice of a large region costs little more than reading the files.
+
+The chunks of BCF files cannot be concatenated with those of other
+files, as the records of a BCF file refer to the contigs and fields of
+its header by number, and records cannot be copied without decoding
+them when only some of the call sets are requested, or when the data
+files list their samples in different orders, as the slice has the
+header of the first of them. These slices are written as bgzipped VCF
+instead: the records are read with pysam and
+their text is compressed into new blocks by the threads of the
+bgzf.blockCompressor.
+
+As with htsget, a copied slice holds every record in the region, but
+may also hold some of the records near it, which clients filter out if
+they need to.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import struct
+
+import pysam
+
+import ga4gh.datamodel.bgzf as bgzf
+import ga4gh.datamodel.htslibindex as htslibindex
+import ga4gh.exceptions as exceptions
+
+
+VCF_MIMETYPE = "application/vnd.ga4gh.vcf"
+BCF_MIMETYPE = "application/vnd.ga4gh.bcf"
+
+_bcfMagic = b"BCF\x02"
+# The fixed columns of the #CHROM line of a VCF header, which are
+# followed by the names of the samples.
+_numFixedColumns = 9
+
+
+class VariantFileSlicer(object):
+    """
+    Streams the pieces of slices of an indexed, bgzipped VCF or BCF file.
+    """
+    def __init__(self, dataFilePath):
+        self._dataFilePath = dataFilePath
+        indexFilePath = htslibindex.getIndexFilePath(dataFilePath)
+        if indexFilePath is None:
+            raise exceptions.NotIndexedException(dataFilePath)
+        self._fileStates = self._getFileStates(
+            [dataFilePath, indexFilePath])
+        self._index = htslibindex.HtslibIndex.parse(indexFilePath)
+        with io.open(dataFilePath, "rb") as dataFile:
+            self._headerData = self._readHeader(dataFile)
+        self._isBcf = self._headerData.startswith(_bcfMagic)
+        if self._isBcf:
+            self._headerText = self._headerData[9:].rstrip(b"\0")
+        else:
+            self._headerText = self._headerData
+        columns = self._headerText.rstrip(b"\n").split(b"\n")[-1].split(
+            b"\t")
+        self._sampleNames = [
+            name.decode("utf8") for name in columns[_numFixedColumns:]]
+        self._referenceNames = self._index.getReferenceNames()
+        if self._referenceNames is None:
+            # The contigs of BCF files are numbered in the order of their
+            # header.
+            variantFile = pysam.VariantFile(dataFilePath)
+            self._referenceNames = list(variantFile.header.contigs)
+            variantFile.close()
+
+    @classmethod
+    def _getFileStates(cls, paths):
+        states = []
+        for path in paths:
+            fileStat = os.stat(path)
+            states.append((fileStat.st_size, fileStat.st_mtime))
+        return states
+
+    def _readHeader(self, dataFile):
+        """
+        Returns the uncompressed header of the specified data file.
+        """
+        data = b""
+        blockOffset = 0
+        try:
+            while True:
+                blockSize, blockData = bgzf.readBlock(dataFile, blockOffset)
+                if blockSize == 0:
+                    raise exceptions.FileOpenFailedException(
+                        self._dataFilePath)
+                data += blockData
+                headerLength = self._parseHeader(data)
+                if headerLength is not None:
+                    break
+                blockOffset += blockSize
+        except struct.error:
+            raise exceptions.FileOpenFailedException(self._dataFilePath)
+        return data[:headerLength]
+
+    def _parseHeader(self, data):
+        """
+        Returns the length of the VCF or BCF header at the start of the
+        specified data, or None if the data does not hold all of it.
+        """
+        if data.startswith(_bcfMagic):
+            if len(data) < 9:
+                return None
+            textLength, = struct.unpack_from(b"<I", data, 5)
+            if len(data) < 9 + textLength:
+                return None
+            return 9 + textLength
+        if len(data) > 0 and data[:1] != b"#":
+            raise exceptions.FileOpenFailedException(self._dataFilePath)
+        offset = 0
+        while offset < len(data) and data[offset:offset + 1] == b"#":
+            lineEnd = data.find(b"\n", offset)
+            if lineEnd == -1:
+                return None
+            offset = lineEnd + 1
+        if offset == len(data):
+            return None
+        return offset
+
+    def isCurrent(self):
+        """
+        Returns True if the data file and its index have not changed
+        since this slicer read them.
+        """
+        indexFilePath = htslibindex.getIndexFilePath(self._dataFilePath)
+        try:
+            return indexFilePath is not None and self._getFileStates(
+                [self._dataFilePath, indexFilePath]) == self._fileStates
+        except OSError:
+            return False
+
+    def isBcf(self):
+        """
+        Returns True if the data file is a BCF file.
+        """
+        return self._isBcf
+
+    def getSampleNames(self):
+        """
+        Returns the list of the names of the samples of the data file,
+        in the order of its header.
+        """
+        return self._sampleNames
+
+    def getHeaderText(self, sampleNames=None):
+        """
+        Returns the text of the VCF header of the data file, or of its
+        subset holding the specified samples if sampleNames is not None.
+        """
+        if sampleNames is None:
+            return self._headerText
+        lines = self._headerText.rstrip(b"\n").split(b"\n")
+        columns = lines[-1].split(b"\t")
+        columns = columns[:_numFixedColumns] + [
+            name for name in columns[_numFixedColumns:]
+            if name.decode("utf8") in sampleNames]
+        lines[-1] = b"\t".join(columns)
+        return b"\n".join(lines) + b"\n"
+
+    def getHeaderBlocks(self):
+        """
+        Returns the BGZF blocks holding the header of the data file.
+        """
+        return bgzf.compressBlocks(self._headerData)
+
+    def getChunks(self, referenceName, start=0, end=None):
+        """
+        Returns the list of the (startOffset, endOffset) virtual offset
+        pairs of the chunks of the data file holding the records of the
+        specified region, which is empty if the contig is not in the
+        file.
+        """
+        if referenceName not in self._referenceNames:
+            return []
+        return self._index.getChunks(
+            self._referenceNames.index(referenceName), start, end)
+
+    def iterChunks(self, chunks):
+        """
+        Returns a generator over the pieces of BGZF blocks holding the
+        specified chunks of the data file.
+        """
+        with io.open(self._dataFilePath, "rb") as dataFile:
+            for chunkStart, chunkEnd in chunks:
+                for piece in bgzf.iterChunk(dataFile, chunkStart, chunkEnd):
+                    if len(piece) > 0:
+                        yield piece
+
+    def iterRecordText(self, referenceName, start=0, end=None,
+                       sampleNames=None):
+        """
+        Returns a generator over the VCF lines of the records in the
+        specified region, holding the calls of the specified list of
+        samples in the order given, or of all of them in the order of
+        the header if sampleNames is None.
+        """
+        if referenceName not in self._referenceNames:
+            return
+        columnIndexes = None
+        fileSampleNames = self._sampleNames
+        if sampleNames is not None:
+            fileSampleNames = [
+                name for name in self._sampleNames if name in sampleNames]
+            if fileSampleNames != list(sampleNames):
+                columnIndexes = [
+                    _numFixedColumns + fileSampleNames.index(name)
+                    for name in sampleNames]
+        variantFile = pysam.VariantFile(self._dataFilePath)
+        try:
+            if fileSampleNames != self._sampleNames:
+                variantFile.subset_samples([
+                    name.encode("utf8") for name in fileSampleNames])
+            for record in variantFile.fetch(
+                    referenceName.encode("utf8"), start, end):
+                text = str(record)
+                if columnIndexes is not None:
+                    columns = text.rstrip(b"\n").split(b"\t")
+                    columns[_numFixedColumns:] = [
+                        columns[index] for index in columnIndexes]
+                    text = b"\t".join(columns) + b"\n"
+                yield text
+        finally:
+            variantFile.close()
+
+
+def getSlice(slicers, referenceName, start=0, end=None, sampleNames=None):
+    """
+    Returns the (mimetype, pieces) pair of the slice of the specified
+    region in the data files of the specified slicers, which are in
+    order of position, holding the calls of the specified samples, or of
+    all of them if sampleNames is None. The header of the slice is that
+    of the first data file, and the calls of the records of the other
+    data files are written in the order of its samples.
+    """
+    if len(slicers) == 0:
+        return VCF_MIMETYPE, iter([bgzf.EOF])
+    isBcf = any(slicer.isBcf() for slicer in slicers)
+    sameSamples = all(
+        slicer.getSampleNames() == slicers[0].getSampleNames()
+        for slicer in slicers[1:])
+    if sampleNames is None and sameSamples and (
+            not isBcf or len(slicers) == 1):
+        mimetype = BCF_MIMETYPE if isBcf else VCF_MIMETYPE
+        return mimetype, _iterCopiedSlice(slicers, referenceName, start, end)
+    return VCF_MIMETYPE, _iterWrittenSlice(
+        slicers, referenceName, start, end, sampleNames)
+
+
+def _iterCopiedSlice(slicers, referenceName, start, end):
+    yield slicers[0].getHeaderBlocks()
+    for slicer in slicers:
+        for piece in slicer.iterChunks(
+                slicer.getChunks(referenceName, start, end)):
+            yield piece
+    yield bgzf.EOF
+
+
+def _iterWrittenSlice(slicers, referenceName, start, end, sampleNames):
+    # The samples of the slice, in the order of the header of the first
+    # data file.
+    sliceSampleNames = [
+        name for name in slicers[0].getSampleNames()
+        if sampleNames is None or name in sampleNames]
+
+    def iterText():
+        yield slicers[0].getHeaderText(sampleNames)
+        for slicer in slicers:
+            for line in slicer.iterRecordText(
+                    referenceName, start, end, sliceSampleNames):
+                yield line
+
+    for blocks in bgzf.blockCompressor.compress(iterText()):
+        yield blocks
+    yield bgzf.EOF
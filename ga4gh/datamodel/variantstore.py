@@ -0,0 +1,902 @@
+"""
+A columnar store of the variants in a variant set, made up of NumPy
+arrays that are memory mapped when the store is loaded.
+
+Parsing the VCF text of each record and then building a call for every
+sample is the main cost of searches over wide cohorts in a
+HtslibVariantSet. The store is built once from a HtslibVariantSet, and
+holds for each contig the positions, alleles, names and FILTER status of
+its variants, a genotype matrix with a row for each variant and a column
+for each sample, and a column for each INFO and FORMAT field. Searches
+then slice contiguous blocks of rows out of these arrays.
+
+The store is a directory holding a JSON manifest and a .npy file for each
+column of each contig. The values of Integer and Float INFO and FORMAT
+fields are stored as 32 bit numbers, as they are in BCF records, with a
+column holding the number of values in each cell; those of the other
+fields are stored as byte strings holding the strings of the GA4GH info
+lists. Either way, the variants are identical to those of the
+HtslibVariantSet the store was built from.
+
+The records of a contig are converted to arrays a chunk at a time, and
+each chunk is saved to a temporary file. Once the number of variants and
+the widths of the columns are known, the chunks are copied into the
+columns, which are written through memory maps, so building a store
+needs the memory for one chunk of records rather than for a contig.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+
+import numpy
+import numpy.lib.format
+
+import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.variants as variants
+import ga4gh.exceptions as exceptions
+import ga4gh.genotypematrix as genotypematrix
+import ga4gh.protocol as protocol
+
+
+MANIFEST_FILE_NAME = "store.json"
+STORE_FORMAT_VERSION = 2
+# Pads genotypes shorter than the greatest ploidy in the genotype matrix.
+_paddingAllele = -2
+# String INFO and FORMAT cells are empty if the field is absent, hold
+# only the None marker if its value is None, and otherwise hold the value
+# marker followed by the separated string values.
+_noneMarker = b"\x1d"
+_valueMarker = b"\x1e"
+_separator = b"\x1f"
+# Maps the types of the INFO and FORMAT fields stored as numbers to the
+# types of their columns.
+_numericTypes = {
+    "Integer": numpy.int32,
+    "Float": numpy.float32,
+}
+# The lengths of the numeric cells whose field is absent, or whose value
+# is None.
+_absentLength = -1
+_noneLength = -2
+# The numeric values that are None, which are those htslib uses for
+# missing values.
+_missingInteger = -2**31
+_missingFloatBits = 0x7f800001
+# Marks the numeric cells of a chunk whose field is absent.
+_absentCell = object()
+# The decoded cell whose value is None.
+_noneCell = [str(None)]
+
+
+def isStoreDir(dataDir):
+    """
+    Returns True if the specified variant set directory holds a variant
+    store.
+    """
+    return os.path.exists(os.path.join(dataDir, MANIFEST_FILE_NAME))
+
+
+def _getColumnFileName(contigIndex, columnName):
+    return "contig{}.{}.npy".format(contigIndex, columnName)
+
+
+def _encodeCell(value, encode=str):
+    if value is None:
+        return _noneMarker
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    return _valueMarker + _separator.join(encode(v) for v in value)
+
+
+def _decodeCell(cell):
+    if cell == _noneMarker:
+        return [str(None)]
+    if len(cell) == 1:
+        return []
+    return cell[1:].split(_separator)
+
+
+def _decodeLikelihood(value):
+    if value == str(None):
+        return None
+    return float(value)
+
+
+def _getMissingMask(values):
+    """
+    Returns the mask of the elements of the specified numeric array that
+    are None.
+    """
+    if values.dtype.kind == "f":
+        return values.view(numpy.int32) == _missingFloatBits
+    return values == _missingInteger
+
+
+def _toNumericArrays(cells, dtype):
+    """
+    Returns the (values, lengths) pair of arrays holding the specified
+    list of the pysam values of a numeric field, which are _absentCell
+    where the field is absent. The values array has a row for each cell,
+    as wide as the longest value.
+    """
+    lengths = numpy.empty(len(cells), dtype=numpy.int16)
+    cellValues = []
+    for index, cell in enumerate(cells):
+        if cell is _absentCell:
+            lengths[index] = _absentLength
+        elif cell is None:
+            lengths[index] = _noneLength
+        else:
+            if not isinstance(cell, (list, tuple)):
+                cell = [cell]
+            lengths[index] = len(cell)
+            cellValues.append((index, cell))
+    width = max([1] + [len(values) for _, values in cellValues])
+    values = numpy.zeros((len(cells), width), dtype=dtype)
+    missing = numpy.zeros((len(cells), width), dtype=numpy.bool_)
+    for index, cell in cellValues:
+        for position, value in enumerate(cell):
+            if value is None:
+                missing[index, position] = True
+            else:
+                values[index, position] = value
+    if values.dtype.kind == "f":
+        values.view(numpy.int32)[missing] = _missingFloatBits
+    else:
+        values[missing] = _missingInteger
+    return values, lengths
+
+
+def _isPaddedColumn(columnName, dtype):
+    """
+    Returns True if the rows of the specified column are padded at the
+    end of their last dimension to the width of the widest of them.
+    """
+    kind, _ = columnName
+    return kind == "genotypes" or (
+        kind in ("info", "format") and dtype.kind != "S")
+
+
+class _ContigBuilder(object):
+    """
+    Builds the columns of the variants on one contig in the specified
+    store directory. The INFO and FORMAT fields with the specified types
+    are stored as numbers.
+    """
+    chunkSize = 4096
+    """
+    The number of records that are converted to arrays at once.
+    """
+
+    def __init__(self, storeDir, contigIndex, samples, infoTypes,
+                 formatTypes):
+        self._storeDir = storeDir
+        self._contigIndex = contigIndex
+        self._sampleIndexes = dict(
+            (sample, index) for index, sample in enumerate(samples))
+        self._numSamples = len(samples)
+        self._infoTypes = infoTypes
+        self._formatTypes = formatTypes
+        self.numVariants = 0
+        self.maxLength = 0
+        # The (path, numRows, columns) triples of the saved chunks, where
+        # columns lists the (columnName, dtype, shape) triples of their
+        # arrays. Columns are named by (kind, key) pairs, where the key
+        # of an INFO or FORMAT column is that of its field.
+        self._chunks = []
+        self._startChunk()
+
+    def _startChunk(self):
+        self._numRows = 0
+        self._starts = []
+        self._ends = []
+        self._referenceBases = []
+        self._alternateBases = []
+        self._names = []
+        self._filters = []
+        self._genotypes = []
+        self._phased = []
+        self._infos = {}
+        self._formats = {}
+
+    def _getEmptyCell(self, key, fieldTypes):
+        if key in fieldTypes:
+            return _absentCell
+        return b""
+
+    def _getColumn(self, columns, key, fieldTypes, numValues):
+        if key not in columns:
+            emptyCell = self._getEmptyCell(key, fieldTypes)
+            columns[key] = [emptyCell] * (self._numRows * numValues)
+        return columns[key]
+
+    def addRecord(self, record):
+        row = self._numRows
+        self._numRows += 1
+        for columns, fieldTypes, numValues in [
+                (self._infos, self._infoTypes, 1),
+                (self._formats, self._formatTypes, self._numSamples)]:
+            for key, column in columns.items():
+                column.extend(
+                    [self._getEmptyCell(key, fieldTypes)] * numValues)
+        self._starts.append(record.start)
+        self._ends.append(record.stop)
+        self.maxLength = max(self.maxLength, record.stop - record.start)
+        self._referenceBases.append(record.ref)
+        self._alternateBases.append(_separator.join(record.alts or []))
+        self._names.append(record.id or b"")
+        self._filters.append(b";".join(record.filter.keys()))
+        for key, value in record.info.iteritems():
+            if value is not None:
+                column = self._getColumn(
+                    self._infos, key, self._infoTypes, 1)
+                if key not in self._infoTypes:
+                    value = _encodeCell(value)
+                column[row] = value
+        # The genotypes are parsed from the text of the record, as in
+        # HtslibVariantSet.convertVariant.
+        sampleData = record.__str__().split()[9:]
+        genotypes = [[] for _ in range(self._numSamples)]
+        phased = [False] * self._numSamples
+        cellOffset = row * self._numSamples
+        for sampleIterator, (name, call) in enumerate(
+                record.samples.iteritems()):
+            index = self._sampleIndexes[name]
+            genotype, phaseset = variants.convertVCFGenotype(
+                sampleData[sampleIterator].split(":")[0], None)
+            genotypes[index] = genotype
+            phased[index] = phaseset is not None
+            for key, value in call.iteritems():
+                if key == 'GT':
+                    continue
+                column = self._getColumn(
+                    self._formats, key, self._formatTypes, self._numSamples)
+                if key not in self._formatTypes:
+                    value = _encodeCell(value, repr if key == 'GL' else str)
+                column[cellOffset + index] = value
+        self._genotypes.append(genotypes)
+        self._phased.append(phased)
+        if self._numRows == self.chunkSize:
+            self._saveChunk()
+
+    def _getGenotypeMatrix(self):
+        ploidy = max([1] + [
+            len(genotype) for genotypes in self._genotypes
+            for genotype in genotypes])
+        matrix = numpy.empty(
+            (self._numRows, self._numSamples, ploidy), dtype=numpy.int16)
+        matrix.fill(_paddingAllele)
+        for row, genotypes in enumerate(self._genotypes):
+            for index, genotype in enumerate(genotypes):
+                matrix[row, index, :len(genotype)] = genotype
+        return matrix
+
+    def _getFieldArrays(self, kind, key, cells, fieldTypes, shape):
+        """
+        Returns the list of the (columnName, array) pairs holding the
+        specified cells of an INFO or FORMAT field, with the specified
+        shape.
+        """
+        if key not in fieldTypes:
+            return [((kind, key), numpy.array(cells).reshape(shape))]
+        values, lengths = _toNumericArrays(
+            cells, _numericTypes[fieldTypes[key]])
+        return [
+            ((kind, key), values.reshape(shape + (values.shape[1],))),
+            ((kind + "Lengths", key), lengths.reshape(shape))]
+
+    def _saveChunk(self):
+        """
+        Converts the records of the current chunk to arrays, and saves
+        them to a temporary file.
+        """
+        if self._numRows == 0:
+            return
+        arrays = [
+            (("starts", None), numpy.array(self._starts, dtype=numpy.int64)),
+            (("ends", None), numpy.array(self._ends, dtype=numpy.int64)),
+            (("referenceBases", None), numpy.array(self._referenceBases)),
+            (("alternateBases", None), numpy.array(self._alternateBases)),
+            (("names", None), numpy.array(self._names)),
+            (("filters", None), numpy.array(self._filters)),
+            (("genotypes", None), self._getGenotypeMatrix()),
+            (("phased", None), numpy.array(self._phased, dtype=numpy.bool_)),
+        ]
+        for key, cells in self._infos.items():
+            arrays.extend(self._getFieldArrays(
+                "info", key, cells, self._infoTypes, (self._numRows,)))
+        for key, cells in self._formats.items():
+            arrays.extend(self._getFieldArrays(
+                "format", key, cells, self._formatTypes,
+                (self._numRows, self._numSamples)))
+        chunkPath = os.path.join(
+            self._storeDir, "contig{}.chunk{}.tmp.npz".format(
+                self._contigIndex, len(self._chunks)))
+        with open(chunkPath, "wb") as chunkFile:
+            numpy.savez(chunkFile, *[array for _, array in arrays])
+        self._chunks.append((chunkPath, self._numRows, [
+            (columnName, array.dtype, array.shape)
+            for columnName, array in arrays]))
+        self.numVariants += self._numRows
+        self._startChunk()
+
+    def _getColumnLayouts(self):
+        """
+        Returns the map of the name of each column to the (dtype, shape)
+        pair of the array holding the rows of all of the chunks.
+        """
+        layouts = {
+            ("starts", None): (numpy.dtype(numpy.int64), ()),
+            ("ends", None): (numpy.dtype(numpy.int64), ()),
+            ("genotypes", None): (
+                numpy.dtype(numpy.int16), (self._numSamples, 1)),
+            ("phased", None): (
+                numpy.dtype(numpy.bool_), (self._numSamples,)),
+        }
+        for kind in ["referenceBases", "alternateBases", "names", "filters"]:
+            layouts[(kind, None)] = numpy.dtype(b"S1"), ()
+        for _, _, columns in self._chunks:
+            for columnName, dtype, shape in columns:
+                shape = shape[1:]
+                if columnName in layouts:
+                    layoutDtype, layoutShape = layouts[columnName]
+                    if dtype.kind == "S":
+                        dtype = max(
+                            dtype, layoutDtype, key=lambda t: t.itemsize)
+                    elif _isPaddedColumn(columnName, dtype):
+                        shape = shape[:-1] + (
+                            max(shape[-1], layoutShape[-1]),)
+                layouts[columnName] = dtype, shape
+        return dict(
+            (columnName, (dtype, (self.numVariants,) + shape))
+            for columnName, (dtype, shape) in layouts.items())
+
+    def finish(self):
+        """
+        Writes the columns of the contig from the saved chunks, which are
+        then removed, and returns the manifest of the contig.
+        """
+        self._saveChunk()
+        layouts = self._getColumnLayouts()
+        fieldKeys = {}
+        fileColumnNames = {}
+        for kind in ["info", "format"]:
+            fieldKeys[kind] = sorted(
+                key for columnKind, key in layouts if columnKind == kind)
+            for index, key in enumerate(fieldKeys[kind]):
+                fileColumnNames[(kind, key)] = "{}{}".format(kind, index)
+                fileColumnNames[(kind + "Lengths", key)] = \
+                    "{}{}Lengths".format(kind, index)
+        columns = {}
+        for columnName, (dtype, shape) in layouts.items():
+            kind, _ = columnName
+            column = numpy.lib.format.open_memmap(
+                os.path.join(self._storeDir, _getColumnFileName(
+                    self._contigIndex, fileColumnNames.get(columnName, kind))),
+                mode="w+", dtype=dtype, shape=shape)
+            if kind == "genotypes":
+                column.fill(_paddingAllele)
+            elif kind in ("infoLengths", "formatLengths"):
+                column.fill(_absentLength)
+            columns[columnName] = column
+        rowStart = 0
+        for chunkPath, numRows, chunkColumns in self._chunks:
+            rowEnd = rowStart + numRows
+            chunk = numpy.load(chunkPath)
+            for index, (columnName, dtype, shape) in enumerate(chunkColumns):
+                column = columns[columnName]
+                array = chunk["arr_{}".format(index)]
+                if _isPaddedColumn(columnName, dtype):
+                    column[rowStart:rowEnd, ..., :shape[-1]] = array
+                else:
+                    column[rowStart:rowEnd] = array
+            chunk.close()
+            os.unlink(chunkPath)
+            rowStart = rowEnd
+        for column in columns.values():
+            column.flush()
+        return {
+            "numVariants": self.numVariants,
+            "maxLength": self.maxLength,
+            "infoKeys": fieldKeys["info"],
+            "infoTypes": [
+                self._infoTypes.get(key, "String")
+                for key in fieldKeys["info"]],
+            "formatKeys": fieldKeys["format"],
+            "formatTypes": [
+                self._formatTypes.get(key, "String")
+                for key in fieldKeys["format"]],
+        }
+
+
+def build(variantSet, storeDir):
+    """
+    Builds a variant store in the specified directory, which is created
+    if it does not exist, from the records of the specified
+    HtslibVariantSet. The manifest is written last, so the directory is
+    only recognised as a store once it is complete.
+    """
+    if not os.path.exists(storeDir):
+        os.makedirs(storeDir)
+    samples = [
+        callSet.getSampleName() for callSet in variantSet.getCallSets()]
+    metadata = []
+    fieldTypes = {"INFO": {}, "FORMAT": {}}
+    for metadatum in variantSet.getMetadata():
+        jsonDict = metadatum.toJsonDict()
+        del jsonDict["id"]
+        metadata.append(jsonDict)
+        section, _, key = metadatum.key.partition(".")
+        if section in fieldTypes and metadatum.type in _numericTypes:
+            fieldTypes[section][key] = metadatum.type
+    contigs = []
+    for referenceName in variantSet.getReferenceNames():
+        builder = _ContigBuilder(
+            storeDir, len(contigs), samples, fieldTypes["INFO"],
+            fieldTypes["FORMAT"])
+        for record in variantSet.getPysamRecords(
+                referenceName, variantSet.vcfMin, variantSet.vcfMax):
+            builder.addRecord(record)
+        contig = builder.finish()
+        contig["name"] = referenceName
+        contigs.append(contig)
+    manifest = {
+        "version": STORE_FORMAT_VERSION,
+        "samples": samples,
+        "metadata": metadata,
+        "contigs": contigs,
+    }
+    manifestPath = os.path.join(storeDir, MANIFEST_FILE_NAME)
+    tempFilePath = "{}.{}.tmp".format(manifestPath, os.getpid())
+    with open(tempFilePath, "w") as manifestFile:
+        json.dump(manifest, manifestFile)
+    os.rename(tempFilePath, manifestPath)
+
+
+class _FieldColumn(object):
+    """
+    The memory mapped column of an INFO or FORMAT field on one contig.
+    The cells of a numeric field are held as numbers, with a column of
+    the number of values in each, and those of other fields as encoded
+    strings.
+    """
+    def __init__(self, key, values, lengths=None):
+        self.key = key
+        self._values = values
+        self._lengths = lengths
+
+    def _getCells(self, column, rows, sampleIndexes):
+        cells = column[rows]
+        if sampleIndexes is not None:
+            cells = cells[:, sampleIndexes]
+        return cells
+
+    def decode(self, rows, sampleIndexes=None, likelihoods=False):
+        """
+        Returns the nested list of the cells in the specified rows, and
+        for a FORMAT field in the columns of the specified samples. A
+        cell is None if the field is absent, _noneCell if its value is
+        None, and otherwise the list of the strings of its values, or of
+        their float values if likelihoods is True. Each distinct value is
+        decoded once, and the lists may be shared by several cells.
+        """
+        if self._lengths is None:
+            cells = self._getCells(self._values, rows, sampleIndexes)
+            uniqueCells, inverse = numpy.unique(cells, return_inverse=True)
+            decoded = numpy.empty(len(uniqueCells), dtype=object)
+            for index, cell in enumerate(uniqueCells.tolist()):
+                if cell == b"":
+                    decoded[index] = None
+                elif cell == _noneMarker:
+                    decoded[index] = _noneCell
+                elif likelihoods:
+                    decoded[index] = [
+                        _decodeLikelihood(value)
+                        for value in _decodeCell(cell)]
+                else:
+                    decoded[index] = _decodeCell(cell)
+            return decoded[inverse].reshape(cells.shape).tolist()
+        values = self._getCells(self._values, rows, sampleIndexes)
+        lengths = self._getCells(self._lengths, rows, sampleIndexes)
+        # Values are compared by their bits, which distinguishes the
+        # missing values of Float fields from other NaNs.
+        bits = values.view(numpy.int32)
+        uniqueBits, inverse = numpy.unique(bits, return_inverse=True)
+        missingBits = _missingInteger
+        if values.dtype.kind == "f":
+            missingBits = _missingFloatBits
+        decoded = numpy.empty(len(uniqueBits), dtype=object)
+        for index, (valueBits, value) in enumerate(zip(
+                uniqueBits.tolist(),
+                uniqueBits.view(values.dtype).tolist())):
+            if valueBits == missingBits:
+                decoded[index] = None if likelihoods else str(None)
+            elif likelihoods:
+                decoded[index] = float(value)
+            else:
+                decoded[index] = str(value)
+        cellValues = decoded[inverse].reshape(values.shape).tolist()
+
+        def getCell(length, values):
+            if length == _absentLength:
+                return None
+            if length == _noneLength:
+                return _noneCell
+            return values[:length]
+
+        if lengths.ndim == 1:
+            return map(getCell, lengths.tolist(), cellValues)
+        return [
+            map(getCell, rowLengths, rowValues)
+            for rowLengths, rowValues in zip(lengths.tolist(), cellValues)]
+
+    def getPaddedValues(self, rows, sampleIndexes):
+        """
+        Returns the list of the float32 arrays of the values of this
+        FORMAT field in each of the specified rows, with a row for each
+        of the specified samples padded at the end with NaN. Cells whose
+        field is absent or whose value is None are empty.
+        """
+        if self._lengths is None:
+            arrays = []
+            for cells in self.decode(rows, sampleIndexes, True):
+                values = [
+                    [] if cell is None or cell is _noneCell else
+                    [numpy.nan if value is None else value for value in cell]
+                    for cell in cells]
+                arrays.append(genotypematrix.toPaddedArray(
+                    values, numpy.nan, numpy.float32))
+            return arrays
+        values = self._getCells(self._values, rows, sampleIndexes)
+        lengths = self._getCells(self._lengths, rows, sampleIndexes)
+        padded = values.astype(numpy.float32)
+        padded[_getMissingMask(values)] = numpy.nan
+        padded[numpy.arange(values.shape[-1]) >= lengths[..., None]] = \
+            numpy.nan
+        # The lengths of cells without values are negative, and a row has
+        # no cells if there are no samples.
+        widths = [0] * len(lengths)
+        if lengths.shape[1] > 0:
+            widths = numpy.maximum(lengths.max(axis=1), 0).tolist()
+        return [
+            padded[index, :, :width] for index, width in enumerate(widths)]
+
+
+class _ContigColumns(object):
+    """
+    The memory mapped columns of the variants on one contig.
+    """
+    def __init__(self, storeDir, contigIndex, contigManifest):
+        self.name = contigManifest["name"]
+        self.numVariants = contigManifest["numVariants"]
+        self.maxLength = contigManifest["maxLength"]
+        self.filePaths = []
+
+        def load(columnName):
+            filePath = os.path.join(
+                storeDir, _getColumnFileName(contigIndex, columnName))
+            self.filePaths.append(filePath)
+            try:
+                return numpy.load(filePath, mmap_mode="r")
+            except (IOError, ValueError):
+                raise exceptions.FileOpenFailedException(filePath)
+
+        def loadFields(kind):
+            columns = []
+            for index, (key, fieldType) in enumerate(zip(
+                    contigManifest[kind + "Keys"],
+                    contigManifest[kind + "Types"])):
+                columnName = "{}{}".format(kind, index)
+                lengths = None
+                if fieldType in _numericTypes:
+                    lengths = load(columnName + "Lengths")
+                columns.append(
+                    _FieldColumn(key, load(columnName), lengths))
+            return columns
+        self.starts = load("starts")
+        self.ends = load("ends")
+        self.referenceBases = load("referenceBases")
+        self.alternateBases = load("alternateBases")
+        self.names = load("names")
+        self.filters = load("filters")
+        self.genotypes = load("genotypes")
+        self.phased = load("phased")
+        self.infos = loadFields("info")
+        self.formats = loadFields("format")
+
+    def getRowRange(self, start, end):
+        """
+        Returns the (first, last) range of rows that may hold variants
+        overlapping the specified region. Variants are sorted by start,
+        so only those starting within the longest variant length before
+        the region can overlap it.
+        """
+        first = int(numpy.searchsorted(
+            self.starts, start - self.maxLength, side="left"))
+        last = int(numpy.searchsorted(self.starts, end, side="left"))
+        return first, max(first, last)
+
+
+class ColumnarVariantSet(
+        datamodel.PysamDatamodelMixin, variants.AbstractVariantSet):
+    """
+    Class representing a variant set backed by a variant store. Variants
+    are built from contiguous blocks of rows of the store's columns,
+    including only the genotype matrix columns of the requested call
+    sets.
+    """
+    blockSize = 256
+
+    def __init__(self, parentContainer, localId, dataDir, backend):
+        super(ColumnarVariantSet, self).__init__(parentContainer, localId)
+        self._dataDir = dataDir
+        self._setAccessTimes(dataDir)
+        manifestPath = os.path.join(dataDir, MANIFEST_FILE_NAME)
+        try:
+            with open(manifestPath) as manifestFile:
+                manifest = json.load(manifestFile)
+        except (IOError, ValueError):
+            raise exceptions.FileOpenFailedException(manifestPath)
+        if manifest.get("version") != STORE_FORMAT_VERSION:
+            raise exceptions.FileOpenFailedException(manifestPath)
+        self._manifestPath = manifestPath
+        self._sampleIndexes = {}
+        for index, sample in enumerate(manifest["samples"]):
+            self.addCallSet(sample)
+            self._sampleIndexes[self.getCallSetId(sample)] = index
+        self._metadata = []
+        for jsonDict in manifest["metadata"]:
+            metadatum = protocol.VariantSetMetadata.fromJsonDict(jsonDict)
+            metadatum.id = self.getMetadataId(metadatum)
+            self._metadata.append(metadatum)
+        self._contigs = {}
+        for contigIndex, contigManifest in enumerate(manifest["contigs"]):
+            contig = _ContigColumns(dataDir, contigIndex, contigManifest)
+            self._contigs[contig.name] = contig
+
+    def getMetadata(self):
+        return self._metadata
+
+    def getNumVariants(self, referenceName=None):
+        if referenceName is None:
+            return sum(
+                contig.numVariants for contig in self._contigs.values())
+        if referenceName in self._contigs:
+            return self._contigs[referenceName].numVariants
+        return 0
+
+    def getDataFilePaths(self):
+        paths = [self._dataDir, self._manifestPath]
+        for referenceName in sorted(self._contigs.keys()):
+            paths.extend(self._contigs[referenceName].filePaths)
+        return paths
+
+    def getReferenceNames(self):
+        return sorted(self._contigs.keys())
+
+    def getReferenceRange(self, referenceName):
+        contig = self._contigs.get(referenceName)
+        if contig is None or contig.numVariants == 0:
+            return 0, 0
+        return int(contig.starts[0]), int(contig.starts[-1]) + contig.maxLength
+
+    def getDataDir(self):
+        return self._dataDir
+
+    def getVariant(self, compoundId):
+        contig = self._contigs.get(compoundId.referenceName)
+        if contig is None:
+            raise exceptions.ObjectNotFoundException(compoundId)
+        start = int(compoundId.start)
+        first = int(numpy.searchsorted(contig.starts, start, side="left"))
+        last = int(numpy.searchsorted(contig.starts, start, side="right"))
+        for gaVariant in self._convertRows(
+                contig, first, last, self._callSetIds):
+            if self.hashVariant(gaVariant) == compoundId.md5:
+                return gaVariant
+        raise exceptions.ObjectNotFoundException(compoundId)
+
+    def getVariants(self, referenceName, startPosition, endPosition,
+                    callSetIds=None, variantFilter=None,
+                    carrierCallSetIds=None):
+        """
+        Returns an iterator over the specified variants. The parameters
+        correspond to the attributes of a GASearchVariantsRequest object.
+        If a VariantFilter is specified, calls are only built for the
+        variants it includes. If carrierCallSetIds are specified, only
+        the variants in which each of these call sets carries a non
+        reference allele in the genotype matrix are built.
+        """
+        callSetIds = self._checkCallSetIds(callSetIds)
+        carrierIndexes = [
+            self._sampleIndexes[callSetId] for callSetId in
+            self._checkCallSetIds(carrierCallSetIds or [])]
+        contig = self._contigs.get(referenceName)
+        if contig is None:
+            return
+        first, last = contig.getRowRange(startPosition, endPosition)
+        for blockStart in range(first, last, self.blockSize):
+            blockEnd = min(blockStart + self.blockSize, last)
+            for gaVariant in self._convertRows(
+                    contig, blockStart, blockEnd, callSetIds, startPosition,
+                    variantFilter, carrierIndexes):
+                yield gaVariant
+
+    def getCarrierCallSetIds(self, compoundId):
+        contig = self._contigs.get(compoundId.referenceName)
+        if contig is None:
+            raise exceptions.ObjectNotFoundException(compoundId)
+        start = int(compoundId.start)
+        first = int(numpy.searchsorted(contig.starts, start, side="left"))
+        last = int(numpy.searchsorted(contig.starts, start, side="right"))
+        gaVariants = self._convertRows(contig, first, last, [])
+        for row, gaVariant in zip(range(first, last), gaVariants):
+            if self.hashVariant(gaVariant) == compoundId.md5:
+                carriers = (contig.genotypes[row] > 0).any(axis=1)
+                return [
+                    self.getCallSetByIndex(index).getId()
+                    for index in numpy.nonzero(carriers)[0]]
+        raise exceptions.ObjectNotFoundException(compoundId)
+
+    def getGenotypeRows(self, referenceName, startPosition, endPosition,
+                        callSetIds=None, includeLikelihoods=False):
+        """
+        Returns an iterator over the genotypematrix.GenotypeRows for the
+        specified call sets, which are sliced out of the genotype matrix
+        of the store a block of rows at a time.
+        """
+        callSetIds = self._checkCallSetIds(callSetIds)
+        contig = self._contigs.get(referenceName)
+        if contig is None:
+            return
+        sampleIndexes = [
+            self._sampleIndexes[callSetId] for callSetId in callSetIds]
+        likelihoodColumn = None
+        if includeLikelihoods:
+            for column in contig.formats:
+                if column.key == 'GL':
+                    likelihoodColumn = column
+        first, last = contig.getRowRange(startPosition, endPosition)
+        for blockStart in range(first, last, self.blockSize):
+            blockEnd = min(blockStart + self.blockSize, last)
+            rows = numpy.arange(blockStart, blockEnd)
+            rows = rows[contig.ends[blockStart:blockEnd] > startPosition]
+            if len(rows) == 0:
+                continue
+            genotypes = contig.genotypes[rows][:, sampleIndexes]
+            phased = contig.phased[rows][:, sampleIndexes]
+            likelihoods = None
+            if likelihoodColumn is not None:
+                likelihoods = likelihoodColumn.getPaddedValues(
+                    rows, sampleIndexes)
+            starts = contig.starts[rows].tolist()
+            ends = contig.ends[rows].tolist()
+            referenceBases = contig.referenceBases[rows].tolist()
+            alternateBases = contig.alternateBases[rows].tolist()
+            for i in range(len(rows)):
+                alleles = []
+                if alternateBases[i] != b"":
+                    alleles = alternateBases[i].split(_separator)
+                rowLikelihoods = None
+                if likelihoods is not None:
+                    rowLikelihoods = likelihoods[i]
+                elif includeLikelihoods:
+                    # The contig has no GL field.
+                    rowLikelihoods = numpy.empty(
+                        (len(sampleIndexes), 0), dtype=numpy.float32)
+                yield genotypematrix.GenotypeRow(
+                    self.getVariantIdFor(
+                        contig.name, starts[i], referenceBases[i], alleles),
+                    starts[i], ends[i], referenceBases[i], alleles,
+                    genotypes[i], phased[i], rowLikelihoods)
+
+    def _convertRows(self, contig, first, last, callSetIds,
+                     startPosition=None, variantFilter=None,
+                     carrierIndexes=None):
+        """
+        Returns the list of GA Variants for the specified block of rows
+        of the specified contig, with the calls for the specified call
+        sets. Only the variants that end after the specified start
+        position, are carried by each of the samples with the specified
+        indexes and are included by the specified VariantFilter are
+        returned.
+        """
+        if carrierIndexes is None:
+            carrierIndexes = []
+        rows = numpy.arange(first, last)
+        if startPosition is not None:
+            rows = rows[contig.ends[first:last] > startPosition]
+        if len(carrierIndexes) > 0 and len(rows) > 0:
+            genotypes = contig.genotypes[rows][:, carrierIndexes]
+            rows = rows[(genotypes > 0).any(axis=2).all(axis=1)]
+        if len(rows) == 0:
+            return []
+        # Calls are listed in the order of the samples in the store, as
+        # they are in the records of a HtslibVariantSet.
+        sampleIndexes = sorted(
+            self._sampleIndexes[callSetId] for callSetId in callSetIds)
+        callSets = [self.getCallSetByIndex(index) for index in sampleIndexes]
+        starts = contig.starts[rows].tolist()
+        ends = contig.ends[rows].tolist()
+        referenceBases = contig.referenceBases[rows].tolist()
+        alternateBases = contig.alternateBases[rows].tolist()
+        names = contig.names[rows].tolist()
+        filters = contig.filters[rows].tolist()
+        infos = [(column.key, column.decode(rows)) for column in contig.infos]
+        gaVariants = []
+        includedRows = []
+        for i in range(len(rows)):
+            gaVariant = self._createGaVariant()
+            gaVariant.referenceName = contig.name
+            if names[i] != b"":
+                gaVariant.names = names[i].split(b";")
+            gaVariant.start = starts[i]
+            gaVariant.end = ends[i]
+            gaVariant.referenceBases = referenceBases[i]
+            if alternateBases[i] != b"":
+                gaVariant.alternateBases = alternateBases[i].split(_separator)
+            for key, cells in infos:
+                if cells[i] is not None:
+                    gaVariant.info[key] = list(cells[i])
+            if variantFilter is not None:
+                variantFilters = []
+                if filters[i] != b"":
+                    variantFilters = filters[i].split(b";")
+                if not variantFilter.includesVariant(
+                        gaVariant, variantFilters):
+                    continue
+            gaVariant.id = self.getVariantId(gaVariant)
+            gaVariants.append(gaVariant)
+            includedRows.append(rows[i])
+        if len(callSets) > 0 and len(includedRows) > 0:
+            self._addCalls(contig, includedRows, sampleIndexes, callSets,
+                           gaVariants)
+        return gaVariants
+
+    def _addCalls(self, contig, rows, sampleIndexes, callSets, gaVariants):
+        """
+        Adds the calls for the specified samples in the specified rows
+        to the corresponding GA Variants. The genotypes, phasing and
+        FORMAT cells of the whole block are sliced and decoded as arrays,
+        each distinct FORMAT value once, so that only the calls
+        themselves are assembled for each sample.
+        """
+        genotypes = contig.genotypes[rows][:, sampleIndexes]
+        # Genotypes are padded at the end, so each is cut to its ploidy.
+        ploidies = (genotypes != _paddingAllele).sum(axis=2).tolist()
+        genotypes = genotypes.tolist()
+        phasesets = numpy.array(
+            [None, variants.convertVCFPhaseset(None)], dtype=object)[
+            contig.phased[rows][:, sampleIndexes].astype(numpy.intp)
+        ].tolist()
+        formats = [
+            (column.key, column.decode(
+                rows, sampleIndexes, likelihoods=column.key == 'GL'))
+            for column in contig.formats]
+        callSetFields = [
+            (callSet.getId(), callSet.getSampleName()) for callSet in callSets]
+        for i, gaVariant in enumerate(gaVariants):
+            rowGenotypes, rowPloidies = genotypes[i], ploidies[i]
+            rowPhasesets = phasesets[i]
+            rowFormats = [(key, cells[i]) for key, cells in formats]
+            for j, (callSetId, sampleName) in enumerate(callSetFields):
+                info = {}
+                genotypeLikelihood = []
+                for key, cells in rowFormats:
+                    cell = cells[j]
+                    if cell is None:
+                        continue
+                    if key == 'GL' and cell is not _noneCell:
+                        genotypeLikelihood = list(cell)
+                    else:
+                        info[key] = list(cell)
+                call = protocol.Call(
+                    callSetId=callSetId, callSetName=sampleName,
+                    genotype=rowGenotypes[j][:rowPloidies[j]],
+                    phaseset=rowPhasesets[j],
+                    genotypeLikelihood=genotypeLikelihood, info=info)
+                call.sampleId = sampleName
+                gaVariant.calls.append(call)
@@ -151,6 +151,28 @@ class RequestValidationFailureException(BadRequestException):
             jsonDict, requestClass, validator.getInvalidFields(jsonDict))
 
 
+class BadRequestArgumentException(BadRequestException):
+    def __init__(self, name, value):
+        self.message = "Invalid value for '{}': '{}'".format(name, value)
+
+
+class BadFieldMaskException(BadRequestException):
+    def __init__(self, fields, reason):
+        self.message = "Invalid fields '{}': {}".format(fields, reason)
+
+
+class BadReadFilterException(BadRequestException):
+    def __init__(self, name, value):
+        self.message = "Invalid read filter value for '{}': '{}'".format(
+            name, value)
+
+
+class BadVariantFilterException(BadRequestException):
+    def __init__(self, expression, reason):
+        self.message = "Invalid variant filter '{}': {}".format(
+            expression, reason)
+
+
 class BadReadsSearchRequestBothRefs(BadRequestException):
     message = "only one of referenceId and referenceName can be specified"
 
@@ -332,6 +354,25 @@ class DatasetNameNotFoundException(NotFoundException):
         self.message = "Dataset with name '{0}' not found".format(name)
 
 
+class ExportJobNotFoundException(NotFoundException):
+    """
+    Indicates a request was made for an export job that does not exist.
+    """
+    def __init__(self, jobId):
+        self.message = "Export job '{0}' not found".format(jobId)
+
+
+class ExportJobNotFinishedException(RuntimeException):
+    """
+    Indicates a request was made for the output of an export job that
+    has not finished successfully.
+    """
+    httpStatus = 409
+
+    def __init__(self, jobId, state):
+        self.message = "Export job '{0}' is {1}".format(jobId, state)
+
+
 class DataException(BaseServerException):
     """
     Exceptions thrown during the server startup, and processing faulty VCFs
@@ -375,13 +416,14 @@ class NotIndexedException(MalformedException):
 class OverlappingVcfException(MalformedException):
     """
     Exception thrown when two VCF files within a VariantSet directory
-    contain records for the same contig.
+    contain records for overlapping regions of the same contig.
     """
     def __init__(self, fileName, contig):
         self.message = (
             "VCF file '{}' contains records for contig '{}'. Other files"
-            " in this VariantSet have records for this contig, and overlapping"
-            " VCFs are not permitted.".format(fileName, contig))
+            " in this VariantSet have records in the same region of this"
+            " contig, and overlapping VCFs are not permitted.".format(
+                fileName, contig))
 
 
 class InconsistentMetaDataException(MalformedException):
@@ -421,6 +463,30 @@ class InconsistentCallSetIdException(MalformedException):
             " directory.".format(fileName))
 
 
+class OverlappingSampleShardsException(MalformedException):
+    """
+    Exception thrown when a sample appears in more than one sample shard
+    of a VariantSet.
+    """
+    def __init__(self, shardDir, sampleName):
+        self.message = (
+            "Sample '{}' in sample shard '{}' also appears in another"
+            " shard of this VariantSet. Each sample must be in exactly"
+            " one shard.".format(sampleName, shardDir))
+
+
+class StaleCarrierIndexException(MalformedException):
+    """
+    Exception thrown when the carrier index of a VariantSet was built
+    from data files that have since changed.
+    """
+    def __init__(self, fileName):
+        self.message = (
+            "The carrier index {} does not match the data files of its"
+            " VariantSet. Rebuild the index after changing the data"
+            " files.".format(fileName))
+
+
 class NotExactlyOneReferenceException(MalformedException):
     """
     A FASTA file has a reference count not equal to one
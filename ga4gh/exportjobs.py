@@ -0,0 +1,330 @@
+"""
+Export jobs, which write the output of long running exports to a spool
+directory in the background.
+
+An export job runs one of the streaming export endpoints of the backend
+(the NDJSON export of a variant set, or a BAM or VCF slice) and writes
+its output to a file in the spool directory, from which it can be
+downloaded in byte ranges once the job has finished, so that a client
+that loses its connection can resume the download rather than the
+export. The jobs are queued in order of priority, and then of
+submission, and are run by a bounded pool of threads, each of which
+runs the highest priority job of a user who has fewer than the maximum
+number of jobs running.
+
+The threads of the jobs run alongside the request threads, so the tasks
+of variant exports are run in worker processes owned by the manager,
+which read the data files through pysam handles of their own rather than
+those of the server process; the BAM and VCF slices open their data
+files for each export.
+
+Jobs are held in memory, and a finished job and its output are removed
+once they have been kept for the retention period. As the jobs of a
+previous server process cannot be downloaded, the files they left in
+the spool directory are removed when a manager starts, once they are
+older than the retention period; newer files may belong to the jobs of
+other server processes sharing the spool directory.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import bisect
+import itertools
+import os
+import re
+import threading
+import time
+import uuid
+
+import ga4gh.datamodel.bamslice as bamslice
+import ga4gh.datamodel.variantexport as variantexport
+import ga4gh.exceptions as exceptions
+
+
+QUEUED = "QUEUED"
+RUNNING = "RUNNING"
+SUCCEEDED = "SUCCEEDED"
+FAILED = "FAILED"
+
+EXPORT_TYPES = {
+    "variants": ("runExportVariantSet", variantexport.EXPORT_MIMETYPE),
+    "bam": ("runExportReadGroupSetBam", bamslice.BAM_MIMETYPE),
+    # VCF slices are BCF when they are copied from a BCF file, so the
+    # endpoint returns the mimetype with the pieces.
+    "vcf": ("runExportVariantSetSlice", None),
+}
+"""
+Maps each type of export job to the name of the backend method that
+runs it and the mimetype of its output.
+"""
+
+_partialSuffix = ".part"
+# The names of the output files of jobs, finished or partial, which are
+# named after their IDs.
+_outputFileNamePattern = re.compile(r"^[0-9a-f]{32}(\.part)?$")
+
+
+def _getTimeMillis():
+    return int(time.time() * 1000)
+
+
+class ExportJob(object):
+    """
+    An export of the object with the specified ID, with the specified
+    request arguments, submitted by the specified user.
+    """
+    def __init__(self, exportType, objectId, args, priority, userId):
+        self.id = uuid.uuid4().hex
+        self.exportType = exportType
+        self.objectId = objectId
+        self.args = args
+        self.priority = priority
+        self.userId = userId
+        self.state = QUEUED
+        self.mimetype = None
+        self.bytesWritten = 0
+        self.errorMessage = None
+        self.created = _getTimeMillis()
+        self.started = None
+        self.finished = None
+        self.pieces = None
+
+    def toJsonDict(self):
+        """
+        Returns the JSON dictionary describing the progress of this job.
+        The ID of the user is not included.
+        """
+        return {
+            "id": self.id,
+            "type": self.exportType,
+            "objectId": self.objectId,
+            "args": self.args,
+            "priority": self.priority,
+            "state": self.state,
+            "mimetype": self.mimetype,
+            "bytesWritten": self.bytesWritten,
+            "errorMessage": self.errorMessage,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class ExportJobManager(object):
+    """
+    Queues export jobs on the specified backend and runs them with the
+    specified number of threads, writing their output to the specified
+    spool directory, with at most the specified number of jobs of each
+    user running at once. Finished jobs and their output are removed
+    once they have been kept for the specified number of seconds.
+    """
+    maxPriority = 9
+    """
+    The highest priority of a job; the lowest is 0.
+    """
+
+    def __init__(self, backend, spoolDir, numThreads=2, maxJobsPerUser=1,
+                 retention=86400):
+        if numThreads < 1 or maxJobsPerUser < 1:
+            raise ValueError(
+                "The number of threads and jobs per user must be positive")
+        if retention < 0:
+            raise ValueError("The retention must be a non-negative value")
+        self._backend = backend
+        self._spoolDir = spoolDir
+        self._maxJobsPerUser = maxJobsPerUser
+        self._retentionMillis = int(retention * 1000)
+        self._variantExporter = variantexport.VariantExporter(
+            alwaysInWorkers=True)
+        self._variantExporter.setNumProcesses(numThreads)
+        if not os.path.isdir(spoolDir):
+            os.makedirs(spoolDir)
+        self._removeStaleFiles()
+        self._jobs = {}
+        # The (-priority, sequenceNumber, job) triples of the queued jobs,
+        # in the order they are run.
+        self._queue = []
+        self._sequenceNumbers = itertools.count()
+        self._numRunningJobs = {}
+        self._closed = False
+        self._condition = threading.Condition()
+        self._threads = []
+        for _ in range(numThreads):
+            thread = threading.Thread(target=self._runJobs)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, exportType, objectId, args, priority=0, userId=None):
+        """
+        Queues an export job of the specified type for the object with
+        the specified ID and request arguments, and returns it. The
+        arguments are checked by the export endpoint before the job is
+        queued, so that requests that cannot succeed raise their errors
+        here.
+        """
+        if exportType not in EXPORT_TYPES:
+            raise exceptions.BadRequestArgumentException("type", exportType)
+        if (not isinstance(priority, int) or isinstance(priority, bool) or
+                not 0 <= priority <= self.maxPriority):
+            raise exceptions.BadRequestArgumentException(
+                "priority", priority)
+        methodName, mimetype = EXPORT_TYPES[exportType]
+        if exportType == "variants":
+            pieces = getattr(self._backend, methodName)(
+                objectId, args, self._variantExporter)
+        else:
+            pieces = getattr(self._backend, methodName)(objectId, args)
+        if mimetype is None:
+            mimetype, pieces = pieces
+        job = ExportJob(exportType, objectId, args, priority, userId)
+        job.mimetype = mimetype
+        job.pieces = pieces
+        with self._condition:
+            if self._closed:
+                raise exceptions.NotImplementedException(
+                    "Export jobs have been shut down")
+            self._removeExpiredJobs()
+            self._jobs[job.id] = job
+            bisect.insort(
+                self._queue, (-priority, next(self._sequenceNumbers), job))
+            self._condition.notify()
+        return job
+
+    def getJob(self, jobId, userId=None):
+        """
+        Returns the job with the specified ID, or raises an
+        ExportJobNotFoundException if there is none. If userId is not
+        None, the jobs submitted by other users are not found either.
+        """
+        with self._condition:
+            self._removeExpiredJobs()
+            job = self._jobs.get(jobId)
+        if job is None or (userId is not None and job.userId != userId):
+            raise exceptions.ExportJobNotFoundException(jobId)
+        return job
+
+    def getOutputPath(self, jobId, userId=None):
+        """
+        Returns the path of the output of the job with the specified ID,
+        which is found as by getJob. Raises an
+        ExportJobNotFinishedException unless it has succeeded.
+        """
+        job = self.getJob(jobId, userId)
+        if job.state != SUCCEEDED:
+            raise exceptions.ExportJobNotFinishedException(jobId, job.state)
+        return self._getOutputPath(job)
+
+    def _getOutputPath(self, job):
+        return os.path.join(self._spoolDir, job.id)
+
+    def _removeStaleFiles(self):
+        """
+        Removes the output files, finished or partial, of the jobs of
+        earlier managers from the spool directory, if they were last
+        modified longer ago than the retention period. Newer files may
+        belong to the jobs of other processes, which remove them.
+        """
+        expiry = _getTimeMillis() - self._retentionMillis
+        for fileName in os.listdir(self._spoolDir):
+            path = os.path.join(self._spoolDir, fileName)
+            if _outputFileNamePattern.match(fileName) is None:
+                continue
+            try:
+                if (os.path.isfile(path) and
+                        os.path.getmtime(path) * 1000 <= expiry):
+                    os.unlink(path)
+            except OSError:
+                # Another process removed the file first.
+                pass
+
+    def _removeExpiredJobs(self):
+        """
+        Removes the jobs that finished longer ago than the retention
+        period, and deletes their output. Must be called with the lock
+        held.
+        """
+        expiry = _getTimeMillis() - self._retentionMillis
+        expiredJobs = [
+            job for job in self._jobs.values()
+            if job.finished is not None and job.finished <= expiry]
+        for job in expiredJobs:
+            del self._jobs[job.id]
+            outputPath = self._getOutputPath(job)
+            if os.path.exists(outputPath):
+                os.unlink(outputPath)
+
+    def close(self):
+        """
+        Stops running jobs once those already running have finished, and
+        waits for the threads to exit. Queued jobs are not run.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._variantExporter.close()
+
+    def _takeJob(self):
+        """
+        Removes and returns the first queued job of a user with fewer
+        than the maximum number of jobs running, or None if there is
+        none. Must be called with the lock held.
+        """
+        for index, (_, _, job) in enumerate(self._queue):
+            if (self._numRunningJobs.get(job.userId, 0) <
+                    self._maxJobsPerUser):
+                del self._queue[index]
+                return job
+        return None
+
+    def _runJobs(self):
+        while True:
+            with self._condition:
+                job = None
+                while not self._closed:
+                    job = self._takeJob()
+                    if job is not None:
+                        break
+                    self._condition.wait()
+                if job is None:
+                    return
+                self._numRunningJobs[job.userId] = \
+                    self._numRunningJobs.get(job.userId, 0) + 1
+                job.state = RUNNING
+                job.started = _getTimeMillis()
+            self._runJob(job)
+            with self._condition:
+                self._numRunningJobs[job.userId] -= 1
+                if self._numRunningJobs[job.userId] == 0:
+                    del self._numRunningJobs[job.userId]
+                # Another job of this user may now be run.
+                self._condition.notify_all()
+
+    def _runJob(self, job):
+        """
+        Writes the output of the specified job to a partial file, which
+        is renamed once all of it has been written.
+        """
+        outputPath = self._getOutputPath(job)
+        partialPath = outputPath + _partialSuffix
+        try:
+            with open(partialPath, "wb") as outputFile:
+                for piece in job.pieces:
+                    if not isinstance(piece, bytes):
+                        piece = piece.encode("utf8")
+                    outputFile.write(piece)
+                    job.bytesWritten += len(piece)
+            os.rename(partialPath, outputPath)
+            state = SUCCEEDED
+        except Exception as exception:
+            if os.path.exists(partialPath):
+                os.unlink(partialPath)
+            job.errorMessage = str(exception)
+            state = FAILED
+        job.pieces = None
+        job.finished = _getTimeMillis()
+        job.state = state
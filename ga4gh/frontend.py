@@ -12,6 +12,8 @@ import datetime
 import socket
 import urlparse
 import functools
+import hashlib
+import zlib
 
 import flask
 import flask.ext.cors as cors
@@ -25,6 +27,16 @@ import requests
 import ga4gh
 import ga4gh.backend as backend
 import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.bamslice as bamslice
+import ga4gh.datamodel.bgzf as bgzf
+import ga4gh.datamodel.pileup as pileup
+import ga4gh.datamodel.stats as stats
+import ga4gh.datamodel.variantexport as variantexport
+import ga4gh.datamodel.variantslice as variantslice
+import ga4gh.datamodel.variants as variants
+import ga4gh.exportjobs as exportjobs
+import ga4gh.genotypematrix as genotypematrix
+import ga4gh.metrics as metrics
 import ga4gh.protocol as protocol
 import ga4gh.exceptions as exceptions
 
@@ -32,6 +44,13 @@ import ga4gh.exceptions as exceptions
 MIMETYPE = "application/json"
 SEARCH_ENDPOINT_METHODS = ['POST', 'OPTIONS']
 SECRET_KEY_LENGTH = 24
+COMPRESSION_ENCODINGS = ['gzip', 'deflate']
+# The number of bytes of a file sent in each chunk of a response.
+FILE_CHUNK_SIZE = 65536
+# Responses in these mimetypes are already compressed.
+COMPRESSED_MIMETYPES = [
+    bamslice.BAM_MIMETYPE, variantslice.VCF_MIMETYPE,
+    variantslice.BCF_MIMETYPE]
 
 app = flask.Flask(__name__)
 assert not hasattr(app, 'urls')
@@ -83,6 +102,8 @@ class ServerStatus(object):
         keys = [
             'DEBUG', 'REQUEST_VALIDATION', 'RESPONSE_VALIDATION',
             'DEFAULT_PAGE_SIZE', 'MAX_RESPONSE_LENGTH',
+            'RESPONSE_COMPRESSION', 'RESPONSE_COMPRESSION_MIN_SIZE',
+            'RESPONSE_COMPRESSION_LEVEL', 'CACHE_CONTROL', 'STATS_PROCESSES',
         ]
         return [(k, app.config[k]) for k in keys]
 
@@ -168,6 +189,21 @@ def configure(configFile=None, baseConfig="ProductionConfig",
     # Setup file handle cache max size
     datamodel.fileHandleCache.setMaxCacheSize(
         app.config["FILE_HANDLE_CACHE_MAX_SIZE"])
+    # Setup the number of pileups cached
+    pileup.pileupCache.setMaxCacheSize(app.config["PILEUP_CACHE_MAX_SIZE"])
+    # Setup the number of processes used to precompute statistics
+    stats.statsEngine.setNumProcesses(app.config["STATS_PROCESSES"])
+    # Setup the number of processes used to build density indexes
+    variants.densityIndexBuilder.setNumProcesses(
+        app.config["DENSITY_INDEX_PROCESSES"])
+    # Setup the number of threads used to fetch from sample shards
+    variants.shardFetcher.setNumThreads(app.config["VARIANT_SHARD_THREADS"])
+    # Setup the number of processes used to export variants
+    variantexport.variantExporter.setNumProcesses(
+        app.config["EXPORT_PROCESSES"])
+    # Setup the number of threads used to compress VCF slices
+    bgzf.blockCompressor.setNumThreads(
+        app.config["BGZF_COMPRESSION_THREADS"])
     # Setup CORS
     cors.CORS(app, allow_headers='Content-Type')
     app.serverStatus = ServerStatus()
@@ -202,6 +238,12 @@ def configure(configFile=None, baseConfig="ProductionConfig",
     theBackend.setResponseValidation(app.config["RESPONSE_VALIDATION"])
     theBackend.setDefaultPageSize(app.config["DEFAULT_PAGE_SIZE"])
     theBackend.setMaxResponseLength(app.config["MAX_RESPONSE_LENGTH"])
+    if app.config["EXPORT_SPOOL_DIR"] is not None:
+        theBackend.setExportJobManager(exportjobs.ExportJobManager(
+            theBackend, app.config["EXPORT_SPOOL_DIR"],
+            app.config["EXPORT_JOB_THREADS"],
+            app.config["EXPORT_JOBS_PER_USER"],
+            app.config["EXPORT_JOB_RETENTION"]))
     app.backend = theBackend
     app.secret_key = os.urandom(SECRET_KEY_LENGTH)
     app.oidcClient = None
@@ -251,22 +293,45 @@ def configure(configFile=None, baseConfig="ProductionConfig",
             app.oidcClient.store_registration_info(response)
 
 
-def getFlaskResponse(responseString, httpStatus=200):
+def getFlaskResponse(responseString, httpStatus=200, mimetype=MIMETYPE):
     """
-    Returns a Flask response object for the specified data and HTTP status.
+    Returns a Flask response object for the specified data, HTTP status
+    and mimetype.
     """
-    return flask.Response(responseString, status=httpStatus, mimetype=MIMETYPE)
+    return flask.Response(responseString, status=httpStatus, mimetype=mimetype)
 
 
-def handleHttpPost(request, endpoint):
+def getResponseMimetype(request, mimetypes=protocol.MIMETYPES):
+    """
+    Returns the mimetype of the wire format used to respond to the
+    specified request. This is negotiated using the Accept header of
+    the request; we respond with JSON unless the client prefers one of
+    the other specified formats that we support for the endpoint.
+    """
+    return request.accept_mimetypes.best_match(mimetypes, default=MIMETYPE)
+
+
+def getNegotiatedFlaskResponse(responseString, mimetype):
+    """
+    Returns a Flask response object for the specified data, which has
+    been serialized in the specified negotiated mimetype.
+    """
+    response = getFlaskResponse(responseString, mimetype=mimetype)
+    response.vary.add("Accept")
+    return response
+
+
+def handleHttpPost(request, endpoint, mimetypes=protocol.MIMETYPES):
     """
     Handles the specified HTTP POST request, which maps to the specified
-    protocol handler endpoint and protocol request class.
+    protocol handler endpoint and protocol request class. The response
+    is written in one of the specified mimetypes.
     """
     if request.mimetype != MIMETYPE:
         raise exceptions.UnsupportedMediaTypeException()
-    responseStr = endpoint(request.get_data())
-    return getFlaskResponse(responseStr)
+    mimetype = getResponseMimetype(request, mimetypes)
+    responseStr = endpoint(request.get_data(), mimetype)
+    return getNegotiatedFlaskResponse(responseStr, mimetype)
 
 
 def handleList(id_, endpoint, request):
@@ -277,13 +342,56 @@ def handleList(id_, endpoint, request):
     return getFlaskResponse(responseStr)
 
 
-def handleHttpGet(id_, endpoint):
+def handleHttpGet(id_, request, endpoint):
     """
     Handles the specified HTTP GET request, which maps to the specified
     protocol handler endpoint and protocol request class
     """
-    responseStr = endpoint(id_)
-    return getFlaskResponse(responseStr)
+    mimetype = getResponseMimetype(request)
+    responseStr = endpoint(id_, mimetype)
+    return getNegotiatedFlaskResponse(responseStr, mimetype)
+
+
+def getEtag(datamodelObject, mimetype):
+    """
+    Returns the entity tag for the representation of the specified
+    datamodel object in the specified mimetype. This changes whenever
+    the server or protocol version changes, or the data files backing
+    the object are modified. Objects that are not backed by files are
+    assumed to be unchanged since the server started.
+    """
+    modificationTime = datamodelObject.getDataModificationTime()
+    if modificationTime is None:
+        modificationTime = app.serverStatus.startupTime
+    fields = [
+        ga4gh.__version__, protocol.version, mimetype,
+        datamodelObject.getId(), repr(modificationTime)]
+    digest = hashlib.md5("\t".join(fields).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def handleHttpGetObject(id_, request, getObjectMethod):
+    """
+    Handles the specified HTTP GET request for the datamodel object
+    returned by the specified backend method. The response carries an
+    entity tag, and we respond with 304 Not Modified without
+    serializing the object if the client already has the current
+    representation. The tag is weak, as the response may be sent with
+    any of the content codings, which are not byte for byte identical.
+    """
+    mimetype = getResponseMimetype(request)
+    datamodelObject = getObjectMethod(id_)
+    etag = getEtag(datamodelObject, mimetype)
+    if request.if_none_match.contains_weak(etag):
+        response = flask.Response(status=304)
+    else:
+        responseStr = app.backend.runGetRequest(datamodelObject, mimetype)
+        response = getFlaskResponse(responseStr, mimetype=mimetype)
+    response.set_etag(etag, weak=True)
+    response.vary.add("Accept")
+    if app.config["CACHE_CONTROL"] is not None:
+        response.headers["Cache-Control"] = app.config["CACHE_CONTROL"]
+    return response
 
 
 def handleHttpOptions():
@@ -332,6 +440,132 @@ def startLogin():
     return flask.redirect(result.url)
 
 
+def getCompressor(encoding, level):
+    """
+    Returns a zlib compression object for the specified HTTP content
+    coding (gzip or deflate) and compression level.
+    """
+    windowBits = zlib.MAX_WBITS
+    if encoding == 'gzip':
+        # Adding 16 to the window bits makes zlib write a gzip header
+        # and trailer rather than a zlib one.
+        windowBits += 16
+    return zlib.compressobj(level, zlib.DEFLATED, windowBits)
+
+
+def compressStream(chunks, compressor, requestMetrics):
+    """
+    Returns a generator over the compressed form of the specified
+    iterable of byte strings. We flush the compressor after each
+    chunk so that clients can decode each part of a streamed response
+    as soon as it is received.
+    """
+    for chunk in chunks:
+        with requestMetrics.timer("compress"):
+            data = compressor.compress(chunk)
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield data
+    with requestMetrics.timer("compress"):
+        data = compressor.flush()
+    yield data
+
+
+def compressResponse(request, response, requestMetrics):
+    """
+    Compresses the body of the specified response using the best of
+    the content codings accepted by the specified request, if any,
+    unless it is already compressed.
+    Streamed responses are compressed as they are sent; other responses
+    are compressed only if their length is at least the configured
+    minimum size.
+    """
+    if not app.config["RESPONSE_COMPRESSION"]:
+        return response
+    if (response.status_code < 200 or response.status_code in (204, 304) or
+            response.direct_passthrough or
+            response.mimetype in COMPRESSED_MIMETYPES or
+            'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(COMPRESSION_ENCODINGS)
+    if encoding is None:
+        return response
+    compressor = getCompressor(
+        encoding, app.config["RESPONSE_COMPRESSION_LEVEL"])
+    if response.is_streamed:
+        response.response = compressStream(
+            response.iter_encoded(), compressor, requestMetrics)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config["RESPONSE_COMPRESSION_MIN_SIZE"]:
+            return response
+        with requestMetrics.timer("compress"):
+            data = compressor.compress(data) + compressor.flush()
+        response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def getServerTimingHeader(requestMetrics):
+    """
+    Returns the value of the Server-Timing header describing the
+    specified request metrics, in which times are given in milliseconds.
+    """
+    return ", ".join(
+        "{};dur={:.3f}".format(name, seconds * 1000)
+        for name, seconds in requestMetrics.getTimes())
+
+
+def logRequestMetrics(method, path, requestMetrics):
+    """
+    Logs the metrics for the specified request. This is done once the
+    response has been closed, so that the time taken to generate and
+    compress streamed responses is included.
+    """
+    times = " ".join(
+        "{}={:.3f}ms".format(name, seconds * 1000)
+        for name, seconds in requestMetrics.getTimes())
+    app.logger.debug("metrics: {} {} {}".format(method, path, times))
+
+
+@app.before_request
+def beginRequestMetrics():
+    """
+    Allocates the metrics object for the current request.
+    """
+    flask.g.requestMetrics = metrics.beginRequest()
+
+
+@app.after_request
+def finishResponse(response):
+    """
+    Applies the transformations common to all responses: content coding
+    negotiation and the reporting of request metrics. Streamed responses
+    are generated and compressed after their headers are sent, so they
+    have no Server-Timing header; their metrics are only logged.
+    """
+    request = flask.request
+    requestMetrics = flask.g.get('requestMetrics')
+    if requestMetrics is None:
+        requestMetrics = metrics.RequestMetrics()
+    response = compressResponse(request, response, requestMetrics)
+    if len(requestMetrics.getTimes()) > 0 and not response.is_streamed:
+        response.headers['Server-Timing'] = getServerTimingHeader(
+            requestMetrics)
+    response.call_on_close(functools.partial(
+        logRequestMetrics, request.method, request.path, requestMetrics))
+    return response
+
+
+@app.teardown_request
+def endRequestMetrics(exception):
+    """
+    Clears the metrics object for the current request.
+    """
+    metrics.endRequest()
+
+
 @app.before_request
 def checkAuthentication():
     """
@@ -366,7 +600,19 @@ def handleFlaskGetRequest(id_, flaskRequest, endpoint):
     Invokes the specified endpoint to generate a response.
     """
     if flaskRequest.method == "GET":
-        return handleHttpGet(id_, endpoint)
+        return handleHttpGet(id_, flaskRequest, endpoint)
+    else:
+        raise exceptions.MethodNotAllowedException()
+
+
+def handleFlaskGetObjectRequest(id_, flaskRequest, getObjectMethod):
+    """
+    Handles the specified flask request for one of the GET URLs that
+    return a datamodel object, using the specified backend method to
+    find the object.
+    """
+    if flaskRequest.method == "GET":
+        return handleHttpGetObject(id_, flaskRequest, getObjectMethod)
     else:
         raise exceptions.MethodNotAllowedException()
 
@@ -382,13 +628,102 @@ def handleFlaskListRequest(id_, flaskRequest, endpoint):
         raise exceptions.MethodNotAllowedException()
 
 
-def handleFlaskPostRequest(flaskRequest, endpoint):
+def handleFlaskExportRequest(id_, flaskRequest, endpoint, mimetype=None):
+    """
+    Handles the specified flask export request for one of the GET URLs.
+    Invokes the specified endpoint to generate the chunks of a response
+    in the specified mimetype, which is streamed as they are generated.
+    If mimetype is None, the endpoint returns the (mimetype, chunks)
+    pair of the response.
+    """
+    if flaskRequest.method == "GET":
+        chunks = endpoint(id_, flaskRequest.args)
+        if mimetype is None:
+            mimetype, chunks = chunks
+        return getFlaskResponse(chunks, mimetype=mimetype)
+    else:
+        raise exceptions.MethodNotAllowedException()
+
+
+def getRequestUserId(flaskRequest):
+    """
+    Returns the ID of the user making the specified request, which limits
+    the number of export jobs each user runs at once: the authentication
+    key if authentication is enabled, and otherwise the address of the
+    client.
+    """
+    if app.oidcClient is not None:
+        key = flask.session.get('key') or flaskRequest.args.get('key')
+        if key is not None:
+            return key
+    return flaskRequest.remote_addr
+
+
+def getExportJobUserId(flaskRequest):
+    """
+    Returns the ID of the user whose export jobs the specified request may
+    read when authentication is enabled, and otherwise None, as any
+    client may read any job.
+    """
+    if app.oidcClient is None:
+        return None
+    return getRequestUserId(flaskRequest)
+
+
+def iterFileRange(path, start, end):
+    """
+    Returns a generator over the bytes of the specified file from start
+    up to end.
+    """
+    with open(path, "rb") as dataFile:
+        dataFile.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = dataFile.read(min(remaining, FILE_CHUNK_SIZE))
+            if len(data) == 0:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def getFileResponse(flaskRequest, path, mimetype):
+    """
+    Returns a Flask response streaming the specified file, or the byte
+    range of it given by the Range header of the specified request, so
+    that interrupted downloads can be resumed. The file is sent as it is,
+    without being compressed.
+    """
+    length = os.path.getsize(path)
+    start, end = 0, length
+    httpStatus = 200
+    byteRange = flaskRequest.range
+    # Requests for several ranges are answered with the whole file.
+    if byteRange is not None and len(byteRange.ranges) == 1:
+        bounds = byteRange.range_for_length(length)
+        if bounds is None:
+            raise exceptions.RangeErrorException()
+        start, end = bounds
+        httpStatus = 206
+    response = flask.Response(
+        iterFileRange(path, start, end), status=httpStatus,
+        mimetype=mimetype, direct_passthrough=True)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Length'] = str(end - start)
+    if httpStatus == 206:
+        response.headers['Content-Range'] = \
+            byteRange.to_content_range_header(length)
+    return response
+
+
+def handleFlaskPostRequest(
+        flaskRequest, endpoint, mimetypes=protocol.MIMETYPES):
     """
     Handles the specified flask request for one of the POST URLS
-    Invokes the specified endpoint to generate a response.
+    Invokes the specified endpoint to generate a response in one of
+    the specified mimetypes.
     """
     if flaskRequest.method == "POST":
-        return handleHttpPost(flaskRequest, endpoint)
+        return handleHttpPost(flaskRequest, endpoint, mimetypes)
     elif flaskRequest.method == "OPTIONS":
         return handleHttpOptions()
     else:
@@ -433,14 +768,14 @@ def index():
 
 @DisplayedRoute('/references/<id>')
 def getReference(id):
-    return handleFlaskGetRequest(
-        id, flask.request, app.backend.runGetReference)
+    return handleFlaskGetObjectRequest(
+        id, flask.request, app.backend.getReference)
 
 
 @DisplayedRoute('/referencesets/<id>')
 def getReferenceSet(id):
-    return handleFlaskGetRequest(
-        id, flask.request, app.backend.runGetReferenceSet)
+    return handleFlaskGetObjectRequest(
+        id, flask.request, app.backend.getReferenceSet)
 
 
 @DisplayedRoute('/references/<id>/bases')
@@ -449,6 +784,60 @@ def listReferenceBases(id):
         id, flask.request, app.backend.runListReferenceBases)
 
 
+@DisplayedRoute('/readgroups/<id>/coverage')
+def listReadGroupCoverage(id):
+    return handleFlaskListRequest(
+        id, flask.request, app.backend.runListReadGroupCoverage)
+
+
+@DisplayedRoute('/variantsets/<id>/density')
+def listVariantSetDensity(id):
+    return handleFlaskListRequest(
+        id, flask.request, app.backend.runListVariantSetDensity)
+
+
+@DisplayedRoute('/variantsets/<id>/export')
+def exportVariantSet(id):
+    return handleFlaskExportRequest(
+        id, flask.request, app.backend.runExportVariantSet,
+        variantexport.EXPORT_MIMETYPE)
+
+
+@DisplayedRoute('/readgroupsets/<id>/bam')
+def exportReadGroupSetBam(id):
+    return handleFlaskExportRequest(
+        id, flask.request, app.backend.runExportReadGroupSetBam,
+        bamslice.BAM_MIMETYPE)
+
+
+@DisplayedRoute('/variantsets/<id>/vcf')
+def exportVariantSetSlice(id):
+    return handleFlaskExportRequest(
+        id, flask.request, app.backend.runExportVariantSetSlice)
+
+
+@DisplayedRoute('/exports', postMethod=True)
+def createExportJob():
+    return handleFlaskPostRequest(
+        flask.request,
+        lambda requestStr, mimetype: app.backend.runCreateExportJob(
+            requestStr, getRequestUserId(flask.request)),
+        [protocol.JSON_MIMETYPE])
+
+
+@DisplayedRoute('/exports/<id>')
+def getExportJob(id):
+    return getFlaskResponse(app.backend.runGetExportJob(
+        id, getExportJobUserId(flask.request)))
+
+
+@DisplayedRoute('/exports/<id>/data')
+def getExportJobData(id):
+    path, mimetype = app.backend.getExportJobOutput(
+        id, getExportJobUserId(flask.request))
+    return getFileResponse(flask.request, path, mimetype)
+
+
 @DisplayedRoute('/callsets/search', postMethod=True)
 def searchCallSets():
     return handleFlaskPostRequest(
@@ -491,48 +880,96 @@ def searchVariants():
         flask.request, app.backend.runSearchVariants)
 
 
+@DisplayedRoute('/genotypematrix/search', postMethod=True)
+def searchGenotypeMatrix():
+    return handleFlaskPostRequest(
+        flask.request, app.backend.runSearchGenotypeMatrix,
+        genotypematrix.MIMETYPES)
+
+
+@DisplayedRoute('/pileup/search', postMethod=True)
+def searchPileup():
+    return handleFlaskPostRequest(
+        flask.request, app.backend.runSearchPileup, [protocol.JSON_MIMETYPE])
+
+
 @DisplayedRoute('/datasets/search', postMethod=True)
 def searchDatasets():
     return handleFlaskPostRequest(
         flask.request, app.backend.runSearchDatasets)
 
 
+@DisplayedRoute('/variants/batchget', postMethod=True)
+def batchGetVariants():
+    return handleFlaskPostRequest(
+        flask.request, app.backend.runBatchGetVariants,
+        [protocol.JSON_MIMETYPE])
+
+
+@DisplayedRoute('/callsets/batchget', postMethod=True)
+def batchGetCallSets():
+    return handleFlaskPostRequest(
+        flask.request, app.backend.runBatchGetCallSets,
+        [protocol.JSON_MIMETYPE])
+
+
+@DisplayedRoute('/readgroups/batchget', postMethod=True)
+def batchGetReadGroups():
+    return handleFlaskPostRequest(
+        flask.request, app.backend.runBatchGetReadGroups,
+        [protocol.JSON_MIMETYPE])
+
+
+@DisplayedRoute('/references/batchget', postMethod=True)
+def batchGetReferences():
+    return handleFlaskPostRequest(
+        flask.request, app.backend.runBatchGetReferences,
+        [protocol.JSON_MIMETYPE])
+
+
 @DisplayedRoute(
     '/variantsets/<no(search):id>',
     pathDisplay='/variantsets/<id>')
 def getVariantSet(id):
-    return handleFlaskGetRequest(
-        id, flask.request, app.backend.runGetVariantSet)
+    return handleFlaskGetObjectRequest(
+        id, flask.request, app.backend.getVariantSet)
 
 
 @DisplayedRoute(
-    '/variants/<no(search):id>',
+    '/variants/<no(search,batchget):id>',
     pathDisplay='/variants/<id>')
 def getVariant(id):
     return handleFlaskGetRequest(
         id, flask.request, app.backend.runGetVariant)
 
 
+@DisplayedRoute('/variants/<id>/carriers')
+def getVariantCarriers(id):
+    if flask.request.method != "GET":
+        raise exceptions.MethodNotAllowedException()
+    return getFlaskResponse(app.backend.runGetVariantCarriers(id))
+
+
 @DisplayedRoute(
     '/readgroupsets/<no(search):id>',
     pathDisplay='/readgroupsets/<id>')
 def getReadGroupSet(id):
-    return handleFlaskGetRequest(
-        id, flask.request, app.backend.runGetReadGroupSet)
+    return handleFlaskGetObjectRequest(
+        id, flask.request, app.backend.getReadGroupSet)
 
 
 @DisplayedRoute('/readgroups/<id>')
 def getReadGroup(id):
-    return handleFlaskGetRequest(
-        id, flask.request, app.backend.runGetReadGroup)
+    return handleFlaskGetObjectRequest(
+        id, flask.request, app.backend.getReadGroup)
 
 
 @DisplayedRoute(
-    '/callsets/<no(search):id>',
+    '/callsets/<no(search,batchget):id>',
     pathDisplay='/callsets/<id>')
 def getCallset(id):
-    return handleFlaskGetRequest(
-        id, flask.request, app.backend.runGetCallset)
+    return handleFlaskGetObjectRequest(
+        id, flask.request, app.backend.getCallSet)
 
 
 @app.route('/oauth2callback', methods=['GET'])
@@ -599,8 +1036,8 @@ def oidcCallback():
     '/datasets/<no(search):id>',
     pathDisplay='/datasets/<id>')
 def getDataset(id):
-    return handleFlaskGetRequest(
-        id, flask.request, app.backend.runGetDataset)
+    return handleFlaskGetObjectRequest(
+        id, flask.request, app.backend.getDataset)
 
 # The below methods ensure that JSON is returned for various errors
 # instead of the default, html
@@ -0,0 +1,374 @@
+"""
+The dense genotype matrix representation of the calls for a list of
+call sets over a region of a variant set.
+
+Searching for variants returns a Call object for every call set at every
+variant, which dominates the cost of pulling genotypes for wide cohorts.
+A GenotypeMatrix instead holds a short descriptor of each variant site and
+NumPy arrays with a row for each site and a column for each call set:
+
+genotypes
+    The allele indexes of each call, in an int8 array (int16 if any
+    allele index does not fit) of shape (numSites, numCallSets, ploidy).
+    No-calls are -1, as in the genotypes of GA4GH Calls, and calls with
+    fewer alleles than the greatest ploidy are padded with -2.
+phased
+    A boolean array of shape (numSites, numCallSets) that is True for
+    the calls with phased genotypes.
+likelihoods
+    If requested, the genotype likelihoods (the GL values) of each call
+    in a float32 array of shape (numSites, numCallSets, numLikelihoods),
+    padded with NaN; otherwise None.
+
+Matrices are written either as JSON, with the arrays base64 encoded, or
+in a binary format made up of a magic number, the length of a JSON header,
+the header, and then the bytes of each of the arrays in turn.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import base64
+import json
+import struct
+
+import numpy
+
+import ga4gh.protocol as protocol
+
+
+BINARY_MIMETYPE = "application/vnd.ga4gh.genotypematrix"
+MIMETYPES = [protocol.JSON_MIMETYPE, BINARY_MIMETYPE]
+NO_CALL_ALLELE = -1
+PADDING_ALLELE = -2
+_binaryMagic = b"GAGM"
+_headerLengthFormat = b"<I"
+_arrayNames = ["genotypes", "phased", "likelihoods"]
+
+
+def toPaddedArray(values, paddingValue, dtype):
+    """
+    Returns a two dimensional array of the specified type holding the
+    specified list of lists, with the shorter lists padded at the end
+    with the specified value.
+    """
+    lengths = set(len(value) for value in values)
+    if len(lengths) <= 1:
+        array = numpy.array(values, dtype=dtype)
+        return array.reshape((len(values), max(lengths | set([0]))))
+    array = numpy.empty((len(values), max(lengths)), dtype=dtype)
+    array.fill(paddingValue)
+    for index, value in enumerate(values):
+        array[index, :len(value)] = value
+    return array
+
+
+def _padStack(arrays, paddingValue, dtype, shape):
+    """
+    Returns an array of the specified shape, whose rows are the
+    specified arrays padded at the end of their last dimension.
+    """
+    stacked = numpy.empty(shape, dtype=dtype)
+    stacked.fill(paddingValue)
+    for index, array in enumerate(arrays):
+        stacked[index, ..., :array.shape[-1]] = array
+    return stacked
+
+
+def _getGenotypeType(maxAllele):
+    if maxAllele > numpy.iinfo(numpy.int8).max:
+        return numpy.int16
+    return numpy.int8
+
+
+class GenotypeRow(object):
+    """
+    The genotypes for a list of call sets at one variant site. The
+    genotypes are a two dimensional array of allele indexes with a row
+    for each call set, padded with PADDING_ALLELE. The likelihoods are a
+    two dimensional float array padded with NaN, or None if they were
+    not requested.
+    """
+    def __init__(
+            self, id_, start, end, referenceBases, alternateBases,
+            genotypes, phased, likelihoods=None):
+        self.id = id_
+        self.start = start
+        self.end = end
+        self.referenceBases = referenceBases
+        self.alternateBases = alternateBases
+        self.genotypes = genotypes
+        self.phased = phased
+        self.likelihoods = likelihoods
+
+    @classmethod
+    def fromGaVariant(cls, gaVariant, callSetIds, includeLikelihoods):
+        """
+        Returns the GenotypeRow for the calls of the specified call sets
+        in the specified GA Variant. Call sets without a call in the
+        variant are given a no-call.
+        """
+        calls = dict((call.callSetId, call) for call in gaVariant.calls)
+        genotypes = []
+        phased = []
+        likelihoods = []
+        for callSetId in callSetIds:
+            call = calls.get(callSetId)
+            if call is None:
+                genotypes.append([NO_CALL_ALLELE])
+                phased.append(False)
+                likelihoods.append([])
+            else:
+                genotypes.append(call.genotype)
+                phased.append(call.phaseset is not None)
+                likelihoods.append([
+                    numpy.nan if value is None else value
+                    for value in call.genotypeLikelihood])
+        if not includeLikelihoods:
+            likelihoods = None
+        else:
+            likelihoods = toPaddedArray(
+                likelihoods, numpy.nan, numpy.float32)
+        return cls(
+            gaVariant.id, gaVariant.start, gaVariant.end,
+            gaVariant.referenceBases, gaVariant.alternateBases,
+            toPaddedArray(genotypes, PADDING_ALLELE, numpy.int16),
+            numpy.array(phased, dtype=numpy.bool_), likelihoods)
+
+    def getSite(self):
+        """
+        Returns the JSON dictionary describing the variant site of this
+        row.
+        """
+        return {
+            "id": self.id,
+            "start": self.start,
+            "end": self.end,
+            "referenceBases": self.referenceBases,
+            "alternateBases": list(self.alternateBases),
+        }
+
+    def getNumBytes(self):
+        """
+        Returns the approximate number of bytes taken up by this row in a
+        binary GenotypeMatrix.
+        """
+        numBytes = self.genotypes.size + self.phased.size
+        if self.likelihoods is not None:
+            numBytes += 4 * self.likelihoods.size
+        return numBytes
+
+
+class GenotypeMatrix(object):
+    """
+    The genotypes for a list of call sets over a list of variant sites,
+    with the nextPageToken of the search that returned them.
+    """
+    def __init__(
+            self, callSetIds, sites, genotypes, phased, likelihoods=None,
+            nextPageToken=None):
+        self.callSetIds = callSetIds
+        self.sites = sites
+        self.genotypes = genotypes
+        self.phased = phased
+        self.likelihoods = likelihoods
+        self.nextPageToken = nextPageToken
+
+    @classmethod
+    def fromRows(cls, callSetIds, rows, includeLikelihoods,
+                 nextPageToken=None):
+        """
+        Returns the GenotypeMatrix holding the specified GenotypeRows for
+        the specified call sets.
+        """
+        numCallSets = len(callSetIds)
+        ploidy = max([0] + [row.genotypes.shape[1] for row in rows])
+        maxAllele = max([0] + [
+            int(row.genotypes.max()) for row in rows
+            if row.genotypes.size > 0])
+        genotypes = _padStack(
+            [row.genotypes for row in rows], PADDING_ALLELE,
+            _getGenotypeType(maxAllele), (len(rows), numCallSets, ploidy))
+        phased = numpy.zeros((len(rows), numCallSets), dtype=numpy.bool_)
+        for index, row in enumerate(rows):
+            phased[index] = row.phased
+        likelihoods = None
+        if includeLikelihoods:
+            numLikelihoods = max(
+                [0] + [row.likelihoods.shape[1] for row in rows])
+            likelihoods = _padStack(
+                [row.likelihoods for row in rows], numpy.nan, numpy.float32,
+                (len(rows), numCallSets, numLikelihoods))
+        return cls(
+            list(callSetIds), [row.getSite() for row in rows], genotypes,
+            phased, likelihoods, nextPageToken)
+
+    @classmethod
+    def concatenate(cls, matrices):
+        """
+        Returns the GenotypeMatrix holding the sites of each of the
+        specified matrices for the same call sets in turn, such as the
+        pages of a search. The nextPageToken is that of the last matrix.
+        """
+        first = matrices[0]
+        numSites = sum(len(matrix.sites) for matrix in matrices)
+        shape = (numSites, len(first.callSetIds))
+        ploidy = max(matrix.genotypes.shape[2] for matrix in matrices)
+        maxAllele = max([0] + [
+            int(matrix.genotypes.max()) for matrix in matrices
+            if matrix.genotypes.size > 0])
+        genotypes = _padStack(
+            [row for matrix in matrices for row in matrix.genotypes],
+            PADDING_ALLELE, _getGenotypeType(maxAllele), shape + (ploidy,))
+        phased = numpy.concatenate(
+            [matrix.phased for matrix in matrices]).reshape(shape)
+        likelihoods = None
+        if first.likelihoods is not None:
+            numLikelihoods = max(
+                matrix.likelihoods.shape[2] for matrix in matrices)
+            likelihoods = _padStack(
+                [row for matrix in matrices for row in matrix.likelihoods],
+                numpy.nan, numpy.float32, shape + (numLikelihoods,))
+        sites = [site for matrix in matrices for site in matrix.sites]
+        return cls(
+            list(first.callSetIds), sites, genotypes, phased, likelihoods,
+            matrices[-1].nextPageToken)
+
+    def _getArrays(self):
+        arrays = [self.genotypes, self.phased, self.likelihoods]
+        return zip(_arrayNames, arrays)
+
+    def serialize(self, mimetype=protocol.JSON_MIMETYPE):
+        """
+        Returns the representation of this matrix in the wire format
+        identified by the specified mimetype.
+        """
+        header = {
+            "callSetIds": self.callSetIds,
+            "sites": self.sites,
+            "nextPageToken": self.nextPageToken,
+        }
+        data = []
+        for name, array in self._getArrays():
+            if array is None:
+                header[name] = None
+            else:
+                array = numpy.ascontiguousarray(array)
+                header[name] = {
+                    "dtype": array.dtype.str,
+                    "shape": list(array.shape),
+                }
+                if mimetype == BINARY_MIMETYPE:
+                    data.append(array.tostring())
+                else:
+                    header[name]["data"] = base64.b64encode(
+                        array.tostring()).decode("ascii")
+        headerString = json.dumps(header).encode("utf8")
+        if mimetype == protocol.JSON_MIMETYPE:
+            return headerString
+        elif mimetype == BINARY_MIMETYPE:
+            prefix = _binaryMagic + struct.pack(
+                _headerLengthFormat, len(headerString))
+            return b"".join([prefix, headerString] + data)
+        else:
+            raise ValueError("Unsupported mimetype: {}".format(mimetype))
+
+    @classmethod
+    def deserialize(cls, data, mimetype=protocol.JSON_MIMETYPE):
+        """
+        Returns the GenotypeMatrix represented by the specified data in
+        the wire format identified by the specified mimetype. The arrays
+        of matrices read from the binary format are read-only views of
+        the data.
+        """
+        if mimetype == protocol.JSON_MIMETYPE:
+            header = json.loads(data)
+            arrayData = None
+        elif mimetype == BINARY_MIMETYPE:
+            data = bytes(data)
+            prefixLength = len(_binaryMagic) + struct.calcsize(
+                _headerLengthFormat)
+            if data[:len(_binaryMagic)] != _binaryMagic:
+                raise ValueError("Not a binary genotype matrix")
+            headerLength, = struct.unpack_from(
+                _headerLengthFormat, data, len(_binaryMagic))
+            header = json.loads(
+                data[prefixLength:prefixLength + headerLength].decode("utf8"))
+            arrayData = data
+            offset = prefixLength + headerLength
+        else:
+            raise ValueError("Unsupported mimetype: {}".format(mimetype))
+        arrays = {}
+        for name in _arrayNames:
+            description = header[name]
+            if description is None:
+                arrays[name] = None
+                continue
+            dtype = numpy.dtype(str(description["dtype"]))
+            shape = tuple(description["shape"])
+            if arrayData is None:
+                array = numpy.frombuffer(
+                    base64.b64decode(description["data"]), dtype=dtype)
+            else:
+                count = int(numpy.prod(shape))
+                array = numpy.frombuffer(
+                    arrayData, dtype=dtype, count=count, offset=offset)
+                offset += count * dtype.itemsize
+            arrays[name] = array.reshape(shape)
+        return cls(
+            header["callSetIds"], header["sites"], arrays["genotypes"],
+            arrays["phased"], arrays["likelihoods"], header["nextPageToken"])
+
+
+class GenotypeMatrixBuilder(object):
+    """
+    A class to allow sequential building of the GenotypeMatrix returned
+    by a search, in the same way as a protocol.SearchResponseBuilder.
+    The matrix is full once it holds pageSize sites, or once its arrays
+    take up at least maxResponseLength bytes in the binary format.
+    """
+    def __init__(self, callSetIds, pageSize, maxResponseLength,
+                 includeLikelihoods=False):
+        self._callSetIds = callSetIds
+        self._pageSize = pageSize
+        self._maxResponseLength = maxResponseLength
+        self._includeLikelihoods = includeLikelihoods
+        self._rows = []
+        self._numBytes = 0
+        self._nextPageToken = None
+
+    def setNextPageToken(self, nextPageToken):
+        """
+        Sets the nextPageToken to the specified value.
+        """
+        self._nextPageToken = nextPageToken
+
+    def addValue(self, genotypeRow):
+        """
+        Appends the specified GenotypeRow to the matrix.
+        """
+        self._rows.append(genotypeRow)
+        self._numBytes += genotypeRow.getNumBytes()
+
+    def isFull(self):
+        """
+        Returns True if the matrix is full, and False otherwise.
+        """
+        return (
+            len(self._rows) >= self._pageSize or
+            self._numBytes >= self._maxResponseLength)
+
+    def getMatrix(self):
+        """
+        Returns the GenotypeMatrix built by this builder.
+        """
+        return GenotypeMatrix.fromRows(
+            self._callSetIds, self._rows, self._includeLikelihoods,
+            self._nextPageToken)
+
+    def getSerializedResponse(self, mimetype=protocol.JSON_MIMETYPE):
+        """
+        Returns the GenotypeMatrix built by this builder in the wire
+        format identified by the specified mimetype.
+        """
+        return self.getMatrix().serialize(mimetype)
@@ -0,0 +1,101 @@
+"""
+Per-request performance metrics.
+
+The frontend begins a RequestMetrics object for each request that it
+handles. Code anywhere below it can then record the wall clock time spent
+in named phases of the request (compression, filtering, etc) without
+the metrics object having to be threaded through every call.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import contextlib
+import threading
+import time
+
+
+_threadLocal = threading.local()
+
+
+class RequestMetrics(object):
+    """
+    The metrics gathered for a single request. These are the
+    accumulated wall clock times, in seconds, spent in named phases of the
+    request.
+    """
+    def __init__(self):
+        self._times = collections.OrderedDict()
+
+    def addTime(self, name, seconds):
+        """
+        Adds the specified number of seconds to the time recorded for
+        the phase with the specified name.
+        """
+        self._times[name] = self._times.get(name, 0) + seconds
+
+    def getTime(self, name):
+        """
+        Returns the time in seconds recorded for the phase with the
+        specified name, or None if no time has been recorded for it.
+        """
+        return self._times.get(name)
+
+    def getTimes(self):
+        """
+        Returns the list of (name, seconds) tuples recorded for this
+        request, in the order in which the phases were first recorded.
+        """
+        return self._times.items()
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """
+        Returns a context manager that adds the wall clock time spent
+        in its body to the time recorded for the specified phase.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.addTime(name, time.time() - start)
+
+
+def beginRequest():
+    """
+    Allocates a new RequestMetrics object, makes it the current metrics
+    object for this thread and returns it.
+    """
+    _threadLocal.requestMetrics = RequestMetrics()
+    return _threadLocal.requestMetrics
+
+
+def endRequest():
+    """
+    Clears the current metrics object for this thread.
+    """
+    _threadLocal.requestMetrics = None
+
+
+def getRequestMetrics():
+    """
+    Returns the current RequestMetrics object for this thread, or None
+    if we are not within a request.
+    """
+    return getattr(_threadLocal, "requestMetrics", None)
+
+
+@contextlib.contextmanager
+def timer(name):
+    """
+    Returns a context manager that adds the wall clock time spent in its
+    body to the specified phase of the current request. If we are not within
+    a request, this does nothing.
+    """
+    requestMetrics = getRequestMetrics()
+    if requestMetrics is None:
+        yield
+    else:
+        with requestMetrics.timer(name):
+            yield
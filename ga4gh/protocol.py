@@ -15,6 +15,11 @@ from cStringIO import StringIO
 import avro.io
 
 
+JSON_MIMETYPE = "application/json"
+AVRO_BINARY_MIMETYPE = "avro/binary"
+MIMETYPES = [JSON_MIMETYPE, AVRO_BINARY_MIMETYPE]
+
+
 def convertDatetime(t):
     """
     Converts the specified datetime object into its appropriate protocol
@@ -113,6 +118,87 @@ class SearchResponseBuilder(object):
             json.dumps(self._nextPageToken),
             self._responseClass.getValueListName(), pageListString)
 
+    def getSerializedResponse(self):
+        """
+        Returns the SearchResponse built by this SearchResponseBuilder
+        in the wire format of this builder.
+        """
+        return self.getJsonString()
+
+
+class AvroSearchResponseBuilder(SearchResponseBuilder):
+    """
+    A SearchResponseBuilder that writes the Avro binary encoding of the
+    SearchResponse rather than its JSON representation. Values are
+    encoded directly into the value list buffer as they are added, and
+    the enclosing record (including the nextPageToken) is written when
+    the response is requested. The maxResponseLength is therefore a limit
+    on the length of the binary encoded values.
+    """
+    def __init__(self, responseClass, pageSize, maxResponseLength):
+        super(AvroSearchResponseBuilder, self).__init__(
+            responseClass, pageSize, maxResponseLength)
+        valueListName = responseClass.getValueListName()
+        valueSchema = None
+        for field in responseClass.schema.fields:
+            if field.name == valueListName:
+                valueSchema = field.type.items
+        self._datumWriter = avro.io.DatumWriter(valueSchema)
+        self._encoder = avro.io.BinaryEncoder(self._valueListBuffer)
+
+    def addValue(self, protocolElement):
+        # We call write_data directly to avoid validating every value
+        # as it is written; response validation is the responsibility
+        # of the caller.
+        self._numElements += 1
+        self._datumWriter.write_data(
+            self._datumWriter.writers_schema, protocolElement.toJsonDict(),
+            self._encoder)
+
+    def getAvroBytes(self):
+        """
+        Returns the Avro binary encoding of the SearchResponse that has
+        been built by this AvroSearchResponseBuilder.
+        """
+        valueListName = self._responseClass.getValueListName()
+        fieldValues = {"nextPageToken": self._nextPageToken}
+        output = StringIO()
+        encoder = avro.io.BinaryEncoder(output)
+        for field in self._responseClass.schema.fields:
+            if field.name == valueListName:
+                # Arrays are encoded as a sequence of blocks, each of
+                # which is prefixed by its element count; we write the
+                # whole value list as a single block.
+                if self._numElements > 0:
+                    encoder.write_long(self._numElements)
+                    output.write(self._valueListBuffer.getvalue())
+                encoder.write_long(0)
+            else:
+                self._datumWriter.write_data(
+                    field.type, fieldValues.get(field.name), encoder)
+        return output.getvalue()
+
+    def getSerializedResponse(self):
+        return self.getAvroBytes()
+
+
+_searchResponseBuilderClassMap = {
+    JSON_MIMETYPE: SearchResponseBuilder,
+    AVRO_BINARY_MIMETYPE: AvroSearchResponseBuilder,
+}
+
+
+def getSearchResponseBuilder(
+        mimetype, responseClass, pageSize, maxResponseLength):
+    """
+    Returns a new SearchResponseBuilder instance that writes responses
+    in the wire format identified by the specified mimetype.
+    """
+    if mimetype not in _searchResponseBuilderClassMap:
+        raise ValueError("Unsupported mimetype '{}'".format(mimetype))
+    builderClass = _searchResponseBuilderClassMap[mimetype]
+    return builderClass(responseClass, pageSize, maxResponseLength)
+
 
 class ProtocolElementEncoder(json.JSONEncoder):
     """
@@ -122,6 +208,184 @@ class ProtocolElementEncoder(json.JSONEncoder):
         return {a: getattr(obj, a) for a in obj.__slots__}
 
 
+def encodeJsonString(value):
+    """
+    Returns the JSON encoding of the specified string, or null if it
+    is None, exactly as it is written by toJsonString.
+    """
+    if value is None:
+        return b"null"
+    return json.encoder.encode_basestring_ascii(value)
+
+
+class JsonObjectTemplate(object):
+    """
+    A template for the JSON representation of instances of a
+    ProtocolElement class. This allows us to write the JSON for an
+    element directly from the values of its fields, without creating
+    the element. The fields are written in the same order as
+    toJsonString writes them, so the output is identical. Fields whose
+    values are the same for every element written using the template
+    can be fixed when it is created, and the fields that are written can
+    be restricted using a FieldMask.
+    """
+    def __init__(self, protocolClass, constants=None, fieldMask=None):
+        if constants is None:
+            constants = {}
+        # The encoder writes the fields in the iteration order of the
+        # dictionary it builds, which we obtain by building it for a
+        # default instance.
+        fieldNames = list(ProtocolElementEncoder().default(protocolClass()))
+        if fieldMask is not None:
+            fieldNames = [
+                fieldName for fieldName in fieldNames
+                if fieldMask.includes(fieldName)]
+        fields = []
+        for fieldName in fieldNames:
+            if fieldName in constants:
+                value = json.dumps(constants[fieldName]).replace("%", "%%")
+            else:
+                value = "%({})s".format(fieldName)
+            fields.append("{}: {}".format(json.dumps(fieldName), value))
+        self._template = ("{" + ", ".join(fields) + "}").encode("ascii")
+
+    def fill(self, values):
+        """
+        Returns the JSON string for an element, where values is a
+        dictionary mapping the names of the fields that are not constant
+        to their JSON encoded values.
+        """
+        return self._template % values
+
+
+class FieldMask(object):
+    """
+    The set of fields of a ProtocolElement class to include in its JSON
+    representation, allowing clients to request partial responses. For
+    embedded fields we may include only some of the fields of the
+    embedded elements, as described by a FieldMask for the embedded
+    class. A FieldMask with no fields specified includes all fields.
+    """
+    def __init__(self, protocolClass, fields=None):
+        """
+        Creates a FieldMask for the specified ProtocolElement class.
+        If fields is not None, it is a dictionary mapping the names of
+        the included fields to the FieldMask for the field, or to None
+        if all of the field is included.
+        """
+        self._protocolClass = protocolClass
+        self._fields = fields
+        self._template = None
+
+    @classmethod
+    def parse(cls, protocolClass, fieldsString):
+        """
+        Returns the FieldMask for the specified ProtocolElement class
+        described by the specified string. This is a comma separated
+        list of field names, in which fields of embedded elements are
+        given as dotted paths; for example "id,alignment.position"
+        for ReadAlignments. Raises a ValueError if the string does not
+        describe fields of the class.
+        """
+        paths = [path.strip() for path in fieldsString.split(",")]
+        fields = {}
+        for path in paths:
+            if path == "":
+                raise ValueError("Empty field name")
+            fieldClass = protocolClass
+            parentFields = fields
+            names = path.split(".")
+            for j, name in enumerate(names):
+                if name not in fieldClass.__slots__:
+                    raise ValueError(
+                        "{} has no field '{}'".format(
+                            fieldClass.__name__, name))
+                if j == len(names) - 1:
+                    parentFields[name] = None
+                elif not fieldClass.isEmbeddedType(name):
+                    raise ValueError(
+                        "Field '{}' of {} has no subfields".format(
+                            name, fieldClass.__name__))
+                elif name in parentFields and parentFields[name] is None:
+                    # The whole field has already been included.
+                    break
+                else:
+                    fieldClass = fieldClass.getEmbeddedType(name)
+                    parentFields = parentFields.setdefault(name, {})
+        return cls._fromDict(protocolClass, fields)
+
+    @classmethod
+    def _fromDict(cls, protocolClass, fields):
+        fieldMasks = {}
+        for name, subfields in fields.items():
+            fieldMasks[name] = None
+            if subfields is not None:
+                fieldMasks[name] = cls._fromDict(
+                    protocolClass.getEmbeddedType(name), subfields)
+        return cls(protocolClass, fieldMasks)
+
+    def getProtocolClass(self):
+        """
+        Returns the ProtocolElement class this FieldMask applies to.
+        """
+        return self._protocolClass
+
+    def isComplete(self):
+        """
+        Returns True if this FieldMask includes all fields.
+        """
+        return self._fields is None
+
+    def includes(self, fieldName):
+        """
+        Returns True if the specified field is included, either wholly
+        or in part.
+        """
+        return self._fields is None or fieldName in self._fields
+
+    def getIncludedFieldNames(self):
+        """
+        Returns the set of the names of the included fields.
+        """
+        if self._fields is None:
+            return set(self._protocolClass.__slots__)
+        return set(self._fields.keys())
+
+    def getSubmask(self, fieldName):
+        """
+        Returns the FieldMask for the embedded elements in the specified
+        embedded field.
+        """
+        if self._fields is None or self._fields.get(fieldName) is None:
+            return FieldMask(self._protocolClass.getEmbeddedType(fieldName))
+        return self._fields[fieldName]
+
+    def toJsonString(self, protocolElement):
+        """
+        Returns the JSON representation of the included fields of the
+        specified ProtocolElement.
+        """
+        if self._fields is None:
+            return protocolElement.toJsonString()
+        if self._template is None:
+            self._template = JsonObjectTemplate(
+                self._protocolClass, fieldMask=self)
+        values = {}
+        for name, fieldMask in self._fields.items():
+            value = getattr(protocolElement, name)
+            if fieldMask is None:
+                values[name] = json.dumps(value, cls=ProtocolElementEncoder)
+            elif value is None:
+                values[name] = b"null"
+            elif isinstance(value, list):
+                values[name] = b"[" + b", ".join(
+                    fieldMask.toJsonString(element)
+                    for element in value) + b"]"
+            else:
+                values[name] = fieldMask.toJsonString(value)
+        return self._template.fill(values)
+
+
 class ProtocolElement(object):
     """
     Superclass of GA4GH protocol elements. These elements are in one-to-one
@@ -151,6 +415,27 @@ class ProtocolElement(object):
         """
         return json.dumps(self, cls=ProtocolElementEncoder)
 
+    def toAvroBytes(self):
+        """
+        Returns the Avro binary encoding of this ProtocolElement.
+        """
+        output = StringIO()
+        datumWriter = avro.io.DatumWriter(self.schema)
+        datumWriter.write(self.toJsonDict(), avro.io.BinaryEncoder(output))
+        return output.getvalue()
+
+    def serialize(self, mimetype=JSON_MIMETYPE):
+        """
+        Returns the representation of this ProtocolElement in the wire
+        format identified by the specified mimetype.
+        """
+        if mimetype == JSON_MIMETYPE:
+            return self.toJsonString()
+        elif mimetype == AVRO_BINARY_MIMETYPE:
+            return self.toAvroBytes()
+        else:
+            raise ValueError("Unsupported mimetype '{}'".format(mimetype))
+
     def toJsonDict(self):
         """
         Returns a JSON dictionary representation of this ProtocolElement.
@@ -187,6 +472,29 @@ class ProtocolElement(object):
         jsonDict = json.loads(jsonStr)
         return cls.fromJsonDict(jsonDict)
 
+    @classmethod
+    def fromAvroBytes(cls, avroBytes):
+        """
+        Returns a decoded ProtocolElement from the specified Avro binary
+        encoded string.
+        """
+        datumReader = avro.io.DatumReader(cls.schema)
+        decoder = avro.io.BinaryDecoder(StringIO(avroBytes))
+        return cls.fromJsonDict(datumReader.read(decoder))
+
+    @classmethod
+    def deserialize(cls, data, mimetype=JSON_MIMETYPE):
+        """
+        Returns a decoded ProtocolElement from the specified data in the
+        wire format identified by the specified mimetype.
+        """
+        if mimetype == JSON_MIMETYPE:
+            return cls.fromJsonString(data)
+        elif mimetype == AVRO_BINARY_MIMETYPE:
+            return cls.fromAvroBytes(data)
+        else:
+            raise ValueError("Unsupported mimetype '{}'".format(mimetype))
+
     @classmethod
     def fromJsonDict(cls, jsonDict):
         """
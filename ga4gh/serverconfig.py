@@ -22,6 +22,12 @@ class BaseConfig(object):
     DEFAULT_PAGE_SIZE = 100
     DATA_SOURCE = "__EMPTY__"
 
+    # Options for compressing responses.
+    RESPONSE_COMPRESSION = True
+    RESPONSE_COMPRESSION_MIN_SIZE = 1024  # 1KB
+    RESPONSE_COMPRESSION_LEVEL = 6
+    CACHE_CONTROL = "no-cache"
+
     # Options for the simulated backend.
     SIMULATED_BACKEND_RANDOM_SEED = 0
     SIMULATED_BACKEND_NUM_CALLS = 1
@@ -33,6 +39,42 @@ class BaseConfig(object):
 
     FILE_HANDLE_CACHE_MAX_SIZE = 50
 
+    # The number of pileups whose allele counts are cached.
+    PILEUP_CACHE_MAX_SIZE = 100
+
+    # The number of worker processes used to precompute statistics.
+    STATS_PROCESSES = 0
+
+    # The number of worker processes used to build the density indexes
+    # of variant sets.
+    DENSITY_INDEX_PROCESSES = 1
+
+    # The number of threads used to fetch from the sample shards of
+    # variant sets concurrently.
+    VARIANT_SHARD_THREADS = 4
+
+    # The number of worker processes used to export variants, or 0 to
+    # export them in the server process.
+    EXPORT_PROCESSES = 0
+
+    # The number of threads used to compress the BGZF blocks of VCF
+    # slices that are not copied from the data files.
+    BGZF_COMPRESSION_THREADS = 4
+
+    # The directory to which export jobs write their output, or None to
+    # disable export jobs.
+    EXPORT_SPOOL_DIR = None
+
+    # The number of threads that run export jobs.
+    EXPORT_JOB_THREADS = 2
+
+    # The number of export jobs of each user that may run at once.
+    EXPORT_JOBS_PER_USER = 1
+
+    # The number of seconds for which finished export jobs and their
+    # output are kept.
+    EXPORT_JOB_RETENTION = 86400
+
 
 class DevelopmentConfig(BaseConfig):
     """
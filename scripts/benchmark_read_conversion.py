@@ -0,0 +1,94 @@
+"""
+Benchmarks the conversion of reads from a BAM file into GA4GH
+ReadAlignments, reporting the number of reads per second for reading
+the file alone, for conversion, for conversion and serialization and
+for writing the JSON directly from the pysam reads.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import time
+
+import ga4gh.backend as backend
+
+
+def timeReads(readsFunction, repeat):
+    """
+    Calls the specified function, which returns an iterable of reads,
+    the specified number of times and returns the tuple (numReads,
+    seconds) for the fastest run.
+    """
+    results = []
+    for _ in range(repeat):
+        before = time.time()
+        numReads = 0
+        for _ in readsFunction():
+            numReads += 1
+        results.append((numReads, time.time() - before))
+    return min(results, key=lambda result: result[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--dataDir", default="tests/data",
+        help="The data directory to use (default: %(default)s)")
+    parser.add_argument(
+        "--readGroupSetIndex", default=0, type=int,
+        help="The index of the read group set in the first dataset")
+    parser.add_argument(
+        "--readGroupIndex", default=0, type=int,
+        help="The index of the read group in the read group set")
+    parser.add_argument(
+        "--referenceName", default="1",
+        help="The reference name to search over (default: %(default)s)")
+    parser.add_argument("--start", default=0, type=int)
+    parser.add_argument("--end", default=None, type=int)
+    parser.add_argument(
+        "--repeat", default=100, type=int,
+        help="The number of times to repeat each run; the fastest "
+        "run is reported")
+    args = parser.parse_args()
+
+    theBackend = backend.FileSystemBackend(args.dataDir)
+    dataset = theBackend.getDatasetByIndex(0)
+    readGroupSet = dataset.getReadGroupSets()[args.readGroupSetIndex]
+    readGroup = readGroupSet.getReadGroups()[args.readGroupIndex]
+    reference = readGroupSet.getReferenceSet().getReferenceByName(
+        args.referenceName)
+    samFile = readGroupSet.getFileHandle(readGroupSet.getSamFilePath())
+
+    def readPysam():
+        start, end = readGroup.sanitizeAlignmentFileFetch(
+            args.start, args.end)
+        return samFile.fetch(reference.getLocalId().encode(), start, end)
+
+    def readConverted():
+        return readGroup.getReadAlignments(reference, args.start, args.end)
+
+    def readSerialized():
+        for readAlignment in readConverted():
+            yield readAlignment.toJsonString()
+
+    def readJson():
+        for jsonRecord in readGroup.getReadAlignmentsJson(
+                reference, args.start, args.end):
+            yield jsonRecord.toJsonString()
+
+    print("{:<20}{:>10}{:>14}".format("stage", "reads", "reads/s"))
+    stages = [
+        ("pysam", readPysam),
+        ("convert", readConverted),
+        ("convert+json", readSerialized),
+        ("direct json", readJson),
+    ]
+    for name, readsFunction in stages:
+        numReads, seconds = timeReads(readsFunction, args.repeat)
+        print("{:<20}{:>10}{:>14.0f}".format(
+            name, numReads, numReads / seconds))
+
+
+if __name__ == '__main__':
+    main()
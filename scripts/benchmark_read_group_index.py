@@ -0,0 +1,166 @@
+"""
+Benchmarks searches for the reads of one read group in a BAM file with
+many read groups, reporting the number of reads per second for fetching
+the region and filtering the reads by their RG tag, for seeking to each
+read in the read group index and for reading each BGZF block of the
+indexed reads once. Unless a BAM file is given, one is written with
+reads from the specified number of read groups interleaved along a
+single reference.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import pysam
+
+import ga4gh.datamodel.readgroupindex as readgroupindex
+import ga4gh.datamodel.reads as reads
+
+
+def writeBamFile(samFilePath, numReads, numReadGroups, readLength):
+    """
+    Writes a sorted and indexed BAM file with the specified number of
+    reads of the specified length on one reference, each in one of the
+    specified number of read groups chosen at random.
+    """
+    readGroupIds = ["rg{}".format(j) for j in range(numReadGroups)]
+    header = {
+        "HD": {"VN": "1.0", "SO": "coordinate"},
+        "SQ": [{"SN": "1", "LN": numReads + readLength}],
+        "RG": [{"ID": readGroupId} for readGroupId in readGroupIds],
+    }
+    random.seed(0)
+    bases = b"".join(
+        random.choice(b"ACGT") for _ in range(numReads + readLength))
+    samFile = pysam.AlignmentFile(samFilePath, "wb", header=header)
+    try:
+        for j in range(numReads):
+            read = pysam.AlignedSegment()
+            read.query_name = "read{}".format(j).encode()
+            read.query_sequence = bases[j:j + readLength]
+            read.flag = 0
+            read.reference_id = 0
+            read.reference_start = j
+            read.mapping_quality = 60
+            read.cigar = [(0, readLength)]
+            read.query_qualities = pysam.fromQualityString(
+                b"I" * readLength)
+            read.tags = [(b"RG", random.choice(readGroupIds).encode())]
+            samFile.write(read)
+    finally:
+        samFile.close()
+    pysam.index(samFilePath.encode())
+
+
+def timeReads(readsFunction, repeat):
+    """
+    Calls the specified function, which returns an iterable of reads,
+    the specified number of times and returns the tuple (numReads,
+    seconds) for the fastest run.
+    """
+    results = []
+    for _ in range(repeat):
+        before = time.time()
+        numReads = 0
+        for _ in readsFunction():
+            numReads += 1
+        results.append((numReads, time.time() - before))
+    return min(results, key=lambda result: result[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--bamFile", default=None,
+        help="The BAM file to search (default: a generated file)")
+    parser.add_argument(
+        "--numReads", default=200000, type=int,
+        help="The number of reads in the generated file "
+        "(default: %(default)s)")
+    parser.add_argument(
+        "--numReadGroups", default=16, type=int,
+        help="The number of read groups in the generated file "
+        "(default: %(default)s)")
+    parser.add_argument(
+        "--readLength", default=100, type=int,
+        help="The length of the reads in the generated file "
+        "(default: %(default)s)")
+    parser.add_argument(
+        "--readGroupId", default=None,
+        help="The read group to search for (default: the first)")
+    parser.add_argument(
+        "--referenceName", default="1",
+        help="The reference name to search over (default: %(default)s)")
+    parser.add_argument("--start", default=0, type=int)
+    parser.add_argument(
+        "--end", default=None, type=int,
+        help="The end of the region (default: the reference length)")
+    parser.add_argument(
+        "--repeat", default=5, type=int,
+        help="The number of times to repeat each run; the fastest "
+        "run is reported")
+    args = parser.parse_args()
+
+    tempDir = tempfile.mkdtemp()
+    try:
+        samFilePath = args.bamFile
+        if samFilePath is None:
+            samFilePath = os.path.join(tempDir, "reads.bam")
+            before = time.time()
+            writeBamFile(
+                samFilePath, args.numReads, args.numReadGroups,
+                args.readLength)
+            print("Wrote {} in {:.2f}s".format(
+                samFilePath, time.time() - before))
+        before = time.time()
+        readgroupindex.ReadGroupIndex.build(samFilePath).save()
+        print("Built the index in {:.2f}s".format(time.time() - before))
+        before = time.time()
+        readGroupIndex = readgroupindex.ReadGroupIndex.load(samFilePath)
+        print("Loaded the index in {:.4f}s".format(time.time() - before))
+        samFile = pysam.AlignmentFile(samFilePath)
+        readGroupId = args.readGroupId
+        if readGroupId is None:
+            readGroupId = samFile.header["RG"][0]["ID"]
+        referenceName = args.referenceName.encode()
+        referenceId = samFile.gettid(referenceName)
+        if args.end is None:
+            args.end = samFile.lengths[referenceId]
+        offsets = readGroupIndex.getOffsets(
+            readGroupId, referenceId, args.start, args.end)
+
+        def fetchAndFilter():
+            return (
+                read for read in samFile.fetch(
+                    referenceName, args.start, args.end)
+                if reads.getReadGroupTag(read) == readGroupId)
+
+        def seekEachRead():
+            for offset in offsets:
+                samFile.seek(offset)
+                yield next(samFile)
+
+        def readEachBlock():
+            return reads.getReadAlignmentsAtOffsets(samFile, offsets)
+
+        for name, readsFunction in [
+                ("fetch and filter", fetchAndFilter),
+                ("seek to each read", seekEachRead),
+                ("read each block once", readEachBlock)]:
+            numReads, seconds = timeReads(readsFunction, args.repeat)
+            print("{:<22}{:>10} reads{:>14.0f} reads/s".format(
+                name, numReads, numReads / seconds))
+        samFile.close()
+    finally:
+        shutil.rmtree(tempDir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmarks searches over a variant set of indexed VCF files against
+the same searches over a columnar variant store built from it, reporting
+the number of variants per second for the GA Variants and for their
+JSON, with the calls for all of the call sets and for some of them.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import shutil
+import tempfile
+import time
+
+import ga4gh.backend as backend
+import ga4gh.datamodel.variantstore as variantstore
+
+
+def timeVariants(variantsFunction, repeat):
+    """
+    Calls the specified function, which returns an iterable of variants,
+    the specified number of times and returns the tuple (numVariants,
+    seconds) for the fastest run.
+    """
+    results = []
+    for _ in range(repeat):
+        before = time.time()
+        numVariants = 0
+        for _ in variantsFunction():
+            numVariants += 1
+        results.append((numVariants, time.time() - before))
+    return min(results, key=lambda result: result[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--dataDir", default="tests/data",
+        help="The data directory to use (default: %(default)s)")
+    parser.add_argument(
+        "--variantSetIndex", default=0, type=int,
+        help="The index of the variant set in the first dataset")
+    parser.add_argument(
+        "--referenceName", default="1",
+        help="The reference name to search over (default: %(default)s)")
+    parser.add_argument("--start", default=0, type=int)
+    parser.add_argument("--end", default=2**31 - 1, type=int)
+    parser.add_argument(
+        "--numCallSets", default=1, type=int,
+        help="The number of call sets in the narrow searches "
+        "(default: %(default)s)")
+    parser.add_argument(
+        "--repeat", default=20, type=int,
+        help="The number of times to repeat each run; the fastest "
+        "run is reported")
+    args = parser.parse_args()
+
+    theBackend = backend.FileSystemBackend(args.dataDir)
+    dataset = theBackend.getDatasetByIndex(0)
+    htslibVariantSet = dataset.getVariantSets()[args.variantSetIndex]
+    storeDir = tempfile.mkdtemp()
+    try:
+        before = time.time()
+        variantstore.build(htslibVariantSet, storeDir)
+        print("Built the store in {:.2f}s".format(time.time() - before))
+        columnarVariantSet = variantstore.ColumnarVariantSet(
+            dataset, htslibVariantSet.getLocalId(), storeDir, theBackend)
+        callSetIds = [
+            callSet.getId() for callSet in htslibVariantSet.getCallSets()]
+        narrowCallSetIds = callSetIds[:args.numCallSets]
+
+        def searchFunction(variantSet, callSetIds, json):
+            def search():
+                if json:
+                    return variantSet.getVariantsJson(
+                        args.referenceName, args.start, args.end,
+                        callSetIds)
+                return variantSet.getVariants(
+                    args.referenceName, args.start, args.end, callSetIds)
+            return search
+
+        print("{:<20}{:<10}{:>10}{:>14}".format(
+            "stage", "source", "variants", "variants/s"))
+        for stage, stageCallSetIds, json in [
+                ("all calls", callSetIds, False),
+                ("all calls json", callSetIds, True),
+                ("some calls", narrowCallSetIds, False),
+                ("some calls json", narrowCallSetIds, True)]:
+            for source, variantSet in [
+                    ("htslib", htslibVariantSet),
+                    ("columnar", columnarVariantSet)]:
+                numVariants, seconds = timeVariants(
+                    searchFunction(variantSet, stageCallSetIds, json),
+                    args.repeat)
+                print("{:<20}{:<10}{:>10}{:>14.0f}".format(
+                    stage, source, numVariants, numVariants / seconds))
+    finally:
+        shutil.rmtree(storeDir)
+
+
+if __name__ == '__main__':
+    main()
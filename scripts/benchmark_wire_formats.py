@@ -0,0 +1,130 @@
+"""
+Benchmarks the wire formats supported by the server, reporting the
+number of bytes sent for a search and the time taken by the client
+to decode the responses.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import time
+
+import ga4gh.backend as backend
+import ga4gh.protocol as protocol
+
+
+def getVariantsSearch(theBackend, args):
+    """
+    Returns the (request, searchMethod, responseClass) tuple for
+    a variants search over the first variant set in the backend.
+    """
+    dataset = theBackend.getDatasetByIndex(0)
+    variantSet = dataset.getVariantSets()[args.variantSetIndex]
+    request = protocol.SearchVariantsRequest()
+    request.variantSetId = variantSet.getId()
+    request.callSetIds = [
+        callSet.getId() for callSet in variantSet.getCallSets()]
+    request.referenceName = args.referenceName
+    request.start = args.start
+    request.end = args.end
+    request.pageSize = args.pageSize
+    return (
+        request, theBackend.runSearchVariants,
+        protocol.SearchVariantsResponse)
+
+
+def getReadsSearch(theBackend, args):
+    """
+    Returns the (request, searchMethod, responseClass) tuple for
+    a reads search over the first read group set in the backend.
+    """
+    dataset = theBackend.getDatasetByIndex(0)
+    readGroupSet = dataset.getReadGroupSets()[args.readGroupSetIndex]
+    referenceSet = readGroupSet.getReferenceSet()
+    reference = referenceSet.getReferenceByName(args.referenceName)
+    request = protocol.SearchReadsRequest()
+    request.readGroupIds = [
+        readGroup.getId() for readGroup in readGroupSet.getReadGroups()]
+    request.referenceId = reference.getId()
+    request.start = args.start
+    request.end = args.end
+    request.pageSize = args.pageSize
+    return (
+        request, theBackend.runSearchReads, protocol.SearchReadsResponse)
+
+
+def runSearch(request, searchMethod, responseClass, mimetype):
+    """
+    Runs the specified search to completion using the specified wire
+    format, and returns the tuple (numObjects, numBytes, encodeTime,
+    decodeTime).
+    """
+    numObjects = 0
+    numBytes = 0
+    encodeTime = 0
+    decodeTime = 0
+    request.pageToken = None
+    notDone = True
+    while notDone:
+        before = time.time()
+        responseString = searchMethod(request.toJsonString(), mimetype)
+        encodeTime += time.time() - before
+        numBytes += len(responseString)
+        before = time.time()
+        response = responseClass.deserialize(responseString, mimetype)
+        decodeTime += time.time() - before
+        numObjects += len(getattr(response, responseClass.getValueListName()))
+        request.pageToken = response.nextPageToken
+        notDone = request.pageToken is not None
+    return numObjects, numBytes, encodeTime, decodeTime
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "objectType", choices=["variants", "reads"],
+        help="The type of object to search for")
+    parser.add_argument(
+        "--dataDir", default="tests/data",
+        help="The data directory to use (default: %(default)s)")
+    parser.add_argument(
+        "--variantSetIndex", default=0, type=int,
+        help="The index of the variant set in the first dataset")
+    parser.add_argument(
+        "--readGroupSetIndex", default=0, type=int,
+        help="The index of the read group set in the first dataset")
+    parser.add_argument(
+        "--referenceName", default="1",
+        help="The reference name to search over (default: %(default)s)")
+    parser.add_argument("--start", default=0, type=int)
+    parser.add_argument("--end", default=2**32, type=int)
+    parser.add_argument("--pageSize", default=100, type=int)
+    parser.add_argument(
+        "--repeat", default=3, type=int,
+        help="The number of times to repeat each search; the fastest "
+        "run is reported")
+    args = parser.parse_args()
+
+    theBackend = backend.FileSystemBackend(args.dataDir)
+    theBackend.setMaxResponseLength(2**32)
+    getSearch = {
+        "variants": getVariantsSearch,
+        "reads": getReadsSearch,
+    }[args.objectType]
+    request, searchMethod, responseClass = getSearch(theBackend, args)
+    print("{:<20}{:>10}{:>14}{:>14}{:>14}".format(
+        "mimetype", "objects", "bytes", "encode (s)", "decode (s)"))
+    for mimetype in protocol.MIMETYPES:
+        results = [
+            runSearch(request, searchMethod, responseClass, mimetype)
+            for _ in range(args.repeat)]
+        numObjects, numBytes = results[0][:2]
+        encodeTime = min(result[2] for result in results)
+        decodeTime = min(result[3] for result in results)
+        print("{:<20}{:>10}{:>14}{:>14.3f}{:>14.3f}".format(
+            mimetype, numObjects, numBytes, encodeTime, decodeTime))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Builds the carrier index of a directory of indexed VCF or BCF files. The
+index is written into the directory itself, where the server uses it to
+skip the records that the selected call sets do not carry in searches
+with carrierCallSetIds, and to list the carriers of a variant without
+reading the records. The index must be rebuilt whenever the data files
+change.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import os
+
+import ga4gh.datamodel.carrierindex as carrierindex
+import ga4gh.datamodel.datasets as datasets
+import ga4gh.datamodel.variants as variants
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "variantSetDir", help="The directory of VCF or BCF files")
+    args = parser.parse_args()
+    # Any existing index is replaced, and would be rejected as stale
+    # when the variant set is opened if the data files have changed.
+    manifestPath = os.path.join(
+        args.variantSetDir, carrierindex.MANIFEST_FILE_NAME)
+    if os.path.exists(manifestPath):
+        os.remove(manifestPath)
+    dataset = datasets.AbstractDataset("dataset")
+    variantSet = variants.HtslibVariantSet(
+        dataset, os.path.basename(os.path.normpath(args.variantSetDir)),
+        args.variantSetDir, None)
+    carrierindex.build(variantSet, args.variantSetDir)
+    print("Wrote", manifestPath)
+
+
+if __name__ == '__main__':
+    main()
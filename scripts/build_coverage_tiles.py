@@ -0,0 +1,32 @@
+"""
+Builds the coverage tile sidecar files for the specified BAM files. The
+server uses these to answer coverage requests for large regions from
+precomputed depth sums, rather than by reading every read in the region.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+
+import ga4gh.datamodel.coverage as coverage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "samFilePaths", nargs="+", help="The BAM files to build tiles for")
+    parser.add_argument(
+        "--binSizes", type=int, nargs="+",
+        default=coverage.DEFAULT_BIN_SIZES,
+        help="The bin sizes of the tiles, which must be multiples of the "
+        "smallest of them (default: %(default)s)")
+    args = parser.parse_args()
+    for samFilePath in args.samFilePaths:
+        tiles = coverage.CoverageTiles.build(samFilePath, args.binSizes)
+        tiles.save()
+        print("Wrote", coverage.getCoverageFilePath(samFilePath))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+"""
+Builds the read group index sidecar files for the specified BAM files.
+The server uses these to seek directly to the reads in a read group,
+rather than decoding and discarding the reads in other read groups.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+
+import ga4gh.datamodel.readgroupindex as readgroupindex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "samFilePaths", nargs="+", help="The BAM files to index")
+    args = parser.parse_args()
+    for samFilePath in args.samFilePaths:
+        readGroupIndex = readgroupindex.ReadGroupIndex.build(samFilePath)
+        readGroupIndex.save()
+        print("Wrote", readgroupindex.getIndexFilePath(samFilePath))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Builds the density index of a directory of indexed VCF or BCF files. The
+index is written into the directory itself, where the server uses it to
+answer variant density requests from precomputed counts. The server also
+builds the index in the background after the first density request if it
+is missing or out of date, counting the variants of each request until it
+is ready, so this only saves those requests the work.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import os
+
+import ga4gh.datamodel.datasets as datasets
+import ga4gh.datamodel.variantdensity as variantdensity
+import ga4gh.datamodel.variants as variants
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "variantSetDir", help="The directory of VCF or BCF files")
+    parser.add_argument(
+        "--binSizes", type=int, nargs="+",
+        default=variantdensity.DEFAULT_BIN_SIZES,
+        help="The bin sizes of the index (default: %(default)s)")
+    args = parser.parse_args()
+    dataset = datasets.AbstractDataset("dataset")
+    variantSet = variants.HtslibVariantSet(
+        dataset, os.path.basename(os.path.normpath(args.variantSetDir)),
+        args.variantSetDir, None)
+    densityIndex = variantdensity.VariantDensityIndex.build(
+        variantSet, args.binSizes)
+    densityIndex.save(args.variantSetDir)
+    print("Wrote", os.path.join(
+        args.variantSetDir, variantdensity.MANIFEST_FILE_NAME))
+
+
+if __name__ == '__main__':
+    main()
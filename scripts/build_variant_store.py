@@ -0,0 +1,35 @@
+"""
+Builds a columnar variant store from a directory of indexed VCF or BCF
+files. When the store directory is placed in the variants directory of a
+dataset, the server answers searches on it from memory mapped NumPy
+arrays rather than by parsing the VCF records.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import os
+
+import ga4gh.datamodel.datasets as datasets
+import ga4gh.datamodel.variants as variants
+import ga4gh.datamodel.variantstore as variantstore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "variantSetDir", help="The directory of VCF or BCF files")
+    parser.add_argument(
+        "storeDir", help="The directory to write the variant store to")
+    args = parser.parse_args()
+    dataset = datasets.AbstractDataset("dataset")
+    variantSet = variants.HtslibVariantSet(
+        dataset, os.path.basename(os.path.normpath(args.variantSetDir)),
+        args.variantSetDir, None)
+    variantstore.build(variantSet, args.storeDir)
+    print("Wrote", args.storeDir)
+
+
+if __name__ == '__main__':
+    main()
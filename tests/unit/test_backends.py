@@ -172,6 +172,25 @@ class TestFileSystemBackend(unittest.TestCase):
             self.assertEqual(self._backend.getReferenceSet(rs.getId()), rs)
             self.assertEqual(self._backend.getReferenceSetByName(name), rs)
 
+    def testDataModificationTimes(self):
+        dataset = self._backend.getDatasetByIndex(0)
+        objects = [dataset]
+        for variantSet in dataset.getVariantSets():
+            objects.append(variantSet)
+            objects.extend(variantSet.getCallSets())
+        for readGroupSet in dataset.getReadGroupSets():
+            objects.append(readGroupSet)
+            objects.extend(readGroupSet.getReadGroups())
+        for referenceSet in self._backend.getReferenceSets():
+            objects.append(referenceSet)
+            objects.extend(referenceSet.getReferences())
+        for datamodelObject in objects:
+            paths = datamodelObject.getDataFilePaths()
+            self.assertGreater(len(paths), 0)
+            self.assertEqual(
+                datamodelObject.getDataModificationTime(),
+                max(os.path.getmtime(path) for path in paths))
+
 
 class TestTopLevelObjectGenerator(unittest.TestCase):
     """
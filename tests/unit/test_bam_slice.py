@@ -0,0 +1,211 @@
+"""
+Tests for streaming slices of BAM files.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import pysam
+
+import ga4gh.datamodel.bamslice as bamslice
+import ga4gh.exceptions as exceptions
+import tests.utils as utils
+
+
+def getReadKey(read):
+    return (
+        read.query_name, read.flag, read.reference_id, read.reference_start,
+        read.cigarstring, read.query_sequence)
+
+
+def writeBam(path, referenceNames, readsPerReference, seed=1):
+    """
+    Writes an indexed BAM file of random reads, spanning many BGZF
+    blocks, to the specified path.
+    """
+    randomNumberGenerator = random.Random(seed)
+    header = {
+        "HD": {"VN": "1.0", "SO": "coordinate"},
+        "SQ": [{"SN": name, "LN": 10000000} for name in referenceNames]}
+    bamFile = pysam.AlignmentFile(path, "wb", header=header)
+    qualities = pysam.fromQualityString(b"I" * 100)
+    bases = "".join(randomNumberGenerator.choice("ACGT") for _ in range(10000))
+    for referenceId in range(len(referenceNames)):
+        position = 0
+        for index in range(readsPerReference):
+            position += randomNumberGenerator.randint(0, 80)
+            read = pysam.AlignedSegment()
+            read.query_name = "read{}.{}".format(referenceId, index).encode()
+            offset = randomNumberGenerator.randint(0, len(bases) - 100)
+            read.query_sequence = bases[offset:offset + 100].encode()
+            read.reference_id = referenceId
+            # The bin of the read is computed from its CIGAR when its
+            # position is set.
+            read.cigar = ((0, 100),)
+            read.reference_start = position
+            read.mapping_quality = 30
+            read.query_qualities = qualities
+            bamFile.write(read)
+    bamFile.close()
+    pysam.index(path.encode())
+
+
+class TestBamSlicer(unittest.TestCase):
+    """
+    Tests slices of a BAM file of many blocks against the reads found by
+    pysam in each region.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls._tempDir = tempfile.mkdtemp()
+        cls._bamFilePath = os.path.join(cls._tempDir, "reads.bam")
+        writeBam(cls._bamFilePath, ["chrA", "chrB"], 20000)
+        with io.open(cls._bamFilePath, "rb") as bamFile:
+            cls._bamData = bamFile.read()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls._tempDir)
+
+    def setUp(self):
+        self._slicer = bamslice.BamSlicer(self._bamFilePath)
+        self._samFile = pysam.AlignmentFile(self._bamFilePath)
+        self._slicePath = os.path.join(self._tempDir, "slice.bam")
+
+    def tearDown(self):
+        self._samFile.close()
+
+    def getSliceReads(self, pieces):
+        with io.open(self._slicePath, "wb") as sliceFile:
+            for piece in pieces:
+                sliceFile.write(piece)
+        sliceSamFile = pysam.AlignmentFile(self._slicePath)
+        self.assertEqual(sliceSamFile.references, self._samFile.references)
+        reads = [
+            getReadKey(read) for read in sliceSamFile.fetch(until_eof=True)]
+        sliceSamFile.close()
+        return reads
+
+    def testSlices(self):
+        self.assertEqual(self._slicer.getReferenceNames(), ["chrA", "chrB"])
+        allReads = [
+            getReadKey(read) for read in self._samFile.fetch(until_eof=True)]
+        self.assertEqual(
+            self.getSliceReads(self._slicer.iterSlice(
+                self._slicer.getChunks())),
+            allReads)
+        for referenceName, start, end in [
+                ("chrA", 0, 1000), ("chrA", 50000, 50001),
+                ("chrA", 20000, 150000), ("chrB", 100000, 10000000),
+                ("chrB", 0, None), ("chrB", 5000000, 6000000)]:
+            expected = [
+                getReadKey(read) for read in self._samFile.fetch(
+                    referenceName.encode(), start, end)]
+            pieces = list(self._slicer.iterSlice(
+                self._slicer.getChunks(referenceName, start, end)))
+            reads = self.getSliceReads(pieces)
+            self.assertTrue(set(expected) <= set(reads))
+            # The slice holds a run of the reads in the file. As htslib
+            # merges the bins of sparse windows into their parents, it
+            # may hold the reads of a 128 kb bin around the region.
+            if len(reads) > 0:
+                first = allReads.index(reads[0])
+                self.assertEqual(
+                    allReads[first:first + len(reads)], reads)
+            if end is not None and end - start < 10000:
+                self.assertLess(len(reads), len(allReads) // 4)
+            # Most of a large slice is copied from the file unchanged.
+            if len(expected) > 1000:
+                copied = sum(
+                    len(piece) for piece in pieces
+                    if len(piece) > 1000 and piece in self._bamData)
+                self.assertGreater(
+                    copied, sum(len(piece) for piece in pieces) // 2)
+
+    def testBadRequests(self):
+        self.assertRaises(
+            exceptions.ReferenceNameNotFoundException,
+            self._slicer.getChunks, "chrC", 0, 10)
+        self.assertTrue(self._slicer.isCurrent())
+        tempDir = tempfile.mkdtemp()
+        try:
+            bamFilePath = os.path.join(tempDir, "reads.bam")
+            shutil.copy(self._bamFilePath, bamFilePath)
+            self.assertRaises(
+                exceptions.NotIndexedException,
+                bamslice.BamSlicer, bamFilePath)
+        finally:
+            shutil.rmtree(tempDir)
+
+
+class TestBamSliceRequests(unittest.TestCase):
+    """
+    Tests BAM slice requests for the test read group sets through the
+    backend and client.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._client = fixture.client
+        self._readGroupSet = fixture.readGroupSet
+        self._tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def writeSlice(self, pieces):
+        path = os.path.join(self._tempDir, "slice.bam")
+        with io.open(path, "wb") as sliceFile:
+            for piece in pieces:
+                sliceFile.write(piece)
+        return path
+
+    def getReads(self, path):
+        samFile = pysam.AlignmentFile(path)
+        reads = [getReadKey(read) for read in samFile.fetch(until_eof=True)]
+        samFile.close()
+        return reads
+
+    def testBamSlice(self):
+        samFile = pysam.AlignmentFile(self._readGroupSet.getSamFilePath())
+        expected = [getReadKey(read) for read in samFile.fetch(b"1")]
+        samFile.close()
+        allReads = self.getReads(self._readGroupSet.getSamFilePath())
+        self.assertGreater(len(expected), 0)
+        readGroupSetId = self._readGroupSet.getId()
+        self.assertEqual(
+            self.getReads(self.writeSlice(self._client.getReadGroupSetBam(
+                readGroupSetId, "1", 0, 2**20))),
+            expected)
+        self.assertEqual(
+            self.getReads(self.writeSlice(
+                self._client.getReadGroupSetBam(readGroupSetId))),
+            allReads)
+        self.assertEqual(
+            self.getReads(self.writeSlice(self._client.getReadGroupSetBam(
+                readGroupSetId, "2"))),
+            [])
+
+    def testBadRequests(self):
+        readGroupSetId = self._readGroupSet.getId()
+        for requestArgs in [
+                {"start": 10}, {"referenceName": "1", "start": -1},
+                {"referenceName": "1", "start": 10, "end": 10}]:
+            self.assertRaises(
+                exceptions.BadRequestArgumentException,
+                self._backend.runExportReadGroupSetBam, readGroupSetId,
+                requestArgs)
+        self.assertRaises(
+            exceptions.ReferenceNameNotFoundException,
+            self._backend.runExportReadGroupSetBam, readGroupSetId,
+            {"referenceName": "noSuchReference"})
+        self.assertRaises(
+            exceptions.NotFoundException,
+            self._backend.runExportReadGroupSetBam, "notValid", {})
@@ -0,0 +1,176 @@
+"""
+Tests for batch get requests.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import unittest
+
+import ga4gh.datamodel as datamodel
+import ga4gh.exceptions as exceptions
+import tests.utils as utils
+
+
+class TestGetVariantsById(unittest.TestCase):
+    """
+    Tests reading many variants of the test variant sets together
+    against reading each of them in turn.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        self._variantSet = fixture.variantSet
+
+    def getCompoundIds(self, variantSet):
+        """
+        Returns a list of the compound IDs of some of the variants of the
+        specified variant set on each of its contigs, out of order and
+        with repeats, and of some variants that do not exist.
+        """
+        compoundIds = []
+        for referenceName in variantSet.getReferenceNames():
+            gaVariants = list(variantSet.getVariants(
+                referenceName, 0, 2**32, []))
+            compoundIds.extend(
+                datamodel.VariantCompoundId.parse(gaVariant.id)
+                for gaVariant in gaVariants[::-3] + gaVariants[:2])
+            compoundIds.append(datamodel.VariantCompoundId(
+                variantSet.getCompoundId(), referenceName,
+                str(gaVariants[0].start), "noSuchVariant"))
+        compoundIds.append(datamodel.VariantCompoundId(
+            variantSet.getCompoundId(), "noSuchReference", "0", "md5"))
+        return compoundIds
+
+    def getExpectedVariants(self, variantSet, compoundIds):
+        gaVariants = []
+        for compoundId in compoundIds:
+            try:
+                gaVariants.append(variantSet.getVariant(compoundId))
+            except exceptions.ObjectNotFoundException:
+                gaVariants.append(None)
+        return gaVariants
+
+    def testVariantSets(self):
+        numVariants = 0
+        for variantSet in self._dataset.getVariantSets():
+            compoundIds = self.getCompoundIds(variantSet)
+            expected = self.getExpectedVariants(variantSet, compoundIds)
+            for variantBatchGap in [0, 1000, 2**32]:
+                variantSet.variantBatchGap = variantBatchGap
+                self.assertEqual(
+                    variantSet.getVariantsById(compoundIds), expected)
+            numVariants += len(
+                [gaVariant for gaVariant in expected if gaVariant])
+        self.assertGreater(numVariants, 0)
+
+    def testFetches(self):
+        variantSet = self._variantSet
+        fetches = []
+
+        def getPysamRecords(referenceName, start, end, *args):
+            fetches.append((referenceName, start, end))
+            return variantSet.__class__.getPysamRecords(
+                variantSet, referenceName, start, end, *args)
+        variantSet.getPysamRecords = getPysamRecords
+        gaVariants = list(variantSet.getVariants("1", 0, 2**32))
+        del fetches[:]
+        starts = [gaVariant.start for gaVariant in gaVariants]
+        compoundIds = [
+            datamodel.VariantCompoundId.parse(gaVariant.id)
+            for gaVariant in reversed(gaVariants)]
+        variantSet.variantBatchGap = 2**32
+        self.assertEqual(
+            variantSet.getVariantsById(compoundIds), gaVariants[::-1])
+        self.assertEqual(fetches, [("1", starts[0], starts[-1] + 1)])
+        del fetches[:]
+        variantSet.variantBatchGap = 0
+        variantSet.getVariantsById(compoundIds)
+        self.assertEqual(len(fetches), len(set(starts)))
+
+
+class TestBatchGetRequests(unittest.TestCase):
+    """
+    Tests batch get requests through the backend and client against
+    single get requests.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._client = fixture.client
+        self._dataset = fixture.dataset
+
+    def testVariants(self):
+        variantIds = []
+        for variantSet in self._dataset.getVariantSets():
+            variantIds.extend(
+                gaVariant.id for gaVariant in
+                variantSet.getVariants("1", 0, 2**32, []))
+        self.assertGreater(len(variantIds), 0)
+        variantIds = variantIds[::-7]
+        compoundId = datamodel.VariantCompoundId.parse(variantIds[0])
+        compoundId.md5 = "noSuchVariant"
+        missingIds = [str(compoundId), "notValid"]
+        requestIds = variantIds[:1] + missingIds + variantIds
+        gaVariants = self._client.batchGetVariants(requestIds)
+        self.assertEqual(
+            gaVariants,
+            [self._client.getVariant(variantIds[0]), None, None] + [
+                self._client.getVariant(variantId)
+                for variantId in variantIds])
+        results = json.loads(self._backend.runBatchGetVariants(
+            json.dumps({"ids": missingIds})))["results"]
+        self.assertEqual(
+            [result["id"] for result in results], missingIds)
+        self.assertEqual(
+            results[0]["error"]["errorCode"],
+            exceptions.ObjectWithIdNotFoundException.getErrorCode())
+        self.assertEqual(
+            results[1]["error"]["errorCode"],
+            exceptions.ObjectWithIdNotFoundException.getErrorCode())
+
+    def testCallSets(self):
+        callSetIds = [
+            callSet.getId() for variantSet in self._dataset.getVariantSets()
+            for callSet in variantSet.getCallSets()]
+        self.assertGreater(len(callSetIds), 0)
+        self.assertEqual(
+            self._client.batchGetCallSets(callSetIds[::-1] + ["notValid"]),
+            [self._backend.getCallSet(callSetId).toProtocolElement()
+             for callSetId in callSetIds[::-1]] + [None])
+
+    def testReadGroups(self):
+        readGroupIds = [
+            readGroup.getId()
+            for readGroupSet in self._dataset.getReadGroupSets()
+            for readGroup in readGroupSet.getReadGroups()]
+        self.assertGreater(len(readGroupIds), 0)
+        self.assertEqual(
+            self._client.batchGetReadGroups(readGroupIds + ["notValid"]),
+            [self._client.getReadGroup(readGroupId)
+             for readGroupId in readGroupIds] + [None])
+
+    def testReferences(self):
+        referenceIds = [
+            reference.getId()
+            for referenceSet in self._backend.getReferenceSets()
+            for reference in referenceSet.getReferences()]
+        self.assertGreater(len(referenceIds), 0)
+        self.assertEqual(
+            self._client.batchGetReferences(referenceIds + ["notValid"]),
+            [self._client.getReference(referenceId)
+             for referenceId in referenceIds] + [None])
+
+    def testBadRequests(self):
+        badRequests = [
+            {}, {"ids": "abc"}, {"ids": [1]}, [],
+            {"ids": ["abc"] * (self._backend.maxBatchGetIds + 1)}]
+        for request in badRequests:
+            self.assertRaises(
+                exceptions.BadRequestArgumentException,
+                self._backend.runBatchGetCallSets, json.dumps(request))
+        self.assertRaises(
+            exceptions.InvalidJsonException,
+            self._backend.runBatchGetVariants, "{")
@@ -0,0 +1,91 @@
+"""
+Tests for the reading and writing of BGZF blocks.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import ga4gh.datamodel.bgzf as bgzf
+
+
+class TestBgzfBlocks(unittest.TestCase):
+    """
+    Tests the writing and reading of BGZF blocks.
+    """
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp()
+        self._data = bytes(bytearray(index % 251 for index in range(300000)))
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+        bgzf.blockCompressor.setNumThreads(4)
+
+    def writeBlocks(self, blocks):
+        path = os.path.join(self._tempDir, "data.gz")
+        with io.open(path, "wb") as dataFile:
+            dataFile.write(blocks + bgzf.EOF)
+        return path
+
+    def testCompressBlocks(self):
+        self.assertEqual(bgzf.compressBlocks(b""), b"")
+        blocks = bgzf.compressBlocks(self._data)
+        pieces = []
+        offset = 0
+        with io.open(self.writeBlocks(blocks), "rb") as dataFile:
+            while True:
+                blockSize, piece = bgzf.readBlock(dataFile, offset)
+                if blockSize == 0:
+                    break
+                self.assertLessEqual(len(piece), 65536)
+                pieces.append(piece)
+                offset += blockSize
+        self.assertEqual(b"".join(pieces), self._data)
+        # The blocks are a valid multi-member gzip stream.
+        gzipFile = gzip.GzipFile(fileobj=io.BytesIO(blocks))
+        self.assertEqual(gzipFile.read(), self._data)
+
+    def testChunks(self):
+        blocks = bgzf.compressBlocks(self._data)
+        with io.open(self.writeBlocks(blocks), "rb") as dataFile:
+            firstBlockSize, firstBlock = bgzf.readBlock(dataFile, 0)
+            for chunkStart, chunkEnd, start, end in [
+                    (10, 100, 10, 100), (0, firstBlockSize << 16, 0, None),
+                    (10, (firstBlockSize << 16) | 5, 10,
+                     len(firstBlock) + 5)]:
+                if end is None:
+                    end = len(firstBlock)
+                self.assertEqual(
+                    bgzf.readData(dataFile, chunkStart, chunkEnd),
+                    self._data[start:end])
+                chunk = b"".join(bgzf.iterChunk(
+                    dataFile, chunkStart, chunkEnd))
+                self.assertEqual(
+                    gzip.GzipFile(fileobj=io.BytesIO(chunk)).read(),
+                    self._data[start:end])
+            self.assertEqual(bgzf.readData(dataFile, 7, None), self._data[7:])
+
+    def testBlockCompressor(self):
+        pieces = [
+            self._data[offset:offset + 1000]
+            for offset in range(0, len(self._data), 1000)]
+        bgzf.BlockCompressor.blocksPerTask = 2
+        try:
+            for numThreads in [0, 3]:
+                bgzf.blockCompressor.setNumThreads(numThreads)
+                blocks = b"".join(bgzf.blockCompressor.compress(pieces))
+                self.assertEqual(
+                    gzip.GzipFile(fileobj=io.BytesIO(blocks)).read(),
+                    self._data)
+                self.assertEqual(
+                    list(bgzf.blockCompressor.compress([])), [])
+        finally:
+            bgzf.BlockCompressor.blocksPerTask = 16
+        self.assertRaises(
+            ValueError, bgzf.blockCompressor.setNumThreads, -1)
@@ -0,0 +1,292 @@
+"""
+Tests for carrier-filtered variant searches and the carrier index.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.carrierindex as carrierindex
+import ga4gh.datamodel.variantfilters as variantfilters
+import ga4gh.datamodel.variants as variants
+import ga4gh.datamodel.variantstore as variantstore
+import ga4gh.exceptions as exceptions
+import ga4gh.protocol as protocol
+import tests.unit.test_sample_shards as test_sample_shards
+import tests.unit.test_variant_shards as test_variant_shards
+import tests.utils as utils
+
+
+def getCarriedVariants(gaVariants, carrierCallSetIds):
+    """
+    Returns the list of the specified GA Variants in which each of the
+    specified call sets carries a non reference allele.
+    """
+    carried = []
+    for gaVariant in gaVariants:
+        genotypes = dict(
+            (call.callSetId, call.genotype) for call in gaVariant.calls)
+        if all(variants.isCarrierGenotype(genotypes[callSetId])
+               for callSetId in carrierCallSetIds):
+            carried.append(gaVariant)
+    return carried
+
+
+class TestCarrierIndex(unittest.TestCase):
+    """
+    Tests carrier-filtered searches of a copy of one of the test variant
+    sets, with and without a carrier index, against the calls of its
+    variants.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        self._variantSet = fixture.variantSet
+        self._tempDir = tempfile.mkdtemp()
+        self._dataDir = os.path.join(self._tempDir, "1kgPhase1")
+        shutil.copytree(self._variantSet.getDataFilePaths()[0], self._dataDir)
+        self._callSetIds = [
+            callSet.getId() for callSet in self._variantSet.getCallSets()]
+        self._carrierCallSetIdsList = [
+            self._callSetIds[:1], self._callSetIds[1:3],
+            self._callSetIds[-1:], self._callSetIds[::-1]]
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def getIndexedVariantSet(self):
+        variantSet = self.getVariantSet()
+        carrierindex.build(variantSet, self._dataDir)
+        return self.getVariantSet()
+
+    def getVariantSet(self):
+        # Using the same local ID gives the variants the same IDs.
+        return variants.HtslibVariantSet(
+            self._dataset, self._variantSet.getLocalId(), self._dataDir,
+            self._backend)
+
+    def assertCarriedVariants(self, variantSet, referenceName, start, end,
+                              callSetIds=None, variantFilter=None):
+        """
+        Asserts that the carrier-filtered searches of the specified
+        variant set return the variants of the test variant set carried
+        by each of the test lists of call sets, and returns the number of
+        variants returned.
+        """
+        numVariants = 0
+        gaVariants = list(self._variantSet.getVariants(
+            referenceName, start, end, None, variantFilter))
+        for carrierCallSetIds in self._carrierCallSetIdsList:
+            expected = getCarriedVariants(gaVariants, carrierCallSetIds)
+            if callSetIds is not None:
+                expected = list(self._variantSet.getVariants(
+                    referenceName, start, end, callSetIds, variantFilter,
+                    carrierCallSetIds))
+            self.assertEqual(
+                test_variant_shards.getJsonDicts(variantSet.getVariants(
+                    referenceName, start, end, callSetIds, variantFilter,
+                    carrierCallSetIds)),
+                test_variant_shards.getJsonDicts(expected))
+            numVariants += len(expected)
+        return numVariants
+
+    def testUnindexedSearches(self):
+        numVariants = 0
+        for referenceName in self._variantSet.getReferenceNames():
+            numVariants += self.assertCarriedVariants(
+                self.getVariantSet(), referenceName, 0, 2**32)
+        self.assertGreater(numVariants, 0)
+
+    def testIndexedSearches(self):
+        variantSet = self.getIndexedVariantSet()
+        self.assertIn(
+            os.path.join(self._dataDir, carrierindex.MANIFEST_FILE_NAME),
+            variantSet.getDataFilePaths())
+        numVariants = 0
+        for referenceName in self._variantSet.getReferenceNames():
+            starts = [
+                gaVariant.start for gaVariant in
+                self._variantSet.getVariants(referenceName, 0, 2**32)]
+            regions = [
+                (0, 2**32), (starts[0], starts[0] + 1),
+                (starts[len(starts) // 2], starts[-1]),
+                (starts[-1] + 1, 2**32)]
+            for start, end in regions:
+                numVariants += self.assertCarriedVariants(
+                    variantSet, referenceName, start, end)
+        self.assertGreater(numVariants, 0)
+        self.assertEqual(
+            list(variantSet.getVariants(
+                "xyz", 0, 2**32, None, None, self._callSetIds[:1])), [])
+
+    def testCallSetsAndFilters(self):
+        variantSet = self.getIndexedVariantSet()
+        variantFilter = variantfilters.VariantFilter("INFO.AF < 0.5")
+        for callSetIds in [[], self._callSetIds[2:4]]:
+            self.assertCarriedVariants(
+                variantSet, "1", 0, 2**32, callSetIds, variantFilter)
+
+    def testRunGaps(self):
+        variantSet = self.getIndexedVariantSet()
+        for carrierRunGap in [0, 1, 1000]:
+            variantSet.carrierRunGap = carrierRunGap
+            self.assertGreater(
+                self.assertCarriedVariants(variantSet, "1", 0, 2**32), 0)
+
+    def testGetCarrierCallSetIds(self):
+        indexedVariantSet = self.getIndexedVariantSet()
+        for gaVariant in self._variantSet.getVariants("2", 0, 2**32):
+            expected = [
+                call.callSetId for call in gaVariant.calls
+                if variants.isCarrierGenotype(call.genotype)]
+            compoundId = datamodel.VariantCompoundId.parse(gaVariant.id)
+            for variantSet in [self._variantSet, indexedVariantSet]:
+                self.assertEqual(
+                    variantSet.getCarrierCallSetIds(compoundId), expected)
+        compoundId = datamodel.VariantCompoundId(
+            self._variantSet.getCompoundId(), "2", 0, "noSuchVariant")
+        self.assertRaises(
+            exceptions.ObjectNotFoundException,
+            indexedVariantSet.getCarrierCallSetIds, compoundId)
+
+    def testStaleIndex(self):
+        # A stale index is not used, and searches read the records.
+        self.getIndexedVariantSet()
+        dataFilePath = os.path.join(self._dataDir, "chr1.vcf.gz")
+        fileStat = os.stat(dataFilePath)
+        os.utime(dataFilePath, (fileStat.st_atime, fileStat.st_mtime + 0.5))
+        variantSet = self.getVariantSet()
+        self.assertRaises(
+            exceptions.StaleCarrierIndexException, carrierindex.CarrierIndex,
+            self._dataDir, variantSet.getDataFileNames())
+        self.assertNotIn(
+            os.path.join(self._dataDir, carrierindex.MANIFEST_FILE_NAME),
+            variantSet.getDataFilePaths())
+        self.assertGreater(
+            self.assertCarriedVariants(variantSet, "1", 0, 2**32), 0)
+
+    def testUnreadableIndex(self):
+        # An index that cannot be read is not used either, and does not
+        # stop the variant set from loading.
+        self.getIndexedVariantSet()
+        manifestPath = os.path.join(
+            self._dataDir, carrierindex.MANIFEST_FILE_NAME)
+        with open(manifestPath) as manifestFile:
+            manifest = manifestFile.read()
+        columnPath = os.path.join(
+            self._dataDir, "carriers.contig0.bitmaps.npy")
+        with open(columnPath, "rb") as columnFile:
+            column = columnFile.read()
+        for manifestText, columnData in [
+                (manifest[:len(manifest) // 2], column),
+                ("[]", column),
+                (manifest.replace('"contigs"', '"x"'), column),
+                (manifest, column[:len(column) // 2])]:
+            with open(manifestPath, "w") as manifestFile:
+                manifestFile.write(manifestText)
+            with open(columnPath, "wb") as columnFile:
+                columnFile.write(columnData)
+            variantSet = self.getVariantSet()
+            self.assertNotIn(manifestPath, variantSet.getDataFilePaths())
+            self.assertGreater(
+                self.assertCarriedVariants(variantSet, "1", 0, 2**32), 0)
+
+    def testColumnarVariantSet(self):
+        storeDir = os.path.join(self._tempDir, "store")
+        variantstore.build(self._variantSet, storeDir)
+        columnarVariantSet = variantstore.ColumnarVariantSet(
+            self._dataset, self._variantSet.getLocalId(), storeDir,
+            self._backend)
+        columnarVariantSet.blockSize = 7
+        for referenceName in self._variantSet.getReferenceNames():
+            self.assertCarriedVariants(
+                columnarVariantSet, referenceName, 0, 2**32)
+        for gaVariant in self._variantSet.getVariants("3", 0, 2**32):
+            compoundId = datamodel.VariantCompoundId.parse(gaVariant.id)
+            self.assertEqual(
+                columnarVariantSet.getCarrierCallSetIds(compoundId),
+                self._variantSet.getCarrierCallSetIds(compoundId))
+
+    def testSampleShardedVariantSet(self):
+        shardsDir = os.path.join(self._tempDir, "shards")
+        os.mkdir(shardsDir)
+        sourcePaths = self._variantSet.getDataFilePaths()[1:]
+        for index, sampleIndexes in enumerate([[0, 1], [2], [3, 4]]):
+            for sourcePath in sourcePaths:
+                test_sample_shards.writeSampleShard(
+                    sourcePath, os.path.join(
+                        shardsDir, "shard{}".format(index)),
+                    sampleIndexes)
+        test_sample_shards.writeShardsFile(
+            shardsDir, ["shard0", "shard1", "shard2"])
+        shardedVariantSet = variants.SampleShardedVariantSet(
+            self._dataset, self._variantSet.getLocalId(), shardsDir,
+            self._backend)
+        self._carrierCallSetIdsList = [
+            self._callSetIds[:1], self._callSetIds[1:3],
+            self._callSetIds[4::-1]]
+        for callSetIds in [self._callSetIds[:5], [], self._callSetIds[3:4]]:
+            self.assertCarriedVariants(
+                shardedVariantSet, "1", 0, 2**32, callSetIds)
+
+
+class TestCarrierSearches(unittest.TestCase):
+    """
+    Tests carrier-filtered searches and carrier lists through the
+    backend and client.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._client = fixture.client
+        self._variantSet = fixture.variantSet
+        self._callSetIds = [
+            callSet.getId() for callSet in self._variantSet.getCallSets()]
+
+    def getRequestString(self, **extensions):
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = self._variantSet.getId()
+        request.referenceName = "1"
+        request.start = 0
+        request.end = 2**32
+        requestDict = request.toJsonDict()
+        requestDict.update(extensions)
+        return json.dumps(requestDict)
+
+    def testSearch(self):
+        carrierCallSetIds = self._callSetIds[:2]
+        responseString = self._backend.runSearchVariants(
+            self.getRequestString(carrierCallSetIds=carrierCallSetIds))
+        response = protocol.SearchVariantsResponse.fromJsonString(
+            responseString)
+        expected = getCarriedVariants(
+            self._variantSet.getVariants("1", 0, 2**32), carrierCallSetIds)
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(
+            [gaVariant.id for gaVariant in response.variants],
+            [gaVariant.id for gaVariant in expected])
+
+    def testGetVariantCarriers(self):
+        for gaVariant in self._variantSet.getVariants("1", 0, 2**32):
+            self.assertEqual(
+                self._client.getVariantCarriers(gaVariant.id),
+                [call.callSetId for call in gaVariant.calls
+                 if variants.isCarrierGenotype(call.genotype)])
+
+    def testBadRequests(self):
+        for carrierCallSetIds in ["abc", [1]]:
+            self.assertRaises(
+                exceptions.BadRequestArgumentException,
+                self._backend.runSearchVariants,
+                self.getRequestString(carrierCallSetIds=carrierCallSetIds))
+        self.assertRaises(
+            exceptions.CallSetNotInVariantSetException,
+            self._backend.runSearchVariants,
+            self.getRequestString(carrierCallSetIds=["noSuchCallSet"]))
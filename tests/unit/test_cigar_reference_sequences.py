@@ -0,0 +1,189 @@
+"""
+Tests for including the reference sequence in the cigars of reads.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import unittest
+
+import ga4gh.datamodel.reads as reads
+import ga4gh.datamodel.references as references
+import ga4gh.exceptions as exceptions
+import ga4gh.protocol as protocol
+import tests.utils as utils
+
+
+def getSimulatedReference(length):
+    """
+    Returns a simulated reference with the specified length.
+    """
+    referenceSet = references.SimulatedReferenceSet("referenceSet")
+    return references.SimulatedReference(
+        referenceSet, "reference", randomSeed=1, length=length)
+
+
+class TestReferenceWindow(unittest.TestCase):
+    """
+    Tests the ReferenceWindow against a simulated reference.
+    """
+    def setUp(self):
+        self._reference = getSimulatedReference(1000)
+
+    def testGetBases(self):
+        window = references.ReferenceWindow(self._reference, 100)
+        ranges = [
+            (0, 10), (5, 50), (50, 100), (99, 100), (100, 100),
+            (100, 150), (120, 400), (130, 140), (990, 1000), (1000, 1000)]
+        for start, end in ranges:
+            self.assertEqual(
+                window.getBases(start, end),
+                self._reference.getBases(start, end))
+        self.assertEqual(window.getNumFetches(), 4)
+
+    def testOutsideReference(self):
+        window = references.ReferenceWindow(self._reference)
+        for start, end in [(-1, 10), (990, 1001), (10, 5), (2000, 2010)]:
+            self.assertIsNone(window.getBases(start, end))
+        self.assertEqual(window.getNumFetches(), 0)
+
+    def testSingleFetch(self):
+        window = references.ReferenceWindow(self._reference)
+        for start in range(0, 950, 7):
+            window.getBases(start, start + 50)
+        self.assertEqual(window.getNumFetches(), 1)
+
+
+class TestCigarReferenceSequences(unittest.TestCase):
+    """
+    Tests the reference sequences in the cigars of the reads converted
+    from the test data.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        # The test reads are not all within the test references, so we
+        # use a simulated reference long enough to hold them all.
+        self._reference = getSimulatedReference(20000)
+
+    def testConvertedReads(self):
+        numSequences = 0
+        for readGroupSet in self._dataset.getReadGroupSets():
+            samFile = readGroupSet.getFileHandle(
+                readGroupSet.getSamFilePath())
+            readGroup = readGroupSet.getReadGroups()[0]
+            pysamReads = [
+                read for referenceName in samFile.references
+                for read in samFile.fetch(referenceName)]
+            converter = reads.HtslibReadAlignmentConverter(
+                readGroup, samFile,
+                referenceWindow=references.ReferenceWindow(self._reference))
+            plainConverter = reads.HtslibReadAlignmentConverter(
+                readGroup, samFile)
+            for read in pysamReads:
+                gaRead = converter.convert(read)
+                self.assertEqual(converter.toJsonString(read),
+                                 gaRead.toJsonString())
+                position = read.reference_start
+                for gaCigarUnit, plainCigarUnit in zip(
+                        gaRead.alignment.cigar,
+                        plainConverter.convert(read).alignment.cigar):
+                    self.assertIsNone(plainCigarUnit.referenceSequence)
+                    operation = reads.SamCigar.ga2int(gaCigarUnit.operation)
+                    length = gaCigarUnit.operationLength
+                    if operation in reads.SamCigar.referenceSequenceOperations:
+                        self.assertEqual(
+                            gaCigarUnit.referenceSequence,
+                            self._reference.getBases(
+                                position, position + length))
+                        numSequences += 1
+                    else:
+                        self.assertIsNone(gaCigarUnit.referenceSequence)
+                    if operation in reads.SamCigar.referenceOperations:
+                        position += length
+        self.assertGreater(numSequences, 0)
+
+    def testFieldMasks(self):
+        readGroupSet = self._dataset.getReadGroupSets()[1]
+        samFile = readGroupSet.getFileHandle(readGroupSet.getSamFilePath())
+        readGroup = readGroupSet.getReadGroups()[0]
+        pysamReads = list(samFile.fetch(samFile.references[0]))
+        self.assertGreater(len(pysamReads), 0)
+        fieldsList = [
+            "alignment.cigar", "alignment.cigar.referenceSequence",
+            "alignment.cigar.operation", "id"]
+        for fields in fieldsList:
+            fieldMask = protocol.FieldMask.parse(
+                protocol.ReadAlignment, fields)
+            converter = reads.HtslibReadAlignmentConverter(
+                readGroup, samFile, fieldMask,
+                references.ReferenceWindow(self._reference))
+            for read in pysamReads:
+                self.assertEqual(
+                    converter.toJsonString(read),
+                    fieldMask.toJsonString(converter.convert(read)))
+
+
+class TestSearchReferenceSequences(unittest.TestCase):
+    """
+    Tests reads searches that include the reference sequences.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        readGroupSet = self._dataset.getReadGroupSetByName("chr17.1-250")
+        self._readGroup = readGroupSet.getReadGroups()[0]
+        self._reference = readGroupSet.getReferenceSet().getReferences()[0]
+
+    def getAlignments(self, responseValidation, includeReferenceSequence):
+        self._backend.setResponseValidation(responseValidation)
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [self._readGroup.getId()]
+        request.referenceId = self._reference.getId()
+        request.start = 0
+        request.end = 2**32
+        requestDict = request.toJsonDict()
+        requestDict["includeReferenceSequence"] = includeReferenceSequence
+        response = protocol.SearchReadsResponse.fromJsonString(
+            self._backend.runSearchReads(json.dumps(requestDict)))
+        return response.alignments
+
+    def testSearchReads(self):
+        plainAlignments = self.getAlignments(False, False)
+        self.assertGreater(len(plainAlignments), 0)
+        alignments = self.getAlignments(False, True)
+        self.assertEqual(self.getAlignments(True, True), alignments)
+        self.assertEqual(len(alignments), len(plainAlignments))
+        for alignment in alignments:
+            for cigarUnit in alignment.alignment.cigar:
+                cigarUnit.referenceSequence = None
+        self.assertEqual(alignments, plainAlignments)
+
+    def testWithinReference(self):
+        # The test reference is shorter than the region of the reads,
+        # so only the operations wholly within it have sequences.
+        length = self._reference.getLength()
+        for alignment in self.getAlignments(False, True):
+            position = alignment.alignment.position.position
+            for cigarUnit in alignment.alignment.cigar:
+                operation = reads.SamCigar.ga2int(cigarUnit.operation)
+                end = position + cigarUnit.operationLength
+                isSequenceOperation = (
+                    operation in reads.SamCigar.referenceSequenceOperations)
+                if isSequenceOperation and end <= length:
+                    self.assertEqual(
+                        cigarUnit.referenceSequence,
+                        self._reference.getBases(position, end))
+                else:
+                    self.assertIsNone(cigarUnit.referenceSequence)
+                if operation in reads.SamCigar.referenceOperations:
+                    position = end
+
+    def testBadValues(self):
+        for value in [1, "true", None]:
+            self.assertRaises(
+                exceptions.BadRequestArgumentException,
+                self.getAlignments, False, value)
@@ -227,6 +227,7 @@ class TestOutputFormats(unittest.TestCase):
             self.key = 'key'
             self.baseUrl = 'baseUrl'
             self.verbose = 'verbose'
+            self.avroBinary = False
 
     class FakeObject(protocol.ProtocolElement):
 
@@ -176,6 +176,73 @@ class TestSearchMethodsCallRunRequest(unittest.TestCase):
             "variants", protocol.Variant, self.objectId)
 
 
+class TestHttpClientResponseCache(unittest.TestCase):
+    """
+    Tests the cache of responses to object GET requests in the HttpClient.
+    """
+    def setUp(self):
+        self.dataset = protocol.Dataset()
+        self.dataset.id = "datasetId"
+        self.httpClient = client.HttpClient("http://example.com", cacheSize=2)
+        self.httpClient._session = mock.Mock()
+
+    def getResponse(self, statusCode, etag=None):
+        response = DummyResponse(self.dataset.toJsonString())
+        response.status_code = statusCode
+        if etag is not None:
+            response.headers["ETag"] = etag
+        return response
+
+    def getSentHeaders(self):
+        return self.httpClient._session.get.call_args[1]["headers"]
+
+    def testNotModifiedUsesCachedResponse(self):
+        session = self.httpClient._session
+        session.get.return_value = self.getResponse(200, '"abc"')
+        self.assertEqual(
+            self.httpClient.getDataset("datasetId"), self.dataset)
+        self.assertEqual(self.getSentHeaders(), {})
+        session.get.return_value = self.getResponse(304)
+        session.get.return_value.text = ""
+        self.assertEqual(
+            self.httpClient.getDataset("datasetId"), self.dataset)
+        self.assertEqual(self.getSentHeaders(), {"If-None-Match": '"abc"'})
+
+    def testResponsesWithoutEtagNotCached(self):
+        session = self.httpClient._session
+        session.get.return_value = self.getResponse(200)
+        self.httpClient.getDataset("datasetId")
+        self.httpClient.getDataset("datasetId")
+        self.assertEqual(self.getSentHeaders(), {})
+
+    def testLeastRecentlyUsedEvicted(self):
+        session = self.httpClient._session
+        session.get.return_value = self.getResponse(200, '"abc"')
+        for id_ in ["a", "b", "a", "c"]:
+            self.httpClient.getDataset(id_)
+        self.httpClient.getDataset("a")
+        self.assertEqual(self.getSentHeaders(), {"If-None-Match": '"abc"'})
+        self.httpClient.getDataset("b")
+        self.assertEqual(self.getSentHeaders(), {})
+
+    def testCacheDisabled(self):
+        self.httpClient = client.HttpClient("http://example.com", cacheSize=0)
+        self.httpClient._session = mock.Mock()
+        self.httpClient._session.get.return_value = self.getResponse(
+            200, '"abc"')
+        self.httpClient.getDataset("datasetId")
+        self.httpClient.getDataset("datasetId")
+        self.assertEqual(self.getSentHeaders(), {})
+
+
+def avroRoundTrip(protocolElement):
+    """
+    Returns the result of encoding the specified protocol element in the
+    Avro binary format and decoding it again.
+    """
+    return protocolElement.fromAvroBytes(protocolElement.toAvroBytes())
+
+
 class DatamodelObjectWrapper(object):
     """
     Thin wrapper class that allows us to treat data model objects uniformly.
@@ -194,9 +261,11 @@ class DummyResponse(object):
     """
     Stand in for requests Response object;
     """
-    def __init__(self, text):
+    def __init__(self, text, mimetype=protocol.JSON_MIMETYPE):
         self.text = text
+        self.content = text
         self.status_code = 200
+        self.headers = {"Content-Type": mimetype}
 
 
 class DummyRequestsSession(object):
@@ -231,8 +300,10 @@ class DummyRequestsSession(object):
         contentType = "Content-type"
         assert contentType in self.headers
         assert self.headers[contentType] == "application/json"
+        assert self.headers["Accept"] in protocol.MIMETYPES
+        assert self.headers["Accept-Encoding"] == "gzip, deflate"
 
-    def get(self, url, params):
+    def get(self, url, params, headers=None):
         # TODO add some more checks for params to see if Key is set,
         # and we're not sending any extra stuff.
         self.checkSessionParameters()
@@ -261,7 +332,8 @@ class DummyRequestsSession(object):
             datatype, id_ = splits[1:]
             assert datatype in self._getMethodMap
             method = self._getMethodMap[datatype]
-            result = method(id_)
+            mimetype = self.headers["Accept"]
+            return DummyResponse(method(id_, mimetype), mimetype)
         return DummyResponse(result)
 
     def post(self, url, params=None, data=None):
@@ -274,17 +346,19 @@ class DummyRequestsSession(object):
         datatype = suffix[1:-len(searchSuffix)]
         assert datatype in self._searchMethodMap
         method = self._searchMethodMap[datatype]
-        result = method(data)
-        return DummyResponse(result)
+        mimetype = self.headers["Accept"]
+        result = method(data, mimetype)
+        return DummyResponse(result, mimetype)
 
 
 class DummyHttpClient(client.HttpClient):
     """
     Client in which we intercept calls to the underlying requests connection.
     """
-    def __init__(self, backend):
+    def __init__(self, backend, avroBinary=False):
         self._urlPrefix = "http://example.com"
-        super(DummyHttpClient, self).__init__(self._urlPrefix)
+        super(DummyHttpClient, self).__init__(
+            self._urlPrefix, avroBinary=avroBinary)
         self._session = DummyRequestsSession(backend, self._urlPrefix)
         self._setupHttpSession()
 
@@ -412,6 +486,27 @@ class TestExhaustiveListingsHttp(ExhaustiveListingsMixin, unittest.TestCase):
         return DummyHttpClient(self.backend)
 
 
+class TestExhaustiveListingsHttpAvro(
+        ExhaustiveListingsMixin, unittest.TestCase):
+    """
+    Tests the exhaustive listings using the HTTP client with the Avro
+    binary wire format.
+    """
+
+    def getClient(self):
+        return DummyHttpClient(self.backend, avroBinary=True)
+
+    def verifyObjectList(self, gaObjects, datamodelObjects, getMethod):
+        # Fields declared as 'float' in the schema are encoded with single
+        # precision, so we compare against the round-tripped values.
+        for gaObject, datamodelObject in utils.zipLists(
+                gaObjects, datamodelObjects):
+            protocolElement = datamodelObject.toProtocolElement()
+            self.assertEqual(gaObject, avroRoundTrip(protocolElement))
+            otherGaObject = getMethod(gaObject.id)
+            self.assertEqual(gaObject, otherGaObject)
+
+
 class TestExhaustiveListingsLocal(ExhaustiveListingsMixin, unittest.TestCase):
     """
     Tests the exhaustive listings using the local client.
@@ -489,3 +584,16 @@ class TestPagingHttp(PagingMixin, unittest.TestCase):
 
     def getClient(self):
         return DummyHttpClient(self.backend)
+
+
+class TestPagingHttpAvro(PagingMixin, unittest.TestCase):
+    """
+    Tests paging using the HTTP client with the Avro binary wire format.
+    """
+
+    def getClient(self):
+        return DummyHttpClient(self.backend, avroBinary=True)
+
+    def setUp(self):
+        super(TestPagingHttpAvro, self).setUp()
+        self.references = map(avroRoundTrip, self.references)
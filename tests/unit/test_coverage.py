@@ -0,0 +1,270 @@
+"""
+Tests for read group coverage and the coverage tiles.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import numpy.testing
+import pysam
+
+import ga4gh.backend as backend
+import ga4gh.datamodel.binning as binning
+import ga4gh.datamodel.coverage as coverage
+import ga4gh.datamodel.reads as reads
+import ga4gh.exceptions as exceptions
+import tests.utils as utils
+
+
+def getExpectedSums(readGroup, referenceName, binSize, firstBin, lastBin):
+    """
+    Returns the array of the depth sums of the specified bins, computed
+    from the reads of the specified HtslibReadGroup.
+    """
+    samFile = pysam.AlignmentFile(readGroup.getSamFilePath())
+    sums = numpy.zeros(lastBin - firstBin, dtype=numpy.int64)
+    readGroupSet = readGroup.getParentContainer()
+    for read in samFile.fetch(until_eof=True):
+        if read.is_unmapped or samFile.getrname(
+                read.reference_id) != referenceName:
+            continue
+        if (not readGroupSet.isUsingDefaultReadGroup() and
+                reads.getReadGroupTag(read) != readGroup.getLocalId()):
+            continue
+        coverage.addBlockSums(sums, firstBin, binSize, read.get_blocks())
+    samFile.close()
+    return sums
+
+
+class TestCoverageTiles(unittest.TestCase):
+    """
+    Tests the coverage of the test read groups computed from coverage
+    tiles against the coverage computed from their reads.
+    """
+    binSizes = [10, 30, 300]
+
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp()
+        self._dataDir = os.path.join(self._tempDir, "data")
+        shutil.copytree(os.path.join("tests", "data"), self._dataDir)
+        self._untiledBackend = backend.FileSystemBackend(self._dataDir)
+        dataset = self._untiledBackend.getDatasetByIndex(0)
+        self._samFilePaths = [
+            readGroupSet.getSamFilePath()
+            for readGroupSet in dataset.getReadGroupSets()]
+        for samFilePath in self._samFilePaths:
+            coverage.CoverageTiles.build(samFilePath, self.binSizes).save()
+        self._tiledBackend = backend.FileSystemBackend(self._dataDir)
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def getReadGroupSets(self, theBackend):
+        return theBackend.getDatasetByIndex(0).getReadGroupSets()
+
+    def getCoveredReferences(self, readGroupSet):
+        """
+        Returns the list of the references with reads in the specified
+        read group set, with the (start, end) extent of their reads.
+        """
+        extents = {}
+        samFile = pysam.AlignmentFile(readGroupSet.getSamFilePath())
+        for read in samFile.fetch(until_eof=True):
+            if not read.is_unmapped:
+                name = samFile.getrname(read.reference_id)
+                start, end = extents.get(
+                    name, (read.reference_start, read.reference_end))
+                extents[name] = (
+                    min(start, read.reference_start),
+                    max(end, read.reference_end))
+        samFile.close()
+        referenceSet = readGroupSet.getReferenceSet()
+        return [
+            (reference, extents[reference.getLocalId()])
+            for reference in referenceSet.getReferences()
+            if reference.getLocalId() in extents]
+
+    def getRegions(self, reference, extent):
+        start, end = extent
+        middle = (start + end) // 2
+        return [
+            (0, reference.getLength()), (start, end), (middle, middle + 1),
+            (start - 13, middle), (end, end + 1000)]
+
+    def testTilesLoaded(self):
+        for readGroupSet in self.getReadGroupSets(self._tiledBackend):
+            tiles = readGroupSet.getCoverageTiles()
+            self.assertIsNotNone(tiles)
+            self.assertEqual(tiles.getBinSizes(), self.binSizes)
+        for readGroupSet in self.getReadGroupSets(self._untiledBackend):
+            self.assertIsNone(readGroupSet.getCoverageTiles())
+
+    def testCoverage(self):
+        numBases = 0
+        readGroupSetPairs = zip(
+            self.getReadGroupSets(self._untiledBackend),
+            self.getReadGroupSets(self._tiledBackend))
+        for untiledSet, tiledSet in readGroupSetPairs:
+            readGroupPairs = zip(
+                untiledSet.getReadGroups(), tiledSet.getReadGroups())
+            for reference, extent in self.getCoveredReferences(untiledSet):
+                for untiled, tiled in readGroupPairs:
+                    for start, end in self.getRegions(reference, extent):
+                        for maxBins in [1, 10, 1000]:
+                            results = [
+                                readGroup.getCoverage(
+                                    reference, start, end, maxBins)
+                                for readGroup in [untiled, tiled]]
+                            for binSize, firstBin, sums in results:
+                                self.assertLessEqual(
+                                    firstBin * binSize, start)
+                                self.assertGreaterEqual(
+                                    (firstBin + len(sums)) * binSize, end)
+                                numpy.testing.assert_array_equal(
+                                    sums, getExpectedSums(
+                                        untiled, reference.getLocalId(),
+                                        binSize, firstBin,
+                                        firstBin + len(sums)))
+                                numBases += int(sums.sum())
+                            # Regions needing bins smaller than those of
+                            # the tiles are computed from the reads.
+                            if results[0][0] < self.binSizes[0]:
+                                self.assertEqual(results[1][0], results[0][0])
+                            else:
+                                tileBinSize = binning.getPrecomputedBinSize(
+                                    self.binSizes, results[0][0])
+                                self.assertEqual(
+                                    results[1][0] % tileBinSize, 0)
+        self.assertGreater(numBases, 0)
+
+    def testAlignedBlocks(self):
+        # The aligned blocks of the GA ReadAlignments include those of
+        # reads flagged as unmapped, which are not in the coverage.
+        numBlocks = 0
+        for readGroupSet in self.getReadGroupSets(self._untiledBackend):
+            for reference, extent in self.getCoveredReferences(readGroupSet):
+                for readGroup in readGroupSet.getReadGroups():
+                    start, end = extent
+                    _, pysamReads = readGroup._getPysamReads(
+                        reference, start, end)
+                    expected = [
+                        block for read in list(pysamReads)
+                        for block in read.get_blocks()]
+                    self.assertEqual(
+                        list(reads.AbstractReadGroup._getAlignedBlocks(
+                            readGroup, reference, start, end)),
+                        expected)
+                    numBlocks += len(expected)
+        self.assertGreater(numBlocks, 0)
+
+    def testChunks(self):
+        # Tiles built from a few blocks at a time are the same as those
+        # built from all of them at once.
+        samFilePath = self._samFilePaths[0]
+        expected = coverage.CoverageTiles.build(samFilePath, self.binSizes)
+        self.assertGreater(len(expected._tiles), 0)
+        savedChunkSize = coverage.CoverageTiles.chunkSize
+        coverage.CoverageTiles.chunkSize = 3
+        try:
+            tiles = coverage.CoverageTiles.build(samFilePath, self.binSizes)
+        finally:
+            coverage.CoverageTiles.chunkSize = savedChunkSize
+        self.assertEqual(sorted(tiles._tiles), sorted(expected._tiles))
+        for key, (firstBin, sums) in expected._tiles.items():
+            self.assertEqual(tiles._tiles[key][0], firstBin)
+            numpy.testing.assert_array_equal(tiles._tiles[key][1], sums)
+
+    def testBadBinSizes(self):
+        for binSizes in [[10, 25], [0, 10]]:
+            self.assertRaises(
+                ValueError, coverage.CoverageTiles.build,
+                self._samFilePaths[0], binSizes)
+
+    def testGetPrecomputedBinSize(self):
+        getBinSize = binning.getPrecomputedBinSize
+        self.assertEqual(getBinSize(self.binSizes, 10), 10)
+        self.assertEqual(getBinSize(self.binSizes, 299), 30)
+        self.assertEqual(getBinSize(self.binSizes, 10**6), 300)
+        self.assertEqual(getBinSize([10, 100], 3), 10)
+
+    def testStaleTilesIgnored(self):
+        samFilePath = self._samFilePaths[0]
+        modificationTime = os.path.getmtime(samFilePath) - 10
+        os.utime(samFilePath, (modificationTime, modificationTime))
+        self.assertIsNone(coverage.CoverageTiles.load(samFilePath))
+        readGroupSet = self.getReadGroupSets(self._tiledBackend)[0]
+        self.assertEqual(readGroupSet.getSamFilePath(), samFilePath)
+        self.assertIsNone(readGroupSet.getCoverageTiles())
+
+
+class TestCoverageRequests(unittest.TestCase):
+    """
+    Tests coverage requests through the backend and client.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._client = fixture.client
+        self._readGroupSet = fixture.readGroupSet
+        self._readGroup = self._readGroupSet.getReadGroups()[0]
+        self._reference, = [
+            reference for reference in
+            self._readGroupSet.getReferenceSet().getReferences()
+            if reference.getLocalId() == "1"]
+
+    def testCoverage(self):
+        # The reads of the test BAM files lie beyond the end of the test
+        # references.
+        length = self._reference.getLength()
+        response = self._client.getReadGroupCoverage(
+            self._readGroup.getId(), self._reference.getId(), maxBins=100)
+        self.assertEqual(response["referenceId"], self._reference.getId())
+        binSize = response["binSize"]
+        self.assertEqual(binSize, -(-length // 100))
+        self.assertEqual(response["start"], 0)
+        self.assertEqual(response["end"], -(-length // binSize) * binSize)
+        self.assertEqual(len(response["depths"]), -(-length // binSize))
+        response = self._client.getReadGroupCoverage(
+            self._readGroup.getId(), self._reference.getId(), 9950, 10150,
+            20)
+        self.assertEqual(response["binSize"], 10)
+        self.assertEqual(response["start"], 9950)
+        self.assertEqual(response["end"], 10150)
+        sums = getExpectedSums(self._readGroup, "1", 10, 995, 1015)
+        self.assertGreater(sums.sum(), 0)
+        self.assertEqual(
+            response["depths"], [round(total / 10, 3) for total in sums])
+        response = self._client.getReadGroupCoverage(
+            self._readGroup.getId(), self._reference.getId(), 10000, 10100)
+        self.assertEqual(response["binSize"], 1)
+        self.assertEqual(response["start"], 10000)
+        self.assertEqual(
+            response["depths"],
+            getExpectedSums(self._readGroup, "1", 1, 10000, 10100).tolist())
+
+    def testBadRequests(self):
+        readGroupId = self._readGroup.getId()
+        referenceId = self._reference.getId()
+        badArgs = [
+            {}, {"referenceId": referenceId, "maxBins": 0},
+            {"referenceId": referenceId, "start": 10, "end": 10},
+            {"referenceId": referenceId, "start": -1}]
+        for requestArgs in badArgs:
+            self.assertRaises(
+                exceptions.BadRequestArgumentException,
+                self._backend.runListReadGroupCoverage, readGroupId,
+                requestArgs)
+        self.assertRaises(
+            exceptions.BadRequestIntegerException,
+            self._backend.runListReadGroupCoverage, readGroupId,
+            {"referenceId": referenceId, "start": "abc"})
+        response = json.loads(self._backend.runListReadGroupCoverage(
+            readGroupId, {"referenceId": referenceId, "maxBins": "1"}))
+        self.assertEqual(len(response["depths"]), 1)
@@ -0,0 +1,446 @@
+"""
+Tests for export jobs.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import ga4gh.exceptions as exceptions
+import ga4gh.exportjobs as exportjobs
+import ga4gh.frontend as frontend
+import tests.utils as utils
+
+
+def waitForJob(getJob, jobId, states=(exportjobs.SUCCEEDED,
+                                      exportjobs.FAILED)):
+    """
+    Waits for the job with the specified ID to reach one of the specified
+    states, and returns its JSON dictionary.
+    """
+    for _ in range(600):
+        job = getJob(jobId)
+        if job["state"] in states:
+            return job
+        time.sleep(0.05)
+    raise AssertionError("Export job {} did not finish".format(jobId))
+
+
+class TestExportJobManager(unittest.TestCase):
+    """
+    Tests the order in which export jobs are run, using exports that wait
+    until they are released.
+    """
+    class FakeBackend(object):
+        def __init__(self):
+            self.started = []
+            self._events = {}
+            self._lock = threading.Lock()
+
+        def getEvent(self, id_):
+            with self._lock:
+                return self._events.setdefault(id_, threading.Event())
+
+        def runExportVariantSet(self, id_, requestArgs, exporter=None):
+            if id_ == "notFound":
+                raise exceptions.ObjectWithIdNotFoundException(id_)
+            event = self.getEvent(id_)
+
+            def export():
+                self.started.append(id_)
+                event.wait(30)
+                if id_.startswith("fail"):
+                    raise ValueError("Export {} failed".format(id_))
+                yield "{}\n".format(id_)
+            return export()
+
+        def release(self, *ids):
+            for id_ in ids:
+                self.getEvent(id_).set()
+
+        def waitForStarts(self, numStarted):
+            for _ in range(600):
+                if len(self.started) >= numStarted:
+                    return
+                time.sleep(0.05)
+
+    def setUp(self):
+        self._backend = self.FakeBackend()
+        self._tempDir = tempfile.mkdtemp()
+        self._spoolDir = os.path.join(self._tempDir, "spool")
+        self._manager = None
+
+    def tearDown(self):
+        self._backend.release(*self._backend.started)
+        if self._manager is not None:
+            self._manager.close()
+        shutil.rmtree(self._tempDir)
+
+    def createManager(self, numThreads, maxJobsPerUser, retention=86400):
+        self._manager = exportjobs.ExportJobManager(
+            self._backend, self._spoolDir, numThreads, maxJobsPerUser,
+            retention)
+
+    def submit(self, id_, priority=0, userId="user1"):
+        return self._manager.submit("variants", id_, {}, priority, userId)
+
+    def getJob(self, jobId):
+        return self._manager.getJob(jobId).toJsonDict()
+
+    def testPriorities(self):
+        self.createManager(1, 2)
+        jobIds = [self.submit("a").id]
+        self._backend.waitForStarts(1)
+        for id_, priority in [("b", 0), ("c", 5), ("d", 5)]:
+            jobIds.append(self.submit(id_, priority).id)
+        self._backend.release("a", "b", "c", "d")
+        for jobId in jobIds:
+            self.assertEqual(
+                waitForJob(self.getJob, jobId)["state"],
+                exportjobs.SUCCEEDED)
+        self.assertEqual(self._backend.started, ["a", "c", "d", "b"])
+        job = self.getJob(jobIds[0])
+        self.assertEqual(job["bytesWritten"], 2)
+        self.assertEqual(job["mimetype"], "application/x-ndjson")
+        self.assertNotIn("userId", job)
+        with io.open(self._manager.getOutputPath(jobIds[0]), "rb") as output:
+            self.assertEqual(output.read(), b"a\n")
+
+    def testUserLimits(self):
+        self.createManager(2, 1)
+        firstJob = self.submit("a")
+        secondJob = self.submit("b")
+        otherUserJob = self.submit("c", userId="user2")
+        self._backend.waitForStarts(2)
+        self.assertEqual(sorted(self._backend.started), ["a", "c"])
+        self.assertEqual(secondJob.state, exportjobs.QUEUED)
+        self.assertEqual(otherUserJob.state, exportjobs.RUNNING)
+        self._backend.release("a")
+        self.assertEqual(
+            waitForJob(self.getJob, firstJob.id)["state"],
+            exportjobs.SUCCEEDED)
+        waitForJob(self.getJob, secondJob.id, [exportjobs.RUNNING])
+        self._backend.release("b", "c")
+        for job in [secondJob, otherUserJob]:
+            self.assertEqual(
+                waitForJob(self.getJob, job.id)["state"],
+                exportjobs.SUCCEEDED)
+
+    def testFailures(self):
+        self.createManager(1, 1)
+        job = self.submit("fail")
+        self._backend.release("fail")
+        job = waitForJob(self.getJob, job.id)
+        self.assertEqual(job["state"], exportjobs.FAILED)
+        self.assertEqual(job["errorMessage"], "Export fail failed")
+        self.assertRaises(
+            exceptions.ExportJobNotFinishedException,
+            self._manager.getOutputPath, job["id"])
+        self.assertEqual(os.listdir(self._spoolDir), [])
+        self.assertRaises(
+            exceptions.NotFoundException, self.submit, "notFound")
+        for exportType, priority in [
+                ("notAType", 0), ("variants", 10), ("variants", "1")]:
+            self.assertRaises(
+                exceptions.BadRequestArgumentException,
+                self._manager.submit, exportType, "a", {}, priority)
+        self.assertRaises(
+            exceptions.ExportJobNotFoundException,
+            self._manager.getJob, "notAJob")
+        self.assertRaises(
+            ValueError, exportjobs.ExportJobManager, self._backend,
+            self._spoolDir, 0)
+        self.assertRaises(
+            ValueError, exportjobs.ExportJobManager, self._backend,
+            self._spoolDir, 1, 1, -1)
+
+    def testUsers(self):
+        self.createManager(1, 1)
+        job = self.submit("a")
+        self._backend.release("a")
+        waitForJob(self.getJob, job.id)
+        self.assertEqual(self._manager.getJob(job.id, "user1"), job)
+        self.assertEqual(
+            self._manager.getOutputPath(job.id, "user1"),
+            self._manager.getOutputPath(job.id))
+        self.assertRaises(
+            exceptions.ExportJobNotFoundException,
+            self._manager.getJob, job.id, "user2")
+        self.assertRaises(
+            exceptions.ExportJobNotFoundException,
+            self._manager.getOutputPath, job.id, "user2")
+
+    def testRetention(self):
+        # The files of the jobs of an earlier manager are removed when it
+        # starts, once they are older than the retention period, but not
+        # the other files of the spool directory, nor newer files, which
+        # may belong to the jobs of another process.
+        os.makedirs(self._spoolDir)
+        staleJobId = "0123456789abcdef" * 2
+        otherJobId = "fedcba9876543210" * 2
+        fileNames = [
+            staleJobId, staleJobId + ".part", "notes.txt", otherJobId,
+            otherJobId + ".part"]
+        for fileName in fileNames:
+            path = os.path.join(self._spoolDir, fileName)
+            with io.open(path, "wb"):
+                pass
+            if not fileName.startswith(otherJobId):
+                modificationTime = time.time() - 61
+                os.utime(path, (modificationTime, modificationTime))
+        self.createManager(1, 1, 60)
+        self.assertEqual(
+            sorted(os.listdir(self._spoolDir)),
+            [otherJobId, otherJobId + ".part", "notes.txt"])
+        finishedJob = self.submit("a")
+        self._backend.release("a")
+        waitForJob(self.getJob, finishedJob.id)
+        outputPath = self._manager.getOutputPath(finishedJob.id)
+        self.assertTrue(os.path.exists(outputPath))
+        runningJob = self.submit("b", userId="user2")
+        self._backend.waitForStarts(2)
+        # Jobs are removed once they have been finished for longer than
+        # the retention period.
+        finishedJob.finished -= 50000
+        self.assertEqual(self._manager.getJob(finishedJob.id), finishedJob)
+        finishedJob.finished -= 10000
+        self.assertRaises(
+            exceptions.ExportJobNotFoundException,
+            self._manager.getJob, finishedJob.id)
+        self.assertFalse(os.path.exists(outputPath))
+        self.assertEqual(self._manager.getJob(runningJob.id), runningJob)
+        self._backend.release("b")
+        self.assertEqual(
+            waitForJob(self.getJob, runningJob.id)["state"],
+            exportjobs.SUCCEEDED)
+
+
+class TestExportJobRequests(unittest.TestCase):
+    """
+    Tests export jobs of the test data through the backend and client.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._tempDir = tempfile.mkdtemp()
+        self._manager = exportjobs.ExportJobManager(
+            self._backend, self._tempDir, 2, 2)
+        self._backend.setExportJobManager(self._manager)
+        self._client = fixture.client
+        dataset = fixture.dataset
+        self._variantSet = fixture.variantSet
+        self._readGroupSet = dataset.getReadGroupSets()[0]
+
+    def tearDown(self):
+        self._manager.close()
+        shutil.rmtree(self._tempDir)
+
+    def assertJobOutput(self, exportType, id_, args, expected):
+        job = self._client.createExportJob(exportType, id_, args)
+        self.assertIn(
+            job["state"], [exportjobs.QUEUED, exportjobs.RUNNING,
+                           exportjobs.SUCCEEDED])
+        job = waitForJob(self._client.getExportJob, job["id"])
+        self.assertEqual(job["state"], exportjobs.SUCCEEDED)
+        self.assertEqual(job["bytesWritten"], len(expected))
+        self.assertEqual(
+            b"".join(self._client.getExportJobData(job["id"])), expected)
+        self.assertEqual(
+            b"".join(self._client.getExportJobData(job["id"], 1000)),
+            expected[1000:])
+        return job
+
+    def testExportJobs(self):
+        variantSetId = self._variantSet.getId()
+        args = {"referenceName": "2", "start": 0, "end": 2**31}
+        expected = "".join(self._backend.runExportVariantSet(
+            variantSetId, args)).encode("utf8")
+        job = self.assertJobOutput("variants", variantSetId, args, expected)
+        self.assertEqual(job["mimetype"], "application/x-ndjson")
+        self.assertEqual(job["args"], {
+            "referenceName": "2", "start": "0", "end": "2147483648"})
+        args = {"referenceName": "1", "callSetIds": ",".join(
+            callSet.getId() for callSet in self._variantSet.getCallSets()[:2])}
+        expected = b"".join(self._client.getVariantSetVcf(
+            variantSetId, "1", callSetIds=args["callSetIds"].split(",")))
+        job = self.assertJobOutput("vcf", variantSetId, args, expected)
+        self.assertEqual(job["mimetype"], "application/vnd.ga4gh.vcf")
+        readGroupSetId = self._readGroupSet.getId()
+        expected = b"".join(self._client.getReadGroupSetBam(readGroupSetId))
+        job = self.assertJobOutput("bam", readGroupSetId, {}, expected)
+        self.assertEqual(job["mimetype"], "application/vnd.ga4gh.bam")
+
+    def testConcurrentSearches(self):
+        # Jobs read the variant set through handles of their own, so
+        # searches of the same file while they run return the same
+        # variants as they do alone.
+        variantSetId = self._variantSet.getId()
+        start, end = self._variantSet.getReferenceRange("1")
+        expectedVariants = [
+            gaVariant.toJsonDict() for gaVariant in
+            self._variantSet.getVariants("1", start, end)]
+        args = {"referenceName": "1", "start": start, "end": end}
+        # The region is a single task, which is still run in a worker.
+        self._backend.exportRegionSize = 10**9
+        expected = "".join(self._backend.runExportVariantSet(
+            variantSetId, args)).encode("utf8")
+        searchResults = []
+        stopped = threading.Event()
+
+        def search():
+            while not stopped.is_set():
+                searchResults.append([
+                    gaVariant.toJsonDict() for gaVariant in
+                    self._variantSet.getVariants("1", start, end)])
+
+        thread = threading.Thread(target=search)
+        thread.start()
+        try:
+            jobs = [
+                self._client.createExportJob("variants", variantSetId, args)
+                for _ in range(4)]
+            for job in jobs:
+                job = waitForJob(self._client.getExportJob, job["id"])
+                self.assertEqual(job["state"], exportjobs.SUCCEEDED)
+                self.assertEqual(
+                    b"".join(self._client.getExportJobData(job["id"])),
+                    expected)
+        finally:
+            stopped.set()
+            thread.join()
+        self.assertGreater(len(searchResults), 0)
+        for variants in searchResults:
+            self.assertEqual(variants, expectedVariants)
+
+    def testBadRequests(self):
+        variantSetId = self._variantSet.getId()
+        for requestString in ["{", "[]"]:
+            self.assertRaises(
+                exceptions.InvalidJsonException,
+                self._backend.runCreateExportJob, requestString)
+        for request in [
+                {"type": "vcf"},
+                {"type": "vcf", "id": variantSetId, "args": []},
+                {"type": "vcf", "id": variantSetId,
+                 "args": {"callSetIds": []}},
+                {"type": "vcf", "id": variantSetId, "args": {}},
+                {"type": "vcf", "id": variantSetId,
+                 "args": {"referenceName": "1"}, "priority": -1}]:
+            self.assertRaises(
+                exceptions.BadRequestArgumentException,
+                self._backend.runCreateExportJob, json.dumps(request))
+        self.assertRaises(
+            exceptions.NotFoundException,
+            self._backend.runCreateExportJob,
+            json.dumps({"type": "bam", "id": "notValid"}))
+        self.assertRaises(
+            exceptions.ExportJobNotFoundException,
+            self._backend.runGetExportJob, "notAJob")
+        self._backend.setExportJobManager(None)
+        self.assertRaises(
+            exceptions.NotImplementedException,
+            self._backend.runGetExportJob, "notAJob")
+
+
+class TestExportJobViews(unittest.TestCase):
+    """
+    Tests the export job endpoints, and the ranged download of their
+    output.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.tempDir = tempfile.mkdtemp()
+        config = {
+            "DATA_SOURCE": os.path.join("tests", "data"),
+            "EXPORT_SPOOL_DIR": os.path.join(cls.tempDir, "spool"),
+        }
+        frontend.reset()
+        frontend.configure(baseConfig="TestConfig", extraConfig=config)
+        cls.app = frontend.app.test_client()
+        dataset = frontend.app.backend.getDatasetByIndex(0)
+        cls.readGroupSetId = dataset.getReadGroupSets()[0].getId()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempDir)
+
+    def getJob(self, jobId):
+        response = self.app.get("/exports/{}".format(jobId))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)
+
+    def testExportJob(self):
+        response = self.app.post(
+            "/exports", headers={"Content-Type": "application/json"},
+            data=json.dumps({"type": "bam", "id": self.readGroupSetId}))
+        self.assertEqual(response.status_code, 200)
+        jobId = json.loads(response.data)["id"]
+        job = waitForJob(self.getJob, jobId)
+        self.assertEqual(job["state"], exportjobs.SUCCEEDED)
+        path = "/exports/{}/data".format(jobId)
+        response = self.app.get(path, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.mimetype, "application/vnd.ga4gh.bam")
+        data = response.data
+        self.assertEqual(len(data), job["bytesWritten"])
+        response = self.app.get(path, headers={"Range": "bytes=100-"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, data[100:])
+        self.assertEqual(
+            response.headers["Content-Range"],
+            "bytes 100-{}/{}".format(len(data) - 1, len(data)))
+        response = self.app.get(path, headers={"Range": "bytes=10-19"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, data[10:20])
+        response = self.app.get(path, headers={
+            "Range": "bytes={}-".format(len(data) + 10)})
+        self.assertEqual(response.status_code, 416)
+
+    def testAuthentication(self):
+        # When authentication is enabled, the jobs of other users are not
+        # found.
+        oidcClient, tokenMap = frontend.app.oidcClient, frontend.app.tokenMap
+        frontend.app.oidcClient = object()
+        frontend.app.tokenMap = {"key1": "token1", "key2": "token2"}
+        try:
+            response = self.app.post(
+                "/exports?key=key1",
+                headers={"Content-Type": "application/json"},
+                data=json.dumps({"type": "bam", "id": self.readGroupSetId}))
+            self.assertEqual(response.status_code, 200)
+            jobId = json.loads(response.data)["id"]
+            waitForJob(
+                lambda jobId: self.getJob(jobId + "?key=key1"), jobId)
+            for path in ["/exports/{}", "/exports/{}/data"]:
+                path = path.format(jobId)
+                self.assertEqual(
+                    self.app.get(path + "?key=key1").status_code, 200)
+                self.assertEqual(
+                    self.app.get(path + "?key=key2").status_code, 404)
+        finally:
+            frontend.app.oidcClient = oidcClient
+            frontend.app.tokenMap = tokenMap
+
+    def testBadRequests(self):
+        self.assertEqual(
+            self.app.get("/exports/notAJob").status_code, 404)
+        self.assertEqual(
+            self.app.get("/exports/notAJob/data").status_code, 404)
+        response = self.app.post(
+            "/exports", headers={"Content-Type": "application/json"},
+            data=json.dumps({"type": "bam", "id": "notValid"}))
+        self.assertEqual(response.status_code, 404)
+        response = self.app.post(
+            "/exports", headers={"Content-Type": "application/json"},
+            data=json.dumps({"type": "x", "id": self.readGroupSetId}))
+        self.assertEqual(response.status_code, 400)
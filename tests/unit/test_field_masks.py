@@ -0,0 +1,217 @@
+"""
+Tests for partial responses using field masks.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import unittest
+
+import ga4gh.datamodel.reads as reads
+import ga4gh.exceptions as exceptions
+import ga4gh.protocol as protocol
+import tests.unit.test_json_records as test_json_records
+import tests.utils as utils
+
+
+class TestFieldMask(unittest.TestCase):
+    """
+    Tests the parsing of field masks and the projection of protocol
+    elements.
+    """
+    def testParse(self):
+        fieldMask = protocol.FieldMask.parse(
+            protocol.ReadAlignment,
+            "id, alignment.position.position,alignment.mappingQuality")
+        self.assertFalse(fieldMask.isComplete())
+        self.assertEqual(
+            fieldMask.getIncludedFieldNames(), set(["id", "alignment"]))
+        alignmentMask = fieldMask.getSubmask("alignment")
+        self.assertEqual(
+            alignmentMask.getIncludedFieldNames(),
+            set(["position", "mappingQuality"]))
+        self.assertEqual(
+            alignmentMask.getSubmask("position").getIncludedFieldNames(),
+            set(["position"]))
+        self.assertTrue(fieldMask.getSubmask("nextMatePosition").isComplete())
+
+    def testWholeFieldIncluded(self):
+        fieldsList = ["alignment,alignment.cigar", "alignment.cigar,alignment"]
+        for fields in fieldsList:
+            fieldMask = protocol.FieldMask.parse(
+                protocol.ReadAlignment, fields)
+            self.assertTrue(fieldMask.getSubmask("alignment").isComplete())
+
+    def testParseErrors(self):
+        badFields = [
+            "", "id,", "noSuchField", "id.value", "alignment.noSuchField",
+            "calls.genotype"]
+        for fields in badFields:
+            self.assertRaises(
+                ValueError, protocol.FieldMask.parse,
+                protocol.ReadAlignment, fields)
+
+    def testToJsonString(self):
+        variant = protocol.Variant(
+            id="variantId", referenceName="1", start=10, end=11,
+            alternateBases=["A"], calls=[
+                protocol.Call(callSetId="cs1", genotype=[0, 1]),
+                protocol.Call(callSetId="cs2", genotype=[1, 1])])
+        fieldMask = protocol.FieldMask.parse(
+            protocol.Variant, "id,start,calls.genotype")
+        self.assertEqual(json.loads(fieldMask.toJsonString(variant)), {
+            "id": "variantId", "start": 10,
+            "calls": [{"genotype": [0, 1]}, {"genotype": [1, 1]}]})
+        completeMask = protocol.FieldMask(protocol.Variant)
+        self.assertEqual(
+            completeMask.toJsonString(variant), variant.toJsonString())
+
+
+class TestProjectedJsonRecords(unittest.TestCase):
+    """
+    Tests that the projected JSON written directly from pysam records is
+    identical to the projected JSON of the protocol objects.
+    """
+    readFields = [
+        "id", "id,alignment.position", "alignment.cigar.operation",
+        "alignedSequence,alignedQuality,info",
+        "nextMatePosition.strand,fragmentName,readGroupId",
+        "alignment.position.referenceName,alignment.mappingQuality"]
+    variantFields = [
+        "id", "start,end,referenceName", "calls.genotype",
+        "calls.callSetId,calls.info", "calls.genotypeLikelihood,info,names",
+        "calls,alternateBases,referenceBases,variantSetId,created"]
+
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+
+    def testReadAlignments(self):
+        readGroupSet = self._dataset.getReadGroupSets()[0]
+        samFile = readGroupSet.getFileHandle(readGroupSet.getSamFilePath())
+        readGroup = readGroupSet.getReadGroups()[0]
+        pysamReads = [
+            read for referenceName in samFile.references
+            for read in samFile.fetch(referenceName)]
+        self.assertGreater(len(pysamReads), 0)
+        for fields in self.readFields:
+            fieldMask = protocol.FieldMask.parse(
+                protocol.ReadAlignment, fields)
+            converter = reads.HtslibReadAlignmentConverter(
+                readGroup, samFile, fieldMask)
+            for read in pysamReads:
+                jsonString = converter.toJsonString(read)
+                self.assertEqual(
+                    jsonString,
+                    fieldMask.toJsonString(converter.convert(read)))
+                self.assertEqual(
+                    set(json.loads(jsonString).keys()),
+                    fieldMask.getIncludedFieldNames())
+
+    def testVariants(self):
+        numVariants = 0
+        for variantSet in self._dataset.getVariantSets():
+            referenceNames = test_json_records.getReferenceNames(variantSet)
+            for fields in self.variantFields:
+                fieldMask = protocol.FieldMask.parse(protocol.Variant, fields)
+                for referenceName in referenceNames:
+                    expected = list(variantSet.getVariants(
+                        referenceName, 0, 2**32))
+                    jsonRecords = list(variantSet.getVariantsJson(
+                        referenceName, 0, 2**32, fieldMask=fieldMask))
+                    self.assertEqual(
+                        [jsonRecord.toJsonString()
+                         for jsonRecord in jsonRecords],
+                        [fieldMask.toJsonString(variant)
+                         for variant in expected])
+                    numVariants += len(jsonRecords)
+        self.assertGreater(numVariants, 0)
+
+
+class TestSearchFields(unittest.TestCase):
+    """
+    Tests searches that specify fields.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        # Use the read group and reference with the most reads.
+        candidates = [
+            (readGroup, reference)
+            for readGroupSet in self._dataset.getReadGroupSets()
+            for readGroup in readGroupSet.getReadGroups()
+            for reference in readGroupSet.getReferenceSet().getReferences()]
+        self._readGroup, self._reference = max(
+            candidates, key=lambda candidate: len(list(
+                candidate[0].getReadAlignments(candidate[1]))))
+
+    def getReadsRequest(self, fields=None):
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [self._readGroup.getId()]
+        request.referenceId = self._reference.getId()
+        request.start = 0
+        request.end = 2**32
+        requestDict = request.toJsonDict()
+        if fields is not None:
+            requestDict["fields"] = fields
+        return json.dumps(requestDict)
+
+    def testSearchReads(self):
+        fields = "id,alignment.position.position"
+        for responseValidation in [False, True]:
+            self._backend.setResponseValidation(responseValidation)
+            response = json.loads(self._backend.runSearchReads(
+                self.getReadsRequest(fields)))
+            self.assertGreater(len(response["alignments"]), 0)
+            for alignment in response["alignments"]:
+                self.assertEqual(
+                    set(alignment.keys()), set(["id", "alignment"]))
+                self.assertEqual(
+                    alignment["alignment"].keys(), ["position"])
+
+    def testFullerPages(self):
+        self._backend.setMaxResponseLength(1000)
+        fullResponse = protocol.SearchReadsResponse.fromJsonString(
+            self._backend.runSearchReads(self.getReadsRequest()))
+        projectedResponse = json.loads(self._backend.runSearchReads(
+            self.getReadsRequest("id")))
+        self.assertGreater(
+            len(projectedResponse["alignments"]),
+            len(fullResponse.alignments))
+
+    def testSearchVariants(self):
+        variantSet = self._dataset.getVariantSets()[0]
+        referenceName = sorted(
+            test_json_records.getReferenceNames(variantSet))[0]
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = variantSet.getId()
+        request.referenceName = referenceName
+        request.start = 0
+        request.end = 2**32
+        requestDict = request.toJsonDict()
+        requestDict["fields"] = "start,calls.genotype"
+        response = json.loads(
+            self._backend.runSearchVariants(json.dumps(requestDict)))
+        self.assertGreater(len(response["variants"]), 0)
+        for variant in response["variants"]:
+            self.assertEqual(set(variant.keys()), set(["start", "calls"]))
+            for call in variant["calls"]:
+                self.assertEqual(call.keys(), ["genotype"])
+
+    def testBadFields(self):
+        for fields in ["noSuchField", "", 1]:
+            self.assertRaises(
+                exceptions.BadFieldMaskException,
+                self._backend.runSearchReads, self.getReadsRequest(fields))
+
+    def testFieldsNotSupported(self):
+        self.assertRaises(
+            exceptions.BadFieldMaskException,
+            self._backend.runSearchReads, self.getReadsRequest("id"),
+            protocol.AVRO_BINARY_MIMETYPE)
+        self.assertRaises(
+            exceptions.BadFieldMaskException,
+            self._backend.runSearchDatasets, json.dumps({"fields": "id"}))
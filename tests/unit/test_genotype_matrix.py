@@ -0,0 +1,228 @@
+"""
+Tests for the dense genotype matrix representation of calls.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import numpy.testing
+
+import ga4gh.datamodel.variants as variants
+import ga4gh.datamodel.variantstore as variantstore
+import ga4gh.exceptions as exceptions
+import ga4gh.genotypematrix as genotypematrix
+import ga4gh.protocol as protocol
+import tests.utils as utils
+
+
+def getMatrix(variantSet, referenceName, callSetIds, includeLikelihoods,
+              getGenotypeRows=None):
+    """
+    Returns the GenotypeMatrix for the whole of the specified contig of
+    the specified variant set, using the specified getGenotypeRows
+    function if it is given.
+    """
+    if getGenotypeRows is None:
+        getGenotypeRows = variantSet.__class__.getGenotypeRows
+    rows = list(getGenotypeRows(
+        variantSet, referenceName, 0, 2**32, callSetIds, includeLikelihoods))
+    if callSetIds is None:
+        callSetIds = [callSet.getId() for callSet in variantSet.getCallSets()]
+    return genotypematrix.GenotypeMatrix.fromRows(
+        callSetIds, rows, includeLikelihoods)
+
+
+class TestGenotypeMatrix(unittest.TestCase):
+    """
+    Tests the genotype matrices of the test variant sets against their
+    GA Variants.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        self._variantSet = fixture.variantSet
+        self._tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def assertMatricesEqual(self, matrix, expected):
+        self.assertEqual(matrix.callSetIds, expected.callSetIds)
+        self.assertEqual(matrix.sites, expected.sites)
+        self.assertEqual(matrix.nextPageToken, expected.nextPageToken)
+        self.assertEqual(matrix.genotypes.dtype, expected.genotypes.dtype)
+        numpy.testing.assert_array_equal(matrix.genotypes, expected.genotypes)
+        numpy.testing.assert_array_equal(matrix.phased, expected.phased)
+        if expected.likelihoods is None:
+            self.assertIsNone(matrix.likelihoods)
+        else:
+            numpy.testing.assert_array_equal(
+                matrix.likelihoods, expected.likelihoods)
+
+    def getCallSetIdsList(self, variantSet):
+        callSetIds = [callSet.getId() for callSet in variantSet.getCallSets()]
+        return [None, [], callSetIds[:1], list(reversed(callSetIds))]
+
+    def testVariantSets(self):
+        for variantSet in self._dataset.getVariantSets():
+            for referenceName in variantSet.getReferenceNames():
+                for callSetIds in self.getCallSetIdsList(variantSet):
+                    for includeLikelihoods in [False, True]:
+                        expected = getMatrix(
+                            variantSet, referenceName, callSetIds,
+                            includeLikelihoods,
+                            variants.AbstractVariantSet.getGenotypeRows)
+                        self.assertGreater(len(expected.sites), 0)
+                        self.assertMatricesEqual(
+                            getMatrix(
+                                variantSet, referenceName, callSetIds,
+                                includeLikelihoods),
+                            expected)
+
+    def testMatrixValues(self):
+        variantSet = self._variantSet
+        callSetIds = [callSet.getId() for callSet in variantSet.getCallSets()]
+        matrix = getMatrix(variantSet, "1", None, True)
+        gaVariants = list(variantSet.getVariants("1", 0, 2**32))
+        self.assertEqual(matrix.genotypes.dtype, numpy.int8)
+        self.assertEqual(
+            matrix.genotypes.shape, (len(gaVariants), len(callSetIds), 2))
+        self.assertEqual(matrix.likelihoods.shape[2], 3)
+        for i, gaVariant in enumerate(gaVariants):
+            self.assertEqual(matrix.sites[i]["id"], gaVariant.id)
+            for j, call in enumerate(gaVariant.calls):
+                self.assertEqual(
+                    [allele for allele in matrix.genotypes[i, j]
+                     if allele != genotypematrix.PADDING_ALLELE],
+                    call.genotype)
+                self.assertEqual(
+                    matrix.phased[i, j], call.phaseset is not None)
+                numpy.testing.assert_array_almost_equal(
+                    matrix.likelihoods[i, j], call.genotypeLikelihood)
+
+    def testColumnarVariantSets(self):
+        for variantSet in self._dataset.getVariantSets():
+            storeDir = os.path.join(self._tempDir, variantSet.getLocalId())
+            variantstore.build(variantSet, storeDir)
+            columnarVariantSet = variantstore.ColumnarVariantSet(
+                self._dataset, variantSet.getLocalId(), storeDir,
+                self._backend)
+            columnarVariantSet.blockSize = 7
+            for referenceName in variantSet.getReferenceNames():
+                for callSetIds in self.getCallSetIdsList(variantSet):
+                    expected = getMatrix(
+                        variantSet, referenceName, callSetIds, True)
+                    matrix = getMatrix(
+                        columnarVariantSet, referenceName, callSetIds, True)
+                    # The store may pad the genotypes to a greater ploidy.
+                    ploidy = expected.genotypes.shape[2]
+                    self.assertTrue((
+                        matrix.genotypes[:, :, ploidy:] ==
+                        genotypematrix.PADDING_ALLELE).all())
+                    matrix.genotypes = matrix.genotypes[:, :, :ploidy]
+                    self.assertMatricesEqual(matrix, expected)
+
+    def testSerialization(self):
+        variantSet = self._dataset.getVariantSets()[0]
+        referenceName = variantSet.getReferenceNames()[0]
+        for includeLikelihoods in [False, True]:
+            matrix = getMatrix(
+                variantSet, referenceName, None, includeLikelihoods)
+            matrix.nextPageToken = "1:2"
+            for mimetype in genotypematrix.MIMETYPES:
+                self.assertMatricesEqual(
+                    genotypematrix.GenotypeMatrix.deserialize(
+                        matrix.serialize(mimetype), mimetype),
+                    matrix)
+        binary = matrix.serialize(genotypematrix.BINARY_MIMETYPE)
+        self.assertLess(
+            len(binary), len(matrix.serialize(protocol.JSON_MIMETYPE)))
+        self.assertRaises(
+            ValueError, genotypematrix.GenotypeMatrix.deserialize,
+            binary[1:], genotypematrix.BINARY_MIMETYPE)
+        self.assertRaises(
+            ValueError, matrix.serialize, protocol.AVRO_BINARY_MIMETYPE)
+
+    def testWideAlleles(self):
+        row = genotypematrix.GenotypeRow(
+            "id", 0, 1, "A", ["C"] * 200,
+            genotypematrix.toPaddedArray(
+                [[0, 200], [1]], genotypematrix.PADDING_ALLELE, numpy.int16),
+            numpy.array([True, False]))
+        matrix = genotypematrix.GenotypeMatrix.fromRows(
+            ["a", "b"], [row], False)
+        self.assertEqual(matrix.genotypes.dtype, numpy.int16)
+        self.assertEqual(matrix.genotypes.tolist(), [[[0, 200], [1, -2]]])
+        empty = genotypematrix.GenotypeMatrix.fromRows(["a", "b"], [], False)
+        self.assertEqual(empty.genotypes.shape, (0, 2, 0))
+        matrix = genotypematrix.GenotypeMatrix.concatenate([empty, matrix])
+        self.assertEqual(matrix.genotypes.tolist(), [[[0, 200], [1, -2]]])
+
+
+class TestGenotypeMatrixSearch(unittest.TestCase):
+    """
+    Tests genotype matrix searches through the backend and client.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._client = fixture.client
+        self._variantSet = fixture.variantSet
+        self._callSetIds = [
+            callSet.getId() for callSet in self._variantSet.getCallSets()]
+
+    def getRequestString(self, **extensions):
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = self._variantSet.getId()
+        request.referenceName = "1"
+        request.start = 0
+        request.end = 2**32
+        requestDict = request.toJsonDict()
+        requestDict.update(extensions)
+        return json.dumps(requestDict)
+
+    def testPaging(self):
+        callSetIds = self._callSetIds[3:0:-1]
+        expected = getMatrix(self._variantSet, "1", callSetIds, True)
+        for pageSize in [1, 7, 1000]:
+            self._client.setPageSize(pageSize)
+            matrix = self._client.getGenotypeMatrix(
+                self._variantSet.getId(), "1", 0, 2**32, callSetIds, True)
+            self.assertEqual(matrix.callSetIds, callSetIds)
+            self.assertEqual(matrix.sites, expected.sites)
+            numpy.testing.assert_array_equal(
+                matrix.genotypes, expected.genotypes)
+            numpy.testing.assert_array_equal(matrix.phased, expected.phased)
+            numpy.testing.assert_array_equal(
+                matrix.likelihoods, expected.likelihoods)
+
+    def testMaxResponseLength(self):
+        self._backend.setMaxResponseLength(len(self._callSetIds) * 4)
+        matrix = genotypematrix.GenotypeMatrix.deserialize(
+            self._backend.runSearchGenotypeMatrix(self.getRequestString()))
+        self.assertEqual(len(matrix.sites), 2)
+        self.assertEqual(matrix.callSetIds, self._callSetIds)
+        self.assertIsNone(matrix.likelihoods)
+        self.assertIsNotNone(matrix.nextPageToken)
+
+    def testBadRequests(self):
+        self.assertRaises(
+            exceptions.BadRequestArgumentException,
+            self._backend.runSearchGenotypeMatrix,
+            self.getRequestString(includeLikelihoods="yes"))
+        self.assertRaises(
+            exceptions.BadFieldMaskException,
+            self._backend.runSearchGenotypeMatrix,
+            self.getRequestString(fields="id"))
+        self.assertRaises(
+            exceptions.CallSetNotInVariantSetException,
+            self._backend.runSearchGenotypeMatrix,
+            self.getRequestString(callSetIds=["noSuchCallSet"]))
@@ -158,14 +158,31 @@ class ImportGraphLayerChecker(object):
         'frontend': ['ga4gh/frontend.py'],
         'backend': ['ga4gh/backend.py'],
         'exceptions': ['ga4gh/exceptions.py'],
+        'metrics': ['ga4gh/metrics.py'],
         'datamodel': ['ga4gh/datamodel/reads.py',
                       'ga4gh/datamodel/references.py',
                       'ga4gh/datamodel/variants.py',
-                      'ga4gh/datamodel/datasets.py'],
+                      'ga4gh/datamodel/datasets.py',
+                      'ga4gh/datamodel/stats.py',
+                      'ga4gh/datamodel/readgroupindex.py',
+                      'ga4gh/datamodel/binning.py',
+                      'ga4gh/datamodel/coverage.py',
+                      'ga4gh/datamodel/variantfilters.py',
+                      'ga4gh/datamodel/htslibindex.py',
+                      'ga4gh/datamodel/variantstore.py',
+                      'ga4gh/datamodel/carrierindex.py',
+                      'ga4gh/datamodel/variantdensity.py',
+                      'ga4gh/datamodel/pileup.py',
+                      'ga4gh/datamodel/variantexport.py',
+                      'ga4gh/datamodel/bamslice.py',
+                      'ga4gh/datamodel/bgzf.py',
+                      'ga4gh/datamodel/variantslice.py'],
         'libraries': ['ga4gh/converters.py',
+                      'ga4gh/exportjobs.py',
                       'ga4gh/configtest.py'],
         'protocol': ['ga4gh/protocol.py',
-                     'ga4gh/_protocol_definitions.py'],
+                     'ga4gh/_protocol_definitions.py',
+                     'ga4gh/genotypematrix.py'],
         'config': ['ga4gh/serverconfig.py'],
         'avrotools': ['ga4gh/avrotools.py'],
     }
@@ -179,6 +196,7 @@ class ImportGraphLayerChecker(object):
         ['libraries'],
         ['datamodel'],
         ['exceptions'],
+        ['metrics'],
         ['avrotools'],
         ['config'],
         ['protocol'],
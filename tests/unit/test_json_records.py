@@ -0,0 +1,169 @@
+"""
+Tests that the JSON written directly from pysam records is identical to
+the JSON of the corresponding protocol objects.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import pysam
+
+import ga4gh.datamodel.reads as reads
+import ga4gh.protocol as protocol
+import tests.utils as utils
+
+
+class TestJsonObjectTemplate(unittest.TestCase):
+    """
+    Tests the JsonObjectTemplate against toJsonString.
+    """
+    def testFill(self):
+        position = protocol.Position(
+            position=100, referenceName="chr%s", strand="POS_STRAND")
+        template = protocol.JsonObjectTemplate(
+            protocol.Position, {"referenceName": "chr%s"})
+        jsonString = template.fill({
+            "position": 100,
+            "strand": protocol.encodeJsonString("POS_STRAND")})
+        self.assertEqual(jsonString, position.toJsonString())
+
+    def testEncodeJsonString(self):
+        for value in [None, "", "ACGT", "\"quoted\"\n", "caf\u00e9"]:
+            self.assertEqual(
+                protocol.encodeJsonString(value),
+                protocol.ProtocolElementEncoder().encode(value))
+
+
+def getReferenceNames(variantSet):
+    """
+    Returns the set of reference names of the variants in the specified
+    variant set.
+    """
+    referenceNames = set()
+    for variantFilePath in variantSet.getDataFilePaths()[1:]:
+        variantFile = pysam.VariantFile(variantFilePath)
+        referenceNames.update(record.chrom for record in variantFile)
+        variantFile.close()
+    return referenceNames
+
+
+class TestJsonRecords(unittest.TestCase):
+    """
+    Compares the JSON records for the reads and variants in the test
+    data with the JSON of their protocol objects.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+
+    def testReadAlignments(self):
+        numReads = 0
+        for readGroupSet in self._dataset.getReadGroupSets():
+            samFile = readGroupSet.getFileHandle(
+                readGroupSet.getSamFilePath())
+            references = readGroupSet.getReferenceSet().getReferences()
+            for readGroup in readGroupSet.getReadGroups():
+                converter = reads.HtslibReadAlignmentConverter(
+                    readGroup, samFile)
+                for reference in references:
+                    for read in samFile.fetch(reference.getLocalId().encode()):
+                        self.assertEqual(
+                            converter.toJsonString(read),
+                            converter.convert(read).toJsonString())
+                        numReads += 1
+                    expected = list(readGroup.getReadAlignments(reference))
+                    jsonRecords = list(
+                        readGroup.getReadAlignmentsJson(reference))
+                    self.assertEqual(
+                        [jsonRecord.toJsonString()
+                         for jsonRecord in jsonRecords],
+                        [gaRead.toJsonString() for gaRead in expected])
+                    self.assertEqual(
+                        [jsonRecord.start for jsonRecord in jsonRecords],
+                        [gaRead.alignment.position.position
+                         for gaRead in expected])
+        self.assertGreater(numReads, 0)
+
+    def testVariants(self):
+        numVariants = 0
+        for variantSet in self._dataset.getVariantSets():
+            callSetIdLists = [
+                None, [], [callSet.getId()
+                           for callSet in variantSet.getCallSets()[:1]]]
+            for referenceName in getReferenceNames(variantSet):
+                for callSetIds in callSetIdLists:
+                    expected = list(variantSet.getVariants(
+                        referenceName, 0, 2**32, callSetIds))
+                    jsonRecords = list(variantSet.getVariantsJson(
+                        referenceName, 0, 2**32, callSetIds))
+                    self.assertEqual(
+                        [jsonRecord.toJsonString()
+                         for jsonRecord in jsonRecords],
+                        [variant.toJsonString() for variant in expected])
+                    self.assertEqual(
+                        [jsonRecord.start for jsonRecord in jsonRecords],
+                        [variant.start for variant in expected])
+                    numVariants += len(jsonRecords)
+        self.assertGreater(numVariants, 0)
+
+
+class TestJsonSearchResponses(unittest.TestCase):
+    """
+    Tests that paged search responses are the same whether or not they
+    are written from JSON records.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+
+    def getAllPages(
+            self, searchMethod, request, responseClass, responseValidation):
+        self._backend.setResponseValidation(responseValidation)
+        pages = []
+        request.pageToken = None
+        while True:
+            responseString = searchMethod(request.toJsonString())
+            pages.append(responseString)
+            response = responseClass.fromJsonString(responseString)
+            if response.nextPageToken is None:
+                break
+            request.pageToken = response.nextPageToken
+        return pages
+
+    def assertSamePages(self, searchMethod, request, responseClass):
+        expected = self.getAllPages(
+            searchMethod, request, responseClass, True)
+        actual = self.getAllPages(
+            searchMethod, request, responseClass, False)
+        self.assertEqual(actual, expected)
+
+    def testSearchReads(self):
+        readGroupSet = self._dataset.getReadGroupSets()[0]
+        for readGroup in readGroupSet.getReadGroups():
+            for reference in readGroupSet.getReferenceSet().getReferences():
+                request = protocol.SearchReadsRequest()
+                request.readGroupIds = [readGroup.getId()]
+                request.referenceId = reference.getId()
+                request.start = 0
+                request.end = 2**32
+                request.pageSize = 3
+                self.assertSamePages(
+                    self._backend.runSearchReads, request,
+                    protocol.SearchReadsResponse)
+
+    def testSearchVariants(self):
+        for variantSet in self._dataset.getVariantSets():
+            for referenceName in getReferenceNames(variantSet):
+                request = protocol.SearchVariantsRequest()
+                request.variantSetId = variantSet.getId()
+                request.referenceName = referenceName
+                request.start = 0
+                request.end = 2**32
+                request.pageSize = 7
+                self.assertSamePages(
+                    self._backend.runSearchVariants, request,
+                    protocol.SearchVariantsResponse)
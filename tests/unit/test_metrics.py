@@ -0,0 +1,79 @@
+"""
+Unit tests for the request metrics.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+import time
+import unittest
+
+import ga4gh.metrics as metrics
+
+
+class TestRequestMetrics(unittest.TestCase):
+    """
+    Tests the RequestMetrics class.
+    """
+    def testAddTime(self):
+        requestMetrics = metrics.RequestMetrics()
+        self.assertIsNone(requestMetrics.getTime("a"))
+        self.assertEqual(requestMetrics.getTimes(), [])
+        requestMetrics.addTime("b", 1)
+        requestMetrics.addTime("a", 2)
+        requestMetrics.addTime("b", 3)
+        self.assertEqual(requestMetrics.getTime("a"), 2)
+        self.assertEqual(requestMetrics.getTime("b"), 4)
+        self.assertEqual(requestMetrics.getTimes(), [("b", 4), ("a", 2)])
+
+    def testTimer(self):
+        requestMetrics = metrics.RequestMetrics()
+        with requestMetrics.timer("phase"):
+            sum(range(10000))
+        self.assertGreaterEqual(requestMetrics.getTime("phase"), 0)
+
+    def testTimerIncludesWaiting(self):
+        # The time recorded is wall clock time, so time spent waiting
+        # (e.g. for I/O) is included.
+        requestMetrics = metrics.RequestMetrics()
+        with requestMetrics.timer("phase"):
+            time.sleep(0.05)
+        self.assertGreaterEqual(requestMetrics.getTime("phase"), 0.04)
+
+
+class TestCurrentRequestMetrics(unittest.TestCase):
+    """
+    Tests the per-thread current request metrics.
+    """
+    def tearDown(self):
+        metrics.endRequest()
+
+    def testOutsideRequest(self):
+        self.assertIsNone(metrics.getRequestMetrics())
+        with metrics.timer("phase"):
+            pass
+        self.assertIsNone(metrics.getRequestMetrics())
+
+    def testWithinRequest(self):
+        requestMetrics = metrics.beginRequest()
+        self.assertIs(metrics.getRequestMetrics(), requestMetrics)
+        with metrics.timer("phase"):
+            pass
+        self.assertIsNotNone(requestMetrics.getTime("phase"))
+        metrics.endRequest()
+        self.assertIsNone(metrics.getRequestMetrics())
+
+    def testThreadsAreIndependent(self):
+        requestMetrics = metrics.beginRequest()
+        otherThreadMetrics = []
+
+        def run():
+            otherThreadMetrics.append(metrics.getRequestMetrics())
+            with metrics.timer("other"):
+                pass
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        self.assertEqual(otherThreadMetrics, [None])
+        self.assertIsNone(requestMetrics.getTime("other"))
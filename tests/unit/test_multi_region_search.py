@@ -0,0 +1,202 @@
+"""
+Tests for searches over several regions in a single request.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import unittest
+
+import ga4gh.backend as backend
+import ga4gh.exceptions as exceptions
+import ga4gh.protocol as protocol
+import tests.utils as utils
+
+
+class TestMergeRegions(unittest.TestCase):
+    """
+    Tests the merging of overlapping and adjacent regions.
+    """
+    def testMergeRegions(self):
+        regions = [
+            ("2", 5, 10), ("1", 30, 40), ("1", 0, 10), ("1", 10, 20),
+            ("1", 35, 50), ("1", 45, 46), ("2", 0, 4)]
+        self.assertEqual(
+            backend._mergeRegions(regions),
+            [("1", 0, 20), ("1", 30, 50), ("2", 0, 4), ("2", 5, 10)])
+        self.assertEqual(backend._mergeRegions([]), [])
+
+
+class TestMultiRegionSearch(unittest.TestCase):
+    """
+    Tests multi-region searches through the backend against searches of
+    each of the merged regions in turn.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        self._variantSet = fixture.variantSet
+        readGroupSet = fixture.readGroupSet
+        self._readGroup = readGroupSet.getReadGroups()[0]
+        self._references = dict(
+            (reference.getLocalId(), reference) for reference in
+            readGroupSet.getReferenceSet().getReferences())
+
+    def getExpected(self, regions, search):
+        """
+        Returns the list of the JSON dictionaries of the objects returned
+        by search(referenceKey, start, end) for each of the specified
+        merged regions, skipping those overlapping the previous region on
+        the same reference.
+        """
+        expected = []
+        for index, (referenceKey, start, end) in enumerate(regions):
+            previousEnd = None
+            if index > 0 and regions[index - 1][0] == referenceKey:
+                previousEnd = regions[index - 1][2]
+            for objStart, obj in search(referenceKey, start, end):
+                if previousEnd is None or objStart >= previousEnd:
+                    expected.append(obj.toJsonDict())
+        return expected
+
+    def getAllResults(
+            self, searchMethod, request, regions, responseClass,
+            responseValidation):
+        """
+        Returns the list of the JSON dictionaries of the objects in all of
+        the pages of the responses to the specified request with the
+        specified regions.
+        """
+        self._backend.setResponseValidation(responseValidation)
+        results = []
+        pageToken = None
+        while True:
+            requestDict = request.toJsonDict()
+            requestDict["pageToken"] = pageToken
+            requestDict["regions"] = regions
+            response = responseClass.fromJsonString(
+                searchMethod(json.dumps(requestDict)))
+            results.extend(
+                value.toJsonDict() for value in
+                getattr(response, responseClass.getValueListName()))
+            pageToken = response.nextPageToken
+            if pageToken is None:
+                break
+        return results
+
+    def getVariantStarts(self, referenceName):
+        return [
+            gaVariant.start for gaVariant in
+            self._variantSet.getVariants(referenceName, 0, 2**32, [])]
+
+    def testSearchVariants(self):
+        starts1 = self.getVariantStarts("1")
+        starts2 = self.getVariantStarts("2")
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = self._variantSet.getId()
+        request.referenceName = "1"
+        request.start = starts1[10]
+        request.end = starts1[20]
+        regions = [
+            {"referenceName": "2", "start": starts2[3],
+             "end": starts2[5] + 1},
+            {"start": starts1[0], "end": starts1[2] + 1},
+            {"start": starts1[15], "end": starts1[25]},
+            {"start": starts1[30] + 1, "end": starts1[32]},
+            {"referenceName": "2", "start": starts2[5] + 1,
+             "end": starts2[8]},
+            {"referenceName": "3", "start": 0, "end": 0}]
+        merged = [
+            ("1", starts1[0], starts1[2] + 1),
+            ("1", starts1[10], starts1[25]),
+            ("1", starts1[30] + 1, starts1[32]),
+            ("2", starts2[3], starts2[8]), ("3", 0, 0)]
+
+        def search(referenceName, start, end):
+            for gaVariant in self._variantSet.getVariants(
+                    referenceName, start, end, []):
+                yield gaVariant.start, gaVariant
+        expected = self.getExpected(merged, search)
+        self.assertGreater(len(expected), 20)
+        request.callSetIds = []
+        for pageSize in [1, 7, 100]:
+            request.pageSize = pageSize
+            for responseValidation in [True, False]:
+                self.assertEqual(
+                    self.getAllResults(
+                        self._backend.runSearchVariants, request, regions,
+                        protocol.SearchVariantsResponse,
+                        responseValidation),
+                    expected)
+
+    def testSearchReads(self):
+        # The test reads are around 100 bases long and start between
+        # 10000 and 10006, so each overlaps several of the regions.
+        reference = self._references["1"]
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [self._readGroup.getId()]
+        request.referenceId = reference.getId()
+        request.start = 10000
+        request.end = 10001
+        regions = [
+            {"start": 10003, "end": 10004}, {"start": 10006, "end": 10007},
+            {"start": 10010, "end": 10020}, {"start": 10001, "end": 10002}]
+        merged = [
+            (reference.getId(), 10000, 10002),
+            (reference.getId(), 10003, 10004),
+            (reference.getId(), 10006, 10007),
+            (reference.getId(), 10010, 10020)]
+
+        def search(referenceId, start, end):
+            for readAlignment in self._readGroup.getReadAlignments(
+                    reference, start, end):
+                yield readAlignment.alignment.position.position, readAlignment
+        expected = self.getExpected(merged, search)
+        self.assertEqual(
+            sorted(read["id"] for read in expected),
+            sorted(readAlignment.id for readAlignment in
+                   self._readGroup.getReadAlignments(reference, 0, 2**32)))
+        for pageSize in [1, 3, 100]:
+            request.pageSize = pageSize
+            for responseValidation in [True, False]:
+                self.assertEqual(
+                    self.getAllResults(
+                        self._backend.runSearchReads, request, regions,
+                        protocol.SearchReadsResponse, responseValidation),
+                    expected)
+
+    def testBadRequests(self):
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = self._variantSet.getId()
+        request.referenceName = "1"
+        request.start = 0
+        request.end = 100
+        for regions in [
+                {}, [1], [{"start": 10}], [{"start": 10, "end": 5}],
+                [{"start": -1, "end": 5}], [{"start": "0", "end": 5}],
+                [{"referenceName": 1, "start": 0, "end": 5}],
+                [{"start": 0, "end": 1}] *
+                (self._backend.maxSearchRegions + 1)]:
+            requestDict = request.toJsonDict()
+            requestDict["regions"] = regions
+            self.assertRaises(
+                exceptions.BadRequestArgumentException,
+                self._backend.runSearchVariants, json.dumps(requestDict))
+        for pageToken in ["abc", "5", "-1:0:0"]:
+            requestDict = request.toJsonDict()
+            requestDict["regions"] = []
+            requestDict["pageToken"] = pageToken
+            self.assertRaises(
+                exceptions.BadPageTokenException,
+                self._backend.runSearchVariants, json.dumps(requestDict))
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [self._readGroup.getId()]
+        request.referenceId = self._references["1"].getId()
+        requestDict = request.toJsonDict()
+        requestDict["regions"] = [
+            {"referenceId": "noSuchReference", "start": 0, "end": 10}]
+        self.assertRaises(
+            exceptions.NotFoundException,
+            self._backend.runSearchReads, json.dumps(requestDict))
@@ -0,0 +1,293 @@
+"""
+Tests for pileup requests and the pileup cache.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import unittest
+
+import mock
+import numpy
+import numpy.testing
+import pysam
+
+import ga4gh.datamodel.pileup as pileup
+import ga4gh.datamodel.reads as reads
+import ga4gh.exceptions as exceptions
+import ga4gh.protocol as protocol
+import tests.utils as utils
+
+
+def getExpectedCounts(readGroup, referenceName, start, end,
+                      minBaseQuality=0, minMappingQuality=0,
+                      includeUnmapped=False):
+    """
+    Returns the array of the allele counts of the specified region,
+    computed from the pysam pileup of the reads of the specified
+    HtslibReadGroup. The pileup excludes the reads flagged as unmapped;
+    if includeUnmapped is True, the aligned pairs of those that have a
+    position are added.
+    """
+    counts = pileup.getEmptyCounts(end - start)
+    readGroupSet = readGroup.getParentContainer()
+    samFile = pysam.AlignmentFile(readGroup.getSamFilePath())
+
+    def isIncluded(read):
+        return (
+            read.mapping_quality >= minMappingQuality and (
+                readGroupSet.isUsingDefaultReadGroup() or
+                reads.getReadGroupTag(read) == readGroup.getLocalId()))
+
+    def addAllele(read, queryPosition, referencePosition):
+        if queryPosition is None:
+            allele = "DEL"
+        else:
+            qualities = read.query_qualities
+            if (qualities is not None and
+                    qualities[queryPosition] < minBaseQuality):
+                return
+            allele = read.query_sequence[queryPosition].upper()
+            if allele not in "ACGT":
+                allele = "N"
+        counts[referencePosition - start, pileup.ALLELES.index(allele)] += 1
+
+    columns = samFile.pileup(
+        referenceName.encode(), start, end, truncate=True,
+        stepper="nofilter", max_depth=1000000)
+    for column in columns:
+        for pileupRead in column.pileups:
+            if not pileupRead.is_refskip and isIncluded(pileupRead.alignment):
+                queryPosition = None
+                if not pileupRead.is_del:
+                    queryPosition = pileupRead.query_position
+                addAllele(
+                    pileupRead.alignment, queryPosition, column.reference_pos)
+    if includeUnmapped:
+        # The test reads have no skipped regions, so the reference
+        # positions without a query position are deletions.
+        for read in samFile.fetch(referenceName.encode(), start, end):
+            if read.is_unmapped and read.cigartuples and isIncluded(read):
+                for queryPosition, referencePosition in \
+                        read.get_aligned_pairs():
+                    if (referencePosition is not None and
+                            start <= referencePosition < end):
+                        addAllele(read, queryPosition, referencePosition)
+    samFile.close()
+    return counts
+
+
+class TestPileupCounts(unittest.TestCase):
+    """
+    Tests the allele counts of the test read groups against those of
+    the pysam pileup of their reads.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+
+    def getTargets(self):
+        """
+        Returns the list of (readGroup, reference, start, end) tuples for
+        the regions around the first reads of each of the test read
+        groups on each of their references.
+        """
+        targets = []
+        for readGroupSet in self._dataset.getReadGroupSets():
+            samFile = pysam.AlignmentFile(readGroupSet.getSamFilePath())
+            starts = {}
+            for read in samFile.fetch(until_eof=True):
+                if not read.is_unmapped:
+                    starts.setdefault(
+                        samFile.getrname(read.reference_id),
+                        read.reference_start)
+            samFile.close()
+            for reference in readGroupSet.getReferenceSet().getReferences():
+                start = starts.get(reference.getLocalId())
+                if start is None:
+                    continue
+                for readGroup in readGroupSet.getReadGroups():
+                    targets.append((readGroup, reference, start, start + 500))
+        return targets
+
+    def testCounts(self):
+        numBases = 0
+        for readGroup, reference, start, end in self.getTargets():
+            for minBaseQuality, minMappingQuality in [(0, 0), (20, 30)]:
+                readFilter = reads.ReadFilter(minMappingQuality)
+                expected = getExpectedCounts(
+                    readGroup, reference.getLocalId(), start, end,
+                    minBaseQuality, minMappingQuality)
+                counts = pileup.getEmptyCounts(end - start)
+                readGroup.addPileupCounts(
+                    counts, reference, start, readFilter, minBaseQuality)
+                numpy.testing.assert_array_equal(counts, expected)
+                # The GA ReadAlignments include those of reads flagged as
+                # unmapped, which are not in the pileup.
+                counts = pileup.getEmptyCounts(end - start)
+                reads.AbstractReadGroup.addPileupCounts(
+                    readGroup, counts, reference, start, readFilter,
+                    minBaseQuality)
+                numpy.testing.assert_array_equal(
+                    counts, getExpectedCounts(
+                        readGroup, reference.getLocalId(), start, end,
+                        minBaseQuality, minMappingQuality, True))
+                numBases += int(counts.sum())
+        self.assertGreater(numBases, 0)
+
+    def testAddAlignedCounts(self):
+        counts = pileup.getEmptyCounts(10)
+        # 2S3M2D1I2M at position 12: the clipped and inserted bases and
+        # the low quality C are not counted.
+        pileup.addAlignedCounts(
+            counts, 10, 12, [(4, 2), (0, 3), (2, 2), (1, 1), (0, 2)],
+            b"GGACNtGT", [30, 30, 30, 10, 30, 30, 30, 30], 20)
+        expected = pileup.getEmptyCounts(10)
+        for offset, allele in [
+                (2, "A"), (4, "N"), (5, "DEL"), (6, "DEL"), (7, "G"),
+                (8, "T")]:
+            expected[offset, pileup.ALLELES.index(allele)] = 1
+        numpy.testing.assert_array_equal(counts, expected)
+        # Bases outside the region are ignored.
+        counts = pileup.getEmptyCounts(3)
+        pileup.addAlignedCounts(
+            counts, 13, 12, [(0, 5)], b"ACNTG", None, 20)
+        self.assertEqual(
+            counts.tolist(),
+            [[0, 1, 0, 0, 0, 0], [0, 0, 0, 0, 1, 0], [0, 0, 0, 1, 0, 0]])
+
+
+class TestPileupCache(unittest.TestCase):
+    """
+    Tests the least recently used pileup cache.
+    """
+    def setUp(self):
+        self._cache = pileup.PileupCache(2)
+        self._computed = []
+
+    def getCounts(self, key):
+        def computeCounts():
+            self._computed.append(key)
+            return pileup.getEmptyCounts(key)
+        return self._cache.getCounts(key, computeCounts)
+
+    def testLeastRecentlyUsed(self):
+        counts = self.getCounts(1)
+        self.assertFalse(counts.flags.writeable)
+        self.assertIs(self.getCounts(1), counts)
+        self.getCounts(2)
+        self.getCounts(1)
+        self.getCounts(3)
+        self.getCounts(1)
+        self.getCounts(2)
+        self.assertEqual(self._computed, [1, 2, 3, 2])
+        self._cache.setMaxCacheSize(1)
+        self.getCounts(1)
+        self.assertEqual(self._computed, [1, 2, 3, 2, 1])
+        self._cache.setMaxCacheSize(0)
+        self.getCounts(1)
+        self.getCounts(1)
+        self.assertEqual(self._computed, [1, 2, 3, 2, 1, 1, 1])
+
+
+class TestPileupRequests(unittest.TestCase):
+    """
+    Tests pileup requests through the backend and client.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._client = fixture.client
+        self._readGroupSet = fixture.readGroupSet
+        self._readGroups = self._readGroupSet.getReadGroups()
+        self._reference, = [
+            reference for reference in
+            self._readGroupSet.getReferenceSet().getReferences()
+            if reference.getLocalId() == "1"]
+        pileup.pileupCache.clear()
+
+    def tearDown(self):
+        pileup.pileupCache.clear()
+
+    def getRequestString(self, **extensions):
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [self._readGroups[0].getId()]
+        request.referenceId = self._reference.getId()
+        request.start = 10000
+        request.end = 10100
+        requestDict = request.toJsonDict()
+        requestDict.update(extensions)
+        return json.dumps(requestDict)
+
+    def testPileup(self):
+        readGroupIds = [readGroup.getId() for readGroup in self._readGroups]
+        response = self._client.getPileup(
+            readGroupIds, self._reference.getId(), 10000, 10100,
+            minBaseQuality=20)
+        self.assertEqual(response["referenceId"], self._reference.getId())
+        self.assertEqual(response["start"], 10000)
+        self.assertEqual(response["end"], 10100)
+        self.assertEqual(response["alleles"], pileup.ALLELES)
+        expected = sum(
+            getExpectedCounts(readGroup, "1", 10000, 10100, 20)
+            for readGroup in self._readGroups)
+        self.assertGreater(expected.sum(), 0)
+        self.assertEqual(response["counts"], expected.tolist())
+        self.assertEqual(
+            self._client.getPileup(
+                readGroupIds, self._reference.getId(), 10000, 10100,
+                minBaseQuality=20),
+            response)
+
+    def testCacheKey(self):
+        dataset = self._backend.getDatasetByIndex(0)
+        readGroupIds = [
+            readGroupSet.getReadGroups()[0].getId()
+            for readGroupSet in dataset.getReadGroupSets()
+            if readGroupSet.getLocalId().startswith(("HG00533", "HG00534"))]
+        self.assertEqual(len(readGroupIds), 2)
+        referenceId = self._reference.getId()
+        response = self._client.getPileup(
+            readGroupIds, referenceId, 10000, 10100)
+        # The same read groups in another order use the cached counts.
+        with mock.patch.object(
+                reads.HtslibReadGroup, "addPileupCounts") as addPileupCounts:
+            self.assertEqual(
+                self._client.getPileup(
+                    readGroupIds[::-1], referenceId, 10000, 10100),
+                response)
+            self.assertEqual(addPileupCounts.call_count, 0)
+        # The counts are recomputed once the data files have changed.
+        modificationTime = self._readGroups[0].getDataModificationTime()
+        with mock.patch.object(
+                reads.HtslibReadGroup, "getDataModificationTime",
+                return_value=modificationTime + 1):
+            with mock.patch.object(
+                    reads.HtslibReadGroup,
+                    "addPileupCounts") as addPileupCounts:
+                self._client.getPileup(
+                    readGroupIds, referenceId, 10000, 10100)
+                self.assertEqual(addPileupCounts.call_count, 2)
+
+    def testBadRequests(self):
+        badRequests = [
+            self.getRequestString(readGroupIds=[]),
+            self.getRequestString(start=10, end=10),
+            self.getRequestString(
+                start=0, end=self._backend.maxPileupLength + 1),
+            self.getRequestString(minBaseQuality=-1),
+            self.getRequestString(minBaseQuality="abc")]
+        for requestString in badRequests:
+            self.assertRaises(
+                exceptions.BadRequestArgumentException,
+                self._backend.runSearchPileup, requestString)
+        self.assertRaises(
+            exceptions.BadReadFilterException,
+            self._backend.runSearchPileup,
+            self.getRequestString(minMappingQuality=256))
+        self.assertRaises(
+            exceptions.UnmappedReadsNotSupported,
+            self._backend.runSearchPileup,
+            self.getRequestString(referenceId=None))
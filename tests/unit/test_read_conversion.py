@@ -0,0 +1,99 @@
+"""
+Tests for the conversion of pysam reads into GA4GH ReadAlignments.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import ga4gh.datamodel.reads as reads
+import ga4gh.protocol as protocol
+import tests.utils as utils
+
+
+class TestHtslibReadAlignmentConverter(unittest.TestCase):
+    """
+    Tests the HtslibReadAlignmentConverter against the reads in the
+    test data.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+
+    def testFlagTable(self):
+        isFlagSet = reads.SamFlags.isFlagSet
+        for flag in range(0x1000):
+            (strand, nextMateStrand, numberReads, readNumber,
+                duplicateFragment, failedVendorQualityChecks,
+                properPlacement, secondaryAlignment,
+                supplementaryAlignment) = (
+                reads.HtslibReadAlignmentConverter.flagTable[flag])
+            self.assertEqual(
+                strand == protocol.Strand.NEG_STRAND,
+                isFlagSet(flag, reads.SamFlags.REVERSED))
+            self.assertEqual(
+                nextMateStrand == protocol.Strand.NEG_STRAND,
+                isFlagSet(flag, reads.SamFlags.NEXT_MATE_REVERSED))
+            self.assertEqual(
+                numberReads is not None,
+                isFlagSet(flag, reads.SamFlags.NUMBER_READS))
+            if numberReads is None:
+                self.assertIsNone(readNumber)
+            self.assertEqual(
+                duplicateFragment,
+                isFlagSet(flag, reads.SamFlags.DUPLICATE_FRAGMENT))
+            self.assertEqual(
+                failedVendorQualityChecks,
+                isFlagSet(flag, reads.SamFlags.FAILED_VENDOR_QUALITY_CHECKS))
+            self.assertEqual(
+                properPlacement,
+                isFlagSet(flag, reads.SamFlags.PROPER_PLACEMENT))
+            self.assertEqual(
+                secondaryAlignment,
+                isFlagSet(flag, reads.SamFlags.SECONDARY_ALIGNMENT))
+            self.assertEqual(
+                supplementaryAlignment,
+                isFlagSet(flag, reads.SamFlags.SUPPLEMENTARY_ALIGNMENT))
+
+    def testConvertedReads(self):
+        numReads = 0
+        for readGroupSet in self._dataset.getReadGroupSets():
+            samFile = readGroupSet.getFileHandle(
+                readGroupSet.getSamFilePath())
+            references = readGroupSet.getReferenceSet().getReferences()
+            for readGroup in readGroupSet.getReadGroups():
+                converter = reads.HtslibReadAlignmentConverter(
+                    readGroup, samFile)
+                for reference in references:
+                    gaReads = list(readGroup.getReadAlignments(reference))
+                    batch = converter.convertBatch(
+                        samFile.fetch(reference.getLocalId().encode()))
+                    for gaRead in gaReads:
+                        self.assertTrue(protocol.ReadAlignment.validate(
+                            gaRead.toJsonDict()))
+                        self.assertEqual(
+                            gaRead.id, readGroup.getReadAlignmentId(gaRead))
+                        self.assertEqual(gaRead.readGroupId, readGroup.getId())
+                        self.assertEqual(
+                            gaRead.alignment.position.referenceName,
+                            reference.getLocalId())
+                        self.assertIn(gaRead, batch)
+                    numReads += len(gaReads)
+        self.assertGreater(numReads, 0)
+
+    def testConvertReadsInBatches(self):
+        readGroupSet = self._dataset.getReadGroupSets()[0]
+        readGroup = readGroupSet.getReadGroups()[0]
+        samFile = readGroupSet.getFileHandle(readGroupSet.getSamFilePath())
+        converter = reads.HtslibReadAlignmentConverter(readGroup, samFile)
+        pysamReads = [
+            read for referenceName in samFile.references
+            for read in samFile.fetch(referenceName)]
+        self.assertGreater(len(pysamReads), 3)
+        expected = converter.convertBatch(pysamReads)
+        for batchSize in [1, 2, 3, len(pysamReads) + 1]:
+            self.assertEqual(
+                list(converter.convertReads(pysamReads, batchSize)),
+                expected)
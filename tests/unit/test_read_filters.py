@@ -0,0 +1,148 @@
+"""
+Tests for filtering the reads in a search by mapping quality and flags.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import unittest
+
+import ga4gh.datamodel.reads as reads
+import ga4gh.exceptions as exceptions
+import ga4gh.protocol as protocol
+import tests.utils as utils
+
+
+class TestReadFilter(unittest.TestCase):
+    """
+    Tests the ReadFilter against the reads in the test data.
+    """
+    filterArgsList = [
+        {},
+        {"minMappingQuality": 10},
+        {"requiredFlags": reads.SamFlags.NUMBER_READS},
+        {"excludedFlags": reads.SamFlags.REVERSED},
+        {"excludedFlags": (
+            reads.SamFlags.DUPLICATE_FRAGMENT |
+            reads.SamFlags.SECONDARY_ALIGNMENT)},
+        {"minMappingQuality": 1,
+         "requiredFlags": reads.SamFlags.PROPER_PLACEMENT,
+         "excludedFlags": reads.SamFlags.REVERSED},
+    ]
+
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+
+    def isIncluded(self, read, filterArgs):
+        isFlagSet = reads.SamFlags.isFlagSet
+        requiredFlags = filterArgs.get("requiredFlags", 0)
+        excludedFlags = filterArgs.get("excludedFlags", 0)
+        return (
+            read.mapping_quality >= filterArgs.get("minMappingQuality", 0) and
+            isFlagSet(read.flag, requiredFlags) and
+            read.flag & excludedFlags == 0)
+
+    def testFilterReads(self):
+        for readGroupSet in self._dataset.getReadGroupSets():
+            samFile = readGroupSet.getFileHandle(
+                readGroupSet.getSamFilePath())
+            pysamReads = [
+                read for referenceName in samFile.references
+                for read in samFile.fetch(referenceName)]
+            self.assertGreater(len(pysamReads), 0)
+            readGroup = readGroupSet.getReadGroups()[0]
+            converter = reads.HtslibReadAlignmentConverter(
+                readGroup, samFile)
+            for filterArgs in self.filterArgsList:
+                readFilter = reads.ReadFilter(**filterArgs)
+                expected = [
+                    read for read in pysamReads
+                    if self.isIncluded(read, filterArgs)]
+                self.assertEqual(
+                    list(readFilter.filterReads(pysamReads)), expected)
+                self.assertEqual(
+                    [read for read in pysamReads
+                     if readFilter.includesReadAlignment(
+                         converter.convert(read))],
+                    expected)
+
+    def testIsEmpty(self):
+        self.assertTrue(reads.ReadFilter().isEmpty())
+        for filterArgs in self.filterArgsList[1:]:
+            self.assertFalse(reads.ReadFilter(**filterArgs).isEmpty())
+
+
+class TestSearchReadFilters(unittest.TestCase):
+    """
+    Tests reads searches that specify read filters.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        self._readGroupSet = self._dataset.getReadGroupSetByName(
+            "chr17.1-250")
+        self._readGroup = self._readGroupSet.getReadGroups()[0]
+        self._reference = self._readGroupSet.getReferenceSet().getReferences(
+            )[0]
+
+    def getAllAlignments(self, responseValidation, pageSize, **filterArgs):
+        self._backend.setResponseValidation(responseValidation)
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [self._readGroup.getId()]
+        request.referenceId = self._reference.getId()
+        request.start = 0
+        request.end = 2**32
+        request.pageSize = pageSize
+        alignments = []
+        while True:
+            requestDict = request.toJsonDict()
+            requestDict.update(filterArgs)
+            response = protocol.SearchReadsResponse.fromJsonString(
+                self._backend.runSearchReads(json.dumps(requestDict)))
+            alignments.extend(response.alignments)
+            if response.nextPageToken is None:
+                break
+            request.pageToken = response.nextPageToken
+        return alignments
+
+    def testFilteredPages(self):
+        allAlignments = self.getAllAlignments(False, 100)
+        filterArgs = {
+            "requiredFlags": reads.SamFlags.NUMBER_READS,
+            "excludedFlags": reads.SamFlags.NEXT_MATE_REVERSED}
+        readFilter = reads.ReadFilter(**filterArgs)
+        expected = [
+            alignment for alignment in allAlignments
+            if readFilter.includesReadAlignment(alignment)]
+        self.assertGreater(len(expected), 0)
+        self.assertLess(len(expected), len(allAlignments))
+        for responseValidation in [False, True]:
+            for pageSize in [1, 2, 100]:
+                self.assertEqual(
+                    self.getAllAlignments(
+                        responseValidation, pageSize, **filterArgs),
+                    expected)
+
+    def testEmptyFilter(self):
+        self.assertEqual(
+            self.getAllAlignments(
+                False, 3, minMappingQuality=0, requiredFlags=0),
+            self.getAllAlignments(False, 3))
+
+    def testBadFilters(self):
+        badFilterArgsList = [
+            {"minMappingQuality": -1},
+            {"minMappingQuality": 256},
+            {"minMappingQuality": "10"},
+            {"requiredFlags": 0x1000},
+            {"excludedFlags": 1.5},
+            {"excludedFlags": True},
+        ]
+        for filterArgs in badFilterArgsList:
+            self.assertRaises(
+                exceptions.BadReadFilterException,
+                self.getAllAlignments, False, 1, **filterArgs)
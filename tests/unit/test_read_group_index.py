@@ -0,0 +1,176 @@
+"""
+Tests for the read group index.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import pysam
+
+import ga4gh.backend as backend
+import ga4gh.datamodel.readgroupindex as readgroupindex
+import ga4gh.datamodel.reads as reads
+
+
+class TestReadGroupIndex(unittest.TestCase):
+    """
+    Tests that searches using the read group index return the same reads
+    as searches that filter the reads in a region by their RG tag.
+    """
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp()
+        self._dataDir = os.path.join(self._tempDir, "data")
+        shutil.copytree(os.path.join("tests", "data"), self._dataDir)
+        self._unindexedBackend = backend.FileSystemBackend(self._dataDir)
+        dataset = self._unindexedBackend.getDatasetByIndex(0)
+        self._samFilePaths = [
+            readGroupSet.getSamFilePath()
+            for readGroupSet in dataset.getReadGroupSets()]
+        for samFilePath in self._samFilePaths:
+            readgroupindex.ReadGroupIndex.build(samFilePath).save()
+        self._indexedBackend = backend.FileSystemBackend(self._dataDir)
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def getReadGroupSets(self, theBackend):
+        return theBackend.getDatasetByIndex(0).getReadGroupSets()
+
+    def testIndexLoaded(self):
+        for readGroupSet in self.getReadGroupSets(self._indexedBackend):
+            self.assertIsNotNone(readGroupSet.getReadGroupIndex())
+        for readGroupSet in self.getReadGroupSets(self._unindexedBackend):
+            self.assertIsNone(readGroupSet.getReadGroupIndex())
+
+    def testSameReads(self):
+        regions = [
+            (None, None), (0, 2**31), (0, 1), (100, 200),
+            (16000000, 17000000), (145000000, 150000000)]
+        readGroupSetPairs = zip(
+            self.getReadGroupSets(self._unindexedBackend),
+            self.getReadGroupSets(self._indexedBackend))
+        numReads = 0
+        for unindexedSet, indexedSet in readGroupSetPairs:
+            references = indexedSet.getReferenceSet().getReferences()
+            readGroupPairs = zip(
+                unindexedSet.getReadGroups(), indexedSet.getReadGroups())
+            for unindexed, indexed in readGroupPairs:
+                for reference in references:
+                    for start, end in regions:
+                        expected = list(unindexed.getReadAlignments(
+                            reference, start, end))
+                        actual = list(indexed.getReadAlignments(
+                            reference, start, end))
+                        self.assertEqual(expected, actual)
+                        numReads += len(actual)
+        self.assertGreater(numReads, 0)
+
+    def testStaleIndexIgnored(self):
+        samFilePath = self._samFilePaths[0]
+        modificationTime = os.path.getmtime(samFilePath) - 10
+        os.utime(samFilePath, (modificationTime, modificationTime))
+        self.assertIsNone(readgroupindex.ReadGroupIndex.load(samFilePath))
+        readGroupSet = self.getReadGroupSets(self._indexedBackend)[0]
+        self.assertEqual(readGroupSet.getSamFilePath(), samFilePath)
+        self.assertIsNone(readGroupSet.getReadGroupIndex())
+
+    def testTruncatedIndexIgnored(self):
+        samFilePath = self._samFilePaths[0]
+        indexFilePath = readgroupindex.getIndexFilePath(samFilePath)
+        with open(indexFilePath, "r+b") as indexFile:
+            indexFile.truncate(os.path.getsize(indexFilePath) - 8)
+        self.assertIsNone(readgroupindex.ReadGroupIndex.load(samFilePath))
+
+    def testGetOffsets(self):
+        samFilePath = self._samFilePaths[0]
+        built = readgroupindex.ReadGroupIndex.build(samFilePath)
+        loaded = readgroupindex.ReadGroupIndex.load(samFilePath)
+        for readGroupIndex in [built, loaded]:
+            self.assertEqual(
+                readGroupIndex.getOffsets("no such read group", 0), [])
+            self.assertEqual(readGroupIndex.getOffsets("", 10000), [])
+
+
+class TestReadAlignmentsAtOffsets(unittest.TestCase):
+    """
+    Tests reading the reads of one read group from a BAM file in which
+    the reads of several read groups are interleaved over many BGZF
+    blocks.
+    """
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp()
+        self._samFilePath = os.path.join(self._tempDir, "reads.bam")
+        self._readGroupIds = ["rg0", "rg1", "rg2"]
+        header = {
+            "HD": {"VN": "1.0", "SO": "coordinate"},
+            "SQ": [{"SN": "1", "LN": 10000}],
+            "RG": [{"ID": readGroupId}
+                   for readGroupId in self._readGroupIds],
+        }
+        samFile = pysam.AlignmentFile(self._samFilePath, "wb", header=header)
+        randomNumberGenerator = random.Random(0)
+        for j in range(5000):
+            read = pysam.AlignedSegment()
+            read.query_name = "read{}".format(j).encode()
+            read.query_sequence = b"ACGT" * 25
+            read.reference_id = 0
+            read.reference_start = j
+            read.cigar = [(0, 100)]
+            read.query_qualities = pysam.fromQualityString(b"I" * 100)
+            readGroupId = randomNumberGenerator.choice(self._readGroupIds)
+            read.tags = [(b"RG", readGroupId.encode())]
+            samFile.write(read)
+        samFile.close()
+        pysam.index(self._samFilePath.encode())
+        self._readGroupIndex = readgroupindex.ReadGroupIndex.build(
+            self._samFilePath)
+        self._samFile = pysam.AlignmentFile(self._samFilePath)
+
+    def tearDown(self):
+        self._samFile.close()
+        shutil.rmtree(self._tempDir)
+
+    def getReadNames(self, readGroupId, start, end):
+        offsets = self._readGroupIndex.getOffsets(readGroupId, 0, start, end)
+        return [
+            read.query_name for read in
+            reads.getReadAlignmentsAtOffsets(self._samFile, offsets)]
+
+    def getExpectedReadNames(self, readGroupId, start, end):
+        return [
+            read.query_name for read in
+            self._samFile.fetch(b"1", start, end)
+            if reads.getReadGroupTag(read) == readGroupId]
+
+    def testManyBlocks(self):
+        offsets = self._readGroupIndex.getOffsets("rg1", 0)
+        blocks = set(offset >> 16 for offset in offsets)
+        self.assertGreater(len(blocks), 1)
+        for readGroupId in self._readGroupIds:
+            for start, end in [(0, 10000), (1000, 1001), (2500, 4000)]:
+                self.assertEqual(
+                    self.getReadNames(readGroupId, start, end),
+                    self.getExpectedReadNames(readGroupId, start, end))
+
+    def testInterleavedIterators(self):
+        # The file handle is shared, so iterators over different read
+        # groups must not disturb each other.
+        iterators = [
+            reads.getReadAlignmentsAtOffsets(
+                self._samFile,
+                self._readGroupIndex.getOffsets(readGroupId, 0))
+            for readGroupId in self._readGroupIds]
+        names = [[] for _ in iterators]
+        for readsTuple in zip(*iterators):
+            for readNames, read in zip(names, readsTuple):
+                readNames.append(read.query_name)
+        for readGroupId, readNames in zip(self._readGroupIds, names):
+            expected = self.getExpectedReadNames(readGroupId, 0, 10000)
+            self.assertEqual(readNames, expected[:len(readNames)])
+        self.assertGreater(len(names[-1]), 0)
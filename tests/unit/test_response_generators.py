@@ -26,7 +26,8 @@ class MockVariantSet(variants.AbstractVariantSet):
         self.numVariants = numVariants
 
     def getVariants(self, referenceName, startPosition, endPosition,
-                    variantName=None, callSetIds=None):
+                    callSetIds=None, variantFilter=None,
+                    carrierCallSetIds=None):
         for i in range(self.numVariants):
             yield generateVariant()
 
@@ -99,7 +100,8 @@ class MockReadGroup(reads.AbstractReadGroup):
         self.numAlignments = numAlignments
 
     def getReadAlignments(self, referenceName=None, referenceId=None,
-                          start=None, end=None):
+                          start=None, end=None, readFilter=None,
+                          includeReferenceSequence=False):
         for i in range(self.numAlignments):
             yield generateReadAlignment(i)
 
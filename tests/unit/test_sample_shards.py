@@ -0,0 +1,253 @@
+"""
+Tests for variant sets with samples split over several shards.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import functools
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pysam
+
+import ga4gh.backend as backend
+import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.variantfilters as variantfilters
+import ga4gh.datamodel.variants as variants
+import ga4gh.exceptions as exceptions
+import ga4gh.protocol as protocol
+import tests.unit.test_variant_shards as test_variant_shards
+import tests.utils as utils
+
+
+def writeSampleShard(sourcePath, shardDir, sampleIndexes, filterName=None):
+    """
+    Writes an indexed copy of the specified VCF, with only the samples
+    at the specified indexes, to the specified directory. If a FILTER
+    name is specified, every record is given that FILTER.
+    """
+    columns = list(range(9)) + [9 + index for index in sampleIndexes]
+    lines = []
+    with gzip.open(sourcePath, "rb") as sourceFile:
+        for line in sourceFile:
+            if line.startswith(b"##"):
+                lines.append(line)
+                continue
+            fields = line.rstrip(b"\n").split(b"\t")
+            if filterName is not None:
+                if line.startswith(b"#"):
+                    lines.append(
+                        b'##FILTER=<ID=' + filterName +
+                        b',Description="Test filter">\n')
+                else:
+                    fields[6] = filterName
+            lines.append(
+                b"\t".join(fields[column] for column in columns) + b"\n")
+    if not os.path.exists(shardDir):
+        os.mkdir(shardDir)
+    path = os.path.join(shardDir, os.path.basename(sourcePath)[:-len(".gz")])
+    with io.open(path, "wb") as shardFile:
+        shardFile.writelines(lines)
+    return pysam.tabix_index(path, preset="vcf", force=True)
+
+
+def writeShardsFile(dataDir, shardNames):
+    """
+    Writes the manifest listing the specified sample shards to the
+    specified variant set directory.
+    """
+    shardsFilePath = os.path.join(dataDir, variants.SHARDS_FILE_NAME)
+    with open(shardsFilePath, "w") as shardsFile:
+        json.dump({"shards": shardNames}, shardsFile)
+
+
+class TestSampleShardedVariantSet(unittest.TestCase):
+    """
+    Tests a variant set made up of sample shards of one of the test
+    variant sets against the variant set itself.
+    """
+    shardSampleIndexes = [[0, 1], [2], [3, 4]]
+
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        self._variantSet = fixture.variantSet
+        self._tempDir = tempfile.mkdtemp()
+        self._sourcePaths = self._variantSet.getDataFilePaths()[1:]
+        self._shardNames = []
+        for index, sampleIndexes in enumerate(self.shardSampleIndexes):
+            self.writeShard("shard{}".format(index), sampleIndexes)
+        self._callSetIds = [
+            callSet.getId() for callSet in self._variantSet.getCallSets()]
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+        variants.shardFetcher.setNumThreads(4)
+
+    def writeShard(self, name, sampleIndexes, filterName=None):
+        for sourcePath in self._sourcePaths:
+            writeSampleShard(
+                sourcePath, os.path.join(self._tempDir, name), sampleIndexes,
+                filterName)
+        if name not in self._shardNames:
+            self._shardNames.append(name)
+        writeShardsFile(self._tempDir, self._shardNames)
+
+    def getShardedVariantSet(self):
+        return variants.SampleShardedVariantSet(
+            self._dataset, self._variantSet.getLocalId(), self._tempDir,
+            self._backend)
+
+    def getVariants(self, variantSet, referenceName, callSetIds):
+        return test_variant_shards.getJsonDicts(variantSet.getVariants(
+            referenceName, 0, 2**32, callSetIds))
+
+    def testCallSets(self):
+        variantSet = self.getShardedVariantSet()
+        self.assertTrue(variants.isSampleShardedDir(self._tempDir))
+        self.assertEqual(
+            [callSet.getId() for callSet in variantSet.getCallSets()],
+            self._callSetIds[:5])
+        self.assertEqual(len(variantSet.getShards()), 3)
+        self.assertEqual(
+            variantSet.getMetadata(), self._variantSet.getMetadata())
+
+    def testGetVariants(self):
+        variantSet = self.getShardedVariantSet()
+        callSetIdsList = [
+            None, [], self._callSetIds[:1], self._callSetIds[1:4],
+            [self._callSetIds[4], self._callSetIds[0]]]
+        for numThreads in [0, 4]:
+            variants.shardFetcher.setNumThreads(numThreads)
+            for referenceName in ["1", "2", "3"]:
+                for callSetIds in callSetIdsList:
+                    expectedCallSetIds = callSetIds
+                    if callSetIds is None:
+                        expectedCallSetIds = self._callSetIds[:5]
+                    expected = self.getVariants(
+                        self._variantSet, referenceName,
+                        sorted(expectedCallSetIds,
+                               key=self._callSetIds.index))
+                    self.assertGreater(len(expected), 0)
+                    self.assertEqual(
+                        self.getVariants(
+                            variantSet, referenceName, callSetIds),
+                        expected)
+
+    def testShardsRead(self):
+        variantSet = self.getShardedVariantSet()
+        searchedShards = []
+        for shard in variantSet.getShards():
+            def getVariants(shard, *args, **kwargs):
+                searchedShards.append(shard)
+                return shard.__class__.getVariantsWithFilters(
+                    shard, *args, **kwargs)
+            shard.getVariantsWithFilters = functools.partial(
+                getVariants, shard)
+        for callSetIds, shardIndexes in [
+                (self._callSetIds[:1], [0]), (self._callSetIds[2:3], [1]),
+                ([], [0]), (self._callSetIds[3:5], [2]),
+                (self._callSetIds[1:4], [0, 1, 2])]:
+            del searchedShards[:]
+            list(variantSet.getVariants("1", 0, 2**32, callSetIds))
+            self.assertEqual(
+                searchedShards,
+                [variantSet.getShards()[index] for index in shardIndexes])
+
+    def testPageTokens(self):
+        variantSet = self.getShardedVariantSet()
+        expected = self.getVariants(
+            self._variantSet, "1", self._callSetIds[:5])
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = variantSet.getId()
+        request.referenceName = "1"
+        request.start = 0
+        request.end = 2**32
+        gaVariants = []
+        while True:
+            iterator = backend.VariantsIntervalIterator(request, variantSet)
+            gaVariant, pageToken = next(iterator)
+            gaVariants.append(gaVariant)
+            if pageToken is None:
+                break
+            request.pageToken = pageToken
+        self.assertEqual(
+            test_variant_shards.getJsonDicts(gaVariants), expected)
+
+    def testGetVariant(self):
+        variantSet = self.getShardedVariantSet()
+        for gaVariant in list(variantSet.getVariants("2", 0, 2**32)):
+            compoundId = datamodel.VariantCompoundId.parse(gaVariant.id)
+            self.assertEqual(variantSet.getVariant(compoundId), gaVariant)
+        compoundId = datamodel.VariantCompoundId(
+            variantSet.getCompoundId(), "2", 0, "noSuchVariant")
+        self.assertRaises(
+            exceptions.ObjectNotFoundException,
+            variantSet.getVariant, compoundId)
+
+    def testGetVariantsById(self):
+        variantSet = self.getShardedVariantSet()
+        gaVariants = list(variantSet.getVariants("2", 0, 2**32))
+        compoundIds = [
+            datamodel.VariantCompoundId.parse(gaVariant.id)
+            for gaVariant in gaVariants[::-2] + gaVariants[:1]]
+        compoundIds.append(datamodel.VariantCompoundId(
+            variantSet.getCompoundId(), "2", 0, "noSuchVariant"))
+        self.assertEqual(
+            variantSet.getVariantsById(compoundIds),
+            gaVariants[::-2] + gaVariants[:1] + [None])
+
+    def testUnknownCallSet(self):
+        variantSet = self.getShardedVariantSet()
+        self.assertRaises(
+            exceptions.CallSetNotInVariantSetException, list,
+            variantSet.getVariants("1", 0, 2**32, [self._callSetIds[5]]))
+
+    def testShardsFile(self):
+        # Only the subdirectories listed in the manifest are shards.
+        os.mkdir(os.path.join(self._tempDir, "backup"))
+        self.assertEqual(len(self.getShardedVariantSet().getShards()), 3)
+        os.remove(os.path.join(self._tempDir, variants.SHARDS_FILE_NAME))
+        self.assertFalse(variants.isSampleShardedDir(self._tempDir))
+        for shardNames in [["shard0", "noSuchShard"], "shard0"]:
+            writeShardsFile(self._tempDir, shardNames)
+            self.assertRaises(
+                exceptions.FileOpenFailedException,
+                self.getShardedVariantSet)
+        with open(os.path.join(
+                self._tempDir, variants.SHARDS_FILE_NAME), "w") as shardsFile:
+            shardsFile.write("{")
+        self.assertRaises(
+            exceptions.FileOpenFailedException, self.getShardedVariantSet)
+
+    def testFilterMergedVariants(self):
+        # The second shard gives every site a FILTER, so no merged site
+        # passes, even when only the calls of the first shard are read.
+        self.writeShard("shard1", self.shardSampleIndexes[1], b"LowQual")
+        variantSet = self.getShardedVariantSet()
+        expected = self.getVariants(
+            self._variantSet, "1", self._callSetIds[:1])
+        for expression, expectedVariants in [
+                ("FILTER == PASS", []), ("FILTER == LowQual", expected),
+                ("FILTER == LowQual AND INFO.AC > 1000", [])]:
+            variantFilter = variantfilters.VariantFilter(expression)
+            self.assertEqual(
+                test_variant_shards.getJsonDicts(variantSet.getVariants(
+                    "1", 0, 2**32, self._callSetIds[:1], variantFilter)),
+                expectedVariants)
+        variantFilter = variantfilters.VariantFilter("FILTER == PASS")
+        self.assertGreater(len(list(self._variantSet.getVariants(
+            "1", 0, 2**32, self._callSetIds[:1], variantFilter))), 0)
+
+    def testOverlappingSamples(self):
+        self.writeShard("shard3", [4, 5])
+        self.assertRaises(
+            exceptions.OverlappingSampleShardsException,
+            self.getShardedVariantSet)
@@ -220,6 +220,23 @@ class SerialisationTest(SchemaTest):
     def testSerialiseRandomValues(self):
         self.validateClasses(self.getRandomInstance)
 
+    def testAvroBinarySerialiseTypicalValues(self):
+        for cls in protocol.getProtocolClasses():
+            instance = self.getTypicalInstance(cls)
+            avroBytes = instance.toAvroBytes()
+            otherInstance = cls.fromAvroBytes(avroBytes)
+            self.assertEqual(instance, otherInstance)
+            for mimetype in protocol.MIMETYPES:
+                data = instance.serialize(mimetype)
+                otherInstance = cls.deserialize(data, mimetype)
+                self.assertEqual(instance, otherInstance)
+
+    def testUnsupportedMimetype(self):
+        instance = self.getTypicalInstance(protocol.Variant)
+        self.assertRaises(ValueError, instance.serialize, "text/plain")
+        self.assertRaises(
+            ValueError, protocol.Variant.deserialize, "", "text/plain")
+
 
 class ValidatorTest(SchemaTest):
     """
@@ -388,3 +405,53 @@ class SearchResponseBuilderTest(SchemaTest):
             self.assertEqual(nextPageToken, builder.getNextPageToken())
             instance = responseClass.fromJsonString(builder.getJsonString())
             self.assertEqual(nextPageToken, instance.nextPageToken)
+
+
+class AvroSearchResponseBuilderTest(SchemaTest):
+    """
+    Tests the AvroSearchResponseBuilder class to ensure that it produces
+    the Avro binary encoding of the SearchResponse.
+    """
+    def testIntegrity(self):
+        for class_ in protocol.getProtocolClasses(protocol.SearchResponse):
+            instance = self.getTypicalInstance(class_)
+            valueList = getattr(instance, class_.getValueListName())
+            builder = protocol.getSearchResponseBuilder(
+                protocol.AVRO_BINARY_MIMETYPE, class_, len(valueList),
+                2**32)
+            self.assertIsInstance(builder, protocol.AvroSearchResponseBuilder)
+            for value in valueList:
+                builder.addValue(value)
+            builder.setNextPageToken(instance.nextPageToken)
+            avroBytes = builder.getSerializedResponse()
+            self.assertEqual(avroBytes, instance.toAvroBytes())
+            otherInstance = class_.fromAvroBytes(avroBytes)
+            self.assertEqual(instance, otherInstance)
+
+    def testEmptyResponse(self):
+        responseClass = protocol.SearchVariantsResponse
+        builder = protocol.AvroSearchResponseBuilder(
+            responseClass, 100, 2**32)
+        for nextPageToken in [None, "", "string"]:
+            builder.setNextPageToken(nextPageToken)
+            instance = responseClass.fromAvroBytes(builder.getAvroBytes())
+            self.assertEqual(instance.variants, [])
+            self.assertEqual(instance.nextPageToken, nextPageToken)
+
+    def testMaxResponseLengthOverridesPageSize(self):
+        responseClass = protocol.SearchVariantsResponse
+        typicalValue = self.getTypicalInstance(protocol.Variant)
+        typicalValueLength = len(typicalValue.toAvroBytes())
+        for numValues in range(1, 10):
+            maxResponseLength = numValues * typicalValueLength
+            builder = protocol.AvroSearchResponseBuilder(
+                responseClass, 1000, maxResponseLength)
+            while not builder.isFull():
+                builder.addValue(typicalValue)
+            instance = responseClass.fromAvroBytes(builder.getAvroBytes())
+            self.assertEqual(len(instance.variants), numValues)
+
+    def testUnsupportedMimetype(self):
+        self.assertRaises(
+            ValueError, protocol.getSearchResponseBuilder, "text/plain",
+            protocol.SearchVariantsResponse, 100, 2**32)
@@ -0,0 +1,143 @@
+"""
+Tests for the precomputed data file statistics.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import os
+import shutil
+import tempfile
+import unittest
+
+import pysam
+
+import ga4gh.backend as backend
+import ga4gh.datamodel.stats as stats
+
+
+class TestStatsEngine(unittest.TestCase):
+    """
+    Tests the StatsEngine using a copy of the test data, so that we can
+    write sidecar files and modify data files.
+    """
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp()
+        self._dataDir = os.path.join(self._tempDir, "data")
+        shutil.copytree(os.path.join("tests", "data"), self._dataDir)
+        self._readsDir = os.path.join(
+            self._dataDir, "datasets", "dataset1", "reads")
+        self._samFilePath = os.path.join(
+            self._readsDir,
+            "HG00096.mapped.ILLUMINA.bwa.GBR.low_coverage.20120522.bam")
+        stats.statsEngine.setNumProcesses(2)
+
+    def tearDown(self):
+        stats.statsEngine.setNumProcesses(0)
+        shutil.rmtree(self._tempDir)
+
+    def getReadGroupCounts(self, samFilePath):
+        counts = collections.defaultdict(lambda: [0, 0, 0])
+        samFile = pysam.AlignmentFile(samFilePath)
+        for read in samFile.fetch(until_eof=True):
+            readGroupCounts = counts[dict(read.tags).get('RG')]
+            readGroupCounts[int(read.is_unmapped)] += 1
+            readGroupCounts[2] += read.query_length
+        samFile.close()
+        return counts
+
+    def testReadGroupStats(self):
+        theBackend = backend.FileSystemBackend(self._dataDir)
+        stats.statsEngine.wait()
+        dataset = theBackend.getDatasetByIndex(0)
+        for readGroupSet in dataset.getReadGroupSets():
+            samFilePath = readGroupSet.getSamFilePath()
+            self.assertTrue(
+                os.path.exists(stats.getStatsFilePath(samFilePath)))
+            counts = self.getReadGroupCounts(samFilePath)
+            totalBases = sum(
+                readGroupCounts[2] for readGroupCounts in counts.values())
+            self.assertEqual(readGroupSet.getNumBases(), totalBases)
+            for readGroup in readGroupSet.getReadGroups():
+                gaReadGroup = readGroup.toProtocolElement()
+                if readGroupSet.isUsingDefaultReadGroup():
+                    expected = [
+                        sum(readGroupCounts[j]
+                            for readGroupCounts in counts.values())
+                        for j in range(3)]
+                else:
+                    expected = counts[readGroup.getLocalId()]
+                self.assertEqual(
+                    [gaReadGroup.stats.alignedReadCount,
+                     gaReadGroup.stats.unalignedReadCount,
+                     gaReadGroup.stats.baseCount],
+                    expected)
+
+    def testVariantSetStats(self):
+        theBackend = backend.FileSystemBackend(self._dataDir)
+        stats.statsEngine.wait()
+        dataset = theBackend.getDatasetByIndex(0)
+        for variantSet in dataset.getVariantSets():
+            total = 0
+            for variantFilePath in variantSet.getDataFilePaths()[1:]:
+                variantFile = pysam.VariantFile(variantFilePath)
+                chroms = [record.chrom for record in variantFile]
+                variantFile.close()
+                for chrom in set(chroms):
+                    self.assertEqual(
+                        variantSet.getNumVariants(chrom), chroms.count(chrom))
+                total += len(chroms)
+            self.assertEqual(variantSet.getNumVariants(), total)
+            self.assertEqual(variantSet.getNumVariants("no such chrom"), 0)
+
+    def testSidecarReused(self):
+        function = stats.computeReadGroupSetStats
+        stats.statsEngine.requestStats(self._samFilePath, function)
+        stats.statsEngine.wait()
+        computed = stats.statsEngine.getStats(self._samFilePath)
+        self.assertIsNotNone(computed)
+        # A new engine with no worker processes uses the sidecar file.
+        statsEngine = stats.StatsEngine()
+        statsEngine.requestStats(self._samFilePath, function)
+        loaded = statsEngine.getStats(self._samFilePath)
+        self.assertEqual(loaded.getValues(), computed.getValues())
+        self.assertEqual(loaded.getStatsTime(), computed.getStatsTime())
+
+    def testModifiedFileInvalidatesStats(self):
+        function = stats.computeReadGroupSetStats
+        stats.statsEngine.requestStats(self._samFilePath, function)
+        stats.statsEngine.wait()
+        computed = stats.statsEngine.getStats(self._samFilePath)
+        modificationTime = os.path.getmtime(self._samFilePath) - 10
+        os.utime(self._samFilePath, (modificationTime, modificationTime))
+        self.assertIsNone(stats.DataFileStats.load(self._samFilePath))
+        statsEngine = stats.StatsEngine()
+        statsEngine.requestStats(self._samFilePath, function)
+        self.assertIsNone(statsEngine.getStats(self._samFilePath))
+        # The running engine notices the change and recomputes.
+        self.assertIsNone(stats.statsEngine.getStats(self._samFilePath))
+        stats.statsEngine.wait()
+        recomputed = stats.statsEngine.getStats(self._samFilePath)
+        self.assertEqual(recomputed.getValues(), computed.getValues())
+        self.assertGreaterEqual(
+            recomputed.getStatsTime(), computed.getStatsTime())
+
+    def testNoProcesses(self):
+        stats.statsEngine.setNumProcesses(0)
+        theBackend = backend.FileSystemBackend(self._dataDir)
+        stats.statsEngine.wait()
+        dataset = theBackend.getDatasetByIndex(0)
+        for readGroupSet in dataset.getReadGroupSets():
+            self.assertIsNone(readGroupSet.getNumBases())
+            for readGroup in readGroupSet.getReadGroups():
+                self.assertEqual(readGroup.getNumAlignedReads(), -1)
+                self.assertIsNone(readGroup.getNumBases())
+        for variantSet in dataset.getVariantSets():
+            self.assertIsNone(variantSet.getNumVariants())
+        self.assertEqual([], [
+            fileName for fileName in os.listdir(self._readsDir)
+            if fileName.endswith(stats.STATS_FILE_SUFFIX)])
+
+    def testBadNumProcesses(self):
+        self.assertRaises(ValueError, stats.statsEngine.setNumProcesses, -1)
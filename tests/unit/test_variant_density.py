@@ -0,0 +1,264 @@
+"""
+Tests for variant density requests and the variant density index.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import numpy.testing
+
+import ga4gh.datamodel.datasets as datasets
+import ga4gh.datamodel.variantdensity as variantdensity
+import ga4gh.datamodel.variantfilters as variantfilters
+import ga4gh.datamodel.variants as variants
+import ga4gh.datamodel.variantstore as variantstore
+import ga4gh.exceptions as exceptions
+import tests.utils as utils
+
+
+def getExpectedCounts(variantSet, referenceName, binSize, firstBin,
+                      lastBin):
+    """
+    Returns the array of the variant counts of the specified bins,
+    computed from the GA Variants of the specified variant set.
+    """
+    counts = variantdensity.getEmptyCounts(lastBin - firstBin)
+    gaVariants = variantSet.getVariants(
+        referenceName, firstBin * binSize, lastBin * binSize, [])
+    for gaVariant in gaVariants:
+        index = gaVariant.start // binSize - firstBin
+        if 0 <= index < len(counts):
+            variantClass = variantfilters.getVariantClass(
+                gaVariant.referenceBases, gaVariant.alternateBases)
+            alleleFrequencyClass = variantdensity.UNKNOWN
+            if "AF" in gaVariant.info:
+                alleleFrequency = max(
+                    float(value) for value in gaVariant.info["AF"])
+                alleleFrequencyClass = variantdensity.COMMON
+                if alleleFrequency < 0.01:
+                    alleleFrequencyClass = variantdensity.RARE
+                elif alleleFrequency < 0.05:
+                    alleleFrequencyClass = variantdensity.LOW
+            counts[
+                index, variantfilters.VARIANT_CLASSES.index(variantClass),
+                variantdensity.ALLELE_FREQUENCY_CLASSES.index(
+                    alleleFrequencyClass)] += 1
+    return counts
+
+
+class TestVariantDensityIndex(unittest.TestCase):
+    """
+    Tests the variant density of a copy of one of the test variant sets
+    computed from its density index against the counts of its variants.
+    """
+    binSizes = [1, 10, 1000]
+
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        self._variantSet = fixture.variantSet
+        self._tempDir = tempfile.mkdtemp()
+        self._dataDir = os.path.join(self._tempDir, "1kgPhase1")
+        shutil.copytree(self._variantSet.getDataFilePaths()[0], self._dataDir)
+        self._manifestPath = os.path.join(
+            self._dataDir, variantdensity.MANIFEST_FILE_NAME)
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def getVariantSet(self):
+        return variants.HtslibVariantSet(
+            self._dataset, self._variantSet.getLocalId(), self._dataDir,
+            self._backend)
+
+    def getRegions(self, referenceName):
+        starts = [
+            gaVariant.start for gaVariant in
+            self._variantSet.getVariants(referenceName, 0, 2**32)]
+        middle = starts[len(starts) // 2]
+        return [
+            (0, 2**32), (starts[0], starts[-1] + 1), (middle, middle + 1),
+            (starts[0] - 13, middle), (starts[-1] + 1, starts[-1] + 1000)]
+
+    def testIndexBuiltOnFirstUse(self):
+        variantSet = self.getVariantSet()
+        self.assertFalse(os.path.exists(self._manifestPath))
+        self.assertNotIn(self._manifestPath, variantSet.getDataFilePaths())
+        # The variants are counted while the index is built.
+        binSize, firstBin, counts = variantSet.getVariantDensity(
+            "1", 0, 2**32, 10)
+        self.assertEqual(binSize, -(-2**32 // 10))
+        numpy.testing.assert_array_equal(counts, getExpectedCounts(
+            self._variantSet, "1", binSize, firstBin,
+            firstBin + len(counts)))
+        variants.densityIndexBuilder.wait()
+        self.assertTrue(os.path.exists(self._manifestPath))
+        self.assertIsNotNone(variantSet._getDensityIndex())
+        self.assertIn(self._manifestPath, variantSet.getDataFilePaths())
+        variantSet = self.getVariantSet()
+        for filePath in variantSet.getDataFilePaths()[1:]:
+            self.assertTrue(os.path.exists(filePath))
+        self.assertIn(self._manifestPath, variantSet.getDataFilePaths())
+
+    def testDensity(self):
+        variantdensity.VariantDensityIndex.build(
+            self.getVariantSet(), self.binSizes).save(self._dataDir)
+        variantSet = self.getVariantSet()
+        self.assertEqual(
+            variantSet._getDensityIndex().getBinSizes(), self.binSizes)
+        # The columnar store has no density index, so counts the
+        # variants.
+        storeDir = os.path.join(self._tempDir, "store")
+        variantstore.build(self._variantSet, storeDir)
+        columnarVariantSet = variantstore.ColumnarVariantSet(
+            self._dataset, self._variantSet.getLocalId(), storeDir,
+            self._backend)
+        numVariants = 0
+        for referenceName in self._variantSet.getReferenceNames():
+            for start, end in self.getRegions(referenceName):
+                for maxBins in [1, 7, 1000]:
+                    results = [
+                        theVariantSet.getVariantDensity(
+                            referenceName, start, end, maxBins)
+                        for theVariantSet in [
+                            variantSet, columnarVariantSet]]
+                    for binSize, firstBin, counts in results:
+                        self.assertLessEqual(firstBin * binSize, start)
+                        self.assertGreaterEqual(
+                            (firstBin + len(counts)) * binSize, end)
+                        numpy.testing.assert_array_equal(
+                            counts, getExpectedCounts(
+                                self._variantSet, referenceName, binSize,
+                                firstBin, firstBin + len(counts)))
+                        numVariants += int(counts.sum())
+                    indexBinSize = max(
+                        [1] + [size for size in self.binSizes
+                               if size <= results[1][0]])
+                    self.assertEqual(results[0][0] % indexBinSize, 0)
+        self.assertGreater(numVariants, 0)
+        binSize, firstBin, counts = variantSet.getVariantDensity(
+            "xyz", 0, 1000, 10)
+        self.assertEqual(counts.sum(), 0)
+
+    def testStaleIndexRebuilt(self):
+        variantdensity.VariantDensityIndex.build(
+            self.getVariantSet(), [10]).save(self._dataDir)
+        variantSet = self.getVariantSet()
+        self.assertEqual(variantSet._getDensityIndex().getBinSizes(), [10])
+        dataFilePath = os.path.join(self._dataDir, "chr1.vcf.gz")
+        fileStat = os.stat(dataFilePath)
+        os.utime(dataFilePath, (fileStat.st_atime, fileStat.st_mtime + 10))
+        self.assertIsNone(variantdensity.VariantDensityIndex.load(
+            self._dataDir, variantSet.getDataFileNames()))
+        self.assertIsNone(variantSet._getDensityIndex())
+        variants.densityIndexBuilder.wait()
+        self.assertEqual(
+            variantSet._getDensityIndex().getBinSizes(),
+            variantdensity.DEFAULT_BIN_SIZES)
+        self.assertIsNotNone(variantdensity.VariantDensityIndex.load(
+            self._dataDir, variantSet.getDataFileNames()))
+
+    def testNoProcesses(self):
+        # Without worker processes no index is built.
+        variants.densityIndexBuilder.setNumProcesses(0)
+        try:
+            variantSet = self.getVariantSet()
+            variantSet.getVariantDensity("1", 0, 2**32, 10)
+            variants.densityIndexBuilder.wait()
+            self.assertIsNone(variantSet._getDensityIndex())
+            self.assertFalse(os.path.exists(self._manifestPath))
+        finally:
+            variants.densityIndexBuilder.setNumProcesses(1)
+
+    def testSimulatedVariantSet(self):
+        dataset = datasets.AbstractDataset("dataset")
+        variantSet = variants.SimulatedVariantSet(
+            dataset, "sim", randomSeed=1, numCalls=1, variantDensity=0.5)
+        binSize, firstBin, counts = variantSet.getVariantDensity(
+            "1", 100, 1000, 10)
+        self.assertEqual((binSize, firstBin), (90, 1))
+        numpy.testing.assert_array_equal(
+            counts, getExpectedCounts(variantSet, "1", 90, 1, 12))
+        self.assertGreater(counts.sum(), 0)
+
+    def testAlleleFrequencyClasses(self):
+        classes = variantdensity.ALLELE_FREQUENCY_CLASSES
+        for alleleFrequencies, expected in [
+                (None, variantdensity.UNKNOWN), ([], variantdensity.UNKNOWN),
+                (["abc"], variantdensity.UNKNOWN),
+                ([0.001], variantdensity.RARE), (["0.01"], variantdensity.LOW),
+                ([0.002, 0.2], variantdensity.COMMON)]:
+            self.assertEqual(
+                variantdensity.getAlleleFrequencyClassIndex(
+                    alleleFrequencies), classes.index(expected))
+
+
+class TestDensityRequests(unittest.TestCase):
+    """
+    Tests variant density requests through the backend and client.
+    """
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp()
+        dataDir = os.path.join(self._tempDir, "data")
+        shutil.copytree(os.path.join("tests", "data"), dataDir)
+        fixture = utils.getDataFixture(dataDir)
+        self._backend = fixture.backend
+        self._client = fixture.client
+        self._variantSet = fixture.variantSet
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def testDensity(self):
+        # The first request starts building the density index.
+        self._client.getVariantSetDensity(
+            self._variantSet.getId(), "1", 0, 2**32, 100)
+        variants.densityIndexBuilder.wait()
+        response = self._client.getVariantSetDensity(
+            self._variantSet.getId(), "1", 0, 2**32, 100)
+        self.assertEqual(response["variantSetId"], self._variantSet.getId())
+        self.assertEqual(response["referenceName"], "1")
+        self.assertEqual(
+            response["variantClasses"], variantfilters.VARIANT_CLASSES)
+        self.assertEqual(
+            response["alleleFrequencyClasses"],
+            variantdensity.ALLELE_FREQUENCY_CLASSES)
+        binSize = response["binSize"]
+        self.assertEqual(binSize, 10000000 * 5)
+        self.assertEqual(response["start"], 0)
+        self.assertEqual(
+            response["end"], binSize * len(response["counts"]))
+        self.assertEqual(
+            response["counts"],
+            getExpectedCounts(
+                self._variantSet, "1", binSize, 0,
+                len(response["counts"])).tolist())
+        self.assertGreater(numpy.sum(response["counts"]), 0)
+
+    def testBadRequests(self):
+        variantSetId = self._variantSet.getId()
+        badArgs = [
+            {}, {"referenceName": "1"}, {"end": 100},
+            {"referenceName": "1", "end": 100, "maxBins": 0},
+            {"referenceName": "1", "start": 10, "end": 10},
+            {"referenceName": "1", "start": -1, "end": 10}]
+        for requestArgs in badArgs:
+            self.assertRaises(
+                exceptions.BadRequestArgumentException,
+                self._backend.runListVariantSetDensity, variantSetId,
+                requestArgs)
+        self.assertRaises(
+            exceptions.BadRequestIntegerException,
+            self._backend.runListVariantSetDensity, variantSetId,
+            {"referenceName": "1", "end": "abc"})
+        response = json.loads(self._backend.runListVariantSetDensity(
+            variantSetId, {"referenceName": "1", "end": "10", "maxBins": "1"}))
+        self.assertEqual(len(response["counts"]), 1)
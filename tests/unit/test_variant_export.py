@@ -0,0 +1,147 @@
+"""
+Tests for the parallel export of variant sets.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import ga4gh.client as client
+import ga4gh.datamodel.variantexport as variantexport
+import ga4gh.datamodel.variants as variants
+import ga4gh.datamodel.variantstore as variantstore
+import ga4gh.exceptions as exceptions
+import tests.unit.test_sample_shards as test_sample_shards
+import tests.utils as utils
+
+
+class TestExportTasks(unittest.TestCase):
+    """
+    Tests the splitting of exports into tasks.
+    """
+    class FakeVariantSet(object):
+        def __init__(self, referenceRanges):
+            self._referenceRanges = referenceRanges
+
+        def getReferenceRange(self, referenceName):
+            return self._referenceRanges.get(referenceName)
+
+    def testGetExportTasks(self):
+        variantSet = self.FakeVariantSet({"1": (5, 27), "2": (0, 0)})
+        self.assertEqual(
+            variantexport.getExportTasks(variantSet, ["1", "2"], 0, None, 10),
+            [variantexport.ExportTask("1", 5, 15, True),
+             variantexport.ExportTask("1", 15, 25, False),
+             variantexport.ExportTask("1", 25, 27, False)])
+        self.assertEqual(
+            variantexport.getExportTasks(variantSet, ["1"], 10, 20, 10),
+            [variantexport.ExportTask("1", 10, 20, True)])
+        self.assertEqual(
+            variantexport.getExportTasks(variantSet, ["3"], 10, 12, 10),
+            [variantexport.ExportTask("3", 10, 12, True)])
+        self.assertIsNone(
+            variantexport.getExportTasks(variantSet, ["3"], 0, None, 10))
+
+
+class TestVariantExport(unittest.TestCase):
+    """
+    Tests exports of the test variant sets, run in the server process and
+    in worker processes, against the variants of each contig in turn.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        self._variantSet = fixture.variantSet
+        self._tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+        variantexport.variantExporter.setNumProcesses(0)
+
+    def getExpected(self, variantSet, referenceNames, start, end):
+        return "".join(
+            jsonRecord.toJsonString() + "\n"
+            for referenceName in referenceNames
+            for jsonRecord in variantSet.getVariantsJson(
+                referenceName, start, end))
+
+    def assertExports(self, variantSet):
+        referenceNames = variantSet.getReferenceNames()
+        self.assertEqual(referenceNames, ["1", "2", "3"])
+        firstStart, end = variantSet.getReferenceRange("1")
+        # The regions are small enough that some of the variants overlap
+        # the boundaries between the tasks.
+        regionSize = (end - firstStart) // 7
+        for numProcesses in [0, 2]:
+            variantexport.variantExporter.setNumProcesses(numProcesses)
+            for exportReferenceNames, start, exportEnd in [
+                    (referenceNames, 0, None),
+                    (["1"], firstStart + 1000, end - 1000)]:
+                tasks = variantexport.getExportTasks(
+                    variantSet, exportReferenceNames, start, exportEnd,
+                    regionSize)
+                self.assertGreater(len(tasks), 5)
+                if exportEnd is None:
+                    exportEnd = 2**32
+                expected = self.getExpected(
+                    variantSet, exportReferenceNames, start, exportEnd)
+                self.assertGreater(len(expected), 0)
+                self.assertEqual(
+                    "".join(variantexport.variantExporter.export(
+                        variantSet, tasks)),
+                    expected)
+
+    def testHtslibVariantSet(self):
+        self.assertExports(self._variantSet)
+
+    def testColumnarVariantSet(self):
+        variantstore.build(self._variantSet, self._tempDir)
+        self.assertExports(variantstore.ColumnarVariantSet(
+            self._dataset, self._variantSet.getLocalId(), self._tempDir,
+            self._backend))
+
+    def testSampleShardedVariantSet(self):
+        for index, sampleIndexes in enumerate([[0, 1], [2, 3, 4]]):
+            for sourcePath in self._variantSet.getDataFilePaths()[1:]:
+                test_sample_shards.writeSampleShard(
+                    sourcePath,
+                    os.path.join(self._tempDir, "shard{}".format(index)),
+                    sampleIndexes)
+        test_sample_shards.writeShardsFile(
+            self._tempDir, ["shard0", "shard1"])
+        self.assertExports(variants.SampleShardedVariantSet(
+            self._dataset, self._variantSet.getLocalId(), self._tempDir,
+            self._backend))
+
+    def testExportRequests(self):
+        localClient = client.LocalClient(self._backend)
+        variantSetId = self._variantSet.getId()
+        exported = [
+            gaVariant.toJsonDict() for gaVariant in
+            localClient.exportVariantSet(variantSetId, "2", 0, 2**32)]
+        self.assertGreater(len(exported), 0)
+        self.assertEqual(
+            exported,
+            [gaVariant.toJsonDict() for gaVariant in
+             self._variantSet.getVariants("2", 0, 2**32)])
+        self.assertEqual(
+            sum(1 for _ in localClient.exportVariantSet(variantSetId)),
+            sum(len(list(self._variantSet.getVariants(
+                referenceName, 0, 2**32)))
+                for referenceName in ["1", "2", "3"]))
+        for requestArgs in [{"start": -1}, {"start": 10, "end": 10}]:
+            self.assertRaises(
+                exceptions.BadRequestArgumentException,
+                self._backend.runExportVariantSet, variantSetId,
+                requestArgs)
+        self.assertRaises(
+            exceptions.BadRequestIntegerException,
+            self._backend.runExportVariantSet, variantSetId, {"end": "x"})
+        self.assertRaises(
+            exceptions.NotFoundException,
+            self._backend.runExportVariantSet, "notValid", {})
@@ -0,0 +1,315 @@
+"""
+Tests for variant filter expressions.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import itertools
+import json
+import unittest
+
+import pysam
+
+import ga4gh.datamodel.variantfilters as variantfilters
+import ga4gh.exceptions as exceptions
+import ga4gh.metrics as metrics
+import ga4gh.protocol as protocol
+import tests.unit.test_json_records as test_json_records
+import tests.utils as utils
+
+
+class TestVariantClass(unittest.TestCase):
+    """
+    Tests the classification of variants.
+    """
+    def testGetVariantClass(self):
+        cases = [
+            ("A", ["C"], variantfilters.SNV),
+            ("A", ["C", "G"], variantfilters.SNV),
+            ("AC", ["GT"], variantfilters.MNV),
+            ("A", ["AC"], variantfilters.INDEL),
+            ("GTC", ["G", "GTCT"], variantfilters.INDEL),
+            ("A", ["C", "AC"], variantfilters.MIXED),
+            ("A", ["<DEL>"], variantfilters.OTHER),
+            ("A", ["*"], variantfilters.OTHER),
+            ("A", ["A[1:100["], variantfilters.OTHER),
+            ("A", [], variantfilters.OTHER),
+            ("A", None, variantfilters.OTHER),
+        ]
+        for referenceBases, alternateBases, variantClass in cases:
+            self.assertEqual(
+                variantfilters.getVariantClass(
+                    referenceBases, alternateBases),
+                variantClass)
+
+
+class TestVariantFilter(unittest.TestCase):
+    """
+    Tests the parsing and evaluation of filter expressions on GA
+    Variants.
+    """
+    def getVariant(self, referenceBases, alternateBases, info):
+        variant = protocol.Variant(
+            referenceBases=referenceBases, alternateBases=alternateBases)
+        variant.info = info
+        return variant
+
+    def testIncludesVariant(self):
+        snv = self.getVariant("A", ["C"], {"AF": ["0.005"], "DB": ["True"]})
+        indel = self.getVariant("A", ["AC", "ACC"], {"AF": ["0.5", "0.02"]})
+        mnv = self.getVariant("AC", ["GT"], {"AA": ["T"]})
+        cases = [
+            ("TYPE == SNV", [snv]),
+            ("type != snv", [indel, mnv]),
+            ("TYPE == 'INDEL' OR TYPE == MNV", [indel, mnv]),
+            ("INFO.AF < 0.01", [snv]),
+            ("INFO.AF < 0.1", [snv, indel]),
+            ("INFO.AF >= 5e-1", [indel]),
+            ("INFO.AF != 0.5", [snv, indel]),
+            ("INFO.AA == T", [mnv]),
+            ("INFO.AA == \"T\"", [mnv]),
+            ("INFO.DB", [snv]),
+            ("NOT INFO.DB", [indel, mnv]),
+            ("NOT (INFO.DB OR INFO.AA)", [indel]),
+            ("INFO.AF < 0.1 AND NOT TYPE == SNV", [indel]),
+            ("TYPE == SNV OR TYPE == INDEL AND INFO.AF > 0.4", [snv, indel]),
+            ("(TYPE == SNV OR TYPE == INDEL) AND INFO.AF > 0.4", [indel]),
+            ("FILTER == PASS", []),
+            ("FILTER == '.'", [snv, indel, mnv]),
+        ]
+        for expression, expected in cases:
+            variantFilter = variantfilters.VariantFilter(expression)
+            self.assertEqual(variantFilter.getExpression(), expression)
+            self.assertEqual(
+                [variant for variant in [snv, indel, mnv]
+                 if variantFilter.includesVariant(variant)],
+                expected, expression)
+
+    def testParseErrors(self):
+        badExpressions = [
+            "", "TYPE", "TYPE == ", "TYPE < SNV", "TYPE == NOTACLASS",
+            "FILTER == 10", "INFO. == 1", "INFO.AF <", "INFO.AF < 1 AND",
+            "(TYPE == SNV", "TYPE == SNV)", "QUAL > 10", "INFO.AF = 1",
+            "INFO.AF < 1 INFO.AC > 1", "NOT", "AND TYPE == SNV", "TYPE == $"]
+        for expression in badExpressions:
+            self.assertRaises(
+                ValueError, variantfilters.VariantFilter, expression)
+
+
+class TestVariantFilterRecords(unittest.TestCase):
+    """
+    Tests filter expressions against the records in the test data.
+    """
+    expressions = [
+        "TYPE == SNV", "TYPE == INDEL", "TYPE != SNV", "TYPE == OTHER",
+        "INFO.AF < 0.01", "INFO.AF >= 0.2", "INFO.DP > 10", "INFO.DB",
+        "NOT INFO.AA", "INFO.AA == G", "INFO.AC == 0",
+        "TYPE == SNV AND INFO.AF < 0.05 OR INFO.DP <= 9",
+    ]
+    filterExpressions = [
+        "FILTER == PASS", "FILTER != PASS", "FILTER == LowQD",
+        "FILTER == '.'", "FILTER == PASS AND TYPE == SNV AND INFO.AF < 0.01",
+    ]
+
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+
+    def getRecords(self, variantSet, referenceName):
+        records = []
+        for variantFilePath in variantSet.getDataFilePaths()[1:]:
+            variantFile = pysam.VariantFile(variantFilePath)
+            if referenceName in variantFile.header.contigs:
+                records.extend(variantFile.fetch(referenceName))
+        return records
+
+    def isIncluded(self, record, expression):
+        # A direct implementation of the filter expressions used above.
+        alts = record.alts or ()
+        isSnv = len(record.ref) == 1 and all(len(alt) == 1 for alt in alts)
+        isSnv = isSnv and len(alts) > 0
+        isIndel = len(alts) > 0 and all(
+            len(alt) != len(record.ref) and alt[0] not in "<*"
+            for alt in alts)
+        filters = list(record.filter.keys())
+
+        def infoValues(key):
+            value = record.info.get(key)
+            if value is None:
+                return ()
+            if isinstance(value, tuple):
+                return value
+            return (value,)
+        af = infoValues("AF")
+        return {
+            "TYPE == SNV": isSnv,
+            "TYPE == INDEL": isIndel,
+            "TYPE != SNV": not isSnv,
+            "TYPE == OTHER": all(alt[0] == "<" for alt in alts),
+            "INFO.AF < 0.01": any(value < 0.01 for value in af),
+            "INFO.AF >= 0.2": any(value >= 0.2 for value in af),
+            "INFO.DP > 10": any(value > 10 for value in infoValues("DP")),
+            "INFO.DB": record.info.get("DB") is True,
+            "NOT INFO.AA": record.info.get("AA") is None,
+            "INFO.AA == G": "G" in infoValues("AA"),
+            "INFO.AC == 0": 0 in infoValues("AC"),
+            "TYPE == SNV AND INFO.AF < 0.05 OR INFO.DP <= 9": (
+                isSnv and any(value < 0.05 for value in af) or
+                any(value <= 9 for value in infoValues("DP"))),
+            "FILTER == PASS": "PASS" in filters,
+            "FILTER != PASS": "PASS" not in filters,
+            "FILTER == LowQD": "LowQD" in filters,
+            "FILTER == '.'": len(filters) == 0,
+            "FILTER == PASS AND TYPE == SNV AND INFO.AF < 0.01": (
+                "PASS" in filters and isSnv and
+                any(value < 0.01 for value in af)),
+        }[expression]
+
+    def testFilterRecords(self):
+        numIncluded = dict.fromkeys(
+            self.expressions + self.filterExpressions, 0)
+        for variantSet in self._dataset.getVariantSets():
+            referenceNames = test_json_records.getReferenceNames(variantSet)
+            for referenceName in referenceNames:
+                records = self.getRecords(variantSet, referenceName)
+                for expression in self.expressions + self.filterExpressions:
+                    variantFilter = variantfilters.VariantFilter(expression)
+                    expected = [
+                        record for record in records
+                        if self.isIncluded(record, expression)]
+                    self.assertEqual(
+                        list(variantFilter.filterRecords(records)), expected,
+                        expression)
+                    numIncluded[expression] += len(expected)
+        for expression, count in numIncluded.items():
+            self.assertGreater(count, 0, expression)
+
+    def testIncludesVariant(self):
+        # Filters on the INFO values and variant class give the same
+        # result on the GA Variants as on the records they came from.
+        for variantSet in self._dataset.getVariantSets():
+            referenceNames = test_json_records.getReferenceNames(variantSet)
+            for referenceName in referenceNames:
+                records = self.getRecords(variantSet, referenceName)
+                variants = [
+                    variantSet.convertVariant(record, [])
+                    for record in records]
+                for expression in self.expressions:
+                    variantFilter = variantfilters.VariantFilter(expression)
+                    self.assertEqual(
+                        [variantFilter.includesRecord(record)
+                         for record in records],
+                        [variantFilter.includesVariant(variant)
+                         for variant in variants],
+                        expression)
+
+    def testFilterMetrics(self):
+        variantSet = self._dataset.getVariantSets()[0]
+        referenceName = sorted(
+            test_json_records.getReferenceNames(variantSet))[0]
+        records = self.getRecords(variantSet, referenceName)
+        variantFilter = variantfilters.VariantFilter("TYPE == SNV")
+        expected = list(variantFilter.filterRecords(records))
+        self.assertGreater(len(records), 3)
+        # The filtering times are added in several batches.
+        variantFilter.timedBatchSize = 3
+        requestMetrics = metrics.beginRequest()
+        try:
+            self.assertIsNone(requestMetrics.getTime("filter"))
+            self.assertEqual(
+                list(variantFilter.filterRecords(records)), expected)
+            self.assertGreaterEqual(requestMetrics.getTime("filter"), 0)
+        finally:
+            metrics.endRequest()
+
+    def testFilterMetricsReadsNoFurther(self):
+        # Only the records needed for the results taken are read, so a
+        # page of results does not read records past its end.
+        variantSet = self._dataset.getVariantSets()[0]
+        referenceName = sorted(
+            test_json_records.getReferenceNames(variantSet))[0]
+        records = self.getRecords(variantSet, referenceName)
+        readRecords = []
+
+        def iterRecords():
+            for record in records:
+                readRecords.append(record)
+                yield record
+        variantFilter = variantfilters.VariantFilter("NOT TYPE == MIXED")
+        metrics.beginRequest()
+        try:
+            included = list(itertools.islice(
+                variantFilter.filterRecords(iterRecords()), 2))
+        finally:
+            metrics.endRequest()
+        self.assertEqual(included, records[:2])
+        self.assertEqual(readRecords, records[:2])
+
+
+class TestSearchVariantFilters(unittest.TestCase):
+    """
+    Tests variant searches that specify a filter expression.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        self._variantSet, = [
+            variantSet for variantSet in self._dataset.getVariantSets()
+            if variantSet.getLocalId() == "example_3"]
+        self._referenceName = sorted(
+            test_json_records.getReferenceNames(self._variantSet))[0]
+
+    def getAllVariants(self, responseValidation, pageSize, expression=None):
+        self._backend.setResponseValidation(responseValidation)
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = self._variantSet.getId()
+        request.referenceName = self._referenceName
+        request.start = 0
+        request.end = 2**32
+        request.pageSize = pageSize
+        variants = []
+        while True:
+            requestDict = request.toJsonDict()
+            if expression is not None:
+                requestDict["filter"] = expression
+            response = protocol.SearchVariantsResponse.fromJsonString(
+                self._backend.runSearchVariants(json.dumps(requestDict)))
+            variants.extend(response.variants)
+            if response.nextPageToken is None:
+                break
+            request.pageToken = response.nextPageToken
+        return variants
+
+    def testFilteredPages(self):
+        expression = "TYPE == SNV AND INFO.DP > 20"
+        variantFilter = variantfilters.VariantFilter(expression)
+        allVariants = self.getAllVariants(False, 100)
+        expected = [
+            variant for variant in allVariants
+            if variantFilter.includesVariant(variant)]
+        self.assertGreater(len(expected), 0)
+        self.assertLess(len(expected), len(allVariants))
+        for responseValidation in [False, True]:
+            for pageSize in [1, 4, 100]:
+                self.assertEqual(
+                    self.getAllVariants(
+                        responseValidation, pageSize, expression),
+                    expected)
+
+    def testFilterStatus(self):
+        passVariants = self.getAllVariants(False, 100, "FILTER == PASS")
+        otherVariants = self.getAllVariants(False, 100, "FILTER != PASS")
+        self.assertGreater(len(passVariants), 0)
+        self.assertGreater(len(otherVariants), 0)
+        self.assertEqual(
+            sorted(variant.id for variant in passVariants + otherVariants),
+            sorted(variant.id for variant in self.getAllVariants(False, 100)))
+
+    def testBadFilters(self):
+        for expression in ["TYPE == NOTACLASS", "", 1, ["TYPE == SNV"]]:
+            self.assertRaises(
+                exceptions.BadVariantFilterException,
+                self.getAllVariants, False, 1, expression)
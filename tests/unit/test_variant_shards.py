@@ -0,0 +1,261 @@
+"""
+Tests for variant sets with contigs split by region over several files.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import pysam
+
+import ga4gh.backend as backend
+import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.htslibindex as htslibindex
+import ga4gh.datamodel.variants as variants
+import ga4gh.exceptions as exceptions
+import ga4gh.protocol as protocol
+import tests.utils as utils
+
+
+def writeShards(
+        sourcePath, directory, boundaries, minShift=-1, prefix="shard",
+        overlap=0):
+    """
+    Splits the records in the specified VCF into shards starting at the
+    specified record numbers, and writes them as indexed VCFs with the
+    specified name prefix in the specified directory. Each shard after
+    the first also repeats the specified number of records at the end
+    of the previous one. Returns the list of shard paths.
+    """
+    headerLines = []
+    recordLines = []
+    with gzip.open(sourcePath, "rb") as sourceFile:
+        for line in sourceFile:
+            if line.startswith(b"#"):
+                headerLines.append(line)
+            else:
+                recordLines.append(line)
+    paths = []
+    boundaries = [0] + boundaries + [len(recordLines)]
+    for index, (start, end) in enumerate(zip(boundaries, boundaries[1:])):
+        path = os.path.join(directory, "{}{}.vcf".format(prefix, index))
+        with io.open(path, "wb") as shardFile:
+            shardFile.writelines(
+                headerLines + recordLines[max(start - overlap, 0):end])
+        paths.append(pysam.tabix_index(
+            path, preset="vcf", min_shift=minShift))
+    return paths
+
+
+def getJsonDicts(gaVariants):
+    """
+    Returns the JSON dictionaries of the specified variants without the
+    creation and update times, which are those of the data directory.
+    """
+    jsonDicts = []
+    for gaVariant in gaVariants:
+        jsonDict = gaVariant.toJsonDict()
+        del jsonDict["created"]
+        del jsonDict["updated"]
+        jsonDicts.append(jsonDict)
+    return jsonDicts
+
+
+class TestHtslibIndex(unittest.TestCase):
+    """
+    Tests the reading of tabix and CSI indexes.
+    """
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp()
+        self._sourcePath = os.path.join(
+            "tests", "data", "datasets", "dataset1", "variants",
+            "1kgPhase1", "chr1.vcf.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def testBinRegion(self):
+        cases = [
+            (0, 14, 5, (0, 2**29)),
+            (1, 14, 5, (0, 2**26)),
+            (2, 14, 5, (2**26, 2**27)),
+            (4681, 14, 5, (0, 2**14)),
+            (4683, 14, 5, (2 * 2**14, 3 * 2**14)),
+            (37448, 14, 5, (2**29 - 2**14, 2**29)),
+            (9, 16, 2, (0, 2**16)),
+        ]
+        for binNumber, minShift, depth, region in cases:
+            self.assertEqual(
+                htslibindex.getBinRegion(binNumber, minShift, depth), region)
+
+    def _checkIndex(self, minShift, extension):
+        path, = writeShards(self._sourcePath, self._tempDir, [], minShift)
+        indexFilePath = htslibindex.getIndexFilePath(path)
+        self.assertEqual(indexFilePath, path + extension)
+        index = htslibindex.HtslibIndex.parse(indexFilePath)
+        self.assertEqual(index.getReferenceNames(), ["1"])
+        self.assertEqual(index.getNumReferences(), 1)
+        records = list(pysam.VariantFile(path).fetch("1"))
+        binExtent = index.getBinExtent(0)
+        self.assertLessEqual(binExtent.minBinStart, records[0].start)
+        self.assertLessEqual(binExtent.maxBinStart, records[-1].start)
+        self.assertGreaterEqual(
+            binExtent.maxBinEnd, max(record.stop for record in records))
+
+    def testTabixIndex(self):
+        self._checkIndex(-1, ".tbi")
+
+    def testCsiIndex(self):
+        self._checkIndex(14, ".csi")
+
+    def testBadIndex(self):
+        path = os.path.join(self._tempDir, "bad.vcf.gz.tbi")
+        with io.open(path, "wb") as indexFile:
+            indexFile.write(b"not an index")
+        self.assertRaises(
+            exceptions.FileOpenFailedException,
+            htslibindex.HtslibIndex.parse, path)
+        self.assertIsNone(htslibindex.getIndexFilePath(
+            os.path.join(self._tempDir, "missing.vcf.gz")))
+
+
+class TestShardedVariantSet(unittest.TestCase):
+    """
+    Tests a variant set made up of region shards of one of the test VCFs
+    against the variant set of the unsharded VCF.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        self._variantSet = fixture.variantSet
+        self._tempDir = tempfile.mkdtemp()
+        self._sourcePath = os.path.join(
+            "tests", "data", "datasets", "dataset1", "variants",
+            "1kgPhase1", "chr1.vcf.gz")
+        self._records = list(pysam.VariantFile(self._sourcePath).fetch("1"))
+        self._shardPaths = writeShards(
+            self._sourcePath, self._tempDir, [10, 11, 50])
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def getShardedVariantSet(self):
+        # Using the same local ID gives the variants the same IDs as
+        # those of the unsharded variant set.
+        return variants.HtslibVariantSet(
+            self._dataset, self._variantSet.getLocalId(), self._tempDir,
+            self._backend)
+
+    def getPagedVariants(self, variantSet, start, end, pageSize):
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = variantSet.getId()
+        request.referenceName = "1"
+        request.start = start
+        request.end = end
+        result = []
+        while True:
+            iterator = backend.VariantsIntervalIterator(request, variantSet)
+            pageToken = None
+            for _ in range(pageSize):
+                item = next(iterator, None)
+                if item is None:
+                    break
+                variant, pageToken = item
+                result.append(variant)
+            if pageToken is None:
+                break
+            request.pageToken = pageToken
+        return result
+
+    def testShards(self):
+        variantSet = self.getShardedVariantSet()
+        shards = variantSet._chromShardMap["1"]
+        self.assertEqual(
+            [shard.filename for shard in shards], self._shardPaths)
+        for shard, (start, end) in zip(shards, [(0, 10), (10, 11), (11, 50)]):
+            records = self._records[start:end]
+            self.assertEqual(shard.firstStart, records[0].start)
+            self.assertEqual(shard.lastStart, records[-1].start)
+            self.assertEqual(
+                shard.end, max(record.stop for record in records))
+        self.assertEqual(
+            variantSet.getDataFilePaths(),
+            [self._tempDir] + sorted(self._shardPaths))
+        self.assertEqual(
+            [callSet.getId() for callSet in variantSet.getCallSets()],
+            [callSet.getId() for callSet in self._variantSet.getCallSets()])
+
+    def testGetVariants(self):
+        variantSet = self.getShardedVariantSet()
+        starts = [record.start for record in self._records]
+        regions = [
+            (0, 2**32), (starts[9], starts[12]), (starts[10], starts[10] + 1),
+            (starts[20], starts[30]), (0, starts[0]), (starts[-1] + 10, 2**32)]
+        for start, end in regions:
+            expected = getJsonDicts(
+                self._variantSet.getVariants("1", start, end))
+            self.assertEqual(
+                getJsonDicts(variantSet.getVariants("1", start, end)),
+                expected)
+        self.assertGreater(
+            len(list(variantSet.getVariants("1", 0, 2**32))), 50)
+
+    def testPageTokens(self):
+        variantSet = self.getShardedVariantSet()
+        expected = getJsonDicts(self._variantSet.getVariants("1", 0, 2**32))
+        for pageSize in [1, 3, 7, 100]:
+            self.assertEqual(
+                getJsonDicts(
+                    self.getPagedVariants(variantSet, 0, 2**32, pageSize)),
+                expected)
+
+    def testGetVariant(self):
+        variantSet = self.getShardedVariantSet()
+        for variant in variantSet.getVariants("1", 0, 2**32):
+            compoundId = datamodel.VariantCompoundId.parse(variant.id)
+            self.assertEqual(variantSet.getVariant(compoundId), variant)
+
+    def testOverlappingShards(self):
+        writeShards(self._sourcePath, self._tempDir, [30], prefix="other")
+        self.assertRaises(
+            exceptions.OverlappingVcfException, self.getShardedVariantSet)
+
+    def testRepeatedBoundaryRecords(self):
+        # Shards that repeat the record at the end of the previous shard
+        # give the same variants, with each record returned once.
+        for path in self._shardPaths:
+            os.remove(path)
+            os.remove(path + ".tbi")
+        writeShards(self._sourcePath, self._tempDir, [10, 11, 50], overlap=1)
+        variantSet = self.getShardedVariantSet()
+        self.assertEqual(len(variantSet._chromShardMap["1"]), 4)
+        starts = [record.start for record in self._records]
+        for start, end in [(0, 2**32), (starts[9], starts[11] + 1)]:
+            self.assertEqual(
+                getJsonDicts(variantSet.getVariants("1", start, end)),
+                getJsonDicts(self._variantSet.getVariants("1", start, end)))
+        self.assertEqual(
+            getJsonDicts(self.getPagedVariants(variantSet, 0, 2**32, 3)),
+            getJsonDicts(self._variantSet.getVariants("1", 0, 2**32)))
+        callSetIds = [
+            callSet.getId() for callSet in self._variantSet.getCallSets()]
+        self.assertEqual(
+            [row.id for row in variantSet.getGenotypeRows(
+                "1", 0, 2**32, callSetIds)],
+            [row.id for row in self._variantSet.getGenotypeRows(
+                "1", 0, 2**32, callSetIds)])
+        # Repeating two records interleaves the shards.
+        writeShards(
+            self._sourcePath, self._tempDir, [30], prefix="other", overlap=2)
+        for path in self._shardPaths:
+            os.remove(path)
+            os.remove(path + ".tbi")
+        self.assertRaises(
+            exceptions.OverlappingVcfException, self.getShardedVariantSet)
@@ -0,0 +1,370 @@
+"""
+Tests for streaming slices of variant sets as VCF.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gzip
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import pysam
+
+import ga4gh.datamodel.bgzf as bgzf
+import ga4gh.datamodel.variantslice as variantslice
+import ga4gh.exceptions as exceptions
+import tests.utils as utils
+
+
+_sampleNames = ["S1", "S2", "S3", "S4"]
+
+
+def writeVcf(path, referenceNames, recordsPerReference, minShift, seed=1):
+    """
+    Writes a bgzipped VCF file of random records, spanning many BGZF
+    blocks, to the specified path, with a tabix index if minShift is 0
+    or a CSI index otherwise, and returns the path of the data file.
+    """
+    randomNumberGenerator = random.Random(seed)
+    lines = [
+        "##fileformat=VCFv4.1",
+        '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">']
+    lines.extend(
+        "##contig=<ID={},length=10000000>".format(name)
+        for name in referenceNames)
+    lines.append("\t".join(
+        ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO",
+         "FORMAT"] + _sampleNames))
+    for referenceName in referenceNames:
+        position = 1
+        for index in range(recordsPerReference):
+            position += randomNumberGenerator.randint(0, 50)
+            # Some of the records are long deletions, which overlap many
+            # of the records after them.
+            referenceBases = "".join(
+                randomNumberGenerator.choice("ACGT") for _ in range(
+                    randomNumberGenerator.choice([1, 1, 1, 200])))
+            genotypes = [
+                randomNumberGenerator.choice(["0|0", "0|1", "1|1"])
+                for _ in _sampleNames]
+            lines.append("\t".join(
+                [referenceName, str(position), "v{}".format(index),
+                 referenceBases, "T", "50", "PASS", ".", "GT"] + genotypes))
+    textPath = path[:-len(".gz")]
+    with io.open(textPath, "w") as textFile:
+        textFile.write("\n".join(lines) + "\n")
+    return pysam.tabix_index(
+        textPath.encode(), preset=b"vcf", min_shift=minShift)
+
+
+def getRecordLines(pieces):
+    """
+    Returns the (header, records) pair of the lines of the bgzipped VCF
+    file made up of the specified pieces.
+    """
+    data = b"".join(pieces)
+    assert data.endswith(bgzf.EOF)
+    text = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+    lines = text.rstrip(b"\n").split(b"\n")
+    return (
+        [line for line in lines if line.startswith(b"#")],
+        [line for line in lines if not line.startswith(b"#")])
+
+
+def getRecordKey(line):
+    return tuple(line.split(b"\t")[:5])
+
+
+class TestVariantFileSlicer(unittest.TestCase):
+    """
+    Tests slices of VCF files of many blocks, with tabix and CSI
+    indexes, against the records found by pysam in each region.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls._tempDir = tempfile.mkdtemp()
+        cls._dataFilePaths = []
+        for minShift in [0, 14]:
+            path = os.path.join(
+                cls._tempDir, "variants{}.vcf.gz".format(minShift))
+            cls._dataFilePaths.append(
+                writeVcf(path, ["chrA", "chrB"], 20000, minShift))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls._tempDir)
+
+    def getExpected(self, dataFilePath, referenceName, start, end):
+        variantFile = pysam.VariantFile(dataFilePath)
+        keys = [
+            (record.chrom, str(record.pos), record.id, record.ref,
+             record.alts[0])
+            for record in variantFile.fetch(referenceName, start, end)]
+        variantFile.close()
+        return keys
+
+    def assertSlices(self, dataFilePath):
+        slicer = variantslice.VariantFileSlicer(dataFilePath)
+        self.assertFalse(slicer.isBcf())
+        self.assertTrue(slicer.isCurrent())
+        with io.open(dataFilePath, "rb") as dataFile:
+            fileData = dataFile.read()
+        _, allRecords = getRecordLines([fileData])
+        allKeys = [getRecordKey(line) for line in allRecords]
+        for referenceName, start, end in [
+                ("chrA", 0, 1000), ("chrA", 50000, 50001),
+                ("chrA", 20000, 150000), ("chrB", 100000, None),
+                ("chrB", 0, None), ("chrB", 5000000, 6000000)]:
+            expected = self.getExpected(
+                dataFilePath, referenceName.encode(), start, end)
+            mimetype, pieces = variantslice.getSlice(
+                [slicer], referenceName, start, end)
+            self.assertEqual(mimetype, variantslice.VCF_MIMETYPE)
+            pieces = list(pieces)
+            header, records = getRecordLines(pieces)
+            self.assertEqual(header[-1].split(b"\t")[9:], _sampleNames)
+            keys = [getRecordKey(line) for line in records]
+            self.assertTrue(set(expected) <= set(keys))
+            # The slice holds a run of the records in the file.
+            if len(keys) > 0:
+                first = allKeys.index(keys[0])
+                self.assertEqual(allKeys[first:first + len(keys)], keys)
+            if end is not None and end - start < 10000:
+                self.assertLess(len(keys), len(allKeys) // 4)
+            # Most of a large slice is copied from the file unchanged.
+            if len(expected) > 1000:
+                copied = sum(
+                    len(piece) for piece in pieces
+                    if len(piece) > 1000 and piece in fileData)
+                self.assertGreater(
+                    copied, sum(len(piece) for piece in pieces) // 2)
+            # Slices of some of the samples hold exactly the records of
+            # the region.
+            mimetype, pieces = variantslice.getSlice(
+                [slicer], referenceName, start, end, ["S4", "S2"])
+            self.assertEqual(mimetype, variantslice.VCF_MIMETYPE)
+            header, records = getRecordLines(pieces)
+            self.assertEqual(header[-1].split(b"\t")[9:], [b"S2", b"S4"])
+            self.assertEqual(
+                [getRecordKey(line) for line in records], expected)
+            self.assertTrue(all(
+                len(line.split(b"\t")) == 11 for line in records))
+        self.assertEqual(slicer.getChunks("chrC", 0, 10), [])
+
+    def testTabixIndex(self):
+        self.assertTrue(os.path.exists(self._dataFilePaths[0] + ".tbi"))
+        self.assertSlices(self._dataFilePaths[0])
+
+    def testCsiIndex(self):
+        self.assertTrue(os.path.exists(self._dataFilePaths[1] + ".csi"))
+        self.assertSlices(self._dataFilePaths[1])
+
+    def testNotIndexed(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            dataFilePath = os.path.join(tempDir, "variants.vcf.gz")
+            shutil.copy(self._dataFilePaths[0], dataFilePath)
+            self.assertRaises(
+                exceptions.NotIndexedException,
+                variantslice.VariantFileSlicer, dataFilePath)
+        finally:
+            shutil.rmtree(tempDir)
+
+
+class TestGetSlice(unittest.TestCase):
+    """
+    Tests the choice between copying the blocks of the data files and
+    writing the records of a slice.
+    """
+    class FakeSlicer(object):
+        def __init__(self, name, isBcf, sampleNames=None):
+            self._name = name
+            self._isBcf = isBcf
+            if sampleNames is None:
+                sampleNames = ["S1", "S2"]
+            self._sampleNames = sampleNames
+
+        def isBcf(self):
+            return self._isBcf
+
+        def getSampleNames(self):
+            return self._sampleNames
+
+        def getHeaderBlocks(self):
+            return bgzf.compressBlocks(b"header " + self._name + b"\n")
+
+        def getHeaderText(self, sampleNames=None):
+            return b"text header " + self._name + b"\n"
+
+        def getChunks(self, referenceName, start=0, end=None):
+            return [(start, end)]
+
+        def iterChunks(self, chunks):
+            for start, end in chunks:
+                yield bgzf.compressBlocks(
+                    b"chunk " + self._name + b"\n")
+
+        def iterRecordText(self, referenceName, start=0, end=None,
+                           sampleNames=None):
+            yield b"record " + self._name + b"\n"
+
+    def getText(self, slicers, sampleNames=None):
+        mimetype, pieces = variantslice.getSlice(
+            slicers, "1", 0, 10, sampleNames)
+        return mimetype, gzip.GzipFile(
+            fileobj=io.BytesIO(b"".join(pieces))).read()
+
+    def testGetSlice(self):
+        vcf1 = self.FakeSlicer(b"vcf1", False)
+        vcf2 = self.FakeSlicer(b"vcf2", False)
+        bcf1 = self.FakeSlicer(b"bcf1", True)
+        bcf2 = self.FakeSlicer(b"bcf2", True)
+        self.assertEqual(
+            self.getText([vcf1, vcf2]),
+            (variantslice.VCF_MIMETYPE,
+             b"header vcf1\nchunk vcf1\nchunk vcf2\n"))
+        self.assertEqual(
+            self.getText([bcf1]),
+            (variantslice.BCF_MIMETYPE, b"header bcf1\nchunk bcf1\n"))
+        self.assertEqual(
+            self.getText([bcf1, bcf2]),
+            (variantslice.VCF_MIMETYPE,
+             b"text header bcf1\nrecord bcf1\nrecord bcf2\n"))
+        self.assertEqual(
+            self.getText([vcf1], ["S1"]),
+            (variantslice.VCF_MIMETYPE, b"text header vcf1\nrecord vcf1\n"))
+        self.assertEqual(
+            self.getText([]), (variantslice.VCF_MIMETYPE, b""))
+        # The records of files with their samples in another order are
+        # written in the order of the header.
+        vcf3 = self.FakeSlicer(b"vcf3", False, ["S2", "S1"])
+        self.assertEqual(
+            self.getText([vcf1, vcf3]),
+            (variantslice.VCF_MIMETYPE,
+             b"text header vcf1\nrecord vcf1\nrecord vcf3\n"))
+
+
+class TestSampleOrder(unittest.TestCase):
+    """
+    Tests slices of data files that list their samples in different
+    orders.
+    """
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def writeVcf(self, name, sampleNames, records):
+        lines = [
+            "##fileformat=VCFv4.1",
+            '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+            "##contig=<ID=chrA,length=1000>",
+            "\t".join(
+                ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER",
+                 "INFO", "FORMAT"] + sampleNames)]
+        for position, genotypes in records:
+            lines.append("\t".join(
+                ["chrA", str(position), ".", "A", "T", "50", "PASS", ".",
+                 "GT"] + genotypes))
+        textPath = os.path.join(self._tempDir, name)
+        with io.open(textPath, "w") as textFile:
+            textFile.write("\n".join(lines) + "\n")
+        return variantslice.VariantFileSlicer(pysam.tabix_index(
+            textPath.encode(), preset=b"vcf"))
+
+    def getGenotypes(self, pieces):
+        header, records = getRecordLines(pieces)
+        sampleNames = header[-1].split(b"\t")[9:]
+        return [
+            dict(zip(sampleNames, line.split(b"\t")[9:]))
+            for line in records]
+
+    def testSampleOrder(self):
+        slicers = [
+            self.writeVcf("a.vcf", ["S1", "S2"], [(10, ["0/1", "0/0"])]),
+            self.writeVcf("b.vcf", ["S2", "S1"], [(20, ["0/0", "1/1"])])]
+        self.assertEqual(slicers[1].getSampleNames(), ["S2", "S1"])
+        expected = [
+            {b"S1": b"0/1", b"S2": b"0/0"}, {b"S1": b"1/1", b"S2": b"0/0"}]
+        mimetype, pieces = variantslice.getSlice(slicers, "chrA")
+        self.assertEqual(mimetype, variantslice.VCF_MIMETYPE)
+        self.assertEqual(self.getGenotypes(pieces), expected)
+        mimetype, pieces = variantslice.getSlice(slicers, "chrA", 0, None, [
+            "S1"])
+        self.assertEqual(
+            self.getGenotypes(pieces), [{b"S1": b"0/1"}, {b"S1": b"1/1"}])
+
+
+class TestVariantSliceRequests(unittest.TestCase):
+    """
+    Tests VCF slice requests for the test variant sets through the
+    backend and client.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._client = fixture.client
+        self._variantSet = fixture.variantSet
+
+    def getExpected(self, referenceName, start, end):
+        return [
+            (gaVariant.referenceName, str(gaVariant.start + 1),
+             gaVariant.referenceBases, gaVariant.alternateBases[0])
+            for gaVariant in self._variantSet.getVariants(
+                referenceName, start, end)]
+
+    def getKeys(self, pieces):
+        header, records = getRecordLines(pieces)
+        keys = []
+        for line in records:
+            fields = line.split(b"\t")
+            keys.append((fields[0], fields[1], fields[3], fields[4]))
+        return header[-1].split(b"\t")[9:], keys
+
+    def testVariantSetVcf(self):
+        variantSetId = self._variantSet.getId()
+        callSets = self._variantSet.getCallSets()
+        allSamples = [callSet.getSampleName() for callSet in callSets]
+        start, end = self._variantSet.getReferenceRange("2")
+        expected = self.getExpected("2", start, end)
+        self.assertGreater(len(expected), 0)
+        samples, keys = self.getKeys(
+            self._client.getVariantSetVcf(variantSetId, "2"))
+        self.assertEqual(samples, allSamples)
+        self.assertEqual(keys, expected)
+        middle = (start + end) // 2
+        expected = self.getExpected("2", middle, end)
+        samples, keys = self.getKeys(self._client.getVariantSetVcf(
+            variantSetId, "2", middle, end,
+            [callSets[3].getId(), callSets[1].getId()]))
+        self.assertEqual(samples, allSamples[1:4:2])
+        self.assertEqual(keys, expected)
+        # There are no variants on other references, but the slice has a
+        # header.
+        samples, keys = self.getKeys(
+            self._client.getVariantSetVcf(variantSetId, "22"))
+        self.assertEqual((samples, keys), (allSamples, []))
+
+    def testBadRequests(self):
+        variantSetId = self._variantSet.getId()
+        for requestArgs in [
+                {}, {"referenceName": "1", "start": -1},
+                {"referenceName": "1", "start": 10, "end": 10}]:
+            self.assertRaises(
+                exceptions.BadRequestArgumentException,
+                self._backend.runExportVariantSetSlice, variantSetId,
+                requestArgs)
+        self.assertRaises(
+            exceptions.CallSetNotFoundException,
+            self._backend.runExportVariantSetSlice, variantSetId,
+            {"referenceName": "1", "callSetIds": "notValid"})
+        self.assertRaises(
+            exceptions.NotFoundException,
+            self._backend.runExportVariantSetSlice, "notValid",
+            {"referenceName": "1"})
@@ -0,0 +1,211 @@
+"""
+Tests for the columnar variant store.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import numpy.testing
+
+import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.variantfilters as variantfilters
+import ga4gh.datamodel.variantstore as variantstore
+import ga4gh.exceptions as exceptions
+import tests.unit.test_variant_shards as test_variant_shards
+import tests.utils as utils
+
+
+class TestColumnarVariantSet(unittest.TestCase):
+    """
+    Tests the ColumnarVariantSets built from each of the test variant
+    sets against the variant sets themselves.
+    """
+    def setUp(self):
+        fixture = utils.getDataFixture()
+        self._backend = fixture.backend
+        self._dataset = fixture.dataset
+        self._tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def getStores(self):
+        """
+        Returns the list of (variantSet, columnarVariantSet) pairs for
+        the test variant sets.
+        """
+        pairs = []
+        for variantSet in self._dataset.getVariantSets():
+            storeDir = os.path.join(self._tempDir, variantSet.getLocalId())
+            variantstore.build(variantSet, storeDir)
+            self.assertTrue(variantstore.isStoreDir(storeDir))
+            # Using the same local ID gives the variants the same IDs.
+            columnarVariantSet = variantstore.ColumnarVariantSet(
+                self._dataset, variantSet.getLocalId(), storeDir,
+                self._backend)
+            pairs.append((variantSet, columnarVariantSet))
+        return pairs
+
+    def assertSameVariants(self, variantSet, columnarVariantSet, *args):
+        expected = test_variant_shards.getJsonDicts(
+            variantSet.getVariants(*args))
+        self.assertEqual(
+            test_variant_shards.getJsonDicts(
+                columnarVariantSet.getVariants(*args)),
+            expected)
+        return len(expected)
+
+    def testVariantSet(self):
+        for variantSet, columnarVariantSet in self.getStores():
+            self.assertEqual(
+                [callSet.getId() for callSet in
+                 columnarVariantSet.getCallSets()],
+                [callSet.getId() for callSet in variantSet.getCallSets()])
+            self.assertEqual(
+                columnarVariantSet.getMetadata(), variantSet.getMetadata())
+            numVariants = 0
+            for referenceName in variantSet.getReferenceNames():
+                numVariants += len(list(
+                    variantSet.getVariants(referenceName, 0, 2**32)))
+                self.assertEqual(
+                    columnarVariantSet.getNumVariants(referenceName),
+                    len(list(variantSet.getVariants(
+                        referenceName, 0, 2**32))))
+            self.assertEqual(
+                columnarVariantSet.getNumVariants(), numVariants)
+            self.assertEqual(columnarVariantSet.getNumVariants("xyz"), 0)
+
+    def testGetVariants(self):
+        numVariants = 0
+        for variantSet, columnarVariantSet in self.getStores():
+            callSetIds = [
+                callSet.getId() for callSet in variantSet.getCallSets()]
+            for referenceName in variantSet.getReferenceNames():
+                starts = [
+                    variant.start for variant in variantSet.getVariants(
+                        referenceName, 0, 2**32)]
+                regions = [
+                    (0, 2**32), (starts[0], starts[0] + 1),
+                    (starts[len(starts) // 2], starts[-1]),
+                    (starts[-1] + 1, 2**32)]
+                for start, end in regions:
+                    for searchCallSetIds in [
+                            None, [], callSetIds[:1], callSetIds[-2:]]:
+                        numVariants += self.assertSameVariants(
+                            variantSet, columnarVariantSet, referenceName,
+                            start, end, searchCallSetIds)
+            self.assertEqual(
+                list(columnarVariantSet.getVariants("xyz", 0, 2**32)), [])
+        self.assertGreater(numVariants, 0)
+
+    def testBlocks(self):
+        variantSet, columnarVariantSet = self.getStores()[0]
+        referenceName = variantSet.getReferenceNames()[0]
+        for blockSize in [1, 7, 1000]:
+            columnarVariantSet.blockSize = blockSize
+            self.assertGreater(
+                self.assertSameVariants(
+                    variantSet, columnarVariantSet, referenceName, 0,
+                    2**32), 1)
+
+    def testFilters(self):
+        expressions = [
+            "TYPE == SNV", "INFO.AF < 0.1", "FILTER == PASS",
+            "FILTER == '.'", "FILTER != PASS AND NOT INFO.DB"]
+        for variantSet, columnarVariantSet in self.getStores():
+            for referenceName in variantSet.getReferenceNames():
+                for expression in expressions:
+                    variantFilter = variantfilters.VariantFilter(expression)
+                    self.assertSameVariants(
+                        variantSet, columnarVariantSet, referenceName, 0,
+                        2**32, None, variantFilter)
+
+    def testGetVariant(self):
+        for variantSet, columnarVariantSet in self.getStores():
+            referenceName = variantSet.getReferenceNames()[0]
+            for gaVariant in columnarVariantSet.getVariants(
+                    referenceName, 0, 2**32):
+                compoundId = datamodel.VariantCompoundId.parse(gaVariant.id)
+                self.assertEqual(
+                    columnarVariantSet.getVariant(compoundId), gaVariant)
+            compoundId = datamodel.VariantCompoundId(
+                columnarVariantSet.getCompoundId(), referenceName, 0,
+                "noSuchVariant")
+            self.assertRaises(
+                exceptions.ObjectNotFoundException,
+                columnarVariantSet.getVariant, compoundId)
+
+    def testChunks(self):
+        # Chunks of a few records hold only some of the fields, and their
+        # columns are narrower than those of the contig.
+        chunkSize = variantstore._ContigBuilder.chunkSize
+        variantstore._ContigBuilder.chunkSize = 7
+        try:
+            stores = self.getStores()
+        finally:
+            variantstore._ContigBuilder.chunkSize = chunkSize
+        for variantSet, columnarVariantSet in stores:
+            storeDir = columnarVariantSet.getDataDir()
+            self.assertFalse(any(
+                fileName.endswith(".tmp.npz")
+                for fileName in os.listdir(storeDir)))
+            for referenceName in variantSet.getReferenceNames():
+                self.assertGreater(self.assertSameVariants(
+                    variantSet, columnarVariantSet, referenceName, 0,
+                    2**32), 0)
+
+    def testNumericColumns(self):
+        for variantSet, columnarVariantSet in self.getStores():
+            fieldTypes = dict(
+                (metadatum.key, metadatum.type)
+                for metadatum in variantSet.getMetadata())
+            manifestPath = os.path.join(
+                columnarVariantSet.getDataDir(),
+                variantstore.MANIFEST_FILE_NAME)
+            with open(manifestPath) as manifestFile:
+                manifest = json.load(manifestFile)
+            for contig in manifest["contigs"]:
+                for section, kind in [("INFO", "info"), ("FORMAT", "format")]:
+                    for key, fieldType in zip(
+                            contig[kind + "Keys"], contig[kind + "Types"]):
+                        expected = fieldTypes["{}.{}".format(section, key)]
+                        if expected not in ["Integer", "Float"]:
+                            expected = "String"
+                        self.assertEqual(fieldType, expected)
+
+    def testPaddedValues(self):
+        values = numpy.array([
+            [[1, 2], [3, 0]],
+            [[0, 0], [0, 0]]], dtype=numpy.float32)
+        lengths = numpy.array([[2, 1], [-1, -2]], dtype=numpy.int32)
+        column = variantstore._FieldColumn("GL", values, lengths)
+        first, second = column.getPaddedValues([0, 1], [1, 0])
+        numpy.testing.assert_array_equal(
+            first, [[3, numpy.nan], [1, 2]])
+        # Cells without values are empty.
+        self.assertEqual(second.shape, (2, 0))
+        # There are no values without samples.
+        arrays = column.getPaddedValues([0, 1], [])
+        self.assertEqual([array.shape for array in arrays], [(0, 0)] * 2)
+
+    def testBadManifest(self):
+        variantSet = self._dataset.getVariantSets()[0]
+        storeDir = os.path.join(self._tempDir, "store")
+        variantstore.build(variantSet, storeDir)
+        manifestPath = os.path.join(storeDir, variantstore.MANIFEST_FILE_NAME)
+        with open(manifestPath) as manifestFile:
+            manifest = json.load(manifestFile)
+        manifest["version"] = -1
+        with open(manifestPath, "w") as manifestFile:
+            json.dump(manifest, manifestFile)
+        self.assertRaises(
+            exceptions.FileOpenFailedException,
+            variantstore.ColumnarVariantSet, self._dataset, "store",
+            storeDir, self._backend)
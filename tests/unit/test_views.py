@@ -5,11 +5,17 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
 import unittest
 import logging
+import zlib
+
+import flask
 
 import ga4gh.datamodel as datamodel
 import ga4gh.frontend as frontend
+import ga4gh.genotypematrix as genotypematrix
+import ga4gh.metrics as metrics
 import ga4gh.protocol as protocol
 
 
@@ -57,7 +63,7 @@ class TestFrontend(unittest.TestCase):
         cls.readAlignment = cls.readGroup.getReadAlignments().next()
         cls.readAlignmentId = cls.readAlignment.id
 
-    def sendPostRequest(self, path, request):
+    def sendPostRequest(self, path, request, accept=None):
         """
         Sends the specified GA request object and returns the response.
         """
@@ -65,16 +71,20 @@ class TestFrontend(unittest.TestCase):
             'Content-type': 'application/json',
             'Origin': self.exampleUrl,
         }
+        if accept is not None:
+            headers['Accept'] = accept
         return self.app.post(
             path, headers=headers, data=request.toJsonString())
 
-    def sendGetRequest(self, path):
+    def sendGetRequest(self, path, accept=None):
         """
         Sends a get request to the specified URL and returns the response.
         """
         headers = {
             'Origin': self.exampleUrl,
         }
+        if accept is not None:
+            headers['Accept'] = accept
         return self.app.get(path, headers=headers)
 
     def sendVariantsSearch(self):
@@ -353,6 +363,86 @@ class TestFrontend(unittest.TestCase):
         response = self.sendGetVariant()
         self.assertEqual(200, response.status_code)
 
+    def testReadGroupCoverage(self):
+        reference = self.readGroupSet.getReferenceSet().getReferences()[0]
+        path = "/readgroups/{}/coverage".format(self.readGroupId)
+        response = self.app.get(path, query_string={
+            "referenceId": reference.getId(), "maxBins": 10})
+        self.assertEqual(200, response.status_code)
+        responseData = json.loads(response.data)
+        self.assertEqual(responseData["referenceId"], reference.getId())
+        self.assertLessEqual(len(responseData["depths"]), 11)
+        response = self.app.get(path)
+        self.assertEqual(400, response.status_code)
+
+    def testVariantSetDensity(self):
+        path = "/variantsets/{}/density".format(self.variantSetId)
+        response = self.app.get(path, query_string={
+            "referenceName": "1", "start": 100, "end": 200, "maxBins": 10})
+        self.assertEqual(200, response.status_code)
+        responseData = json.loads(response.data)
+        self.assertEqual(responseData["binSize"], 10)
+        self.assertEqual(len(responseData["counts"]), 10)
+        # The simulated variant set has a variant at every position.
+        self.assertEqual(
+            sum(sum(sum(row) for row in bins)
+                for bins in responseData["counts"]), 100)
+        response = self.app.get(path, query_string={"referenceName": "1"})
+        self.assertEqual(400, response.status_code)
+
+    def testVariantSetExport(self):
+        path = "/variantsets/{}/export".format(self.variantSetId)
+        response = self.app.get(path, query_string={
+            "referenceName": "1", "start": 100, "end": 110})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.data.splitlines()
+        # The simulated variant set has a variant at every position.
+        self.assertEqual(
+            [json.loads(line)["start"] for line in lines],
+            list(range(100, 110)))
+        response = self.app.get(path, query_string={"referenceName": "1"})
+        self.assertEqual(400, response.status_code)
+        response = self.app.post(path)
+        self.assertEqual(405, response.status_code)
+
+    def testPileupSearch(self):
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [self.readGroupId]
+        request.referenceId = self.referenceId
+        request.start = 0
+        request.end = 10
+        response = self.sendPostRequest('/pileup/search', request)
+        self.assertEqual(200, response.status_code)
+        responseData = json.loads(response.data)
+        self.assertEqual(len(responseData["counts"]), 10)
+        request.end = 0
+        response = self.sendPostRequest('/pileup/search', request)
+        self.assertEqual(400, response.status_code)
+
+    def testBatchGet(self):
+        headers = {
+            'Content-type': 'application/json',
+            'Origin': self.exampleUrl,
+        }
+        for path, id_ in [
+                ('/variants/batchget', self.variantId),
+                ('/callsets/batchget', self.callSetId),
+                ('/readgroups/batchget', self.readGroupId),
+                ('/references/batchget', self.referenceId)]:
+            response = self.app.post(
+                path, headers=headers,
+                data=json.dumps({"ids": [id_, "notValid"]}))
+            self.assertEqual(200, response.status_code)
+            results = json.loads(response.data)["results"]
+            self.assertEqual(
+                [result["id"] for result in results], [id_, "notValid"])
+            self.assertEqual(results[0]["value"]["id"], id_)
+            self.assertIn("error", results[1])
+            response = self.app.post(
+                path, headers=headers, data=json.dumps({"ids": id_}))
+            self.assertEqual(400, response.status_code)
+
     def testCallSetsSearch(self):
         response = self.sendCallSetsSearch()
         self.assertEqual(200, response.status_code)
@@ -377,6 +467,249 @@ class TestFrontend(unittest.TestCase):
         datasets = list(responseData.datasets)
         self.assertEqual(self.datasetId, datasets[0].id)
 
+    def testAvroBinarySearch(self):
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [self.readGroupId]
+        request.referenceId = self.referenceId
+        jsonResponse = self.sendPostRequest('/reads/search', request)
+        self.assertEqual(protocol.JSON_MIMETYPE, jsonResponse.mimetype)
+        for accept in [
+                protocol.AVRO_BINARY_MIMETYPE,
+                'application/json;q=0.5, avro/binary']:
+            avroResponse = self.sendPostRequest(
+                '/reads/search', request, accept)
+            self.assertEqual(200, avroResponse.status_code)
+            self.assertEqual(
+                protocol.AVRO_BINARY_MIMETYPE, avroResponse.mimetype)
+            self.assertIn("Accept", avroResponse.headers["Vary"])
+            self.assertLess(len(avroResponse.data), len(jsonResponse.data))
+            self.assertEqual(
+                protocol.SearchReadsResponse.fromJsonString(
+                    jsonResponse.data),
+                protocol.SearchReadsResponse.fromAvroBytes(
+                    avroResponse.data))
+
+    def testGenotypeMatrixSearch(self):
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = self.variantSetId
+        request.referenceName = "1"
+        request.start = 0
+        request.end = 10
+        jsonResponse = self.sendPostRequest('/genotypematrix/search', request)
+        self.assertEqual(200, jsonResponse.status_code)
+        self.assertEqual(protocol.JSON_MIMETYPE, jsonResponse.mimetype)
+        binaryResponse = self.sendPostRequest(
+            '/genotypematrix/search', request, genotypematrix.BINARY_MIMETYPE)
+        self.assertEqual(200, binaryResponse.status_code)
+        self.assertEqual(
+            genotypematrix.BINARY_MIMETYPE, binaryResponse.mimetype)
+        self.assertIn("Accept", binaryResponse.headers["Vary"])
+        jsonMatrix = genotypematrix.GenotypeMatrix.deserialize(
+            jsonResponse.data, protocol.JSON_MIMETYPE)
+        binaryMatrix = genotypematrix.GenotypeMatrix.deserialize(
+            binaryResponse.data, genotypematrix.BINARY_MIMETYPE)
+        self.assertEqual(len(jsonMatrix.sites), 10)
+        self.assertEqual(jsonMatrix.sites, binaryMatrix.sites)
+        self.assertTrue(
+            (jsonMatrix.genotypes == binaryMatrix.genotypes).all())
+        # Avro is not one of the formats of the genotype matrix.
+        response = self.sendPostRequest(
+            '/genotypematrix/search', request, protocol.AVRO_BINARY_MIMETYPE)
+        self.assertEqual(protocol.JSON_MIMETYPE, response.mimetype)
+
+    def testAvroBinaryGet(self):
+        path = "/readgroupsets/{}".format(self.readGroupSetId)
+        response = self.sendGetRequest(path, protocol.AVRO_BINARY_MIMETYPE)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(protocol.AVRO_BINARY_MIMETYPE, response.mimetype)
+        readGroupSet = protocol.ReadGroupSet.fromAvroBytes(response.data)
+        self.assertEqual(
+            readGroupSet, self.readGroupSet.toProtocolElement())
+
+    def testUnsupportedAcceptFallsBackToJson(self):
+        path = "/readgroupsets/{}".format(self.readGroupSetId)
+        response = self.sendGetRequest(path, "text/html")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(protocol.JSON_MIMETYPE, response.mimetype)
+
+    def testConditionalGet(self):
+        paths = [
+            "/datasets/{}".format(self.datasetId),
+            "/referencesets/{}".format(self.referenceSetId),
+            "/references/{}".format(self.referenceId),
+            "/variantsets/{}".format(self.variantSetId),
+            "/callsets/{}".format(self.callSetId),
+            "/readgroupsets/{}".format(self.readGroupSetId),
+            "/readgroups/{}".format(self.readGroupId),
+        ]
+        for path in paths:
+            response = self.sendGetRequest(path)
+            self.assertEqual(200, response.status_code)
+            etag = response.headers["ETag"]
+            self.assertTrue(etag.startswith('W/"'))
+            self.assertEqual("no-cache", response.headers["Cache-Control"])
+            self.assertIn("Accept", response.headers["Vary"])
+            response = self.app.get(path, headers={'If-None-Match': etag})
+            self.assertEqual(304, response.status_code)
+            self.assertEqual(etag, response.headers["ETag"])
+            self.assertEqual(b"", response.data)
+            # Clients may send the tag back without the weak prefix.
+            response = self.app.get(
+                path, headers={'If-None-Match': etag[2:]})
+            self.assertEqual(304, response.status_code)
+            response = self.app.get(
+                path, headers={'If-None-Match': '"other"'})
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(etag, response.headers["ETag"])
+
+    def testEtagOfCompressedResponse(self):
+        path = "/readgroupsets/{}".format(self.readGroupSetId)
+        response = self.sendGetRequest(path)
+        config = frontend.app.config
+        savedMinSize = config["RESPONSE_COMPRESSION_MIN_SIZE"]
+        config["RESPONSE_COMPRESSION_MIN_SIZE"] = 0
+        try:
+            compressedResponse = self.app.get(
+                path, headers={'Accept-Encoding': 'gzip'})
+        finally:
+            config["RESPONSE_COMPRESSION_MIN_SIZE"] = savedMinSize
+        self.assertEqual(
+            "gzip", compressedResponse.headers["Content-Encoding"])
+        # The representations differ only in their content coding, so
+        # they carry the same weak tag.
+        etag = response.headers["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(etag, compressedResponse.headers["ETag"])
+
+    def testEtagDependsOnMimetype(self):
+        path = "/readgroupsets/{}".format(self.readGroupSetId)
+        jsonResponse = self.sendGetRequest(path)
+        avroResponse = self.sendGetRequest(
+            path, protocol.AVRO_BINARY_MIMETYPE)
+        self.assertNotEqual(
+            jsonResponse.headers["ETag"], avroResponse.headers["ETag"])
+        response = self.app.get(path, headers={
+            'Accept': protocol.AVRO_BINARY_MIMETYPE,
+            'If-None-Match': jsonResponse.headers["ETag"]})
+        self.assertEqual(200, response.status_code)
+
+    def sendCompressedReadsSearch(self, acceptEncoding, minSize=0):
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [self.readGroupId]
+        request.referenceId = self.referenceId
+        headers = {
+            'Content-type': 'application/json',
+            'Accept-Encoding': acceptEncoding,
+        }
+        config = frontend.app.config
+        savedMinSize = config["RESPONSE_COMPRESSION_MIN_SIZE"]
+        config["RESPONSE_COMPRESSION_MIN_SIZE"] = minSize
+        try:
+            response = self.app.post(
+                '/reads/search', headers=headers,
+                data=request.toJsonString())
+        finally:
+            config["RESPONSE_COMPRESSION_MIN_SIZE"] = savedMinSize
+        self.assertEqual(200, response.status_code)
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        return response
+
+    def testGzipCompression(self):
+        uncompressed = self.sendReadsSearch()
+        response = self.sendCompressedReadsSearch("gzip")
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertIn("compress;dur=", response.headers["Server-Timing"])
+        data = zlib.decompress(response.data, 16 + zlib.MAX_WBITS)
+        self.assertEqual(uncompressed.data, data)
+        self.assertEqual(
+            len(response.data), int(response.headers["Content-Length"]))
+
+    def testDeflateCompression(self):
+        uncompressed = self.sendReadsSearch()
+        response = self.sendCompressedReadsSearch("deflate;q=0.5, gzip;q=0")
+        self.assertEqual("deflate", response.headers["Content-Encoding"])
+        self.assertEqual(uncompressed.data, zlib.decompress(response.data))
+
+    def testCompressionNotAccepted(self):
+        uncompressed = self.sendReadsSearch()
+        for acceptEncoding in ["identity", "gzip;q=0", "br"]:
+            response = self.sendCompressedReadsSearch(acceptEncoding)
+            self.assertNotIn("Content-Encoding", response.headers)
+            self.assertNotIn("Server-Timing", response.headers)
+            self.assertEqual(uncompressed.data, response.data)
+
+    def testCompressionMinSize(self):
+        uncompressed = self.sendReadsSearch()
+        response = self.sendCompressedReadsSearch(
+            "gzip", len(uncompressed.data) + 1)
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(uncompressed.data, response.data)
+
+    def testCompressStreamedResponse(self):
+        chunks = ["chunk {}\n".format(j) for j in range(100)]
+        headers = {'Accept-Encoding': 'gzip'}
+        with frontend.app.test_request_context(headers=headers):
+            requestMetrics = metrics.RequestMetrics()
+            response = flask.Response(iter(chunks))
+            response = frontend.compressResponse(
+                flask.request, response, requestMetrics)
+            self.assertEqual("gzip", response.headers["Content-Encoding"])
+            self.assertNotIn("Content-Length", response.headers)
+            # Each chunk can be decoded as soon as it is received.
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            for chunk, compressedChunk in zip(chunks, response.response):
+                self.assertEqual(
+                    chunk, decompressor.decompress(compressedChunk))
+            data = b"".join(response.response)
+            self.assertEqual(b"", decompressor.decompress(data))
+            self.assertIsNotNone(requestMetrics.getTime("compress"))
+
+    def testStreamedResponseHasNoServerTiming(self):
+        # The times for a streamed response are not known until after
+        # its headers are sent.
+        headers = {'Accept-Encoding': 'gzip'}
+        with frontend.app.test_request_context(headers=headers):
+            frontend.beginRequestMetrics()
+            metrics.getRequestMetrics().addTime("filter", 1)
+            response = frontend.finishResponse(
+                flask.Response(iter(["chunk"] * 10)))
+            self.assertNotIn("Server-Timing", response.headers)
+            response = frontend.finishResponse(flask.Response("data" * 100))
+            self.assertIn("filter;dur=", response.headers["Server-Timing"])
+            frontend.endRequestMetrics(None)
+
+    def testCompressedMimetypeNotCompressed(self):
+        headers = {'Accept-Encoding': 'gzip'}
+        with frontend.app.test_request_context(headers=headers):
+            response = flask.Response(
+                iter([b"BAM"]), mimetype=frontend.COMPRESSED_MIMETYPES[0])
+            response = frontend.compressResponse(
+                flask.request, response, metrics.RequestMetrics())
+            self.assertNotIn("Content-Encoding", response.headers)
+            self.assertEqual(b"BAM", b"".join(response.response))
+
+    def testReadGroupSetBam(self):
+        # The simulated read group sets are not read from BAM files.
+        path = "/readgroupsets/{}/bam".format(self.readGroupSetId)
+        self.assertEqual(501, self.app.get(path).status_code)
+        self.assertEqual(405, self.app.post(path).status_code)
+
+    def testVariantSetVcf(self):
+        # The simulated variant sets are not read from VCF files.
+        path = "/variantsets/{}/vcf".format(self.variantSetId)
+        self.assertEqual(
+            501, self.app.get(path + "?referenceName=1").status_code)
+        self.assertEqual(400, self.app.get(path).status_code)
+        self.assertEqual(405, self.app.post(path).status_code)
+
+    def testExportJobsDisabled(self):
+        # No spool directory is configured for export jobs.
+        self.assertEqual(501, self.app.get("/exports/job").status_code)
+        response = self.app.post(
+            "/exports", headers={"Content-Type": "application/json"},
+            data=json.dumps({"type": "bam", "id": self.readGroupSetId}))
+        self.assertEqual(501, response.status_code)
+
     def testNoAuthentication(self):
         path = '/oauth2callback'
         self.assertEqual(501, self.app.get(path).status_code)
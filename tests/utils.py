@@ -6,6 +6,7 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import StringIO
+import collections
 import functools
 import humanize
 import itertools
@@ -14,10 +15,41 @@ import signal
 import sys
 import time
 
+import ga4gh.backend as backend
+import ga4gh.client as client
+
 
 packageName = 'ga4gh'
 
 
+DataFixture = collections.namedtuple(
+    "DataFixture",
+    ["backend", "client", "dataset", "variantSet", "readGroupSet"])
+
+
+def getDataFixture(dataDir=None):
+    """
+    Returns a DataFixture for the test data in the specified directory
+    (by default, tests/data): a FileSystemBackend for the directory, a
+    LocalClient for the backend, the first dataset, and the 1kgPhase1
+    variant set and HG00533 read group set of the dataset that many of
+    the tests search.
+    """
+    if dataDir is None:
+        dataDir = os.path.join("tests", "data")
+    theBackend = backend.FileSystemBackend(dataDir)
+    dataset = theBackend.getDatasetByIndex(0)
+    variantSet, = [
+        variantSet for variantSet in dataset.getVariantSets()
+        if variantSet.getLocalId() == "1kgPhase1"]
+    readGroupSet, = [
+        readGroupSet for readGroupSet in dataset.getReadGroupSets()
+        if readGroupSet.getLocalId().startswith("HG00533")]
+    return DataFixture(
+        theBackend, client.LocalClient(theBackend), dataset, variantSet,
+        readGroupSet)
+
+
 def captureOutput(func, *args, **kwargs):
     """
     Runs the specified function and arguments, and returns the